@@ -0,0 +1,25 @@
+"""Console entry point of cloudx-proxy (also `python -m cloudx_proxy`).
+
+`--version` is answered here, before click and the commands are imported.
+"""
+
+import os
+import sys
+
+
+def main():
+    if sys.argv[1:] == ['--version']:
+        from ._version import __version__
+        prog = os.path.basename(sys.argv[0])
+        if prog == '__main__.py':
+            prog = 'python -m cloudx_proxy'
+        # Same output as click's version_option
+        print(f"{prog}, version {__version__}")
+        return
+
+    from .cli import cli
+    cli()
+
+
+if __name__ == '__main__':
+    main()
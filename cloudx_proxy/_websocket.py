@@ -0,0 +1,269 @@
+"""Minimal RFC 6455 WebSocket support for the native SSM data channel.
+
+Only what the Session Manager data channel needs is implemented: the client
+handshake over ws:// or wss://, text and binary messages, fragmented
+receives, ping/pong and close. The server side of the handshake is included
+so tests can run a local stand-in for the SSM endpoint.
+"""
+
+import base64
+import hashlib
+import os
+import socket
+import ssl
+import struct
+import threading
+from typing import Tuple
+from urllib.parse import urlsplit
+
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+
+class WebSocketError(Exception):
+    """Raised on handshake failures and protocol violations."""
+
+
+class WebSocketClosed(WebSocketError):
+    """Raised when the peer closed the connection."""
+
+
+def accept_key(key: str) -> str:
+    """Compute the Sec-WebSocket-Accept value for a Sec-WebSocket-Key."""
+    digest = hashlib.sha1((key + _GUID).encode()).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _apply_mask(data: bytes, key: bytes) -> bytes:
+    """XOR data with a 4-byte masking key."""
+    length = len(data)
+    if not length:
+        return b''
+    # One big-integer XOR is far faster than a per-byte Python loop
+    repeated = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(opcode: int, payload: bytes, mask: bool = True) -> bytes:
+    """Encode a single final frame.
+
+    Args:
+        opcode: Frame opcode (OP_TEXT, OP_BINARY, ...)
+        payload: Frame payload
+        mask: Mask the payload (required for client-to-server frames)
+
+    Returns:
+        bytes: The encoded frame
+    """
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 65536:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', length)
+
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = _apply_mask(payload, key)
+    return bytes(header) + payload
+
+
+class WebSocket:
+    """A connected WebSocket endpoint."""
+
+    def __init__(self, sock: socket.socket, client: bool = True):
+        """Wrap an already handshaken socket.
+
+        Args:
+            sock: Connected socket (plain or TLS)
+            client: True for the client side (masks outgoing frames)
+        """
+        self.sock = sock
+        self.client = client
+        self.closed = False
+        self._reader = sock.makefile('rb')
+        self._send_lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, url: str, timeout: float = 10.0) -> 'WebSocket':
+        """Open a client connection.
+
+        Args:
+            url: ws:// or wss:// URL
+            timeout: Connect and handshake timeout in seconds
+
+        Returns:
+            WebSocket: The connected client
+
+        Raises:
+            WebSocketError: If the server does not accept the upgrade
+            OSError: On network errors
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('ws', 'wss'):
+            raise WebSocketError(f"Unsupported WebSocket URL scheme: {parts.scheme}")
+        secure = parts.scheme == 'wss'
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+
+        key = base64.b64encode(os.urandom(16)).decode()
+        host_header = host if parts.port is None else f"{host}:{port}"
+        request = (
+            f"GET {path} HTTP/1.1\r\n"
+            f"Host: {host_header}\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Key: {key}\r\n"
+            "Sec-WebSocket-Version: 13\r\n"
+            "\r\n"
+        )
+        sock.sendall(request.encode())
+
+        ws = cls(sock, client=True)
+        status_line, headers = ws._read_http_head()
+        if not status_line.startswith(('HTTP/1.1 101', 'HTTP/1.0 101')):
+            sock.close()
+            raise WebSocketError(f"WebSocket upgrade rejected: {status_line}")
+        if headers.get('sec-websocket-accept') != accept_key(key):
+            sock.close()
+            raise WebSocketError("WebSocket upgrade returned an invalid Sec-WebSocket-Accept")
+
+        sock.settimeout(None)
+        return ws
+
+    @classmethod
+    def accept(cls, sock: socket.socket) -> 'WebSocket':
+        """Perform the server side of the handshake on an accepted socket."""
+        ws = cls(sock, client=False)
+        _request_line, headers = ws._read_http_head()
+        key = headers.get('sec-websocket-key')
+        if not key:
+            raise WebSocketError("Missing Sec-WebSocket-Key")
+        response = (
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\n"
+            "Connection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n"
+            "\r\n"
+        )
+        sock.sendall(response.encode())
+        return ws
+
+    def _read_http_head(self) -> Tuple[str, dict]:
+        """Read an HTTP request/status line and headers."""
+        first = self._reader.readline().decode('latin-1').strip()
+        headers = {}
+        while True:
+            line = self._reader.readline().decode('latin-1')
+            if not line:
+                raise WebSocketClosed("Connection closed during handshake")
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return first, headers
+
+    def _read_exactly(self, count: int) -> bytes:
+        data = self._reader.read(count)
+        if data is None or len(data) < count:
+            raise WebSocketClosed("Connection closed by peer")
+        return data
+
+    def _read_frame(self) -> Tuple[bool, int, bytes]:
+        first, second = self._read_exactly(2)
+        fin = bool(first & 0x80)
+        opcode = first & 0x0F
+        masked = bool(second & 0x80)
+        length = second & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._read_exactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read_exactly(8))[0]
+        key = self._read_exactly(4) if masked else None
+        payload = self._read_exactly(length)
+        if key:
+            payload = _apply_mask(payload, key)
+        return fin, opcode, payload
+
+    def send(self, payload, opcode: int = None) -> None:
+        """Send a text (str) or binary (bytes) message."""
+        if opcode is None:
+            opcode = OP_TEXT if isinstance(payload, str) else OP_BINARY
+        if isinstance(payload, str):
+            payload = payload.encode()
+        frame = encode_frame(opcode, payload, mask=self.client)
+        with self._send_lock:
+            if self.closed:
+                raise WebSocketClosed("WebSocket is closed")
+            self.sock.sendall(frame)
+
+    def recv(self) -> Tuple[int, bytes]:
+        """Receive the next complete data message.
+
+        Control frames are handled transparently (pings are answered).
+
+        Returns:
+            Tuple[int, bytes]: (OP_TEXT or OP_BINARY, payload)
+
+        Raises:
+            WebSocketClosed: When the peer closes the connection
+        """
+        message_opcode = None
+        fragments = []
+        while True:
+            fin, opcode, payload = self._read_frame()
+            if opcode == OP_PING:
+                self.send(payload, OP_PONG)
+                continue
+            if opcode == OP_PONG:
+                continue
+            if opcode == OP_CLOSE:
+                self.close()
+                raise WebSocketClosed("Connection closed by peer")
+            if opcode != OP_CONTINUATION:
+                message_opcode = opcode
+                fragments = []
+            fragments.append(payload)
+            if fin:
+                return message_opcode, b''.join(fragments)
+
+    def ping(self, payload: bytes = b'') -> None:
+        """Send a ping frame."""
+        self.send(payload, OP_PING)
+
+    def close(self) -> None:
+        """Send a close frame (best effort) and close the socket."""
+        with self._send_lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.sock.sendall(encode_frame(OP_CLOSE, b'', mask=self.client))
+            except OSError:
+                pass
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
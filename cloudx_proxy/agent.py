@@ -0,0 +1,391 @@
+"""Resident connect agent for cloudx-proxy.
+
+Every ``connect`` normally imports boto3 and builds sessions and clients from
+scratch before it talks to AWS. The agent is an optional long-lived process
+that keeps sessions, clients and resolved credentials warm per
+(profile, aws-env, region) and serves connect requests over a local Unix
+socket. ``connect`` hands the preparation work (status check, wake-up, key
+push) to the agent when one is running and falls back to the in-process path
+otherwise.
+
+The wire protocol is newline-delimited JSON: the client sends one request
+object, the agent streams ``{"log": ...}`` lines followed by one final reply.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+AGENT_SOCKET_ENV = "CLOUDX_PROXY_AGENT_SOCKET"
+
+# Seconds to wait for the agent to accept a connection before falling back
+CONNECT_TIMEOUT = 2.0
+
+# Clients built when a context is created, so no request waits for them
+WARM_SERVICES = ('ssm', 'ec2', 'ec2-instance-connect')
+
+
+def default_socket_path() -> Path:
+    """Return the agent socket path.
+
+    Uses $CLOUDX_PROXY_AGENT_SOCKET when set, otherwise
+    ~/.ssh/control/cloudx-proxy-agent.sock (the control directory is created
+    with 700 permissions by setup).
+    """
+    override = os.environ.get(AGENT_SOCKET_ENV)
+    if override:
+        return Path(os.path.expanduser(override))
+    return Path.home() / ".ssh" / "control" / "cloudx-proxy-agent.sock"
+
+
+def agent_supported() -> bool:
+    """Check if this platform supports the Unix socket agent."""
+    return hasattr(socket, 'AF_UNIX') and hasattr(socketserver, 'ThreadingUnixStreamServer')
+
+
+def request(message: dict, socket_path: Path = None,
+            log: Callable[[str], None] = None) -> Optional[dict]:
+    """Send a request to a running agent.
+
+    Args:
+        message: Request object (must contain 'op')
+        socket_path: Agent socket (default: default_socket_path())
+        log: Callable receiving log lines streamed by the agent
+
+    Returns:
+        Optional[dict]: The agent's final reply, or None if no agent could be
+        reached or the conversation broke off before a reply arrived
+    """
+    if not agent_supported():
+        return None
+
+    path = Path(socket_path) if socket_path else default_socket_path()
+    if not path.exists():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        sock.connect(str(path))
+        # Preparation may wait minutes for an instance to boot
+        sock.settimeout(None)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(message).encode() + b'\n')
+            stream.flush()
+            for line in stream:
+                reply = json.loads(line)
+                if 'log' in reply:
+                    if log:
+                        log(reply['log'])
+                    continue
+                return reply
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+    return None
+
+
+class AgentServer(socketserver.ThreadingUnixStreamServer if agent_supported() else object):
+    """Unix socket server that holds warm AWS contexts and prepares connections."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, idle_timeout: int = 0):
+        """Initialize the agent server.
+
+        Args:
+            socket_path: Path of the Unix socket to listen on
+            idle_timeout: Seconds without requests before the agent exits (0 = never)
+        """
+        self.socket_path = Path(socket_path)
+        self.idle_timeout = idle_timeout
+        self._contexts = {}
+        self._contexts_lock = threading.Lock()
+        self._active = 0
+        self._last_activity = time.monotonic()
+        super().__init__(str(self.socket_path), _AgentHandler)
+
+    def server_bind(self) -> None:
+        super().server_bind()
+        os.chmod(self.socket_path, 0o600)
+
+    def context(self, profile: str, aws_env: str = None, region: str = None, client_config=None):
+        """Return the warm context for a profile/aws-env/region and client settings, building it on first use.
+
+        The agent keeps the shared sessions.context() with credentials
+        resolved and the clients of every connect step already built.
+        """
+        from . import sessions
+
+        key = (profile, aws_env, region, client_config)
+        with self._contexts_lock:
+            if key not in self._contexts:
+                self._contexts[key] = sessions.context(*key).warm(WARM_SERVICES)
+            return self._contexts[key]
+
+    def has_context(self, profile: str, aws_env: str = None, region: str = None, client_config=None) -> bool:
+        return (profile, aws_env, region, client_config) in self._contexts
+
+    @property
+    def context_count(self) -> int:
+        return len(self._contexts)
+
+    def begin_request(self) -> None:
+        with self._contexts_lock:
+            self._active += 1
+            self._last_activity = time.monotonic()
+
+    def end_request(self) -> None:
+        with self._contexts_lock:
+            self._active -= 1
+            self._last_activity = time.monotonic()
+
+    def service_actions(self) -> None:
+        """Shut down after idle_timeout seconds without requests."""
+        if not self.idle_timeout or self._active:
+            return
+        if time.monotonic() - self._last_activity > self.idle_timeout:
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+class _AgentHandler(socketserver.StreamRequestHandler):
+    """Handles a single agent request."""
+
+    def reply(self, message: dict) -> None:
+        try:
+            self.wfile.write(json.dumps(message).encode() + b'\n')
+            self.wfile.flush()
+        except OSError:
+            # Client went away; finish the work anyway so the next connect benefits
+            pass
+
+    def handle(self) -> None:
+        try:
+            message = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+
+        self.server.begin_request()
+        try:
+            op = message.get('op')
+            if op == 'ping':
+                from . import __version__
+                self.reply({'ok': True, 'pid': os.getpid(), 'version': __version__,
+                            'contexts': self.server.context_count})
+            elif op == 'shutdown':
+                self.reply({'ok': True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            elif op == 'prepare':
+                self.prepare(message)
+            elif op == 'terminate':
+                self.terminate(message)
+            else:
+                self.reply({'ok': False, 'error': f"Unknown request: {op}"})
+        except Exception as e:
+            self.reply({'ok': False, 'error': str(e)})
+        finally:
+            self.server.end_request()
+
+    def _proxy(self, message: dict):
+        """Build a CloudXProxy bound to the warm context for a request."""
+        from .clientconfig import ClientSettings, resolve
+        from .core import CloudXProxy
+        from .timing import Timing
+
+        # Records share the client's run id so one connect reads as one run
+        timing = Timing(message.get('timing'), lambda line: self.reply({'log': line}), message['instance_id'])
+        timing.run = message.get('run') or timing.run
+
+        # The client resolves its settings from its own options and environment
+        client_config = message.get('client_config')
+        client_config = ClientSettings.from_dict(client_config) if client_config else resolve()
+        key = (message['profile'], message.get('aws_env'), message.get('region'), client_config)
+        with timing.span('agent_context', warm=self.server.has_context(*key)):
+            ctx = self.server.context(*key)
+        proxy = CloudXProxy(
+            instance_id=message['instance_id'],
+            port=message.get('port', 22),
+            profile=message['profile'],
+            ssh_key=message['ssh_key'],
+            ssh_config=message.get('ssh_config'),
+            ssh_dir=message.get('ssh_dir'),
+            context=ctx,
+            timing=timing,
+            status_ttl=message.get('status_ttl'),
+            optimistic=message.get('optimistic', False),
+            native=message.get('native', False)
+        )
+        proxy.log = lambda line: self.reply({'log': line})
+        return ctx, proxy
+
+    def prepare(self, message: dict) -> None:
+        """Run status check, wake-up and key push with a warm context.
+
+        With 'native' set the agent also calls StartSession and returns the
+        session's stream URL and token, so the client can relay the data
+        channel without building an AWS session of its own.
+        """
+        ctx, proxy = self._proxy(message)
+        ok = proxy.prepare()
+        reply = {'ok': ok, 'region': ctx.region, 'key_push': proxy.key_push_entry(),
+                 'status_cached': proxy.status_cached}
+
+        if ok and message.get('native'):
+            from botocore.exceptions import ClientError
+            from .datachannel import open_session
+            try:
+                reply['session'] = proxy.preopened_session
+                if reply['session'] is None:
+                    with proxy.timing.activate(), proxy.timing.span('session_open'):
+                        reply['session'] = open_session(ctx.client('ssm'), message['instance_id'],
+                                                        message.get('port', 22))
+            except ClientError as e:
+                proxy.log(f"Native session unavailable: {e}")
+
+        self.reply(reply)
+
+    def terminate(self, message: dict) -> None:
+        """Terminate a session started for a native client."""
+        _ctx, proxy = self._proxy(message)
+        proxy.terminate_session(message['session_id'])
+        self.reply({'ok': True})
+
+
+def connect(target: dict, log: Callable[[str], None], socket_path: Path = None,
+            timing=None) -> Optional[bool]:
+    """Connect through a running agent.
+
+    The agent prepares the instance; the session itself always runs in this
+    process because it owns the ProxyCommand's stdin/stdout. If the session
+    fails to start after the agent trusted a cached Online status, the
+    instance is prepared again without the cache.
+
+    Args:
+        target: instance_id, port, profile, region, ssh_key, ssh_config,
+            ssh_dir, aws_env, native, relay, status_ttl and optimistic, as given
+            to the connect command, and client_config (ClientSettings.to_dict())
+        log: Callable used for stderr logging
+        socket_path: Agent socket (default: default_socket_path())
+        timing: Timing shared with the agent, which records the preparation
+            phases under the same run (optional)
+
+    Returns:
+        Optional[bool]: None if no agent is running (the caller should connect
+        in-process), otherwise whether the connection succeeded
+
+    Raises:
+        subprocess.CalledProcessError: If the AWS CLI session fails
+        DataChannelError: If a native session's data channel is lost
+    """
+    from .core import SessionStartError
+    from .timing import Timing
+
+    timing = timing or Timing()
+    if timing.enabled:
+        target = dict(target, timing=timing.destination, run=timing.run)
+    reply = request(dict(target, op='prepare'), socket_path, log=log)
+    if reply is None:
+        return None
+
+    while True:
+        if not reply.get('ok'):
+            if reply.get('error'):
+                log(f"Error: {reply['error']}")
+            return False
+
+        log("Starting SSM session...")
+        try:
+            _run_session(target, reply, log, socket_path, timing)
+            return True
+        except SessionStartError:
+            if not reply.get('status_cached'):
+                raise
+        log("Session failed to start, checking the instance again...")
+        target = dict(target, status_ttl=0)
+        reply = request(dict(target, op='prepare'), socket_path, log=log)
+        if reply is None:
+            log("Error: lost connection to the cloudx-proxy agent")
+            return False
+
+
+def _run_session(target: dict, reply: dict, log: Callable[[str], None], socket_path: Path, timing) -> None:
+    """Relay the session the agent prepared, natively or with the AWS CLI."""
+    from .cache import watch_session
+
+    timing.mark('ready', agent=True)
+    with timing.activate(), watch_session(reply.get('key_push'), timing) as watched:
+        session = reply.get('session')
+        if session:
+            from .datachannel import DataChannelError, relay_session
+            try:
+                status = relay_session(session, log, timing=timing, stats=watched)
+            finally:
+                request(dict(target, op='terminate', session_id=session['SessionId']), socket_path)
+            if status is not None:
+                if status != 0:
+                    raise DataChannelError("Session data channel was lost")
+                return
+            log("Falling back to AWS CLI session")
+
+        from .core import configure_aws_env, run_session
+        configure_aws_env(target.get('aws_env'))
+        with timing.span('session', native=False) as span:
+            stats = run_session(target['instance_id'], target.get('port', 22), target['profile'], reply['region'], log,
+                                relay=target.get('relay', True))
+            span.update(stats or {})
+            watched.update(stats or {})
+
+
+def ping(socket_path: Path = None) -> Optional[dict]:
+    """Return the running agent's status, or None if no agent is reachable."""
+    return request({'op': 'ping'}, socket_path)
+
+
+def stop(socket_path: Path = None) -> bool:
+    """Ask a running agent to shut down.
+
+    Returns:
+        bool: True if an agent acknowledged the request
+    """
+    reply = request({'op': 'shutdown'}, socket_path)
+    return bool(reply and reply.get('ok'))
+
+
+def serve(socket_path: Path = None, idle_timeout: int = 0) -> None:
+    """Run the agent in the foreground until stopped or idle.
+
+    Args:
+        socket_path: Unix socket to listen on (default: default_socket_path())
+        idle_timeout: Seconds without requests before exiting (0 = never)
+
+    Raises:
+        RuntimeError: If the platform has no Unix sockets or an agent is already running
+    """
+    if not agent_supported():
+        raise RuntimeError("The connect agent requires Unix domain sockets, which this platform lacks")
+
+    path = Path(socket_path) if socket_path else default_socket_path()
+    if path.exists():
+        if ping(path) is not None:
+            raise RuntimeError(f"An agent is already running on {path}")
+        # Stale socket left behind by an agent that did not exit cleanly
+        path.unlink()
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    server = AgentServer(path, idle_timeout)
+    try:
+        print(f"cloudx-proxy agent listening on {path} (pid {os.getpid()})", file=sys.stderr)
+        server.serve_forever(poll_interval=1.0)
+    finally:
+        server.server_close()
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
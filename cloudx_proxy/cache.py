@@ -0,0 +1,182 @@
+"""Small file-backed caches shared by concurrent cloudx-proxy processes.
+
+Entries live in JSON files under the control directory (~/.ssh/control),
+are written atomically under a FileLock and expire after a TTL. Expired
+entries are evicted whenever the file is updated.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Optional
+
+from .locking import FileLock, LockTimeout, default_lock_dir
+
+# EC2 Instance Connect keeps a pushed key for 60 seconds; reuse a push only
+# while enough of that remains for ssh to finish its handshake.
+KEY_PUSH_VALIDITY = 60
+KEY_PUSH_REUSE = KEY_PUSH_VALIDITY - 20
+
+# Seconds an Online instance status is trusted without asking SSM again
+STATUS_TTL = 15
+STATUS_TTL_ENV = "CLOUDX_PROXY_STATUS_TTL"
+
+# sshd rejecting the pushed key looks like a clean exit from outside: ssh
+# closes stdin and the AWS CLI exits 0, and the authentication messages are
+# encrypted. What shows is how little the server sent after the key
+# exchange: a few USERAUTH_FAILUREs, where a login gets USERAUTH_SUCCESS,
+# the hostkeys-00@openssh.com notice with all host keys and the channel
+# messages. A session that ends within AUTH_FAILURE_WINDOW with less than
+# AUTH_MIN_BYTES from the server after NEWKEYS (or before the key exchange
+# finished) has its key push forgotten.
+AUTH_FAILURE_WINDOW = 20
+AUTH_MIN_BYTES = 1024
+
+
+class FileCache:
+    """JSON file mapping keys to values with a write timestamp and a TTL."""
+
+    def __init__(self, path: Path, ttl: float, clock: Callable[[], float] = time.time):
+        """Initialize the cache.
+
+        Args:
+            path: Cache file
+            ttl: Seconds an entry stays valid
+            clock: Wall clock (injectable for tests)
+        """
+        self.path = Path(path)
+        self.ttl = ttl
+        self.clock = clock
+
+    def _load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return a fresh entry ({'ts': ..., 'value': ...}) or None."""
+        entry = self._load().get(key)
+        if entry and self.clock() - entry.get('ts', 0) < self.ttl:
+            return entry
+        return None
+
+    def put(self, key: str, value=None) -> None:
+        """Store a value under key with the current time."""
+        now = self.clock()
+        self._update(lambda data: data.__setitem__(key, {'ts': now, 'value': value}))
+
+    def delete(self, key: str) -> None:
+        """Remove an entry (no-op if missing)."""
+        self._update(lambda data: data.pop(key, None))
+
+    def _update(self, change: Callable[[dict], None]) -> None:
+        """Apply change to the cache file under its lock (best effort)."""
+        try:
+            with FileLock(self.path.with_name(self.path.name + '.lock'), timeout=2):
+                data = self._load()
+                change(data)
+                now = self.clock()
+                data = {key: entry for key, entry in data.items() if now - entry.get('ts', 0) < self.ttl}
+                tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.path)
+        except (OSError, LockTimeout):
+            # A cache that cannot be written only costs an extra AWS call
+            pass
+
+
+def resolve_status_ttl(value: float = None) -> float:
+    """Resolve the status cache TTL from an option, $CLOUDX_PROXY_STATUS_TTL or STATUS_TTL (0 disables)."""
+    if value is not None:
+        return max(0.0, float(value))
+    try:
+        return max(0.0, float(os.environ[STATUS_TTL_ENV]))
+    except (KeyError, ValueError):
+        return STATUS_TTL
+
+
+def status_cache(ttl: float = STATUS_TTL, directory: Path = None) -> FileCache:
+    """Return the cache of recently observed instance statuses, keyed by instance ID."""
+    directory = Path(directory) if directory else default_lock_dir()
+    return FileCache(directory / "cloudx-proxy-status.json", ttl)
+
+
+def key_fingerprint(public_key: str) -> str:
+    """Return the SHA256 fingerprint of an OpenSSH public key, as shown by ssh-keygen -l."""
+    fields = public_key.split()
+    try:
+        blob = base64.b64decode(fields[1], validate=True)
+    except (IndexError, ValueError):
+        blob = public_key.strip().encode()
+    digest = base64.b64encode(hashlib.sha256(blob).digest()).decode().rstrip('=')
+    return f"SHA256:{digest}"
+
+
+def key_push_cache(directory: Path = None) -> FileCache:
+    """Return the cache of recent EC2 Instance Connect key pushes."""
+    directory = Path(directory) if directory else default_lock_dir()
+    return FileCache(directory / "cloudx-proxy-keypush.json", KEY_PUSH_REUSE)
+
+
+def key_push_entry(instance_id: str, os_user: str, fingerprint: str) -> str:
+    """Return the key_push_cache() key for a push."""
+    return f"{instance_id}|{os_user}|{fingerprint}"
+
+
+@contextmanager
+def watch_session(entry: Optional[str], timing=None):
+    """Forget a key push if the session relying on it fails.
+
+    A session fails if it raises (e.g. the AWS CLI or the data channel exited
+    with an error) or looks rejected by sshd (see session_rejected()). Short
+    sessions that did their work (git fetch, scp) keep the push.
+
+    Args:
+        entry: key_push_cache() key of the push the session relies on (None: nothing to forget)
+        timing: Timing to record the invalidation into (optional)
+
+    Yields:
+        dict: For the caller to update with the session's relay statistics
+        (bytes_out and kex_end, see relay.relay_process())
+    """
+    started = time.monotonic()
+    stats = {}
+    try:
+        yield stats
+    except BaseException:
+        _forget_key_push(entry, timing)
+        raise
+    if session_rejected(stats, time.monotonic() - started):
+        _forget_key_push(entry, timing)
+
+
+def session_rejected(stats: dict, duration: float) -> bool:
+    """Whether a session that ended cleanly looks like sshd rejected the login.
+
+    Args:
+        stats: Relay statistics with bytes_out and kex_end; without them
+            (stdin/stdout passed through) only the duration counts
+        duration: Seconds the session ran
+    """
+    if duration >= AUTH_FAILURE_WINDOW:
+        return False
+    if stats.get('bytes_out') is None:
+        return True
+    kex_end = stats.get('kex_end')
+    return kex_end is None or stats['bytes_out'] - kex_end < AUTH_MIN_BYTES
+
+
+def _forget_key_push(entry: Optional[str], timing=None) -> None:
+    if not entry:
+        return
+    key_push_cache().delete(entry)
+    if timing:
+        timing.event('key_push_cache', result='invalidated')
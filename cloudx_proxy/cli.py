@@ -1,10 +1,11 @@
+import functools
 import os
 import sys
 from pathlib import Path
+from typing import Optional
 import click
+from click.shell_completion import CompletionItem
 from . import __version__
-from .core import CloudXProxy
-from .setup import CloudXSetup
 from .colors import header, error as color_error, info, format_hostname, format_command, secondary
 
 
@@ -50,6 +51,125 @@ class OptionalValueOption(click.Option):
         self._flag_default = _flag_value
 
 
+def _default_list_config(ssh_config: str = None) -> Path:
+    """Resolve the SSH config to list: --ssh-config, else ~/.ssh/cloudX/config, else ~/.ssh/vscode/config."""
+    if ssh_config:
+        return Path(os.path.expanduser(ssh_config))
+    # Check for cloudX config first, then vscode
+    cloudx_config = Path(os.path.expanduser("~/.ssh/cloudX/config"))
+    vscode_config = Path(os.path.expanduser("~/.ssh/vscode/config"))
+    if not cloudx_config.exists() and vscode_config.exists():
+        return vscode_config
+    return cloudx_config
+
+
+def _command_host_prefix() -> str:
+    """Detect ssh_host_prefix from command name (cloudX-proxy or cloudx-proxy)."""
+    cmd_name = os.path.basename(sys.argv[0])
+    return 'cloudX' if cmd_name == 'cloudX-proxy' else 'cloudx'
+
+
+def _complete_environment(ctx, param, incomplete):
+    """Shell completion for --environment from the host index."""
+    from . import hostindex
+    try:
+        with hostindex.HostIndex() as index:
+            names = index.environments(_default_list_config(ctx.params.get('ssh_config')), _command_host_prefix())
+    except Exception:
+        return []
+    return [name for name in names if name.lower().startswith(incomplete.lower())]
+
+
+def _complete_instance(ctx, param, incomplete):
+    """Shell completion for connect's INSTANCE_ID from the host index, with the host alias as help."""
+    from . import hostindex
+    try:
+        with hostindex.HostIndex() as index:
+            hosts = index.hosts(_default_list_config(ctx.params.get('ssh_config')), _command_host_prefix(), None)
+    except Exception:
+        return []
+    return [CompletionItem(host['instance_id'], help=host['host'])
+            for host in hosts if host['instance_id'] and host['instance_id'].startswith(incomplete)]
+
+
+def _complete_host(ctx, param, incomplete):
+    """Shell completion for a host alias from the host index, with the instance ID as help."""
+    from . import hostindex
+    try:
+        with hostindex.HostIndex() as index:
+            hosts = index.hosts(_default_list_config(ctx.params.get('ssh_config')), _command_host_prefix(), None)
+    except Exception:
+        return []
+    return [CompletionItem(host['host'], help=host['instance_id'])
+            for host in hosts if host['host'].lower().startswith(incomplete.lower())]
+
+
+def _host_target(host: str, config_file: Path, ssh_host_prefix: str, default_profile: str) -> Optional[dict]:
+    """Return the instance_id (and profile, aws_env, region) of a configured host or an instance ID.
+
+    Returns:
+        Optional[dict]: None if host is neither an instance ID nor a host of the config
+    """
+    from . import hostindex
+    from .setup import CloudXSetup
+
+    if CloudXSetup.validate_instance_id(host):
+        return {'instance_id': host}
+    with hostindex.HostIndex() as index:
+        found = index.find(config_file, ssh_host_prefix, default_profile, host=host)
+    if not found or not found[0]['instance_id']:
+        return None
+    return found[0]
+
+
+def _parse_endpoint_urls(ctx, param, value):
+    """Validate --endpoint-url SERVICE=URL values into a dict."""
+    from .clientconfig import parse_endpoints
+    try:
+        return parse_endpoints(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+_CLIENT_OPTIONS = (
+    click.option('--connect-timeout', type=click.FloatRange(min=0, min_open=True), default=None,
+                 help='Seconds to wait for a connection to an AWS endpoint (default: $CLOUDX_PROXY_CONNECT_TIMEOUT or config file)'),
+    click.option('--read-timeout', type=click.FloatRange(min=0, min_open=True), default=None,
+                 help='Seconds to wait for an AWS response (default: $CLOUDX_PROXY_READ_TIMEOUT or config file)'),
+    click.option('--retry-mode', type=click.Choice(['legacy', 'standard', 'adaptive']), default=None,
+                 help='botocore retry mode (default: $CLOUDX_PROXY_RETRY_MODE, $AWS_RETRY_MODE, config file or standard)'),
+    click.option('--max-attempts', type=click.IntRange(min=1), default=None,
+                 help='Attempts per AWS call including the first (default: $CLOUDX_PROXY_MAX_ATTEMPTS, $AWS_MAX_ATTEMPTS or config file)'),
+    click.option('--tcp-keepalive/--no-tcp-keepalive', default=None,
+                 help='TCP keepalive on AWS connections (default: $CLOUDX_PROXY_TCP_KEEPALIVE, config file or on)'),
+    click.option('--max-pool-connections', type=click.IntRange(min=1), default=None,
+                 help='Connections kept per AWS client (default: $CLOUDX_PROXY_MAX_POOL_CONNECTIONS, config file or 10)'),
+    click.option('--endpoint-url', 'endpoint_urls', multiple=True, metavar='SERVICE=URL', callback=_parse_endpoint_urls,
+                 help='Endpoint of an AWS service, e.g. ssm=https://vpce-....ssm.eu-west-1.vpce.amazonaws.com (repeatable)'),
+)
+
+
+def client_config_options(function):
+    """Add the AWS client options, passed to the command as one client_options dict."""
+    names = ('connect_timeout', 'read_timeout', 'retry_mode', 'max_attempts', 'tcp_keepalive',
+             'max_pool_connections', 'endpoint_urls')
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        kwargs['client_options'] = {name: kwargs.pop(name) for name in names}
+        return function(*args, **kwargs)
+
+    for option in reversed(_CLIENT_OPTIONS):
+        wrapper = option(wrapper)
+    return wrapper
+
+
+def _resolve_client_config(client_options: dict, defaults: dict = None):
+    """Resolve the clientconfig.ClientSettings of a command's client_options."""
+    from . import clientconfig
+    options = dict(client_options)
+    endpoints = options.pop('endpoint_urls')
+    return clientconfig.resolve(options, endpoints, defaults or clientconfig.PROXY_DEFAULTS)
 
 
 @click.group()
@@ -65,13 +185,20 @@ Main commands:
 \b
   setup     - Configure AWS profile, SSH keys, and SSH configuration
   connect   - Connect to an EC2 instance via SSM
+  agent     - Run a resident agent that keeps AWS sessions warm for connect
+  tunnel    - Share one SSM session across ssh connections on a local port
+  mux       - Share one SSM session across connect --mux ProxyCommands
+  socks     - SOCKS5 proxy to ports on and behind an instance, without ssh
   list      - List configured SSH hosts
+  status    - Show EC2 state and SSM status of configured hosts
+  stats     - Summarise connect timing recorded with --timing
   cleanup   - Clean up and reorganize SSH configuration
-  migrate   - Migrate from legacy vscode directory to cloudX"""
+  migrate   - Migrate from legacy vscode directory to cloudX
+  install-launcher - Install a pinned cloudx-proxy and run ProxyCommand from it"""
     pass
 
 @cli.command()
-@click.argument('instance_id')
+@click.argument('instance_id', shell_complete=_complete_instance)
 @click.argument('port', type=int, default=22)
 @click.option('--profile', default=None, help='AWS profile to use')
 @click.option('--region', help='AWS region (default: from profile, or eu-west-1 if not set)')
@@ -80,7 +207,31 @@ Main commands:
 @click.option('--ssh-dir', help='Directory for SSH keys and config')
 @click.option('--aws-env', help='AWS environment directory (default: ~/.aws, use name of directory in ~/.aws/aws-envs/)')
 @click.option('--dry-run', is_flag=True, help='Preview connection workflow without executing')
-def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: str, dry_run: bool):
+@click.option('--no-agent', is_flag=True, help='Do not hand the connection to a running cloudx-proxy agent')
+@click.option('--native', is_flag=True, help='Relay the session with the built-in SSM data channel client instead of the AWS CLI')
+@click.option('--relay/--no-relay', default=True,
+              help='Relay the AWS CLI session through cloudx-proxy (os.splice on Linux) and record bytes and stall time, '
+                   'or hand stdin/stdout to the AWS CLI (default: relay where supported, not on Windows)')
+@click.option(
+    '--timing',
+    cls=OptionalValueOption,
+    flag_value='file',
+    default=None,
+    metavar='[FILE|stderr]',
+    help='Record per-phase and per-API-call timing as JSON lines. Without a value ~/.ssh/control/cloudx-proxy-timing.jsonl is used (default: $CLOUDX_PROXY_TIMING)'
+)
+@click.option('--status-ttl', type=float, default=None,
+              help='Seconds a cached Online instance status is trusted, 0 to always check (default: $CLOUDX_PROXY_STATUS_TTL or 15)')
+@click.option('--optimistic', is_flag=True,
+              help='Check the instance status and push the SSH key (and with --native start the session) concurrently')
+@click.option('--mux', is_flag=True,
+              help='Share one SSM session with other connects to the instance through a background cloudx-proxy mux')
+@click.option('--mux-persist', type=click.FloatRange(min=0), default=None,
+              help='Seconds a mux started by this connect stays up without connections (default: $CLOUDX_PROXY_MUX_PERSIST or 14400)')
+@client_config_options
+def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: str, dry_run: bool,
+            no_agent: bool, native: bool, relay: bool, timing: str, status_ttl: float, optimistic: bool,
+            mux: bool, mux_persist: float, client_options: dict):
     """Connect to an EC2 instance via SSM.
 
     INSTANCE_ID is the EC2 instance ID to connect to (e.g., i-0123456789abcdef0)
@@ -90,6 +241,43 @@ def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str
     - Falls back to ~/.ssh/vscode if it exists (profile=vscode, ssh-key=vscode)
     - Defaults to ~/.ssh/cloudX otherwise
 
+    When a cloudx-proxy agent is running, the status check, instance start and
+    key push are handed to it over its local socket so no AWS session has to
+    be built here. Without an agent everything runs in this process.
+
+    With --native the session is relayed by the built-in SSM data channel
+    client instead of `aws ssm start-session` and the session-manager-plugin.
+    Sessions the native client cannot handle (e.g. KMS encrypted sessions)
+    fall back to the AWS CLI automatically.
+
+    The AWS CLI session's stdin/stdout go through cloudx-proxy rather than
+    being handed to the CLI (--no-relay), so the bytes moved each way and the
+    time either side stalled end up in the --timing records, and a login
+    sshd rejected is told apart from a short successful session.
+
+    With --timing (or $CLOUDX_PROXY_TIMING) every phase and AWS API call is
+    timed and appended as JSON lines to a file, or logged to stderr with
+    --timing stderr. Summarise the file with `cloudx-proxy stats`.
+
+    An instance seen Online by any connect in the last 15 seconds (see
+    --status-ttl) is not checked again; if its session then fails to start,
+    the full status check and wake-up run after all.
+
+    With --optimistic the status check, key push and (with --native)
+    StartSession run concurrently instead of one after another, which saves
+    two round trips when the instance is already Online. If it is not, the
+    regular wake-up path runs.
+
+    With --mux (which setup adds on Windows, whose ssh has no ControlMaster)
+    the connection goes through a background `cloudx-proxy mux` for the
+    instance, started by the first connect. The mux keeps one SSM
+    port-forwarding session for all connects and exits after --mux-persist
+    seconds without connections, like ControlPersist.
+
+    AWS calls fail fast by default (3 second connect and 10 second read
+    timeouts, standard retries with 3 attempts). Tune them with the client
+    options, $CLOUDX_PROXY_* variables or ~/.config/cloudx-proxy/config.ini.
+
     \b
     Example usage:
     \b
@@ -97,7 +285,13 @@ def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str
     cloudx-proxy connect i-0123456789abcdef0 22 --profile myprofile --region eu-west-1
     cloudx-proxy connect i-0123456789abcdef0 22 --ssh-config ~/.ssh/cloudx/config
     cloudx-proxy connect i-0123456789abcdef0 22 --aws-env prod
+    cloudx-proxy connect i-0123456789abcdef0 22 --timing
+    cloudx-proxy connect i-0123456789abcdef0 22 --mux --mux-persist 600
+    cloudx-proxy connect i-0123456789abcdef0 22 --read-timeout 5 --endpoint-url ssm=https://vpce-0example.ssm.eu-west-1.vpce.amazonaws.com
     """
+    from .setup import CloudXSetup
+    from . import agent as connect_agent
+    from . import timing as timing_mod
     try:
         # Auto-detect defaults from config directory
         default_profile, default_ssh_key, detected_dir = detect_ssh_defaults()
@@ -115,7 +309,298 @@ def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str
             print("Examples: i-1234567890abcdef0 or i-12345678", file=sys.stderr)
             sys.exit(1)
 
-        client = CloudXProxy(
+        def log(message: str) -> None:
+            print(message, file=sys.stderr)
+
+        log(f"cloudx-proxy@{__version__} Connecting to instance {instance_id} on port {port}...")
+        span_timing = timing_mod.Timing.from_option(timing, log, instance_id) if not dry_run else timing_mod.Timing()
+        client_config = _resolve_client_config(client_options)
+
+        if mux and not dry_run:
+            from . import mux as connect_mux
+            if not connect_mux.connect({
+                'instance_id': instance_id,
+                'port': port,
+                'profile': profile,
+                'region': region,
+                'ssh_key': ssh_key,
+                'ssh_config': ssh_config,
+                'ssh_dir': ssh_dir,
+                'aws_env': aws_env,
+                'client_config': client_config.to_dict()
+            }, log, persist=mux_persist):
+                sys.exit(1)
+            return
+
+        if not dry_run and not no_agent:
+            result = connect_agent.connect({
+                'instance_id': instance_id,
+                'port': port,
+                'profile': profile,
+                'region': region,
+                'ssh_key': ssh_key,
+                'ssh_config': ssh_config,
+                'ssh_dir': ssh_dir,
+                'aws_env': aws_env,
+                'native': native,
+                'relay': relay,
+                'status_ttl': status_ttl,
+                'optimistic': optimistic,
+                'client_config': client_config.to_dict()
+            }, log, timing=span_timing)
+            if result is not None:
+                if not result:
+                    sys.exit(1)
+                return
+
+        # Only a connection made in this process needs boto3
+        from .core import CloudXProxy
+        with span_timing.span('init'):
+            client = CloudXProxy(
+                instance_id=instance_id,
+                port=port,
+                profile=profile,
+                region=region,
+                ssh_key=ssh_key,
+                ssh_config=ssh_config,
+                ssh_dir=ssh_dir,
+                aws_env=aws_env,
+                dry_run=dry_run,
+                native=native,
+                relay=relay,
+                timing=span_timing,
+                status_ttl=status_ttl,
+                optimistic=optimistic,
+                client_config=client_config
+            )
+
+        if not client.connect():
+            sys.exit(1)
+
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
+
+@cli.command()
+@click.argument('host', shell_complete=_complete_host)
+@click.option('--port', 'local_port', type=click.IntRange(1, 65535),
+              help='Local port ssh connects to (default: the Port of a host already pointed at a tunnel)')
+@click.option('--remote-port', type=int, default=22, show_default=True, help='Port on the instance to forward to')
+@click.option('--bind', default='127.0.0.1', show_default=True, help='Local address to listen on')
+@click.option('--profile', default=None, help='AWS profile to use (default: from the host\'s ProxyCommand)')
+@click.option('--region', help='AWS region (default: from the host\'s ProxyCommand or profile)')
+@click.option('--ssh-key', default=None, help='SSH key name to use')
+@click.option('--ssh-config', help='SSH config file to use (default: ~/.ssh/cloudX/config)')
+@click.option('--aws-env', help='AWS environment directory (default: from the host\'s ProxyCommand)')
+@click.option('--configure', is_flag=True,
+              help='Point HOST in the SSH config at the tunnel (HostName localhost, Port PORT) before starting it')
+@click.option('--restore', is_flag=True, help='Point HOST in the SSH config back at its ProxyCommand and exit')
+@client_config_options
+def tunnel(host: str, local_port: int, remote_port: int, bind: str, profile: str, region: str, ssh_key: str,
+           ssh_config: str, aws_env: str, configure: bool, restore: bool, client_options: dict):
+    """Share one SSM port-forwarding session across ssh connections.
+
+    HOST is a configured host (e.g. cloudx-dev-web) or an EC2 instance ID.
+
+    Without ControlMaster (e.g. with the default Windows ssh client) every
+    ssh, scp, git or VS Code connection runs its own ProxyCommand and SSM
+    session. The tunnel keeps one AWS-StartPortForwardingSession to the
+    instance and listens on a local port; each connection to that port gets
+    the SSH key pushed and is relayed through the shared session. A dropped
+    session is restarted with backoff.
+
+    With --configure the host's SSH config entry is pointed at the tunnel,
+    so `ssh HOST` connects to localhost:PORT without a ProxyCommand while
+    the tunnel runs. --restore points it back at the ProxyCommand.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy tunnel cloudx-dev-web --port 2222 --configure
+    cloudx-proxy tunnel cloudx-dev-web
+    cloudx-proxy tunnel i-0123456789abcdef0 --port 5432 --remote-port 5432
+    cloudx-proxy tunnel cloudx-dev-web --restore
+    """
+    from . import configfile
+    from .setup import CloudXSetup
+    from .sshconfig import find_host
+    from .tunnel import Tunnel, tunneled_instance
+    try:
+        config_file = _default_list_config(ssh_config)
+        ssh_host_prefix = _command_host_prefix()
+        default_profile, default_ssh_key, _ = detect_ssh_defaults()
+        setup = CloudXSetup(ssh_config=str(config_file), ssh_host_prefix=ssh_host_prefix)
+
+        if restore:
+            if not setup.set_tunnel(host, None):
+                sys.exit(1)
+            return
+
+        if configure and CloudXSetup.validate_instance_id(host):
+            print(color_error("Error: --configure needs a configured host, not an instance ID"), file=sys.stderr)
+            sys.exit(1)
+        target = _host_target(host, config_file, ssh_host_prefix, default_profile)
+        if target is None:
+            print(color_error(f"Error: Host {host} not found in {config_file}"), file=sys.stderr)
+            sys.exit(1)
+        if not local_port and not CloudXSetup.validate_instance_id(host):
+            block = find_host(configfile.read_with_includes(config_file)[0], host)
+            if block is not None and tunneled_instance(block) and (block.get('Port') or '').isdigit():
+                local_port = int(block.get('Port'))
+        if not local_port:
+            print(color_error("Error: --port is required"), file=sys.stderr)
+            sys.exit(1)
+
+        if configure and not setup.set_tunnel(host, local_port):
+            sys.exit(1)
+
+        from .core import CloudXProxy
+        proxy = CloudXProxy(
+            instance_id=target['instance_id'],
+            port=remote_port,
+            profile=profile or target.get('profile') or default_profile,
+            region=region or target.get('region'),
+            ssh_key=ssh_key or default_ssh_key,
+            ssh_config=ssh_config,
+            aws_env=aws_env or target.get('aws_env'),
+            client_config=_resolve_client_config(client_options)
+        )
+        Tunnel(proxy, local_port, remote_port, bind).serve()
+
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
+
+@cli.command()
+@click.option('--host', 'host', required=True, shell_complete=_complete_host,
+              help='Configured host (e.g. cloudx-dev-web) or EC2 instance ID the sessions go through')
+@click.option('--port', 'local_port', type=click.IntRange(0, 65535), default=1080, show_default=True,
+              help='Local port of the SOCKS5 proxy')
+@click.option('--bind', default='127.0.0.1', show_default=True, help='Local address to listen on')
+@click.option('--idle', type=click.FloatRange(min=0, min_open=True), default=300, show_default=True,
+              help='Seconds a destination\'s session stays up without connections')
+@click.option('--max-sessions', type=click.IntRange(min=1), default=16, show_default=True,
+              help='Sessions running at once; a new destination replaces the longest idle one')
+@click.option('--profile', default=None, help='AWS profile to use (default: from the host\'s ProxyCommand)')
+@click.option('--region', help='AWS region (default: from the host\'s ProxyCommand or profile)')
+@click.option('--ssh-config', help='SSH config file to use (default: ~/.ssh/cloudX/config)')
+@click.option('--aws-env', help='AWS environment directory (default: from the host\'s ProxyCommand)')
+@client_config_options
+def socks(host: str, local_port: int, bind: str, idle: float, max_sessions: int, profile: str, region: str,
+          ssh_config: str, aws_env: str, client_options: dict):
+    """Run a SOCKS5 proxy that reaches destinations through SSM port forwarding.
+
+    Each CONNECT goes through an SSM port-forwarding session from the
+    instance of --host to its destination, without ssh in between: localhost
+    is the instance itself, other names and addresses are resolved and
+    reached by the instance. Sessions are started on demand, shared by all
+    connections to the same destination and stopped after --idle seconds
+    without connections.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy socks --host cloudx-dev-web
+    cloudx-proxy socks --host cloudx-dev-web --port 1081 --idle 60
+    curl --socks5-hostname localhost:1080 http://localhost:8080/
+    """
+    from .socks import SocksServer
+    try:
+        config_file = _default_list_config(ssh_config)
+        default_profile = detect_ssh_defaults()[0]
+        target = _host_target(host, config_file, _command_host_prefix(), default_profile)
+        if target is None:
+            print(color_error(f"Error: Host {host} not found in {config_file}"), file=sys.stderr)
+            sys.exit(1)
+
+        from .core import CloudXProxy
+        # Port forwarding needs no SSH key: the sessions only wake the instance
+        proxy = CloudXProxy(
+            instance_id=target['instance_id'],
+            profile=profile or target.get('profile') or default_profile,
+            region=region or target.get('region'),
+            ssh_config=ssh_config,
+            aws_env=aws_env or target.get('aws_env'),
+            client_config=_resolve_client_config(client_options)
+        )
+        SocksServer(proxy, local_port, bind, idle, max_sessions).serve()
+
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
+
+@cli.command()
+@click.argument('instance_id', required=False, shell_complete=_complete_instance)
+@click.argument('port', type=int, default=22)
+@click.option('--profile', default=None, help='AWS profile to use')
+@click.option('--region', help='AWS region (default: from profile, or eu-west-1 if not set)')
+@click.option('--ssh-key', default=None, help='SSH key name to use')
+@click.option('--ssh-config', help='SSH config file to use')
+@click.option('--ssh-dir', help='Directory for SSH keys and config')
+@click.option('--aws-env', help='AWS environment directory (default: ~/.aws, use name of directory in ~/.aws/aws-envs/)')
+@click.option('--persist', type=click.FloatRange(min=0), default=None,
+              help='Exit after this many seconds without connections, 0 with the last one (default: $CLOUDX_PROXY_MUX_PERSIST or 14400)')
+@click.option('--status', is_flag=True, help='List the running muxes and exit')
+@click.option('--stop', is_flag=True, help='Stop the muxes of INSTANCE_ID and PORT (all muxes without it) and exit')
+@client_config_options
+def mux(instance_id: str, port: int, profile: str, region: str, ssh_key: str, ssh_config: str, ssh_dir: str,
+        aws_env: str, persist: float, status: bool, stop: bool, client_options: dict):
+    """Run the connection multiplexer of an instance for `connect --mux`.
+
+    `connect --mux` starts the mux in the background when none is running
+    for the instance, port and connect options (profile, region, SSH key,
+    AWS environment, ...), so it is rarely started by hand. The mux
+    keeps one SSM port-forwarding session and relays every connect through
+    it; each connection gets the SSH key pushed. A dropped session is
+    restarted with backoff, and the mux exits after --persist seconds
+    without connections.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy mux --status
+    cloudx-proxy mux --stop
+    cloudx-proxy mux i-0123456789abcdef0 --stop
+    cloudx-proxy mux i-0123456789abcdef0 22 --persist 600
+    """
+    from . import mux as connect_mux
+    try:
+        if status:
+            muxes = [found for found in connect_mux.running()
+                     if not instance_id or found['instance_id'] == instance_id]
+            if not muxes:
+                print("No cloudx-proxy mux is running.")
+                sys.exit(1)
+            for found in muxes:
+                session = "session up" if found['session_ready'] else "no session"
+                print(f"{found['instance_id']}:{found['remote_port']} mux v{found['version']} (pid {found['pid']}, "
+                      f"{found['connections']} connections, {found['sessions']} sessions started, {session})")
+            return
+
+        if stop:
+            paths = [Path(found['state_file']) for found in connect_mux.running()
+                     if not instance_id or (found['instance_id'], found['remote_port']) == (instance_id, port)]
+            stopped = [path for path in paths if connect_mux.stop(path)]
+            if not stopped:
+                print("No cloudx-proxy mux is running.")
+                sys.exit(1)
+            print(f"Stopped {len(stopped)} cloudx-proxy mux{'es' if len(stopped) != 1 else ''}.")
+            return
+
+        if not instance_id:
+            print(color_error("Error: INSTANCE_ID is required"), file=sys.stderr)
+            sys.exit(1)
+
+        default_profile, default_ssh_key, _ = detect_ssh_defaults()
+        profile = profile or default_profile
+        ssh_key = ssh_key or default_ssh_key
+        client_config = _resolve_client_config(client_options)
+        from .core import CloudXProxy
+        proxy = CloudXProxy(
             instance_id=instance_id,
             port=port,
             profile=profile,
@@ -124,14 +609,76 @@ def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str
             ssh_config=ssh_config,
             ssh_dir=ssh_dir,
             aws_env=aws_env,
-            dry_run=dry_run
+            client_config=client_config
         )
+        # The target connect --mux started this mux for, which names its state file
+        connect_mux.serve(proxy, {
+            'instance_id': instance_id,
+            'port': port,
+            'profile': profile,
+            'region': region,
+            'ssh_key': ssh_key,
+            'ssh_config': ssh_config,
+            'ssh_dir': ssh_dir,
+            'aws_env': aws_env,
+            'client_config': client_config.to_dict()
+        }, persist)
 
-        client.log(f"cloudx-proxy@{__version__} Connecting to instance {instance_id} on port {port}...")
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
 
-        if not client.connect():
-            sys.exit(1)
+@cli.command()
+@click.option('--socket', 'socket_path', help='Unix socket to listen on (default: ~/.ssh/control/cloudx-proxy-agent.sock)')
+@click.option('--idle-timeout', type=int, default=14400, show_default=True,
+              help='Exit after this many seconds without requests (0 = run until stopped)')
+@click.option('--status', is_flag=True, help='Show whether an agent is running and exit')
+@click.option('--stop', is_flag=True, help='Stop the running agent and exit')
+def agent(socket_path: str, idle_timeout: int, status: bool, stop: bool):
+    """Run a resident agent that keeps AWS sessions warm for connect.
 
+    The agent holds boto3 sessions, clients and resolved credentials per
+    profile, aws-env and region. While it runs, every `connect` (and thus every
+    ssh ProxyCommand) hands its status check, instance start and key push to
+    the agent instead of building AWS sessions itself.
+
+    The agent runs in the foreground; start it from a login item, a systemd
+    user unit or simply in the background of your shell.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy agent &
+    cloudx-proxy agent --idle-timeout 0
+    cloudx-proxy agent --status
+    cloudx-proxy agent --stop
+    """
+    from . import agent as connect_agent
+    try:
+        path = Path(os.path.expanduser(socket_path)) if socket_path else None
+
+        if status:
+            reply = connect_agent.ping(path)
+            if reply is None:
+                print("No cloudx-proxy agent is running.")
+                sys.exit(1)
+            print(f"cloudx-proxy agent v{reply['version']} running (pid {reply['pid']}, {reply['contexts']} warm AWS contexts)")
+            return
+
+        if stop:
+            if connect_agent.stop(path):
+                print("cloudx-proxy agent stopped.")
+            else:
+                print("No cloudx-proxy agent is running.")
+                sys.exit(1)
+            return
+
+        connect_agent.serve(path, idle_timeout)
+
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print(color_error(f"Error: {str(e)}"), file=sys.stderr)
         sys.exit(1)
@@ -153,11 +700,16 @@ def connect(instance_id: str, port: int, profile: str, region: str, ssh_key: str
 )
 @click.option('--instance', help='EC2 instance ID to set up connection for')
 @click.option('--hostname', help='Hostname to use for SSH configuration')
+@click.option('--discover', is_flag=True, help='Add host entries for all instances found by their cloudX-{env}-{hostname} Name tags')
 @click.option('--ssh-host-prefix', help='Prefix for SSH hosts (default: cloudx or cloudX depending on command name)')
 @click.option('--yes', 'non_interactive', is_flag=True, help='Non-interactive mode, use default values for all prompts')
 @click.option('--dry-run', is_flag=True, help='Preview setup changes without executing')
+@click.option('--layout', type=click.Choice(['single', 'sharded']),
+              help='Layout of a new SSH config: one file, or one file per environment (default: single; convert existing configs with cleanup)')
+@client_config_options
 def setup(profile: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: str, use_1password: str,
-          instance: str, hostname: str, ssh_host_prefix: str, non_interactive: bool, dry_run: bool):
+          instance: str, hostname: str, discover: bool, ssh_host_prefix: str, non_interactive: bool, dry_run: bool,
+          layout: str, client_options: dict):
     """Set up AWS profile, SSH keys, and configuration for CloudX.
     
     \b
@@ -167,6 +719,13 @@ def setup(profile: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: st
     2. Create or use existing SSH key
     3. Configure SSH for CloudX instances
     4. Check instance setup status
+
+    With --discover, step 3 and 4 are replaced by adding (or updating) host
+    entries for every instance whose Name tag matches cloudX-{env}-{hostname},
+    found with paginated EC2 queries and written to the SSH config at once.
+
+    The client options work as for connect, with more patient defaults
+    (10 second connect and 30 second read timeouts, 5 attempts).
     
     \b
     Example usage:
@@ -177,7 +736,11 @@ def setup(profile: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: st
     cloudx-proxy setup --1password
     cloudx-proxy setup --1password Work
     cloudx-proxy setup --instance i-0123456789abcdef0 --hostname myserver --yes
+    cloudx-proxy setup --discover --yes
+    cloudx-proxy setup --layout sharded
     """
+    from .clientconfig import SETUP_DEFAULTS
+    from .setup import CloudXSetup
     try:
         # Determine default prefix based on command name if not provided
         if not ssh_host_prefix:
@@ -197,7 +760,9 @@ def setup(profile: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: st
             instance_id=instance,
             ssh_host_prefix=ssh_host_prefix,
             non_interactive=non_interactive,
-            dry_run=dry_run
+            dry_run=dry_run,
+            layout=layout,
+            client_config=_resolve_client_config(client_options, SETUP_DEFAULTS)
         )
         
         if dry_run:
@@ -216,6 +781,16 @@ def setup(profile: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: st
         if not setup.setup_ssh_key():
             sys.exit(1)
         
+        if discover:
+            setup.print_status("Discovering instances from EC2 Name tags...", None, 2)
+            hosts = setup.discover_instances()
+            if hosts is None:
+                sys.exit(1)
+            setup.print_status(f"Found {len(hosts)} instances", True, 2)
+            if hosts and not setup.sync_ssh_config(hosts):
+                sys.exit(1)
+            return
+
         # Get instance ID first, then fetch tags to auto-populate environment and hostname
         instance_id = instance or setup.prompt("Enter EC2 instance ID (e.g., i-0123456789abcdef0)")
 
@@ -267,16 +842,32 @@ def setup(profile: str, ssh_key: str, ssh_config: str, ssh_dir: str, aws_env: st
         print(f"\n{color_error(f'Error: {str(e)}')}", file=sys.stderr)
         sys.exit(1)
 
+def _status_label(status: dict) -> str:
+    """Format a fleet.fetch_status() entry, e.g. 'running, Online'."""
+    if not status:
+        return "unknown"
+    if status.get('error'):
+        return f"error: {status['error']}"
+    if status.get('ping'):
+        return f"{status['state']}, {status['ping']}"
+    return status['state']
+
+
 @cli.command()
 @click.option('--ssh-config', help='SSH config file to use (default: ~/.ssh/cloudX/config)')
-@click.option('--environment', help='Filter hosts by environment (e.g., dev, prod)')
+@click.option('--environment', shell_complete=_complete_environment,
+              help='Filter hosts by environment (e.g., dev, prod)')
 @click.option('--detailed', is_flag=True, help='Show detailed information including instance IDs')
+@click.option('--status', 'show_status', is_flag=True, help='Also show EC2 state and SSM status of each instance')
 @click.option('--dry-run', is_flag=True, help='Preview list output format')
-def list(ssh_config: str, environment: str, detailed: bool, dry_run: bool):
+@client_config_options
+def list(ssh_config: str, environment: str, detailed: bool, show_status: bool, dry_run: bool,
+         client_options: dict):
     """List configured cloudx-proxy SSH hosts.
     
     This command parses the SSH configuration file and displays all configured cloudx-proxy hosts.
-    Hosts are grouped by environment for easier navigation.
+    Hosts are grouped by environment for easier navigation. With --status the
+    state of every instance is looked up as in `cloudx-proxy status`.
     
     \b
     Example usage:
@@ -285,22 +876,12 @@ def list(ssh_config: str, environment: str, detailed: bool, dry_run: bool):
     cloudx-proxy list --environment dev
     cloudx-proxy list --ssh-config ~/.ssh/cloudx/config
     cloudx-proxy list --detailed
+    cloudx-proxy list --status
     """
+    from . import fleet, hostindex
     try:
         # Determine SSH config file path
-        if ssh_config:
-            config_file = Path(os.path.expanduser(ssh_config))
-        else:
-            # Check for cloudX config first, then vscode
-            cloudx_config = Path(os.path.expanduser("~/.ssh/cloudX/config"))
-            vscode_config = Path(os.path.expanduser("~/.ssh/vscode/config"))
-            
-            if cloudx_config.exists():
-                config_file = cloudx_config
-            elif vscode_config.exists():
-                config_file = vscode_config
-            else:
-                config_file = cloudx_config
+        config_file = _default_list_config(ssh_config)
         
         if dry_run:
             print(f"\n\033[1;95m=== cloudx-proxy List (DRY RUN) ===\033[0m\n")
@@ -309,6 +890,8 @@ def list(ssh_config: str, environment: str, detailed: bool, dry_run: bool):
                 print(f"[DRY RUN] Would filter hosts by environment: {environment}")
             if detailed:
                 print(f"[DRY RUN] Would show detailed information including instance IDs")
+            if show_status:
+                print(f"[DRY RUN] Would look up instance status with batched AWS API calls")
             print(f"[DRY RUN] Would parse SSH configuration and display grouped hosts")
             return
         
@@ -317,71 +900,17 @@ def list(ssh_config: str, environment: str, detailed: bool, dry_run: bool):
             print("Run 'cloudx-proxy setup' to create a configuration.")
             sys.exit(1)
 
-        # Detect ssh_host_prefix from command name
-        cmd_name = os.path.basename(sys.argv[0])
-        ssh_host_prefix = 'cloudX' if cmd_name == 'cloudX-proxy' else 'cloudx'
-
-        # Use shared parser from CloudXSetup
-        setup = CloudXSetup(ssh_config=str(config_file), ssh_host_prefix=ssh_host_prefix)
-        config_content = config_file.read_text()
-        parsed = setup._parse_ssh_config(config_content)
+        ssh_host_prefix = _command_host_prefix()
+        with hostindex.HostIndex() as index:
+            hosts = index.hosts(config_file, ssh_host_prefix, detect_ssh_defaults()[0], environment)
+            # Global and environment patterns (cloudx-*, cloudx-dev-*)
+            generic_hosts = [(name, "N/A") for name in index.patterns(config_file, ssh_host_prefix)]
+        statuses = fleet.fetch_status(hosts, _resolve_client_config(client_options)) if show_status else {}
 
-        # Extract hosts from parsed structure
         environments = {}
-        generic_hosts = []
-
-        # Add global pattern if present
-        if parsed['global']:
-            generic_hosts.append((f"{ssh_host_prefix}-*", "N/A"))
-
-        # Process each environment
-        for env_key, env_data in parsed['environments'].items():
-            # Use original case name for display, fallback to key if not present
-            display_name = env_data.get('name', env_key)
-
-            # Add environment pattern to generic hosts
-            generic_hosts.append((env_data['pattern'], "N/A"))
-
-            # Filter by environment if specified
-            if environment and env_key.lower() != environment.lower():
-                continue
-
-            # Parse host entries from environment lines
-            current_host = None
-            current_instance_id = None
-            current_comment = None
-
-            for line in env_data['lines']:
-                if line.startswith('Host ') and '*' not in line:
-                    # Save previous host if exists
-                    if current_host:
-                        # Extract short name from hostname (cloudx-env-name -> name)
-                        parts = current_host.split('-')
-                        short_name = '-'.join(parts[2:]) if len(parts) >= 3 else current_host
-                        if display_name not in environments:
-                            environments[display_name] = []
-                        environments[display_name].append((current_host, short_name, current_instance_id or "N/A", current_comment))
-
-                    # Extract hostname and inline comment
-                    host_part = line.replace('Host ', '', 1).strip()
-                    if '#' in host_part:
-                        current_host = host_part.split('#')[0].strip()
-                        current_comment = host_part.split('#', 1)[1].strip()
-                    else:
-                        current_host = host_part
-                        current_comment = None
-                    current_instance_id = None
-                elif current_host and 'HostName' in line:
-                    # Extract instance ID
-                    current_instance_id = line.split()[-1].strip()
-
-            # Don't forget the last host
-            if current_host:
-                parts = current_host.split('-')
-                short_name = '-'.join(parts[2:]) if len(parts) >= 3 else current_host
-                if display_name not in environments:
-                    environments[display_name] = []
-                environments[display_name].append((current_host, short_name, current_instance_id or "N/A", current_comment))
+
+        for host in hosts:
+            environments.setdefault(host['environment'], []).append(host)
         
         # Display results
         if not environments and not generic_hosts:
@@ -400,15 +929,17 @@ def list(ssh_config: str, environment: str, detailed: bool, dry_run: bool):
             print()
 
         # Print environments and hosts
-        for env, hosts in sorted(environments.items()):
+        for env, env_hosts in sorted(environments.items()):
             print(info(f"Environment: {env}"))
-            for hostname, name, instance_id, comment in sorted(hosts, key=lambda x: x[1]):
+            for host in sorted(env_hosts, key=lambda x: x['name']):
                 # Build the output line with instance ID and optional comment in brackets
-                if comment:
-                    bracket_content = f"{hostname}, {instance_id}, {comment}"
-                else:
-                    bracket_content = f"{hostname}, {instance_id}"
-                print(f"  {name} {secondary(f'({bracket_content})')}")
+                bracket_content = f"{host['host']}, {host['instance_id'] or 'N/A'}"
+                if host['comment']:
+                    bracket_content += f", {host['comment']}"
+                line = f"  {host['name']} {secondary(f'({bracket_content})')}"
+                if show_status:
+                    line += f" {_status_label(statuses.get(host['instance_id']))}"
+                print(line)
             print()
 
         # Print usage hint
@@ -420,6 +951,137 @@ def list(ssh_config: str, environment: str, detailed: bool, dry_run: bool):
         print(color_error(f"Error: {str(e)}"), file=sys.stderr)
         sys.exit(1)
 
+@cli.command()
+@click.option('--ssh-config', help='SSH config file to use (default: ~/.ssh/cloudX/config)')
+@click.option('--environment', shell_complete=_complete_environment,
+              help='Filter hosts by environment (e.g., dev, prod)')
+@client_config_options
+def status(ssh_config: str, environment: str, client_options: dict):
+    """Show EC2 state and SSM status of all configured hosts.
+
+    Instance IDs are collected from the SSH config and looked up with a few
+    batched DescribeInstances and DescribeInstanceInformation calls per AWS
+    profile, aws-env and region (taken from each environment's ProxyCommand),
+    rather than one call per host.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy status
+    cloudx-proxy status --environment dev
+    """
+    from . import fleet, hostindex
+    try:
+        config_file = _default_list_config(ssh_config)
+        if not config_file.exists():
+            print(f"SSH config file not found: {config_file}")
+            print("Run 'cloudx-proxy setup' to create a configuration.")
+            sys.exit(1)
+
+        with hostindex.HostIndex() as index:
+            hosts = index.hosts(config_file, _command_host_prefix(), detect_ssh_defaults()[0], environment)
+        if not hosts:
+            print("No cloudx-proxy hosts configured.")
+            return
+
+        statuses = fleet.fetch_status(hosts, _resolve_client_config(client_options))
+
+        print(f"\n{header('=== cloudx-proxy Instance Status ===')}\n")
+        environments = {}
+        for host in hosts:
+            environments.setdefault(host['environment'], []).append(host)
+        for env, env_hosts in sorted(environments.items()):
+            print(info(f"Environment: {env}"))
+            print(f"  {'host':<30} {'instance':<20} {'state':<14} {'ssm':<16}")
+            for host in sorted(env_hosts, key=lambda x: x['name']):
+                entry = statuses.get(host['instance_id']) or {}
+                state = entry.get('state') or '-'
+                ping = entry.get('ping') or '-'
+                print(f"  {host['name']:<30} {host['instance_id'] or 'N/A':<20} {state:<14} {ping:<16}")
+                if entry.get('error'):
+                    print(f"    {color_error(entry['error'])}")
+            print()
+
+        running = sum(1 for entry in statuses.values() if entry.get('state') == 'running')
+        online = sum(1 for entry in statuses.values() if entry.get('ping') == 'Online')
+        print(secondary(f"{len(statuses)} instances: {running} running, {online} Online"))
+
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
+
+@cli.command()
+@click.argument('timing_file', required=False)
+@click.option('--host', 'host_filter', help='Only include records for this instance ID')
+@click.option('--by-host', is_flag=True, help='Also break the summary down per host')
+def stats(timing_file: str, host_filter: str, by_host: bool):
+    """Summarise connect timing recorded with `connect --timing`.
+
+    TIMING_FILE defaults to $CLOUDX_PROXY_TIMING when it names a file, else
+    ~/.ssh/control/cloudx-proxy-timing.jsonl. Durations are shown in
+    milliseconds as p50/p95/p99 per phase and per AWS API call.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy stats
+    cloudx-proxy stats --by-host
+    cloudx-proxy stats /tmp/timing.jsonl --host i-0123456789abcdef0
+    """
+    from . import timing as timing_mod
+    try:
+        if timing_file:
+            path = Path(os.path.expanduser(timing_file))
+        else:
+            configured = timing_mod.Timing.from_option().destination
+            if configured and configured != timing_mod.STDERR:
+                path = Path(configured)
+            else:
+                path = timing_mod.default_timing_file()
+
+        if not path.exists():
+            print(f"Timing file not found: {path}")
+            print("Record timing with 'cloudx-proxy connect --timing' or $CLOUDX_PROXY_TIMING.")
+            sys.exit(1)
+
+        records = [r for r in timing_mod.load_records(path) if not host_filter or r.get('host') == host_filter]
+        if not records:
+            print(f"No timing records in {path}")
+            return
+
+        runs = len({r.get('run') for r in records})
+        print(f"\n{header('=== cloudx-proxy Connect Timing ===')}\n")
+        print(secondary(f"{len(records)} records from {runs} connects in {path}"))
+        print()
+
+        def print_table(title: str, summary: dict) -> None:
+            print(info(title))
+            print(f"  {'kind':<6} {'name':<44} {'count':>6} {'fail':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+            for (kind, name), row in sorted(summary.items()):
+                print(f"  {kind:<6} {name:<44} {row['count']:>6} {row['failed']:>5} "
+                      f"{row['p50']:>9.1f} {row['p95']:>9.1f} {row['p99']:>9.1f} {row['max']:>9.1f}")
+            print()
+
+        print_table("All hosts (ms):", timing_mod.summarize(records))
+
+        events = timing_mod.count_events(records)
+        if events:
+            print(info("Events:"))
+            for (name, result), count in sorted(events.items()):
+                print(f"  {name:<30} {result:<20} {count:>6}")
+            print()
+
+        if by_host:
+            per_host = {}
+            for (host, kind, name), row in timing_mod.summarize(records, by_host=True).items():
+                per_host.setdefault(host, {})[(kind, name)] = row
+            for host, summary in sorted(per_host.items()):
+                print_table(f"Host {host} (ms):", summary)
+
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
+
 @cli.command()
 @click.option('--target-dir', help='Target directory for migration (default: ~/.ssh/cloudX)')
 @click.option('--dry-run', is_flag=True, help='Preview migration without executing')
@@ -429,6 +1091,7 @@ def migrate(target_dir: str, dry_run: bool):
     This command moves the configuration from ~/.ssh/vscode to ~/.ssh/cloudX
     (or another specified directory) and updates ~/.ssh/config.
     """
+    from .setup import CloudXSetup
     try:
         setup = CloudXSetup(dry_run=dry_run)
 
@@ -447,13 +1110,22 @@ def migrate(target_dir: str, dry_run: bool):
 @click.option('--ssh-config', default=None, help='SSH config file to use')
 @click.option('--ssh-host-prefix', help='Prefix for SSH hosts (default: cloudx or cloudX depending on command name)')
 @click.option('--dry-run', is_flag=True, help='Preview cleanup without executing')
-def cleanup(ssh_config: str, ssh_host_prefix: str, dry_run: bool):
+@click.option('--layout', type=click.Choice(['single', 'sharded']),
+              help='Convert to one config file, or to one file per environment included from the config (default: keep the current layout)')
+@click.option('--proxy-command', type=click.Choice(['uvx', 'launcher']),
+              help='Run ProxyCommand with uvx, or with the launcher from install-launcher (default: keep the current form)')
+def cleanup(ssh_config: str, ssh_host_prefix: str, dry_run: bool, layout: str, proxy_command: str):
     """Clean up and reorganize SSH configuration file.
 
     This command:
     - Removes duplicate environment and host entries
     - Reorganizes the config with proper structure and ASCII banners
     - Writes the file completely fresh (full rewrite)
+    - With --layout sharded, moves every environment into its own file
+      (<config>.d/<env>.conf) included from the config; --layout single
+      merges them back
+    - With --proxy-command launcher, runs ProxyCommand with the launcher
+      installed by install-launcher; --proxy-command uvx goes back to uvx
     - Auto-detects SSH config location and matching ssh-host-prefix
 
     SSH config location is auto-detected:
@@ -472,7 +1144,10 @@ def cleanup(ssh_config: str, ssh_host_prefix: str, dry_run: bool):
     cloudX-proxy cleanup
     cloudx-proxy cleanup --ssh-config ~/.ssh/cloudx/config
     cloudx-proxy cleanup --dry-run
+    cloudx-proxy cleanup --layout sharded
+    cloudx-proxy cleanup --proxy-command uvx
     """
+    from .setup import CloudXSetup
     try:
         # Auto-detect SSH config location if not provided
         if not ssh_config:
@@ -487,7 +1162,8 @@ def cleanup(ssh_config: str, ssh_host_prefix: str, dry_run: bool):
             else:
                 ssh_host_prefix = 'cloudx'
 
-        setup = CloudXSetup(ssh_config=ssh_config, ssh_host_prefix=ssh_host_prefix, dry_run=dry_run)
+        setup = CloudXSetup(ssh_config=ssh_config, ssh_host_prefix=ssh_host_prefix, dry_run=dry_run, layout=layout,
+                            proxy_command=proxy_command)
 
         if setup.cleanup_config():
             print("\n\033[92mCleanup completed successfully!\033[0m")
@@ -498,5 +1174,61 @@ def cleanup(ssh_config: str, ssh_host_prefix: str, dry_run: bool):
         print(color_error(f"Error: {str(e)}"), file=sys.stderr)
         sys.exit(1)
 
+
+@cli.command('install-launcher')
+@click.option('--ssh-config', default=None, help='SSH config file to use')
+@click.option('--ssh-host-prefix', help='Prefix for SSH hosts (default: cloudx or cloudX depending on command name)')
+@click.option('--package', help='Requirement or path to install (default: cloudx-proxy pinned to this version)')
+@click.option('--dry-run', is_flag=True, help='Preview the installation and config changes without executing')
+def install_launcher(ssh_config: str, ssh_host_prefix: str, package: str, dry_run: bool):
+    """Install a pinned cloudx-proxy and run ProxyCommand from it.
+
+    A ProxyCommand of 'uvx cloudx-proxy connect ...' lets uv check and
+    resolve the package on every ssh connection. This command installs
+    cloudx-proxy into ~/.local/share/cloudx-proxy/venv (with uv if
+    available, otherwise venv and pip) and changes the ProxyCommands of the
+    SSH config to run it by absolute path. Only the program part of each
+    ProxyCommand changes. Run it again to upgrade the launcher;
+    'cleanup --proxy-command uvx' switches the config back.
+
+    \b
+    Example usage:
+    \b
+    cloudx-proxy install-launcher
+    cloudx-proxy install-launcher --package cloudx-proxy==0.16.3
+    cloudx-proxy install-launcher --dry-run
+    """
+    from . import launcher
+    from .setup import CloudXSetup
+    try:
+        if not ssh_config:
+            default_profile, default_ssh_key, detected_dir = detect_ssh_defaults()
+            ssh_config = f"{detected_dir}/config"
+        if not ssh_host_prefix:
+            ssh_host_prefix = _command_host_prefix()
+        package = package or launcher.default_package()
+        setup = CloudXSetup(ssh_config=ssh_config, ssh_host_prefix=ssh_host_prefix, dry_run=dry_run,
+                            proxy_command='launcher')
+
+        print(f"\n{header('=== cloudx-proxy Launcher ===')}\n")
+        if dry_run:
+            setup.print_status(f"[DRY RUN] Would install {package} into {launcher.default_venv()}", None, 2)
+            if launcher.installed():
+                setup.convert_proxy_commands()
+            else:
+                setup.print_status(f"[DRY RUN] Would change the ProxyCommands of {ssh_config} to the launcher", None, 2)
+            return
+
+        setup.print_status(f"Installing {package} into {launcher.default_venv()}...")
+        launcher.install(package)
+        setup.print_status(f"Installed {launcher.bin_dir()}", True, 2)
+        if not setup.convert_proxy_commands():
+            sys.exit(1)
+        print(f"\nTo go back to uvx, run: {format_command(os.path.basename(sys.argv[0]) + ' cleanup --proxy-command uvx')}")
+
+    except Exception as e:
+        print(color_error(f"Error: {str(e)}"), file=sys.stderr)
+        sys.exit(1)
+
 if __name__ == '__main__':
     cli()
@@ -0,0 +1,246 @@
+"""Timeouts, retries, connection pooling and endpoints of the AWS clients.
+
+botocore's defaults (60 second connect and read timeouts, legacy retries)
+let a ProxyCommand hang for minutes on a bad network before ssh sees an
+error. resolve() combines, per setting and from highest to lowest priority:
+
+1. Command line options (connect and setup)
+2. Environment variables (CLOUDX_PROXY_CONNECT_TIMEOUT, ...; the retry
+   settings also honor AWS_RETRY_MODE and AWS_MAX_ATTEMPTS)
+3. The [client] and [endpoints] sections of the config file
+   ($CLOUDX_PROXY_CONFIG, default ~/.config/cloudx-proxy/config.ini)
+4. PROXY_DEFAULTS (fail fast, for connect) or SETUP_DEFAULTS
+
+Endpoint URLs are set per service, e.g. for VPC interface endpoints. The
+environment variables for them are botocore's own AWS_ENDPOINT_URL_<SERVICE>,
+which take precedence over the config file.
+
+Resolving does not import botocore; ClientSettings.config() does.
+"""
+
+import configparser
+import os
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+CONFIG_ENV = "CLOUDX_PROXY_CONFIG"
+
+RETRY_MODES = ('legacy', 'standard', 'adaptive')
+
+# Fail fast: ssh is waiting, and a retry on a fresh connection beats a long read
+PROXY_DEFAULTS = {
+    'connect_timeout': 3.0,
+    'read_timeout': 10.0,
+    'retry_mode': 'standard',
+    'max_attempts': 3,
+    'tcp_keepalive': True,
+    'max_pool_connections': 10,
+}
+
+# Interactive commands can afford to wait for a slow network
+SETUP_DEFAULTS = dict(PROXY_DEFAULTS, connect_timeout=10.0, read_timeout=30.0, max_attempts=5)
+
+# Environment variables per setting, checked in order
+ENVIRONMENT = {
+    'connect_timeout': ("CLOUDX_PROXY_CONNECT_TIMEOUT",),
+    'read_timeout': ("CLOUDX_PROXY_READ_TIMEOUT",),
+    'retry_mode': ("CLOUDX_PROXY_RETRY_MODE", "AWS_RETRY_MODE"),
+    'max_attempts': ("CLOUDX_PROXY_MAX_ATTEMPTS", "AWS_MAX_ATTEMPTS"),
+    'tcp_keepalive': ("CLOUDX_PROXY_TCP_KEEPALIVE",),
+    'max_pool_connections': ("CLOUDX_PROXY_MAX_POOL_CONNECTIONS",),
+}
+
+
+def _positive_float(value: str) -> float:
+    number = float(value)
+    if number <= 0:
+        raise ValueError(f"{value} is not positive")
+    return number
+
+
+def _positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise ValueError(f"{value} is not positive")
+    return number
+
+
+def _retry_mode(value: str) -> str:
+    value = value.strip().lower()
+    if value not in RETRY_MODES:
+        raise ValueError(f"{value} is not one of {', '.join(RETRY_MODES)}")
+    return value
+
+
+def _boolean(value: str) -> bool:
+    states = configparser.ConfigParser.BOOLEAN_STATES
+    if value.strip().lower() not in states:
+        raise ValueError(f"{value} is not a boolean")
+    return states[value.strip().lower()]
+
+
+PARSERS = {
+    'connect_timeout': _positive_float,
+    'read_timeout': _positive_float,
+    'retry_mode': _retry_mode,
+    'max_attempts': _positive_int,
+    'tcp_keepalive': _boolean,
+    'max_pool_connections': _positive_int,
+}
+
+
+class ClientSettings:
+    """Resolved client settings; equal settings share sessions.context() entries."""
+
+    def __init__(self, endpoints: Dict[str, str] = None, **values):
+        """Initialize the settings.
+
+        Args:
+            endpoints: Endpoint URL per service name, e.g. {'ssm': 'https://...'}
+            **values: Settings of PROXY_DEFAULTS (missing ones take its values)
+        """
+        unknown = set(values) - set(PROXY_DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+        self.values = dict(PROXY_DEFAULTS, **values)
+        self.endpoints = dict(endpoints or {})
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['values'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def _key(self) -> tuple:
+        return tuple(sorted(self.values.items())), tuple(sorted(self.endpoints.items()))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ClientSettings) and self._key() == other._key()
+
+    def __hash__(self) -> int:
+        return hash(self._key())
+
+    def __repr__(self) -> str:
+        return f"ClientSettings({self.to_dict()!r})"
+
+    def to_dict(self) -> dict:
+        """Return the settings as JSON-serializable dict (e.g. for an agent request)."""
+        return dict(self.values, endpoints=dict(self.endpoints))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'ClientSettings':
+        """Inverse of to_dict()."""
+        data = dict(data)
+        return cls(data.pop('endpoints', None), **data)
+
+    def to_args(self) -> List[str]:
+        """Return the command line options that resolve to these settings (e.g. for a spawned mux)."""
+        args = []
+        for name, value in self.values.items():
+            option = '--' + name.replace('_', '-')
+            if isinstance(value, bool):
+                args.append(option if value else '--no-' + option[2:])
+            else:
+                args += [option, str(value)]
+        for service, url in sorted(self.endpoints.items()):
+            args += ['--endpoint-url', f"{service}={url}"]
+        return args
+
+    def config(self):
+        """Return the botocore Config of these settings."""
+        from botocore.config import Config
+
+        return Config(
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout,
+            retries={'mode': self.retry_mode, 'total_max_attempts': self.max_attempts},
+            tcp_keepalive=self.tcp_keepalive,
+            max_pool_connections=self.max_pool_connections,
+        )
+
+    def client_kwargs(self, service: str) -> dict:
+        """Return the keyword arguments of Session.client() for a service."""
+        kwargs = {'config': self.config()}
+        if self.endpoints.get(service):
+            kwargs['endpoint_url'] = self.endpoints[service]
+        return kwargs
+
+
+def default_config_file() -> Path:
+    """Return the config file: $CLOUDX_PROXY_CONFIG or ~/.config/cloudx-proxy/config.ini."""
+    override = os.environ.get(CONFIG_ENV)
+    if override:
+        return Path(os.path.expanduser(override))
+    return Path.home() / ".config" / "cloudx-proxy" / "config.ini"
+
+
+def _read_config_file(path: Path) -> configparser.ConfigParser:
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(path)
+    except configparser.Error:
+        pass  # A broken file must not keep ssh from connecting; it is ignored like a missing one
+    return parser
+
+
+def parse_endpoints(values: Iterable[str]) -> Dict[str, str]:
+    """Parse SERVICE=URL pairs as given to --endpoint-url.
+
+    Raises:
+        ValueError: If a value is not of the form SERVICE=URL
+    """
+    endpoints = {}
+    for value in values or ():
+        service, separator, url = value.partition('=')
+        if not separator or not service.strip() or not url.strip():
+            raise ValueError(f"Expected SERVICE=URL, got {value!r}")
+        endpoints[service.strip()] = url.strip()
+    return endpoints
+
+
+def _service_env(service: str) -> str:
+    return "AWS_ENDPOINT_URL_" + service.upper().replace('-', '_')
+
+
+def resolve(options: Optional[dict] = None, endpoints: Optional[Dict[str, str]] = None,
+            defaults: dict = PROXY_DEFAULTS, config_file: Path = None) -> ClientSettings:
+    """Resolve the client settings from options, environment, config file and defaults.
+
+    Invalid values in the environment or config file are ignored, falling
+    back to the next source, so they never break a ProxyCommand.
+
+    Args:
+        options: Settings given on the command line; None values are unset
+        endpoints: Endpoint URL per service given on the command line
+        defaults: PROXY_DEFAULTS or SETUP_DEFAULTS
+        config_file: Config file (default: default_config_file())
+
+    Returns:
+        ClientSettings: The resolved settings
+    """
+    options = options or {}
+    path = Path(config_file) if config_file else default_config_file()
+    parser = _read_config_file(path) if path.exists() else configparser.ConfigParser()
+    file_values = dict(parser['client']) if parser.has_section('client') else {}
+
+    values = {}
+    for name, parse in PARSERS.items():
+        if options.get(name) is not None:
+            values[name] = options[name]
+            continue
+        candidates = [os.environ.get(variable) for variable in ENVIRONMENT[name]] + [file_values.get(name)]
+        values[name] = defaults[name]
+        for candidate in candidates:
+            if candidate:
+                try:
+                    values[name] = parse(candidate)
+                    break
+                except ValueError:
+                    continue
+
+    resolved = {}
+    if parser.has_section('endpoints'):
+        resolved = {service: url for service, url in parser['endpoints'].items()
+                    if url and not os.environ.get(_service_env(service)) and not os.environ.get("AWS_ENDPOINT_URL")}
+    resolved.update(endpoints or {})
+    return ClientSettings(resolved, **values)
@@ -0,0 +1,201 @@
+"""Crash-safe writes of SSH config files shared by concurrent processes.
+
+Running ssh processes read the config while setup, cleanup or another
+setup run (scripted onboarding often starts several) change it. Every
+change therefore goes through update() or write(): they hold an advisory
+lock next to the file (.<name>.lock), write the new content to a temporary
+file in the same directory, fsync it, set 0600 and rename it over the old
+file. Readers see either the old or the new file, never a truncated one,
+and read-modify-write cycles of different processes do not lose each
+other's changes.
+
+read_with_includes() reads a config together with the files it includes,
+such as the per-environment files of the sharded layout.
+"""
+
+import glob
+import hashlib
+import os
+import re
+import shlex
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .locking import FileLock
+from .sshconfig import SSHConfig
+
+# Seconds to wait for another process that is writing the same file
+LOCK_TIMEOUT = 30
+
+_INCLUDE = re.compile(r'^[ \t]*include\b', re.IGNORECASE | re.MULTILINE)
+
+
+class ConfigChanged(RuntimeError):
+    """Raised by write() when the file no longer has the expected content."""
+
+
+def _target(path: Path) -> Path:
+    # Write through symlinks (e.g. a config kept in a dotfiles repository)
+    # instead of replacing the link with a regular file
+    return Path(os.path.realpath(path))
+
+
+def lock(path: Path, timeout: float = LOCK_TIMEOUT) -> FileLock:
+    """Return the lock guarding changes to path (not yet acquired)."""
+    target = _target(path)
+    return FileLock(target.with_name(f".{target.name}.lock"), timeout=timeout)
+
+
+def read(path: Path) -> str:
+    """Return the content of path ('' if it does not exist)."""
+    try:
+        return Path(path).read_text()
+    except FileNotFoundError:
+        return ''
+
+
+def digest(content: str) -> str:
+    """Return the SHA-256 of content, for compare-and-swap with write()."""
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def stamp(files: List[Path]) -> List[list]:
+    """Return [path, inode, size, mtime_ns] of each file, the cheap half of a fingerprint with digest().
+
+    Take it before reading the files: a file replaced in between then looks
+    changed next time instead of unchanged.
+    """
+    stamps = []
+    for name in files:
+        st = os.stat(name)
+        stamps.append([str(name), st.st_ino, st.st_size, st.st_mtime_ns])
+    return stamps
+
+
+def write_atomic(path: Path, content: str, mode: int = 0o600) -> None:
+    """Replace path with content: temp file, fsync, chmod, rename.
+
+    Callers should hold lock(path) so that concurrent writers are serialized.
+
+    Args:
+        path: File to write
+        content: New content
+        mode: Permissions of the new file
+    """
+    target = _target(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if os.name != 'nt':
+            os.chmod(tmp, mode)  # O_CREAT honours the umask
+        os.replace(tmp, target)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+    if os.name != 'nt':
+        # Make the rename itself durable
+        dir_fd = os.open(target.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def write(path: Path, content: str, expected: Optional[str] = None, timeout: float = LOCK_TIMEOUT) -> None:
+    """Atomically replace path with content under its lock.
+
+    Args:
+        path: File to write
+        content: New content
+        expected: digest() of the content the caller based its change on;
+            if given and the file has changed since, nothing is written
+        timeout: Seconds to wait for the lock
+
+    Raises:
+        ConfigChanged: If expected does not match the current content
+        LockTimeout: If another process holds the lock for longer than timeout
+    """
+    with lock(path, timeout):
+        if expected is not None and digest(read(path)) != expected:
+            raise ConfigChanged(f"{path} was changed by another process")
+        write_atomic(path, content)
+
+
+def update(path: Path, change: Callable[[str], str], timeout: float = LOCK_TIMEOUT) -> Tuple[str, str]:
+    """Read path, apply change and write the result, all under the lock.
+
+    The file is only written if change returns different content.
+
+    Args:
+        path: File to update ('' is passed to change if it does not exist)
+        change: Callable mapping the current content to the new content
+        timeout: Seconds to wait for the lock
+
+    Returns:
+        Tuple[str, str]: Old and new content
+
+    Raises:
+        LockTimeout: If another process holds the lock for longer than timeout
+    """
+    with lock(path, timeout):
+        old = read(path)
+        new = change(old)
+        if new != old:
+            write_atomic(path, new)
+    return old, new
+
+
+def include_patterns(content: str) -> List[str]:
+    """Return the paths of the Include directives of a config, expanded as ssh does.
+
+    Relative paths are taken to be in ~/.ssh (as for a user config).
+    """
+    if not _INCLUDE.search(content):
+        return []
+    patterns = []
+    for line in SSHConfig.parse(content).lines():
+        if line.kind == 'directive' and line.key == 'include':
+            try:
+                values = shlex.split(line.value)
+            except ValueError:
+                values = line.value.split()
+            for value in values:
+                value = os.path.expanduser(value)
+                patterns.append(value if os.path.isabs(value) else str(Path.home() / ".ssh" / value))
+    return patterns
+
+
+def included_files(patterns: List[str]) -> List[Path]:
+    """Return the files matching Include patterns, in the order ssh reads them."""
+    files = []
+    for pattern in patterns:
+        files += [Path(name) for name in sorted(glob.glob(pattern)) if os.path.isfile(name)]
+    return files
+
+
+def read_with_includes(path: Path) -> Tuple[str, List[str], List[Path]]:
+    """Read a config followed by the files it includes (one level, e.g. per-environment shards).
+
+    Returns:
+        Tuple[str, List[str], List[Path]]: Combined content, Include patterns
+            of the config and the included files read
+    """
+    content = read(path)
+    patterns = include_patterns(content)
+    files = included_files(patterns)
+    return join([content] + [read(name) for name in files]), patterns, files
+
+
+def join(contents: List[str]) -> str:
+    """Concatenate config contents as ssh reads them, one after the other."""
+    return ''.join(part if part.endswith('\n') or not part else part + '\n' for part in contents)
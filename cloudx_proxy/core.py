@@ -1,13 +1,135 @@
 import os
+import subprocess
 import sys
-import time
+import threading
+from typing import Optional
 import boto3
 from botocore.exceptions import ClientError
+from . import clientconfig, sessions
+from .cache import (STATUS_TTL, key_fingerprint, key_push_cache, key_push_entry, resolve_status_ttl,
+                    status_cache, watch_session)
+from .timing import Timing, instrument_client
+
+
+class SessionStartError(subprocess.CalledProcessError):
+    """The AWS CLI failed in the StartSession call, before any session data was relayed."""
+
+
+def configure_aws_env(aws_env: str = None) -> None:
+    """Point the AWS SDK and CLI at an aws-envs directory.
+
+    Args:
+        aws_env: Name of the directory in ~/.aws/aws-envs/ (None leaves the environment untouched)
+    """
+    if aws_env:
+        aws_env_dir = os.path.expanduser(f"~/.aws/aws-envs/{aws_env}")
+        os.environ["AWS_CONFIG_FILE"] = os.path.join(aws_env_dir, "config")
+        os.environ["AWS_SHARED_CREDENTIALS_FILE"] = os.path.join(aws_env_dir, "credentials")
+
+
+def run_session(instance_id: str, port: int, profile: str, region: str, log=None,
+                relay: bool = True) -> Optional[dict]:
+    """Run `aws ssm start-session` with SSH port forwarding on our stdin/stdout.
+
+    When used as a ProxyCommand, we need to:
+    1. Pass through stdin/stdout directly to AWS CLI
+    2. Only use stderr for logging
+    3. Let the session manager plugin handle the actual data transfer
+
+    With relay set (and supported, see relay.py) the AWS CLI gets pipes and
+    cloudx-proxy relays stdin/stdout itself, counting bytes and stalls and
+    following the SSH key exchange (see cache.session_rejected()).
+
+    Args:
+        instance_id: EC2 instance ID to connect to
+        port: Remote port to forward
+        profile: AWS profile to pass to the AWS CLI
+        region: AWS region to pass to the AWS CLI
+        log: Callable used for stderr logging (default: print to stderr)
+        relay: Relay stdin/stdout instead of passing them through (default: True)
+
+    Returns:
+        Optional[dict]: Relay statistics (see relay.relay_process()), or None
+        when stdin/stdout were passed through
+
+    Raises:
+        SessionStartError: If the StartSession call failed (stdin is untouched, so the caller may retry)
+        subprocess.CalledProcessError: If the AWS CLI exits with a non-zero status otherwise
+    """
+    import platform
+
+    log = log or (lambda message: print(message, file=sys.stderr))
+
+    # Build environment with AWS credentials configuration
+    env = os.environ.copy()
+    if 'AWS_CONFIG_FILE' in os.environ:
+        env['AWS_CONFIG_FILE'] = os.environ['AWS_CONFIG_FILE']
+    if 'AWS_SHARED_CREDENTIALS_FILE' in os.environ:
+        env['AWS_SHARED_CREDENTIALS_FILE'] = os.environ['AWS_SHARED_CREDENTIALS_FILE']
+
+    # Determine AWS CLI command based on platform
+    aws_cmd = 'aws.exe' if platform.system() == 'Windows' else 'aws'
+
+    # Build command as list (works for both Windows and Unix)
+    cmd = [
+        aws_cmd, 'ssm', 'start-session',
+        '--target', instance_id,
+        '--document-name', 'AWS-StartSSHSession',
+        '--parameters', f'portNumber={port}',
+        '--profile', profile,
+        '--region', region
+    ]
+
+    start_failed = False
+
+    def log_stderr(line: str) -> None:
+        nonlocal start_failed
+        line = line.strip()
+        # e.g. "An error occurred (TargetNotConnected) when calling the StartSession operation: ..."
+        start_failed = start_failed or 'when calling the StartSession operation' in line
+        log(line)
+
+    from .relay import relay_process, relay_supported
+    relay = relay and relay_supported()
+
+    # Start AWS CLI process with direct stdin/stdout pass-through (or pipes to relay)
+    process = subprocess.Popen(
+        cmd,
+        env=env,
+        stdin=subprocess.PIPE if relay else sys.stdin,
+        stdout=subprocess.PIPE if relay else sys.stdout,
+        stderr=subprocess.PIPE,  # Capture stderr for our logging
+        shell=platform.system() == 'Windows'  # shell=True only on Windows
+    )
+
+    stats = None
+    if relay:
+        sys.stdout.flush()
+        stats = relay_process(process, sys.stdin.fileno(), sys.stdout.fileno(), log_stderr)
+    else:
+        # Monitor stderr for logging while process runs
+        while True:
+            err_line = process.stderr.readline()
+            if not err_line and process.poll() is not None:
+                break
+            if err_line:
+                log_stderr(err_line.decode())
+
+    if process.returncode != 0:
+        if start_failed:
+            raise SessionStartError(process.returncode, cmd)
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return stats
+
 
 class CloudXProxy:
     def __init__(self, instance_id: str, port: int = 22, profile: str = "vscode",
                  region: str = None, ssh_key: str = "vscode", ssh_config: str = None,
-                 ssh_dir: str = None, aws_env: str = None, dry_run: bool = False):
+                 ssh_dir: str = None, aws_env: str = None, dry_run: bool = False,
+                 session: boto3.Session = None, clients: dict = None, native: bool = False,
+                 timing: Timing = None, status_ttl: float = None, optimistic: bool = False,
+                 context: sessions.AWSContext = None, client_config: clientconfig.ClientSettings = None,
+                 relay: bool = True):
         """Initialize CloudX client for SSH tunneling via AWS SSM.
         
         Args:
@@ -20,34 +142,51 @@ class CloudXProxy:
             ssh_dir: Directory for SSH keys and config (optional)
             aws_env: AWS environment directory (default: None, uses ~/.aws)
             dry_run: Preview mode, show what would be done without executing (default: False)
+            session: Pre-built boto3 session to use instead of a shared context (optional)
+            clients: Pre-built clients keyed by service name to reuse with session (optional)
+            native: Relay the session with the built-in data channel client instead of the AWS CLI (default: False)
+            timing: Timing spans to record phases and AWS API calls into (default: disabled)
+            status_ttl: Seconds a cached Online status is trusted, 0 to always ask SSM
+                (default: $CLOUDX_PROXY_STATUS_TTL or 15)
+            optimistic: Check status, push the key (and in native mode start the
+                session) concurrently, assuming the instance is Online (default: False)
+            context: Shared session context to take the session and clients from, e.g. held warm
+                by the agent (default: sessions.context() of profile, aws_env, region and client_config)
+            client_config: Timeouts, retries and endpoints of the AWS clients
+                (default: clientconfig.resolve() with its fail-fast defaults)
+            relay: Relay an AWS CLI session's stdin/stdout in this process (see relay.py) (default: True)
         """
         self.instance_id = instance_id
         self.port = port
         self.profile = profile
         self.dry_run = dry_run
+        self.native = native
+        self.timing = timing or Timing()
+        self.status_ttl = resolve_status_ttl(status_ttl)
+        self.status_cached = False
+        self.optimistic = optimistic
+        self.relay = relay
+        self.preopened_session = None
         
         # Configure AWS environment
-        if aws_env:
-            aws_env_dir = os.path.expanduser(f"~/.aws/aws-envs/{aws_env}")
-            os.environ["AWS_CONFIG_FILE"] = os.path.join(aws_env_dir, "config")
-            os.environ["AWS_SHARED_CREDENTIALS_FILE"] = os.path.join(aws_env_dir, "credentials")
+        configure_aws_env(aws_env)
         
+        # AWS clients are built on first use (see _client)
+        self._context = None
+        self.client_config = client_config or getattr(context, 'client_config', None) or clientconfig.resolve()
+        self._clients = dict(clients or {})
+        self._clients_lock = threading.Lock()
+
         # Set up AWS session with eu-west-1 as default region (skip in dry-run mode)
         if not self.dry_run:
-            if not region:
-                # Try to get region from profile first
-                session = boto3.Session(profile_name=profile)
-                region = session.region_name or 'eu-west-1'
-            
-            self.session = boto3.Session(profile_name=profile, region_name=region)
-            self.ssm = self.session.client('ssm')
-            self.ec2 = self.session.client('ec2')
-            self.ec2_connect = self.session.client('ec2-instance-connect')
+            if session is None:
+                # Shared per profile/aws-env/region: config files are read and the region resolved once
+                self._context = context or sessions.context(profile, aws_env, region, self.client_config)
+                session = self._context.session
+            self.session = session
+            region = session.region_name
         else:
             self.session = None
-            self.ssm = None
-            self.ec2 = None
-            self.ec2_connect = None
             if not region:
                 region = 'eu-west-1'  # Default for dry-run display
         self.region = region
@@ -75,6 +214,36 @@ class CloudXProxy:
             
         self.ssh_key = os.path.join(self.ssh_dir, f"{ssh_key}.pub")
 
+    def _client(self, service: str):
+        """Return the client of a service (None in dry-run mode), building it on first use."""
+        if self.dry_run:
+            return None
+        client = self._clients.get(service)
+        if client is None:
+            with self._clients_lock:
+                client = self._clients.get(service)
+                if client is None:
+                    if self._context:
+                        client = self._context.client(service)
+                    else:
+                        client = self.session.client(service, **self.client_config.client_kwargs(service))
+                    self._clients[service] = client
+        if self.timing.enabled:
+            instrument_client(client)
+        return client
+
+    @property
+    def ssm(self):
+        return self._client('ssm')
+
+    @property
+    def ec2(self):
+        return self._client('ec2')
+
+    @property
+    def ec2_connect(self):
+        return self._client('ec2-instance-connect')
+
     def log(self, message: str) -> None:
         """Log message to stderr to avoid interfering with SSH connection."""
         print(message, file=sys.stderr)
@@ -94,6 +263,36 @@ class CloudXProxy:
         except ClientError:
             return 'Offline'
 
+    def cached_instance_status(self) -> str:
+        """Return the instance status, skipping the SSM call while a fresh Online status is cached.
+
+        Statuses read from SSM are shared with other cloudx-proxy processes
+        through the status cache: Online is stored, anything else removes the
+        entry.
+        """
+        if self.status_ttl:
+            cache = status_cache(self.status_ttl)
+            entry = cache.get(self.instance_id)
+            if entry and entry['value'] == 'Online':
+                self.timing.event('status_cache', result='hit')
+                self.status_cached = True
+                return 'Online'
+            self.timing.event('status_cache', result='miss')
+
+        self.status_cached = False
+        with self.timing.span('get_instance_status') as span:
+            status = span['status'] = self.get_instance_status()
+        self.remember_status(status)
+        return status
+
+    def remember_status(self, status: str) -> None:
+        """Share an observed instance status through the status cache."""
+        cache = status_cache(max(self.status_ttl, STATUS_TTL))
+        if status == 'Online':
+            cache.put(self.instance_id, status)
+        elif cache.get(self.instance_id):
+            cache.delete(self.instance_id)
+
     def start_instance(self) -> bool:
         """Start the EC2 instance if it's stopped."""
         if self.dry_run:
@@ -107,60 +306,95 @@ class CloudXProxy:
             self.log(f"Error starting instance: {e}")
             return False
 
-    def wait_for_instance(self, max_attempts: int = 30, delay: int = 3) -> bool:
-        """Wait for instance to come online.
-        
+    def wait_for_instance(self, status: str = None, timeout: int = None) -> bool:
+        """Start the instance if needed and wait for it to come online.
+
+        Follows the EC2 state and SSM PingStatus together (see wakeup.py):
+        a stopping instance is allowed to stop before it is started, and
+        polling speeds up around the time the instance is expected to come
+        online based on earlier wake-ups.
+
         Args:
-            max_attempts: Maximum number of status checks
-            delay: Seconds between checks
-        
+            status: SSM PingStatus already observed (optional)
+            timeout: Seconds to wait (default: wakeup.WAKE_TIMEOUT)
+
         Returns:
-            bool: True if instance came online, False if timeout
+            bool: True if instance came online, False if it failed or timed out
         """
+        from .wakeup import InstanceWaker, WAKE_TIMEOUT
+
+        timeout = timeout or WAKE_TIMEOUT
         if self.dry_run:
-            self.log(f"[DRY RUN] Would wait for instance to come online (max {max_attempts * delay} seconds)")
+            self.log(f"[DRY RUN] Would wait for instance to come online (max {timeout} seconds)")
             return True
-            
-        for _ in range(max_attempts):
-            if self.get_instance_status() == 'Online':
-                return True
-            time.sleep(delay)
-        return False
 
-    def push_ssh_key(self) -> bool:
+        return InstanceWaker(self).wake(status, timeout)
+
+    def public_key_path(self) -> str:
+        """Return the public key file to push.
+
+        Checks if the path already ends in .pub (because of 1Password
+        integration) and appends it otherwise (a non-1Password key).
+        """
+        key_path = self.ssh_key
+        if not key_path.endswith('.pub'):
+            key_path += '.pub'
+        return key_path
+
+    def key_push_entry(self) -> str:
+        """Return the key push cache entry for this connection's key, or None if the key is unreadable."""
+        try:
+            with open(self.public_key_path()) as f:
+                return key_push_entry(self.instance_id, 'ec2-user', key_fingerprint(f.read()))
+        except OSError:
+            return None
+
+    def push_ssh_key(self, log=None) -> bool:
         """Push SSH public key to instance via EC2 Instance Connect.
         
         Determines which SSH key to use (regular key or 1Password-managed key),
         then pushes the correct public key to the instance.
+
+        A pushed key stays valid for 60 seconds, so a push of the same key to
+        the same instance made by any cloudx-proxy process in the last
+        KEY_PUSH_REUSE seconds is reused instead of repeated.
+
+        Args:
+            log: Callable used for logging (default: self.log)
         """
+        log = log or self.log
         if self.dry_run:
             key_path = self.ssh_key
             if not key_path.endswith('.pub'):
                 key_path += '.pub'
-            self.log(f"[DRY RUN] Would push SSH public key: {key_path}")
-            self.log(f"[DRY RUN] Would send key to instance {self.instance_id} as ec2-user")
+            log(f"[DRY RUN] Would push SSH public key: {key_path}")
+            log(f"[DRY RUN] Would send key to instance {self.instance_id} as ec2-user")
             return True
             
         try:
-            # Check if file exists with .pub extension (could be a non-1Password key)
-            # or if the .pub extension is already part of self.ssh_key (because of 1Password integration)
-            key_path = self.ssh_key
-            if not key_path.endswith('.pub'):
-                key_path += '.pub'
-                
-            self.log(f"Using public key: {key_path}")
+            key_path = self.public_key_path()
+            log(f"Using public key: {key_path}")
             
             with open(key_path) as f:
                 public_key = f.read()
-            
+
+            cache = key_push_cache()
+            entry = key_push_entry(self.instance_id, 'ec2-user', key_fingerprint(public_key))
+            if cache.get(entry):
+                self.timing.event('key_push_cache', result='hit')
+                log("SSH public key was pushed moments ago, reusing it")
+                return True
+            self.timing.event('key_push_cache', result='miss')
+
             self.ec2_connect.send_ssh_public_key(
                 InstanceId=self.instance_id,
                 InstanceOSUser='ec2-user',
                 SSHPublicKey=public_key
             )
+            cache.put(entry)
             return True
         except (ClientError, FileNotFoundError) as e:
-            self.log(f"Error pushing SSH key: {e}")
+            log(f"Error pushing SSH key: {e}")
             return False
 
     def start_session(self) -> None:
@@ -168,66 +402,78 @@ class CloudXProxy:
         
         Uses AWS CLI directly to ensure proper stdin/stdout handling for SSH ProxyCommand.
         The session manager plugin will automatically handle the data transfer.
-        
-        When used as a ProxyCommand, we need to:
-        1. Pass through stdin/stdout directly to AWS CLI
-        2. Only use stderr for logging
-        3. Let the session manager plugin handle the actual data transfer
+        See run_session() for the stdin/stdout handling.
+
+        In native mode the session is started through the SSM API and relayed by
+        the built-in data channel client; if the channel cannot be opened the
+        AWS CLI is used instead.
         """
         if self.dry_run:
             region = self.region or 'eu-west-1'  # Use initialized region or default
             self.log(f"[DRY RUN] Would start SSM session with SSH port forwarding")
+            if self.native:
+                self.log(f"[DRY RUN] Would relay the session with the native data channel client")
             self.log(f"[DRY RUN] Would run: aws ssm start-session --target {self.instance_id} --document-name AWS-StartSSHSession --parameters portNumber={self.port} --profile {self.profile} --region {region}")
             return
-            
-        import subprocess
-        import platform
-        
+
+        with self.timing.activate(), watch_session(self.key_push_entry(), self.timing) as watched:
+            self.timing.mark('ready')
+            if self.native and self.start_native_session(watched):
+                return
+
+            try:
+                with self.timing.span('session', native=False) as span:
+                    stats = run_session(self.instance_id, self.port, self.profile, self.session.region_name,
+                                        self.log, relay=self.relay)
+                    span.update(stats or {})
+                    watched.update(stats or {})
+            except subprocess.CalledProcessError as e:
+                self.log(f"Error starting session: {e}")
+                raise
+
+    def start_native_session(self, stats: dict = None) -> bool:
+        """Start the session and relay it with the built-in data channel client.
+
+        Args:
+            stats: Dict to update with the relayed byte counts (optional)
+
+        Returns:
+            bool: True if the session ran natively, False if the caller should
+            fall back to the AWS CLI (nothing has been relayed in that case)
+
+        Raises:
+            DataChannelError: If the data channel is lost mid-session
+        """
+        from .datachannel import DataChannelError, open_session, relay_session
+
         try:
-            # Build environment with AWS credentials configuration
-            env = os.environ.copy()
-            if 'AWS_CONFIG_FILE' in os.environ:
-                env['AWS_CONFIG_FILE'] = os.environ['AWS_CONFIG_FILE']
-            if 'AWS_SHARED_CREDENTIALS_FILE' in os.environ:
-                env['AWS_SHARED_CREDENTIALS_FILE'] = os.environ['AWS_SHARED_CREDENTIALS_FILE']
-            
-            # Determine AWS CLI command based on platform
-            aws_cmd = 'aws.exe' if platform.system() == 'Windows' else 'aws'
-            
-            # Build command as list (works for both Windows and Unix)
-            cmd = [
-                aws_cmd, 'ssm', 'start-session',
-                '--target', self.instance_id,
-                '--document-name', 'AWS-StartSSHSession',
-                '--parameters', f'portNumber={self.port}',
-                '--profile', self.profile,
-                '--region', self.session.region_name
-            ]
-            
-            # Start AWS CLI process with direct stdin/stdout pass-through
-            process = subprocess.Popen(
-                cmd,
-                env=env,
-                stdin=sys.stdin,
-                stdout=sys.stdout,
-                stderr=subprocess.PIPE,  # Capture stderr for our logging
-                shell=platform.system() == 'Windows'  # shell=True only on Windows
-            )
-            
-            # Monitor stderr for logging while process runs
-            while True:
-                err_line = process.stderr.readline()
-                if not err_line and process.poll() is not None:
-                    break
-                if err_line:
-                    self.log(err_line.decode().strip())
-            
-            if process.returncode != 0:
-                raise subprocess.CalledProcessError(process.returncode, cmd)
-            
-        except subprocess.CalledProcessError as e:
-            self.log(f"Error starting session: {e}")
-            raise
+            session, self.preopened_session = self.preopened_session, None
+            if session is None:
+                with self.timing.span('session_open'):
+                    session = open_session(self.ssm, self.instance_id, self.port)
+        except ClientError as e:
+            self.log(f"Native session unavailable: {e}")
+            self.log("Falling back to AWS CLI session")
+            return False
+
+        try:
+            status = relay_session(session, self.log, timing=self.timing, stats=stats)
+        finally:
+            self.terminate_session(session['SessionId'])
+
+        if status is None:
+            self.log("Falling back to AWS CLI session")
+            return False
+        if status != 0:
+            raise DataChannelError("Session data channel was lost")
+        return True
+
+    def terminate_session(self, session_id: str) -> None:
+        """Terminate an SSM session (best effort)."""
+        try:
+            self.ssm.terminate_session(SessionId=session_id)
+        except ClientError as e:
+            self.log(f"Error terminating session {session_id}: {e}")
 
     def connect(self) -> bool:
         """Main connection flow:
@@ -244,23 +490,121 @@ class CloudXProxy:
             self.log(f"[DRY RUN] Would push SSH key to instance")
             self.log(f"[DRY RUN] Would start SSM session with port forwarding 22 -> localhost:22")
             return True
-            
-        status = self.get_instance_status()
-        
-        if status != 'Online':
-            self.log(f"Instance {self.instance_id} is {status}, starting...")
-            if not self.start_instance():
+
+        if not self.prepare():
+            return False
+
+        self.log("Starting SSM session...")
+        try:
+            self.start_session()
+        except SessionStartError:
+            if not self.status_cached:
+                raise
+            # The cached Online status was stale; take the full wake-up path
+            self.log("Session failed to start, checking the instance again...")
+            self.status_ttl = 0
+            if not self.prepare():
                 return False
-            
-            self.log("Waiting for instance to come online...")
-            if not self.wait_for_instance():
+            self.start_session()
+        return True
+
+    def prepare(self) -> bool:
+        """Get the instance ready for an SSM session:
+        1. Check instance status
+        2. Start if needed and wait for online
+        3. Push SSH key
+
+        Concurrent connects to the same instance (e.g. the parallel ssh
+        processes VS Code starts) share one preparation: the first does the
+        work while the others wait for it and reuse its result.
+
+        Returns:
+            bool: True if the instance is online and the key was pushed
+        """
+        from .locking import single_flight
+
+        with self.timing.activate():
+            return single_flight(self.instance_id, self._prepare, token=f"ec2-user:{self.ssh_key}",
+                                 log=self.log, timing=self.timing)
+
+    def wake(self) -> bool:
+        """Get the instance online for a session that needs no SSH key (e.g. port forwarding).
+
+        Like prepare() without the key push; concurrent callers share one wake-up.
+
+        Returns:
+            bool: True if the instance is online
+        """
+        from .locking import single_flight
+
+        with self.timing.activate():
+            return single_flight(self.instance_id, lambda: self._wake(self.cached_instance_status()),
+                                 token="online", log=self.log, timing=self.timing)
+
+    def _prepare(self) -> bool:
+        if self.optimistic:
+            return self._prepare_optimistic()
+        return self._wake_and_push(self.cached_instance_status())
+
+    def _wake(self, status: str) -> bool:
+        if status != 'Online':
+            self.log(f"Instance {self.instance_id} is {status}, waking it up...")
+            with self.timing.span('wait_for_instance') as span:
+                span['ok'] = self.wait_for_instance(status)
+            if not span['ok']:
                 self.log("Instance failed to come online")
                 return False
-        
-        self.log("Pushing SSH public key...")
-        if not self.push_ssh_key():
-            return False
-        
-        self.log("Starting SSM session...")
-        self.start_session()
+            self.remember_status('Online')
         return True
+
+    def _wake_and_push(self, status: str) -> bool:
+        if not self._wake(status):
+            return False
+
+        self.log("Pushing SSH public key...")
+        with self.timing.span('push_ssh_key') as span:
+            span['ok'] = self.push_ssh_key()
+        return span['ok']
+
+    def _prepare_optimistic(self) -> bool:
+        """Prepare assuming the instance is Online.
+
+        The status check, the key read and push and (in native mode)
+        StartSession run concurrently, so a warm instance costs one round
+        trip instead of three. If the instance turns out not to be Online,
+        the speculative work is discarded and the regular path runs.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from .datachannel import open_session
+
+        def run(work, *args):
+            with self.timing.activate():
+                return work(*args)
+
+        push_log = []
+        with self.timing.span('preflight', optimistic=True) as span, ThreadPoolExecutor(max_workers=3) as pool:
+            status = pool.submit(run, self.cached_instance_status)
+            push = pool.submit(run, self.push_ssh_key, push_log.append)
+            session = pool.submit(run, open_session, self.ssm, self.instance_id, self.port) if self.native else None
+
+            online = status.result() == 'Online'
+            pushed = push.result()
+            opened = None
+            if session is not None:
+                try:
+                    opened = session.result()
+                except ClientError:
+                    pass
+            span['online'] = online
+
+        if online:
+            for message in push_log:
+                self.log(message)
+            self.preopened_session = opened
+            return pushed
+
+        # Not Online: a session started too early is useless, the push may have failed
+        if opened:
+            self.terminate_session(opened['SessionId'])
+        self.timing.event('preflight', result='redo')
+        return self._wake_and_push(status.result())
@@ -0,0 +1,477 @@
+"""Native client for the SSM Session Manager data channel.
+
+Implements the part of the session-manager-plugin protocol needed for
+`AWS-StartSSHSession`, so a connect can relay stdin/stdout straight to the
+session websocket instead of spawning the AWS CLI and the plugin:
+
+1. Open the websocket returned by StartSession and authenticate with its token
+2. Answer the agent's handshake (session type Port, no KMS encryption)
+3. Exchange `input_stream_data` / `output_stream_data` messages, acknowledging
+   every message received and resending our own until they are acknowledged
+
+Every websocket message is a binary ClientMessage: a 120 byte big-endian
+header (type, schema, timestamp, sequence number, flags, id, SHA-256 digest,
+payload type and length) followed by the payload.
+
+Sessions that require KMS encryption are refused during the handshake, before
+any stdin is consumed, so the caller can fall back to the AWS CLI.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from ._websocket import WebSocket, WebSocketError, OP_BINARY
+from .relay import KexWatcher
+
+CLIENT_VERSION = "1.2.0.0"
+
+# Message types
+INPUT_STREAM_DATA = "input_stream_data"
+OUTPUT_STREAM_DATA = "output_stream_data"
+ACKNOWLEDGE = "acknowledge"
+CHANNEL_CLOSED = "channel_closed"
+START_PUBLICATION = "start_publication"
+PAUSE_PUBLICATION = "pause_publication"
+
+# Payload types
+PAYLOAD_OUTPUT = 1
+PAYLOAD_ERROR = 2
+PAYLOAD_SIZE = 3
+PAYLOAD_PARAMETER = 4
+PAYLOAD_HANDSHAKE_REQUEST = 5
+PAYLOAD_HANDSHAKE_RESPONSE = 6
+PAYLOAD_HANDSHAKE_COMPLETE = 7
+PAYLOAD_ENC_CHALLENGE_REQUEST = 8
+PAYLOAD_ENC_CHALLENGE_RESPONSE = 9
+PAYLOAD_FLAG = 10
+PAYLOAD_STDERR = 11
+PAYLOAD_EXIT_CODE = 12
+
+# Flag payload values (port sessions)
+FLAG_DISCONNECT_TO_PORT = 1
+FLAG_TERMINATE_SESSION = 2
+FLAG_CONNECT_TO_PORT_ERROR = 3
+
+# Handshake action status
+ACTION_SUCCESS = 1
+ACTION_FAILED = 2
+ACTION_UNSUPPORTED = 3
+
+# Bytes of stdin per input_stream_data message (same as the plugin)
+INPUT_CHUNK_SIZE = 1024
+# Unacknowledged outgoing messages before we stop reading stdin
+SEND_WINDOW = 10000
+# Seconds before an unacknowledged message is sent again
+RESEND_TIMEOUT = 1.0
+# Seconds between websocket keep-alive pings
+PING_INTERVAL = 300
+
+_HEADER = struct.Struct('>I32sIQqQ16s32sII')
+# The header length field excludes the trailing payload length field
+HEADER_LENGTH = _HEADER.size - 4
+
+
+class DataChannelError(Exception):
+    """Raised when the data channel cannot be opened or fails its handshake."""
+
+
+def _uuid_to_bytes(value: uuid.UUID) -> bytes:
+    # The plugin writes the least significant half first
+    raw = value.bytes
+    return raw[8:] + raw[:8]
+
+
+def _uuid_from_bytes(raw: bytes) -> uuid.UUID:
+    return uuid.UUID(bytes=raw[8:] + raw[:8])
+
+
+class ClientMessage:
+    """A single data channel message."""
+
+    def __init__(self, message_type: str, sequence_number: int, payload: bytes = b'',
+                 payload_type: int = 0, flags: int = 0, message_id: uuid.UUID = None,
+                 created_date: int = None, schema_version: int = 1):
+        self.message_type = message_type
+        self.sequence_number = sequence_number
+        self.payload = payload
+        self.payload_type = payload_type
+        self.flags = flags
+        self.message_id = message_id or uuid.uuid4()
+        self.created_date = created_date if created_date is not None else int(time.time() * 1000)
+        self.schema_version = schema_version
+
+    def encode(self) -> bytes:
+        """Serialize the message for the websocket."""
+        header = _HEADER.pack(
+            HEADER_LENGTH,
+            self.message_type.encode().ljust(32),
+            self.schema_version,
+            self.created_date,
+            self.sequence_number,
+            self.flags,
+            _uuid_to_bytes(self.message_id),
+            hashlib.sha256(self.payload).digest(),
+            self.payload_type,
+            len(self.payload),
+        )
+        return header + self.payload
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'ClientMessage':
+        """Parse a message received from the websocket.
+
+        Raises:
+            DataChannelError: If the message is truncated or malformed
+        """
+        if len(data) < _HEADER.size:
+            raise DataChannelError(f"Truncated data channel message ({len(data)} bytes)")
+        (header_length, message_type, schema_version, created_date, sequence_number,
+         flags, message_id, _digest, payload_type, payload_length) = _HEADER.unpack_from(data)
+        start = header_length + 4
+        payload = data[start:start + payload_length]
+        if len(payload) != payload_length:
+            raise DataChannelError("Data channel message payload is truncated")
+        return cls(
+            message_type=message_type.rstrip(b' \x00').decode(),
+            sequence_number=sequence_number,
+            payload=payload,
+            payload_type=payload_type,
+            flags=flags,
+            message_id=_uuid_from_bytes(message_id),
+            created_date=created_date,
+            schema_version=schema_version,
+        )
+
+
+class DataChannel:
+    """Relay between local file descriptors and an SSM session websocket."""
+
+    def __init__(self, stream_url: str, token_value: str, session_id: str = None,
+                 log: Callable[[str], None] = None, connect_timeout: float = 10.0):
+        """Initialize the data channel.
+
+        Args:
+            stream_url: StreamUrl returned by ssm:StartSession
+            token_value: TokenValue returned by ssm:StartSession
+            session_id: SessionId returned by ssm:StartSession (for logging)
+            log: Callable used for stderr logging
+            connect_timeout: Seconds allowed for the websocket connect and handshake
+        """
+        self.stream_url = stream_url
+        self.token_value = token_value
+        self.session_id = session_id
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.connect_timeout = connect_timeout
+
+        self.ws: Optional[WebSocket] = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.kex = KexWatcher()
+        self.exit_code: Optional[int] = None
+        self._close_reason: Optional[str] = None
+
+        self._send_sequence = 0
+        self._expected_sequence = 0
+        self._incoming = {}      # out-of-order messages by sequence number
+        self._unacked = {}       # sequence number -> [encoded message, last send time]
+        self._lock = threading.Condition()
+        self._handshake_complete = threading.Event()
+        self._publication = threading.Event()
+        self._publication.set()
+        self._closed = threading.Event()
+        self._out_fd: Optional[int] = None
+
+    # -- sending -----------------------------------------------------------
+
+    def _send_raw(self, data: bytes) -> None:
+        self.ws.send(data, OP_BINARY)
+
+    def _send_input(self, payload: bytes, payload_type: int) -> None:
+        """Send a sequenced input_stream_data message and track it until acknowledged."""
+        with self._lock:
+            while len(self._unacked) >= SEND_WINDOW and not self._closed.is_set():
+                self._lock.wait(0.5)
+            message = ClientMessage(INPUT_STREAM_DATA, self._send_sequence, payload, payload_type)
+            encoded = message.encode()
+            self._unacked[self._send_sequence] = [encoded, time.monotonic()]
+            self._send_sequence += 1
+        self._send_raw(encoded)
+
+    def _send_ack(self, message: ClientMessage) -> None:
+        ack = {
+            "AcknowledgedMessageType": message.message_type,
+            "AcknowledgedMessageId": str(message.message_id),
+            "AcknowledgedMessageSequenceNumber": message.sequence_number,
+            "IsSequentialMessage": True,
+        }
+        self._send_raw(ClientMessage(ACKNOWLEDGE, 0, json.dumps(ack).encode(), flags=3).encode())
+
+    def send_flag(self, flag: int) -> None:
+        """Send a control flag such as FLAG_TERMINATE_SESSION."""
+        self._send_input(struct.pack('>I', flag), PAYLOAD_FLAG)
+
+    # -- opening -----------------------------------------------------------
+
+    def open(self) -> None:
+        """Connect the websocket and complete the session handshake.
+
+        Raises:
+            DataChannelError: If the channel cannot be used; nothing has been
+                read from stdin yet, so the caller may fall back safely
+        """
+        try:
+            self.ws = WebSocket.connect(self.stream_url, timeout=self.connect_timeout)
+            self.ws.send(json.dumps({
+                "MessageSchemaVersion": "1.0",
+                "RequestId": str(uuid.uuid4()),
+                "TokenValue": self.token_value,
+                "ClientId": str(uuid.uuid4()),
+                "ClientVersion": CLIENT_VERSION,
+            }))
+        except (OSError, WebSocketError) as e:
+            raise DataChannelError(f"Could not open data channel: {e}") from e
+
+        reader = threading.Thread(target=self._receive_loop, name="datachannel-receive", daemon=True)
+        reader.start()
+
+        deadline = time.monotonic() + self.connect_timeout
+        while not self._handshake_complete.wait(0.05):
+            if self._closed.is_set():
+                raise DataChannelError(self._close_reason or "Data channel closed during handshake")
+            if time.monotonic() > deadline:
+                self.close()
+                raise DataChannelError("Timed out waiting for the data channel handshake")
+
+        threading.Thread(target=self._maintenance_loop, name="datachannel-resend", daemon=True).start()
+
+    def _fail(self, reason: str) -> None:
+        self._close_reason = reason
+        self.close()
+
+    def _handle_handshake_request(self, payload: bytes) -> None:
+        request = json.loads(payload)
+        processed = []
+        errors = []
+        for action in request.get("RequestedClientActions", []):
+            action_type = action.get("ActionType")
+            if action_type == "SessionType":
+                session_type = (action.get("ActionParameters") or {}).get("SessionType")
+                if session_type == "Port":
+                    processed.append({"ActionType": action_type, "ActionStatus": ACTION_SUCCESS})
+                else:
+                    error = f"Unsupported session type: {session_type}"
+                    processed.append({"ActionType": action_type, "ActionStatus": ACTION_FAILED, "Error": error})
+                    errors.append(error)
+            elif action_type == "KMSEncryption":
+                error = "KMS encrypted sessions are not supported by the native client"
+                processed.append({"ActionType": action_type, "ActionStatus": ACTION_FAILED, "Error": error})
+                errors.append(error)
+            else:
+                processed.append({"ActionType": action_type, "ActionStatus": ACTION_UNSUPPORTED})
+
+        response = {"ClientVersion": CLIENT_VERSION, "ProcessedClientActions": processed, "Errors": errors}
+        self._send_input(json.dumps(response).encode(), PAYLOAD_HANDSHAKE_RESPONSE)
+        if errors:
+            self._fail("; ".join(errors))
+
+    # -- receiving ---------------------------------------------------------
+
+    def _receive_loop(self) -> None:
+        try:
+            while not self._closed.is_set():
+                opcode, data = self.ws.recv()
+                if opcode != OP_BINARY:
+                    continue
+                self._handle_message(ClientMessage.decode(data))
+        except (OSError, WebSocketError, DataChannelError, ValueError) as e:
+            if not self._closed.is_set():
+                self._close_reason = self._close_reason or f"Data channel lost: {e}"
+        finally:
+            self._closed.set()
+            with self._lock:
+                self._lock.notify_all()
+
+    def _handle_message(self, message: ClientMessage) -> None:
+        if message.message_type == OUTPUT_STREAM_DATA:
+            self._send_ack(message)
+            if message.sequence_number < self._expected_sequence:
+                return  # duplicate of something already processed
+            self._incoming[message.sequence_number] = message
+            while self._expected_sequence in self._incoming:
+                self._process_output(self._incoming.pop(self._expected_sequence))
+                self._expected_sequence += 1
+        elif message.message_type == ACKNOWLEDGE:
+            ack = json.loads(message.payload)
+            with self._lock:
+                self._unacked.pop(ack.get("AcknowledgedMessageSequenceNumber"), None)
+                self._lock.notify_all()
+        elif message.message_type == CHANNEL_CLOSED:
+            details = json.loads(message.payload or b'{}')
+            if details.get("Output"):
+                self.log(details["Output"])
+            self._close_reason = self._close_reason or "Session closed by the remote side"
+            self.close()
+        elif message.message_type == PAUSE_PUBLICATION:
+            self._publication.clear()
+        elif message.message_type == START_PUBLICATION:
+            self._publication.set()
+
+    def _process_output(self, message: ClientMessage) -> None:
+        if message.payload_type == PAYLOAD_OUTPUT:
+            if self._out_fd is not None:
+                self._write_all(self._out_fd, message.payload)
+                self.bytes_out += len(message.payload)
+                self.kex.feed(message.payload)
+        elif message.payload_type == PAYLOAD_HANDSHAKE_REQUEST:
+            self._handle_handshake_request(message.payload)
+        elif message.payload_type == PAYLOAD_HANDSHAKE_COMPLETE:
+            self._handshake_complete.set()
+        elif message.payload_type == PAYLOAD_STDERR:
+            self.log(message.payload.decode(errors='replace').rstrip())
+        elif message.payload_type == PAYLOAD_EXIT_CODE:
+            try:
+                self.exit_code = int(message.payload.decode().strip() or 0)
+            except ValueError:
+                pass
+        elif message.payload_type == PAYLOAD_FLAG and len(message.payload) >= 4:
+            if struct.unpack('>I', message.payload[:4])[0] == FLAG_CONNECT_TO_PORT_ERROR:
+                self.log("The instance could not connect to the SSH port")
+
+    @staticmethod
+    def _write_all(fd: int, data: bytes) -> None:
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    # -- maintenance -------------------------------------------------------
+
+    def _maintenance_loop(self) -> None:
+        """Resend unacknowledged messages and keep the websocket alive."""
+        last_ping = time.monotonic()
+        while not self._closed.wait(0.2):
+            now = time.monotonic()
+            with self._lock:
+                overdue = [entry for entry in self._unacked.values() if now - entry[1] > RESEND_TIMEOUT]
+                for entry in overdue:
+                    entry[1] = now
+            try:
+                for encoded, _ in overdue:
+                    self._send_raw(encoded)
+                if now - last_ping > PING_INTERVAL:
+                    self.ws.ping()
+                    last_ping = now
+            except (OSError, WebSocketError):
+                return
+
+    # -- relaying ----------------------------------------------------------
+
+    def relay(self, in_fd: int, out_fd: int) -> int:
+        """Relay bytes between local file descriptors and the session.
+
+        Blocks until the session closes or in_fd reaches EOF and every
+        outgoing message has been acknowledged.
+
+        Args:
+            in_fd: File descriptor to read (usually stdin)
+            out_fd: File descriptor to write (usually stdout)
+
+        Returns:
+            int: 0 on a clean close, 1 if the channel was lost
+        """
+        self._out_fd = out_fd
+        threading.Thread(target=self._stdin_loop, args=(in_fd,), name="datachannel-stdin", daemon=True).start()
+        self._closed.wait()
+        lost = self._close_reason and self._close_reason.startswith("Data channel lost")
+        return 1 if lost else 0
+
+    def _stdin_loop(self, in_fd: int) -> None:
+        try:
+            while not self._closed.is_set():
+                chunk = os.read(in_fd, INPUT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._publication.wait()
+                self._send_input(chunk, PAYLOAD_OUTPUT)
+                self.bytes_in += len(chunk)
+
+            # EOF: tell the agent we are done and wait for our data to land
+            self.send_flag(FLAG_TERMINATE_SESSION)
+            with self._lock:
+                while self._unacked and not self._closed.is_set():
+                    self._lock.wait(0.5)
+        except (OSError, WebSocketError):
+            pass
+        self.close()
+
+    def close(self) -> None:
+        """Close the websocket and release relay()."""
+        self._closed.set()
+        if self.ws:
+            self.ws.close()
+        with self._lock:
+            self._lock.notify_all()
+
+
+def open_session(ssm_client, instance_id: str, port: int = 22) -> dict:
+    """Call ssm:StartSession for an SSH port-forwarding session.
+
+    Args:
+        ssm_client: boto3 SSM client
+        instance_id: Target EC2 instance ID
+        port: Remote port number
+
+    Returns:
+        dict: SessionId, TokenValue and StreamUrl
+    """
+    response = ssm_client.start_session(
+        Target=instance_id,
+        DocumentName='AWS-StartSSHSession',
+        Parameters={'portNumber': [str(port)]}
+    )
+    return {key: response[key] for key in ('SessionId', 'TokenValue', 'StreamUrl')}
+
+
+def relay_session(session: dict, log: Callable[[str], None] = None,
+                  in_fd: int = None, out_fd: int = None, timing=None, stats: dict = None) -> Optional[int]:
+    """Open a data channel for a started session and relay stdin/stdout.
+
+    Args:
+        session: SessionId, TokenValue and StreamUrl from open_session()
+        log: Callable used for stderr logging
+        in_fd: File descriptor to read (default: stdin)
+        out_fd: File descriptor to write (default: stdout)
+        timing: Timing to record the handshake and session spans into (optional)
+        stats: Dict to update with bytes_in, bytes_out and kex_end once relayed (optional)
+
+    Returns:
+        Optional[int]: Relay exit status, or None if the channel could not be
+        opened (nothing was relayed, so the caller can fall back)
+    """
+    from .timing import Timing
+
+    log = log or (lambda message: print(message, file=sys.stderr))
+    timing = timing or Timing()
+    channel = DataChannel(session['StreamUrl'], session['TokenValue'], session.get('SessionId'), log)
+    try:
+        with timing.span('channel_open'):
+            channel.open()
+    except DataChannelError as e:
+        log(f"Native session unavailable: {e}")
+        return None
+
+    in_fd = sys.stdin.fileno() if in_fd is None else in_fd
+    out_fd = sys.stdout.fileno() if out_fd is None else out_fd
+    with timing.span('session', native=True) as span:
+        status = channel.relay(in_fd, out_fd)
+        span.update(ok=status == 0, bytes_in=channel.bytes_in, bytes_out=channel.bytes_out)
+    if stats is not None:
+        stats.update(bytes_in=channel.bytes_in, bytes_out=channel.bytes_out, kex_end=channel.kex.kex_end)
+    return status
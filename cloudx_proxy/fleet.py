@@ -0,0 +1,195 @@
+"""Instance state and SSM status for every host in a cloudx-proxy SSH config.
+
+Hosts are grouped by the AWS profile, aws-env and region their ProxyCommand
+connects with. Each group is queried with a handful of batched, paginated
+DescribeInstances and DescribeInstanceInformation calls (chunked to the
+API filter limits) instead of one call per host, and groups and chunks are
+queried concurrently.
+"""
+
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List
+
+from .sshconfig import SSHConfig
+from .tunnel import tunneled_instance
+
+# Values per EC2 filter (DescribeInstances allows up to 200)
+EC2_CHUNK = 200
+# Values per InstanceIds filter of DescribeInstanceInformation (limit 50)
+SSM_CHUNK = 50
+MAX_WORKERS = 8
+
+# Options of `connect` that select the AWS account and region
+_CONNECT_OPTIONS = {'--profile': 'profile', '--aws-env': 'aws_env', '--region': 'region'}
+
+
+def connect_options(proxy_command: str) -> dict:
+    """Extract profile, aws-env and region from a cloudx-proxy ProxyCommand.
+
+    Args:
+        proxy_command: ProxyCommand value, e.g. "uvx cloudx-proxy connect %h %p --aws-env prod"
+
+    Returns:
+        dict: Subset of {'profile', 'aws_env', 'region'} set on the command line
+    """
+    try:
+        words = shlex.split(proxy_command)
+    except ValueError:
+        words = proxy_command.split()
+    options = {}
+    for i, word in enumerate(words):
+        option, _, value = word.partition('=')
+        if option in _CONNECT_OPTIONS:
+            if not value and i + 1 < len(words):
+                value = words[i + 1]
+            if value:
+                options[_CONNECT_OPTIONS[option]] = value
+    return options
+
+
+def configured_hosts(config: SSHConfig, ssh_host_prefix: str, default_profile: str,
+                     environment: str = None) -> List[dict]:
+    """List the hosts of a cloudx-proxy SSH config.
+
+    Hosts are named <prefix>-<environment>-<name>. Profile, aws-env and
+    region come from the ProxyCommand of the environment's <prefix>-<env>-*
+    block, overridden by one on the host itself. Hosts pointed at a tunnel
+    take their instance ID from HostKeyAlias.
+
+    Args:
+        config: Parsed SSH config
+        ssh_host_prefix: Host prefix, e.g. 'cloudx'
+        default_profile: Profile used when a ProxyCommand has no --profile
+        environment: Only include this environment (case-insensitive, optional)
+
+    Returns:
+        list: One dict per host with environment, host, name, instance_id,
+            comment, profile, aws_env and region
+    """
+    pattern_re = re.compile(rf'{re.escape(ssh_host_prefix)}-(\w+)-\*', re.IGNORECASE)
+    host_re = re.compile(rf'{re.escape(ssh_host_prefix)}-(\w+)-', re.IGNORECASE)
+    env_names = {}  # lowercase environment -> name as written in the config
+    env_options = {}
+    entries = {}
+
+    for block in config.hosts():
+        name = block.name
+        if name.endswith('*'):
+            match = pattern_re.match(name)
+            if match:
+                env_key = match.group(1).lower()
+                env_names[env_key] = match.group(1)
+                env_options[env_key] = connect_options(block.get('ProxyCommand', ''))
+        else:
+            match = host_re.match(name)
+            if match:
+                entries[name] = (match.group(1), block)
+
+    hosts = []
+    for name, (env_name, block) in entries.items():
+        env_key = env_name.lower()
+        display_name = env_names.setdefault(env_key, env_name)
+        if environment and env_key != environment.lower():
+            continue
+        parts = name.split('-')
+        host = {'profile': default_profile, 'aws_env': None, 'region': None}
+        host.update(env_options.get(env_key, {}))
+        host.update(connect_options(block.get('ProxyCommand', '')))
+        host.update(environment=display_name, host=name,
+                    name='-'.join(parts[2:]) if len(parts) >= 3 else name,
+                    instance_id=tunneled_instance(block) or block.get('HostName'), comment=block.comment or None)
+        hosts.append(host)
+    return hosts
+
+
+def _chunks(items: List[str], size: int) -> Iterable[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _ec2_states(ec2, instance_ids: List[str]) -> Dict[str, str]:
+    states = {}
+    paginator = ec2.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': instance_ids}]):
+        for reservation in page.get('Reservations', []):
+            for instance in reservation.get('Instances', []):
+                states[instance['InstanceId']] = instance['State']['Name']
+    return states
+
+
+def _ssm_pings(ssm, instance_ids: List[str]) -> Dict[str, str]:
+    pings = {}
+    paginator = ssm.get_paginator('describe_instance_information')
+    for page in paginator.paginate(Filters=[{'Key': 'InstanceIds', 'Values': instance_ids}],
+                                   PaginationConfig={'PageSize': SSM_CHUNK}):
+        for info in page.get('InstanceInformationList', []):
+            pings[info['InstanceId']] = info['PingStatus']
+    return pings
+
+
+def fetch_status(hosts: List[dict], client_config=None, context_factory: Callable = None,
+                 max_workers: int = MAX_WORKERS) -> Dict[str, dict]:
+    """Look up EC2 state and SSM ping status for the instances of hosts.
+
+    Args:
+        hosts: Host dicts as returned by configured_hosts()
+        client_config: clientconfig.ClientSettings of the clients (timeouts and
+            retries, so one slow region cannot stall the lookup)
+        context_factory: Callable(profile, aws_env, region) returning a
+            sessions.AWSContext (default: the shared sessions.context with
+            client_config)
+        max_workers: Concurrent API calls
+
+    Returns:
+        dict: instance ID -> {'state': EC2 state or 'not found', 'ping': SSM
+            PingStatus or None, 'error': message if the lookup failed}
+    """
+    from botocore.exceptions import BotoCoreError, ClientError
+
+    if context_factory is None:
+        from . import sessions
+
+        def context_factory(profile, aws_env, region):
+            return sessions.context(profile, aws_env, region, client_config=client_config)
+
+    groups = {}
+    for host in hosts:
+        if host.get('instance_id'):
+            key = (host['profile'], host['aws_env'], host['region'])
+            groups.setdefault(key, set()).add(host['instance_id'])
+
+    results = {}
+    tasks = []
+    # Sessions are not thread-safe, clients are: build them here, call them from the pool
+    for key, instance_ids in groups.items():
+        instance_ids = sorted(instance_ids)
+        try:
+            context = context_factory(*key)
+            ec2 = context.client('ec2')
+            ssm = context.client('ssm')
+        except (BotoCoreError, ClientError) as e:
+            for instance_id in instance_ids:
+                results[instance_id] = {'state': None, 'ping': None, 'error': str(e)}
+            continue
+        for instance_id in instance_ids:
+            results[instance_id] = {'state': 'not found', 'ping': None, 'error': None}
+        tasks += [('state', _ec2_states, ec2, chunk) for chunk in _chunks(instance_ids, EC2_CHUNK)]
+        tasks += [('ping', _ssm_pings, ssm, chunk) for chunk in _chunks(instance_ids, SSM_CHUNK)]
+
+    def run(task):
+        field, query, client, chunk = task
+        try:
+            return field, chunk, query(client, chunk), None
+        except (BotoCoreError, ClientError) as e:
+            return field, chunk, {}, str(e)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for field, chunk, values, error in pool.map(run, tasks):
+            for instance_id in chunk:
+                if error:
+                    results[instance_id].update({field: None, 'error': error})
+                elif instance_id in values:
+                    results[instance_id][field] = values[instance_id]
+    return results
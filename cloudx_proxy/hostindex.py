@@ -0,0 +1,267 @@
+"""Persistent index of the hosts in cloudx-proxy SSH configs.
+
+`list`, `status`, `cleanup --dry-run` and shell completion read hosts from
+an SQLite database in the control directory (~/.ssh/control) instead of
+parsing the whole config on every run. A config is indexed together with
+the files it includes (the environment files of the sharded layout). It is
+checked with one stat (inode, size, mtime) per file; only when one changed
+are the files hashed, and only when their content changed are they parsed
+again, writing just the rows that differ. Lookups by host, instance ID or environment are index
+queries, independent of the size of the config.
+
+The index is a cache: if it cannot be opened or written, the config is
+parsed directly.
+"""
+
+import json
+import os
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from . import configfile
+from .fleet import configured_hosts
+from .locking import default_lock_dir
+from .sshconfig import SSHConfig
+
+INDEX_FILE = "cloudx-proxy-hosts.sqlite"
+
+# Bump when the schema or the meaning of a column changes; older indexes are rebuilt
+FORMAT_VERSION = 3
+
+# Seconds to wait for another process updating the index
+LOCK_TIMEOUT = 10
+
+_COLUMNS = ('host', 'environment', 'name', 'instance_id', 'comment', 'profile', 'aws_env', 'region')
+
+_SCHEMA = """
+CREATE TABLE configs (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    prefix TEXT NOT NULL,
+    includes TEXT NOT NULL,  -- JSON list of the config's Include patterns
+    stamp TEXT NOT NULL,  -- JSON list of [path, inode, size, mtime_ns] of the config and included files
+    digest TEXT NOT NULL
+);
+CREATE TABLE hosts (
+    config INTEGER NOT NULL, host TEXT NOT NULL,
+    environment TEXT, name TEXT, instance_id TEXT, comment TEXT,
+    profile TEXT, aws_env TEXT, region TEXT,
+    PRIMARY KEY (host, config)
+) WITHOUT ROWID;
+CREATE INDEX hosts_instance ON hosts (config, instance_id);
+CREATE INDEX hosts_environment ON hosts (config, environment COLLATE NOCASE);
+CREATE TABLE patterns (
+    config INTEGER NOT NULL, position INTEGER NOT NULL, name TEXT NOT NULL,
+    PRIMARY KEY (config, position)
+) WITHOUT ROWID;
+"""
+
+
+def _scan(content: str, ssh_host_prefix: str) -> Tuple[Dict[str, tuple], List[str]]:
+    """Parse a config into host rows (keyed by host) and prefix-* patterns.
+
+    Profiles are stored as written (None if the ProxyCommand has none);
+    the default profile is applied when hosts are read.
+    """
+    config = SSHConfig.parse(content)
+    rows = {host['host']: tuple(host[column] for column in _COLUMNS)
+            for host in configured_hosts(config, ssh_host_prefix, None)}
+    prefix = f"{ssh_host_prefix.lower()}-"
+    patterns = [block.name for block in config.hosts()
+                if block.name.endswith('*') and block.name.lower().startswith(prefix)]
+    return rows, list(dict.fromkeys(patterns))
+
+
+def _host(row, default_profile: str) -> dict:
+    host = dict(zip(_COLUMNS, row))
+    host['profile'] = host['profile'] or default_profile
+    return host
+
+
+class HostIndex:
+    """SQLite index of host -> instance ID, environment, comment, profile, aws-env and region."""
+
+    def __init__(self, path: Path = None):
+        """Initialize the index (the database is opened on first use).
+
+        Args:
+            path: Database file (default: ~/.ssh/control/cloudx-proxy-hosts.sqlite)
+        """
+        self.path = Path(path) if path else default_lock_dir() / INDEX_FILE
+        self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """Close the database connection."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if not self.path.exists():
+                os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+            db = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+            try:
+                if db.execute("PRAGMA user_version").fetchone()[0] != FORMAT_VERSION:
+                    db.execute("BEGIN IMMEDIATE")
+                    # Another process may have upgraded it while we waited
+                    if db.execute("PRAGMA user_version").fetchone()[0] != FORMAT_VERSION:
+                        for (table,) in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                            db.execute(f'DROP TABLE "{table}"')
+                        for statement in _SCHEMA.split(';'):
+                            if statement.strip():
+                                db.execute(statement)
+                        db.execute(f"PRAGMA user_version = {FORMAT_VERSION}")
+                    db.execute("COMMIT")
+            except BaseException:
+                db.close()
+                raise
+            self._db = db
+        return self._db
+
+    def _config_id(self, config_file: Path, ssh_host_prefix: str) -> int:
+        """Return the index ID of config_file, (re)indexing it if it or an included file changed."""
+        db = self._connect()
+        path = os.path.abspath(config_file)
+        prefix = ssh_host_prefix.lower()
+
+        row = db.execute("SELECT id, prefix, includes, stamp FROM configs WHERE path = ?", (path,)).fetchone()
+        if row and row[1] == prefix:
+            files = [path] + [str(name) for name in configfile.included_files(json.loads(row[2]))]
+            if json.dumps(configfile.stamp(files)) == row[3]:
+                return row[0]
+
+        # Each file is stamped before it is read (see configfile.stamp)
+        stamp = configfile.stamp([path])
+        contents = [Path(path).read_text()]
+        patterns = configfile.include_patterns(contents[0])
+        for name in configfile.included_files(patterns):
+            stamp += configfile.stamp([name])
+            contents.append(configfile.read(name))
+        content = configfile.join(contents)
+        stamp = json.dumps(stamp)
+        includes = json.dumps(patterns)
+        digest = configfile.digest(content)
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT id, prefix, digest FROM configs WHERE path = ?", (path,)).fetchone()
+            if row and row[1] == prefix and row[2] == digest:
+                # Touched or rewritten with the same content
+                db.execute("UPDATE configs SET includes = ?, stamp = ? WHERE id = ?", (includes, stamp, row[0]))
+                db.execute("COMMIT")
+                return row[0]
+
+            rows, patterns = _scan(content, ssh_host_prefix)
+            if row:
+                config_id = row[0]
+                db.execute("UPDATE configs SET prefix = ?, includes = ?, stamp = ?, digest = ? WHERE id = ?",
+                           (prefix, includes, stamp, digest, config_id))
+                if row[1] != prefix:
+                    db.execute("DELETE FROM hosts WHERE config = ?", (config_id,))
+            else:
+                config_id = db.execute("INSERT INTO configs (path, prefix, includes, stamp, digest) "
+                                       "VALUES (?, ?, ?, ?, ?)", (path, prefix, includes, stamp, digest)).lastrowid
+
+            # Write only the rows that changed
+            old = {r[0]: tuple(r) for r in db.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM hosts WHERE config = ?", (config_id,))}
+            removed = [(config_id, host) for host in old.keys() - rows.keys()]
+            changed = [(config_id,) + values for host, values in rows.items() if old.get(host) != values]
+            db.executemany("DELETE FROM hosts WHERE config = ? AND host = ?", removed)
+            db.executemany(f"INSERT OR REPLACE INTO hosts (config, {', '.join(_COLUMNS)}) "
+                           f"VALUES (?, {', '.join('?' * len(_COLUMNS))})", changed)
+            db.execute("DELETE FROM patterns WHERE config = ?", (config_id,))
+            db.executemany("INSERT INTO patterns (config, position, name) VALUES (?, ?, ?)",
+                           [(config_id, position, name) for position, name in enumerate(patterns)])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return config_id
+
+    def _query(self, config_file: Path, ssh_host_prefix: str, where: str = "", args: tuple = ()) -> Optional[List[tuple]]:
+        """Return host rows matching where, or None if the index is unusable.
+
+        A missing config also returns None; parsing it then raises FileNotFoundError.
+        """
+        try:
+            config_id = self._config_id(config_file, ssh_host_prefix)
+            return self._connect().execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM hosts WHERE config = ?{where} ORDER BY environment, name",
+                (config_id,) + args).fetchall()
+        except (sqlite3.Error, OSError):
+            return None
+
+    def _scan_file(self, config_file: Path, ssh_host_prefix: str) -> Tuple[List[tuple], List[str]]:
+        Path(config_file).stat()  # FileNotFoundError for a missing config
+        rows, patterns = _scan(configfile.read_with_includes(Path(config_file))[0], ssh_host_prefix)
+        return sorted(rows.values(), key=lambda row: (row[1], row[2])), patterns
+
+    def hosts(self, config_file: Path, ssh_host_prefix: str, default_profile: str,
+              environment: str = None) -> List[dict]:
+        """List the hosts of a config, as fleet.configured_hosts() does.
+
+        Args:
+            config_file: SSH config file
+            ssh_host_prefix: Host prefix, e.g. 'cloudx'
+            default_profile: Profile used when a ProxyCommand has no --profile
+            environment: Only include this environment (case-insensitive, optional)
+
+        Returns:
+            list: Host dicts sorted by environment and name
+        """
+        if environment:
+            rows = self._query(config_file, ssh_host_prefix, " AND environment = ? COLLATE NOCASE", (environment,))
+        else:
+            rows = self._query(config_file, ssh_host_prefix)
+        if rows is None:
+            rows = [row for row in self._scan_file(config_file, ssh_host_prefix)[0]
+                    if not environment or row[1].lower() == environment.lower()]
+        return [_host(row, default_profile) for row in rows]
+
+    def find(self, config_file: Path, ssh_host_prefix: str, default_profile: str,
+             host: str = None, instance_id: str = None) -> List[dict]:
+        """Look up hosts by alias or by instance ID.
+
+        Args:
+            config_file: SSH config file
+            ssh_host_prefix: Host prefix, e.g. 'cloudx'
+            default_profile: Profile used when a ProxyCommand has no --profile
+            host: Host alias, e.g. 'cloudx-dev-web'
+            instance_id: EC2 instance ID
+
+        Returns:
+            list: Matching host dicts (an instance may have several aliases)
+        """
+        column, value = ('host', host) if host is not None else ('instance_id', instance_id)
+        rows = self._query(config_file, ssh_host_prefix, f" AND {column} = ?", (value,))
+        if rows is None:
+            index = _COLUMNS.index(column)
+            rows = [row for row in self._scan_file(config_file, ssh_host_prefix)[0] if row[index] == value]
+        return [_host(row, default_profile) for row in rows]
+
+    def patterns(self, config_file: Path, ssh_host_prefix: str) -> List[str]:
+        """Return the <prefix>-* and <prefix>-<env>-* patterns of a config in file order."""
+        try:
+            config_id = self._config_id(config_file, ssh_host_prefix)
+            return [name for (name,) in self._connect().execute(
+                "SELECT name FROM patterns WHERE config = ? ORDER BY position", (config_id,))]
+        except (sqlite3.Error, OSError):
+            return self._scan_file(config_file, ssh_host_prefix)[1]
+
+    def environments(self, config_file: Path, ssh_host_prefix: str) -> List[str]:
+        """Return the environments that have hosts in a config, sorted."""
+        try:
+            config_id = self._config_id(config_file, ssh_host_prefix)
+            return [name for (name,) in self._connect().execute(
+                "SELECT DISTINCT environment FROM hosts WHERE config = ? ORDER BY environment", (config_id,))]
+        except (sqlite3.Error, OSError):
+            return sorted({row[1] for row in self._scan_file(config_file, ssh_host_prefix)[0]})
@@ -0,0 +1,137 @@
+"""Pinned local install of cloudx-proxy for ProxyCommand.
+
+`uvx cloudx-proxy connect ...` lets uv check its cache and resolve the
+package before every connection. install() puts a pinned cloudx-proxy into
+a virtual environment (~/.local/share/cloudx-proxy/venv, created with uv
+when it is available, with venv and pip otherwise), so that ProxyCommand
+can run its console script by absolute path. program() and
+proxy_program() translate between the two ProxyCommand forms.
+"""
+
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from . import __version__
+
+# Console scripts of the package, see [project.scripts]
+SCRIPTS = ('cloudx-proxy', 'cloudX-proxy')
+
+_CONNECT = re.compile(r'\s+connect(?=\s|$)')
+
+
+def default_venv() -> Path:
+    """Return the virtual environment the launcher is installed into."""
+    return Path.home() / ".local" / "share" / "cloudx-proxy" / "venv"
+
+
+def bin_dir(venv: Path = None) -> Path:
+    """Return the directory holding the console scripts of a virtual environment."""
+    return Path(venv or default_venv()) / ("Scripts" if os.name == 'nt' else "bin")
+
+
+def _script(directory: Path, name: str) -> Path:
+    return Path(directory) / (f"{name}.exe" if os.name == 'nt' else name)
+
+
+def installed(venv: Path = None) -> bool:
+    """Return True if the launcher is installed in venv."""
+    return _script(bin_dir(venv), SCRIPTS[0]).exists()
+
+
+def default_package() -> str:
+    """Return the requirement the launcher pins: this version of cloudx-proxy."""
+    return f"cloudx-proxy=={__version__}"
+
+
+def install(package: str = None, venv: Path = None, run: Callable = subprocess.run) -> Path:
+    """Install cloudx-proxy into a virtual environment.
+
+    The environment is created if it does not exist; installing into an
+    existing one upgrades or downgrades it to package.
+
+    Args:
+        package: Requirement or path to install (default: default_package())
+        venv: Virtual environment (default: default_venv())
+        run: subprocess.run compatible callable
+
+    Returns:
+        Path: Directory of the installed console scripts
+
+    Raises:
+        subprocess.CalledProcessError: If creating the environment or installing fails
+        FileNotFoundError: If the console scripts are missing afterwards
+    """
+    venv = Path(venv or default_venv())
+    package = package or default_package()
+    python = _script(bin_dir(venv), "python")
+    uv = shutil.which('uv')
+
+    commands: List[List[str]] = []
+    if not python.exists():
+        commands.append([uv, 'venv', '--quiet', str(venv)] if uv else [sys.executable, '-m', 'venv', str(venv)])
+    if uv:
+        commands.append([uv, 'pip', 'install', '--quiet', '--python', str(python), package])
+    else:
+        commands.append([str(python), '-m', 'pip', 'install', '--quiet', '--disable-pip-version-check', package])
+    for command in commands:
+        run(command, check=True)
+
+    if not installed(venv):
+        raise FileNotFoundError(f"{_script(bin_dir(venv), SCRIPTS[0])} was not installed")
+    return bin_dir(venv)
+
+
+def program(name: str, launcher: Optional[Path] = None) -> str:
+    """Return the program part of a ProxyCommand.
+
+    Args:
+        name: Console script, 'cloudx-proxy' or 'cloudX-proxy'
+        launcher: Directory of the launcher's console scripts, or None for uvx
+
+    Returns:
+        str: e.g. 'uvx cloudx-proxy' or '/home/me/.local/share/cloudx-proxy/venv/bin/cloudx-proxy'
+    """
+    if launcher is None:
+        return f"uvx {name}"
+    path = str(_script(launcher, name))
+    # ssh expands %-tokens in ProxyCommand and runs it through the shell
+    if os.name == 'nt':
+        path = f'"{path}"' if ' ' in path else path
+    else:
+        path = shlex.quote(path)
+    return path.replace('%', '%%')
+
+
+def proxy_program(proxy_command: str) -> Optional[tuple]:
+    """Split the program off a cloudx-proxy ProxyCommand.
+
+    Args:
+        proxy_command: ProxyCommand value, e.g. 'uvx cloudx-proxy connect %h %p --aws-env dev'
+
+    Returns:
+        Optional[tuple]: (script name, launcher directory or None for uvx, rest
+            of the command starting at ' connect'), or None if it is not a
+            cloudx-proxy connect command
+    """
+    match = _CONNECT.search(proxy_command)
+    if not match:
+        return None
+    try:
+        words = shlex.split(proxy_command[:match.start()].replace('%%', '%'), posix=os.name != 'nt')
+    except ValueError:
+        return None
+    words = [word.strip('"') for word in words]
+    if len(words) == 2 and words[0] == 'uvx' and words[1] in SCRIPTS:
+        return words[1], None, proxy_command[match.start():]
+    if len(words) == 1 and os.path.isabs(words[0]):
+        path = Path(words[0])
+        name = path.name[:-4] if path.name.endswith('.exe') else path.name
+        if name in SCRIPTS:
+            return name, path.parent, proxy_command[match.start():]
+    return None
@@ -0,0 +1,177 @@
+"""Cross-process file locks and single-flight for cloudx-proxy.
+
+VS Code Remote often starts several ssh processes for the same host at once,
+each running its own ``connect``. single_flight() lets one of them (the
+leader) do the expensive preparation while the others block on a file lock
+under the control directory and reuse the leader's result instead of
+repeating the same AWS calls.
+"""
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# Seconds a follower waits for the leader before doing the work itself
+FLIGHT_TIMEOUT = 300
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a FileLock cannot be acquired in time."""
+
+
+def default_lock_dir() -> Path:
+    """Return the directory for lock and flight files (~/.ssh/control)."""
+    return Path.home() / ".ssh" / "control"
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared between processes and threads.
+
+    Uses flock() on Unix (locks belong to the open file, so two threads of the
+    same process also exclude each other) and msvcrt.locking() on Windows.
+    """
+
+    def __init__(self, path: Path, timeout: float = None, poll: float = 0.05):
+        """Initialize the lock.
+
+        Args:
+            path: Lock file (created if missing)
+            timeout: Seconds to wait for the lock (None waits forever)
+            poll: Seconds between attempts while waiting with a timeout
+        """
+        self.path = Path(path)
+        self.timeout = timeout
+        self.poll = poll
+        self._fd = None
+
+    def _try_lock(self, blocking: bool) -> bool:
+        try:
+            if os.name == 'nt':
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self) -> None:
+        """Acquire the lock.
+
+        Raises:
+            LockTimeout: If the lock is still held by someone else after timeout seconds
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        blocking = self.timeout is None and os.name != 'nt'
+        deadline = time.monotonic() + (self.timeout or 0)
+        while not self._try_lock(blocking):
+            if self.timeout is not None and time.monotonic() >= deadline:
+                os.close(self._fd)
+                self._fd = None
+                raise LockTimeout(f"Timed out waiting for lock {self.path}")
+            time.sleep(self.poll)
+
+    def release(self) -> None:
+        """Release the lock (no-op if not held)."""
+        if self._fd is None:
+            return
+        try:
+            if os.name == 'nt':
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def _safe_key(key: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', key)
+
+
+def single_flight(key: str, work: Callable[[], bool], token: str = '', timeout: float = FLIGHT_TIMEOUT,
+                  log: Callable[[str], None] = None, timing=None, directory: Path = None) -> bool:
+    """Run work at most once among concurrent callers sharing a key.
+
+    The first caller takes the lock for key and runs work. Callers that
+    arrive while it runs wait for the lock; when they get it they reuse the
+    leader's result if it finished after they started waiting and was
+    produced for the same token. Otherwise they run work themselves, still
+    one at a time.
+
+    Args:
+        key: What the work is about, e.g. an instance ID
+        work: Callable returning True on success
+        token: Identifies what the result is valid for (e.g. the SSH key pushed)
+        timeout: Seconds to wait for a running leader before doing the work anyway
+        log: Callable used for stderr logging
+        timing: Timing to record the wait and the outcome into (optional)
+        directory: Directory for lock and result files (default: default_lock_dir())
+
+    Returns:
+        bool: Result of work, or the reused result of the leader
+    """
+    directory = Path(directory) if directory else default_lock_dir()
+    name = f"cloudx-proxy-{_safe_key(key)}"
+    result_path = directory / f"{name}.flight"
+    log = log or (lambda message: None)
+
+    waiting_since = time.time()
+    lock = FileLock(directory / f"{name}.lock", timeout)
+    try:
+        lock.acquire()
+    except LockTimeout:
+        log(f"Another connect to {key} is still busy, continuing without waiting")
+        return work()
+    except OSError as e:
+        # No usable control directory: behave as before single-flight existed
+        log(f"Cannot lock {directory}: {e}")
+        return work()
+
+    try:
+        waited = time.time() - waiting_since
+        result = _read_result(result_path)
+        if result and result.get('token') == token and result.get('finished', 0) >= waiting_since:
+            log(f"Reusing preparation by concurrent connect (pid {result.get('pid')})")
+            if timing:
+                timing.record('phase', 'single_flight', waited, result['ok'], role='follower')
+            return result['ok']
+
+        if timing:
+            timing.record('phase', 'single_flight', waited, role='leader')
+        ok = work()
+        _write_result(result_path, {'token': token, 'ok': bool(ok), 'finished': time.time(), 'pid': os.getpid()})
+        return ok
+    finally:
+        lock.release()
+
+
+def _read_result(path: Path) -> Optional[dict]:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_result(path: Path, result: dict) -> None:
+    try:
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(result))
+        os.replace(tmp, path)
+    except OSError:
+        pass
@@ -0,0 +1,493 @@
+"""Connection multiplexer for ssh clients without ControlMaster.
+
+The default Windows ssh client ignores ControlMaster, so setup comments it
+out there and every ssh, scp, git or VS Code connection runs its own
+ProxyCommand, SSM session and key push. With ``connect --mux`` the
+ProxyCommand instead hands its stdin/stdout to a background mux process per
+instance, port and connect settings (profile, AWS environment, region, SSH
+key, ...), started by the first connect and shared by all later ones:
+
+- The mux keeps one AWS-StartPortForwardingSession (a tunnel.Tunnel), whose
+  session-manager-plugin multiplexes every connection over the session's
+  single data channel, so only the first connect pays for StartSession and
+  the instance check
+- Each connect reaches the mux over a loopback TCP socket and authenticates
+  with the token in the mux's state file (~/.ssh/control, 600 permissions);
+  loopback TCP rather than a Unix socket because Python has no AF_UNIX on
+  Windows
+- Like ControlPersist, the mux exits once it has had no connections for its
+  persist time (--mux-persist, 4 hours by default)
+
+The local protocol is the agent's newline-delimited JSON: the client sends
+one request object, the mux streams ``{"log": ...}`` lines (the session's
+own log while the client waits for it) followed by one reply. After an
+``{"ok": true}`` reply to a connect request the socket carries the raw SSH
+stream.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .locking import FileLock, LockTimeout, default_lock_dir
+from .tunnel import BIND, CHUNK, Tunnel
+
+# Seconds without connections before the mux exits (ControlPersist 4h)
+PERSIST = 4 * 3600
+PERSIST_ENV = "CLOUDX_PROXY_MUX_PERSIST"
+
+# Seconds to reach a mux and exchange the request line
+CONNECT_TIMEOUT = 2.0
+# Seconds a connect waits for the mux it started to listen
+START_TIMEOUT = 30
+
+
+def resolve_persist(value: float = None) -> float:
+    """Resolve the persist time from an option, $CLOUDX_PROXY_MUX_PERSIST or PERSIST (0 exits with the last connection)."""
+    if value is not None:
+        return max(0.0, float(value))
+    try:
+        return max(0.0, float(os.environ[PERSIST_ENV]))
+    except (KeyError, ValueError):
+        return PERSIST
+
+
+# Connect options a mux runs with; connects that differ in any of them get muxes of their own
+SETTINGS = ('profile', 'region', 'ssh_key', 'ssh_config', 'ssh_dir', 'aws_env', 'client_config')
+
+
+def settings_key(target: dict) -> str:
+    """Return a short hash of the SETTINGS of a connect target."""
+    settings = {option: target.get(option) or None for option in SETTINGS}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def state_path(target: dict, directory: Path = None) -> Path:
+    """Return the state file of the mux for a connect target (see spawn_command()).
+
+    The name holds the instance, the port and settings_key(): an instance
+    reached through hosts with another profile or SSH key must not share the
+    mux, which pushes its key with its own credentials.
+    """
+    directory = Path(directory) if directory else default_lock_dir()
+    return directory / f"cloudx-proxy-mux-{target['instance_id']}-{target.get('port', 22)}-{settings_key(target)}.json"
+
+
+def read_state(path: Path) -> Optional[dict]:
+    """Return the port, token and pid a mux recorded, or None without a (valid) state file."""
+    try:
+        state = json.loads(Path(path).read_text())
+    except (OSError, ValueError):
+        return None
+    return state if isinstance(state, dict) and state.get('port') and state.get('token') else None
+
+
+def _read_line(sock: socket.socket, buffer: bytes = b'') -> Tuple[bytes, bytes]:
+    """Read one line from sock; return it and the bytes received after it."""
+    while b'\n' not in buffer:
+        data = sock.recv(CHUNK)
+        if not data:
+            raise ConnectionError("The cloudx-proxy mux closed the connection")
+        buffer += data
+    line, _, rest = buffer.partition(b'\n')
+    return line, rest
+
+
+def _dial(path: Path) -> Optional[Tuple[socket.socket, dict]]:
+    """Connect to the mux of a state file; None if none is listening."""
+    state = read_state(path)
+    if state is None:
+        return None
+    try:
+        return socket.create_connection((BIND, state['port']), timeout=CONNECT_TIMEOUT), state
+    except OSError:
+        return None
+
+
+def _converse(sock: socket.socket, state: dict, message: dict,
+              log: Callable[[str], None] = None) -> Tuple[dict, bytes]:
+    """Send a request and return the mux's reply and the bytes that followed it.
+
+    Raises:
+        OSError: If the conversation broke off before a reply arrived
+        ValueError: If the mux sent something that is not JSON
+    """
+    sock.sendall(json.dumps(dict(message, token=state['token'])).encode() + b'\n')
+    buffer = b''
+    while True:
+        line, buffer = _read_line(sock, buffer)
+        reply = json.loads(line)
+        if 'log' in reply:
+            if log:
+                log(reply['log'])
+            continue
+        return reply, buffer
+
+
+def request(path: Path, message: dict) -> Optional[dict]:
+    """Send a request (e.g. {'op': 'ping'}) to the mux of a state file; None if it is not reachable."""
+    dialed = _dial(path)
+    if dialed is None:
+        return None
+    sock, state = dialed
+    try:
+        return _converse(sock, state, message)[0]
+    except (OSError, ValueError):
+        return None
+    finally:
+        sock.close()
+
+
+def running(directory: Path = None) -> List[dict]:
+    """Return the ping replies of the running muxes, each with its 'state_file'."""
+    directory = Path(directory) if directory else default_lock_dir()
+    muxes = []
+    for path in sorted(directory.glob("cloudx-proxy-mux-*.json")):
+        reply = request(path, {'op': 'ping'})
+        if reply and reply.get('ok'):
+            muxes.append(dict(reply, state_file=str(path)))
+    return muxes
+
+
+def stop(path: Path) -> bool:
+    """Ask the mux of a state file to exit; True if it acknowledged."""
+    reply = request(path, {'op': 'shutdown'})
+    return bool(reply and reply.get('ok'))
+
+
+def spawn_command(target: dict, persist: float) -> List[str]:
+    """Return the command that runs the mux for a connect target in the foreground.
+
+    Args:
+        target: instance_id, port, profile, region, ssh_key, ssh_config,
+            ssh_dir and aws_env as given to connect, and client_config
+            (ClientSettings.to_dict())
+        persist: Seconds without connections before the mux exits
+    """
+    from .clientconfig import ClientSettings
+
+    command = [sys.executable, '-m', 'cloudx_proxy', 'mux', target['instance_id'], str(target.get('port', 22)),
+               '--persist', str(persist)]
+    for option in ('profile', 'region', 'ssh_key', 'ssh_config', 'ssh_dir', 'aws_env'):
+        if target.get(option):
+            command += ['--' + option.replace('_', '-'), str(target[option])]
+    if target.get('client_config'):
+        command += ClientSettings.from_dict(target['client_config']).to_args()
+    return command
+
+
+def _start(target: dict, path: Path, persist: float, log: Callable[[str], None]) -> Optional[Tuple[socket.socket, dict]]:
+    """Start a mux in the background and connect to it once it listens."""
+    log_file = path.with_suffix('.log')
+    log(f"Starting cloudx-proxy mux (log: {log_file})")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if os.name == 'nt':
+        detach = {'creationflags': subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        detach = {'start_new_session': True}
+    with open(log_file, 'ab') as stderr:
+        # Not attached to ssh's stdin/stdout, so ssh does not wait for it
+        process = subprocess.Popen(spawn_command(target, persist), stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=stderr, close_fds=True, **detach)
+
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        dialed = _dial(path)
+        if dialed is not None:
+            return dialed
+        if process.poll() is not None:
+            log(f"Error: the cloudx-proxy mux exited, see {log_file}")
+            return None
+        time.sleep(0.05)
+    log(f"Error: the cloudx-proxy mux did not start within {START_TIMEOUT}s, see {log_file}")
+    return None
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _relay(sock: socket.socket, in_fd: int, out_fd: int, pending: bytes) -> None:
+    """Relay in_fd/out_fd through sock until the mux closes the connection."""
+    def upload():
+        try:
+            while True:
+                chunk = os.read(in_fd, CHUNK)
+                if not chunk:
+                    break
+                sock.sendall(chunk)
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    threading.Thread(target=upload, name="mux-upload", daemon=True).start()
+    if pending:
+        _write_all(out_fd, pending)
+    try:
+        while True:
+            data = sock.recv(CHUNK)
+            if not data:
+                break
+            _write_all(out_fd, data)
+    except OSError:
+        pass
+
+
+def connect(target: dict, log: Callable[[str], None], persist: float = None, directory: Path = None,
+            in_fd: int = None, out_fd: int = None) -> bool:
+    """Relay stdin/stdout through the mux of the target, starting the mux if none is running.
+
+    Concurrent connects for the same target start one mux between them:
+    the first takes a file lock and starts it, the others wait for the lock
+    and connect to that mux.
+
+    Args:
+        target: Connect target, see spawn_command()
+        log: Callable used for stderr logging
+        persist: Persist time of a mux started here (default: resolve_persist())
+        directory: Directory of the state files (default: ~/.ssh/control)
+        in_fd: File descriptor to read (default: stdin)
+        out_fd: File descriptor to write (default: stdout)
+
+    Returns:
+        bool: True if the connection was relayed
+    """
+    path = state_path(target, directory)
+    dialed = _dial(path)
+    if dialed is None:
+        try:
+            with FileLock(path.with_suffix('.lock'), timeout=START_TIMEOUT):
+                # Another connect may have started it while we waited
+                dialed = _dial(path) or _start(target, path, resolve_persist(persist), log)
+        except LockTimeout:
+            log("Error: timed out waiting for another connect to start the cloudx-proxy mux")
+            return False
+    if dialed is None:
+        return False
+
+    sock, state = dialed
+    try:
+        # The mux may have to wake the instance first
+        sock.settimeout(None)
+        try:
+            reply, pending = _converse(sock, state, {'op': 'connect'}, log)
+        except (OSError, ValueError) as e:
+            log(f"Error: {e}")
+            return False
+        if not reply.get('ok'):
+            log(f"Error: {reply.get('error', 'the cloudx-proxy mux refused the connection')}")
+            return False
+        log(f"Connected through cloudx-proxy mux (pid {state.get('pid')})")
+        _relay(sock, sys.stdin.fileno() if in_fd is None else in_fd,
+               sys.stdout.fileno() if out_fd is None else out_fd, pending)
+        return True
+    finally:
+        sock.close()
+
+
+class MuxServer:
+    """Background mux: one shared session for every connect of an instance, port and settings."""
+
+    def __init__(self, proxy, state_file: Path, remote_port: int = 22, persist: float = PERSIST,
+                 log: Callable[[str], None] = None, **tunnel_options):
+        """Initialize the mux.
+
+        Args:
+            proxy: core.CloudXProxy of the instance; prepares it and pushes the key
+            state_file: Where clients find the mux (state_path() of the target)
+            remote_port: Port on the instance (default: 22)
+            persist: Seconds without connections before serve() returns (0 = with the last connection)
+            log: Callable used for logging (default: stderr)
+            **tunnel_options: Passed on to tunnel.Tunnel (e.g. backoff_initial)
+        """
+        self.proxy = proxy
+        self.remote_port = remote_port
+        self.persist = persist
+        self.state_file = Path(state_file)
+        self.write_log = log or (lambda message: print(message, file=sys.stderr, flush=True))
+        self.token = secrets.token_hex(16)
+        self.port = None
+        self.tunnel = Tunnel(proxy, 0, remote_port, log=self.log, **tunnel_options)
+        self._lock = threading.Lock()
+        self._waiting = {}       # connection -> function sending it log lines
+        self._active = 0
+        self._served = False
+        self._last_activity = time.monotonic()
+        self._stopped = threading.Event()
+        self._listener = None
+
+    def log(self, message: str) -> None:
+        """Log a session message, also to every connect still waiting for the session."""
+        self.write_log(message)
+        with self._lock:
+            waiting = list(self._waiting.values())
+        for send in waiting:
+            send({'log': message})
+
+    def start(self) -> None:
+        """Listen for connects, record the state file and start the session."""
+        from . import __version__
+        from .configfile import write_atomic
+
+        self._listener = socket.create_server((BIND, 0))
+        self._listener.settimeout(0.5)
+        self.port = self._listener.getsockname()[1]
+        write_atomic(self.state_file, json.dumps({
+            'pid': os.getpid(), 'port': self.port, 'token': self.token, 'version': __version__,
+            'instance_id': self.proxy.instance_id, 'remote_port': self.remote_port,
+        }))
+        threading.Thread(target=self._accept, name="mux-accept", daemon=True).start()
+        self.tunnel.start(listen=False)
+        self.write_log(f"cloudx-proxy mux for {self.proxy.instance_id}:{self.remote_port} listening on "
+                       f"{BIND}:{self.port} (pid {os.getpid()})")
+
+    def idle(self) -> bool:
+        """True once the mux has had no connections for its persist time."""
+        with self._lock:
+            # The connect that started the mux gets CONNECT_TIMEOUT to arrive
+            persist = self.persist if self._served else max(self.persist, CONNECT_TIMEOUT)
+            return not self._active and time.monotonic() - self._last_activity >= persist
+
+    def serve(self) -> None:
+        """Start the mux and run it until it is idle, stopped or interrupted."""
+        self.start()
+        try:
+            while not self._stopped.wait(min(1.0, self.persist or 0.1)):
+                if self.idle():
+                    self.write_log(f"No connections for {self.persist:.0f}s, exiting")
+                    break
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop listening, end the session and remove the state file."""
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.close()
+        self.tunnel.stop()
+        # A mux started after us may have taken the file over
+        state = read_state(self.state_file)
+        if state and state['token'] == self.token:
+            try:
+                self.state_file.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        """Serve one request."""
+        try:
+            conn.settimeout(CONNECT_TIMEOUT)
+            line, pending = _read_line(conn)
+            message = json.loads(line)
+            conn.settimeout(None)
+        except (OSError, ValueError):
+            conn.close()
+            return
+        if not isinstance(message, dict) or not hmac.compare_digest(str(message.get('token', '')), self.token):
+            conn.close()
+            return
+
+        op = message.get('op')
+        if op == 'connect':
+            self._connect(conn, pending)
+            return
+        try:
+            if op == 'ping':
+                from . import __version__
+                with self._lock:
+                    active = self._active
+                reply = {'ok': True, 'pid': os.getpid(), 'version': __version__,
+                         'instance_id': self.proxy.instance_id, 'remote_port': self.remote_port,
+                         'connections': active, 'sessions': self.tunnel.sessions,
+                         'session_ready': self.tunnel.session_port is not None}
+            elif op == 'shutdown':
+                reply = {'ok': True}
+                self._stopped.set()
+            else:
+                reply = {'ok': False, 'error': f"Unknown request: {op}"}
+            conn.sendall(json.dumps(reply).encode() + b'\n')
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _connect(self, conn: socket.socket, pending: bytes) -> None:
+        """Relay one connect through the shared session."""
+        send_lock = threading.Lock()
+        relaying = []
+
+        def send(message: dict) -> None:
+            with send_lock:
+                # Once the reply is out the socket carries the SSH stream
+                if relaying:
+                    return
+                try:
+                    conn.sendall(json.dumps(message).encode() + b'\n')
+                except OSError:
+                    pass
+
+        def ready() -> None:
+            with self._lock:
+                self._waiting.pop(conn, None)
+            with send_lock:
+                conn.sendall(json.dumps({'ok': True}).encode() + b'\n')
+                relaying.append(True)
+
+        def log(message: str) -> None:
+            self.write_log(message)
+            send({'log': message})
+
+        with self._lock:
+            self._active += 1
+            self._served = True
+            self._waiting[conn] = send
+        try:
+            self.tunnel.relay(conn, log=log, ready=ready, pending=pending,
+                              failed=lambda reason: send({'ok': False, 'error': reason}))
+        finally:
+            with self._lock:
+                self._waiting.pop(conn, None)
+                self._active -= 1
+                self._last_activity = time.monotonic()
+
+
+def serve(proxy, target: dict, persist: float = None) -> None:
+    """Run the mux of a connect target in the foreground until it is idle or stopped.
+
+    Args:
+        proxy: core.CloudXProxy built from the target
+        target: Connect target, see spawn_command(); names the state file
+        persist: Seconds without connections before the mux exits (default: resolve_persist())
+
+    Raises:
+        RuntimeError: If a mux for the target is already running
+    """
+    remote_port = target.get('port', 22)
+    path = state_path(target)
+    if request(path, {'op': 'ping'}) is not None:
+        raise RuntimeError(f"A cloudx-proxy mux for {proxy.instance_id}:{remote_port} is already running")
+    server = MuxServer(proxy, path, remote_port, resolve_persist(persist))
+    # Connects waiting for the session see the instance check and wake-up
+    proxy.log = server.log
+    server.serve()
@@ -0,0 +1,80 @@
+"""Cache of parse results next to the SSH config they were computed from.
+
+A result is stored in .<config>.parsed.json beside the config, keyed by a
+caller-chosen name (parser and its options) and the fingerprint of the
+files it was computed from: path, inode, size and mtime_ns of each, plus a
+SHA-256 of their content. When the stat fields match, the result is used
+without reading the files; when only they changed (touched, or rewritten
+with the same content), the hash still matches and the result is reused.
+Anything else, including a file written by another FORMAT_VERSION or a
+damaged one, is treated as a miss.
+
+The cache is best effort: it is written atomically and a failure to write
+it only costs a parse next time.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Callable, List
+
+from . import configfile
+
+# Bump when the layout of the cache file or of a cached result changes
+FORMAT_VERSION = 1
+
+
+class ParseCache:
+    """Parse results of one config (and the files read with it), stored beside it."""
+
+    def __init__(self, config_file: Path):
+        """Initialize the cache.
+
+        Args:
+            config_file: SSH config the results belong to
+        """
+        config_file = Path(config_file)
+        self.path = config_file.with_name(f".{config_file.name}.parsed.json")
+
+    def _load(self) -> dict:
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != FORMAT_VERSION:
+            return {}
+        return data.get('entries') or {}
+
+    def _store(self, entries: dict) -> None:
+        try:
+            configfile.write_atomic(self.path, json.dumps({'version': FORMAT_VERSION, 'entries': entries}))
+        except OSError:
+            pass
+
+    def get(self, files: List[Path], key: str, parse: Callable[[str], Any]) -> Any:
+        """Return parse(content of files), computing it only if the files changed.
+
+        Args:
+            files: Files whose content (concatenated, see configfile.join) is parsed
+            key: Name of the parse, including every option it depends on
+            parse: Function of the content; its result must be JSON serializable
+
+        Returns:
+            The result of parse, possibly from the cache (a fresh copy either way)
+        """
+        files = [Path(os.path.abspath(name)) for name in files]
+        entries = self._load()
+        entry = entries.get(key)
+        stamp = configfile.stamp(files)
+        if entry and entry.get('stamp') == stamp:
+            return entry['value']
+
+        content = configfile.join([configfile.read(name) for name in files])
+        digest = configfile.digest(content)
+        if entry and entry.get('digest') == digest:
+            value = entry['value']
+        else:
+            value = parse(content)
+        entries[key] = {'stamp': stamp, 'digest': digest, 'value': value}
+        self._store(entries)
+        return json.loads(json.dumps(value))
@@ -0,0 +1,317 @@
+"""Relay between a ProxyCommand's stdin/stdout and the AWS CLI session.
+
+By default run_session() hands stdin/stdout to `aws ssm start-session` and
+only forwards its stderr. With relay mode cloudx-proxy owns the data path
+instead. The child gets pipes, and one selector loop moves data both ways,
+forwards stderr line by line and notices stdin EOF and child exit without
+blocking on any of them. On Linux the data moves with os.splice(), so it
+never passes through Python, with os.read()/os.write() in 256 KiB chunks
+as fallback. The loop counts the bytes of each direction and how long a
+full destination stalled it.
+
+KexWatcher follows the server's side of the SSH stream through the
+unencrypted key exchange, so a session can tell how much the server sent
+after it (see cache.watch_session()). The outbound direction is read
+through Python until the server's NEWKEYS and spliced after that.
+"""
+
+import errno
+import os
+import selectors
+import subprocess
+import time
+from typing import Callable
+
+CHUNK = 256 * 1024
+
+SPLICE_FLAGS = getattr(os, 'SPLICE_F_MOVE', 0) | getattr(os, 'SPLICE_F_NONBLOCK', 0)
+
+# Seconds between child exit checks where exit cannot be selected on (no pidfd)
+EXIT_POLL = 0.5
+
+
+# SSH message number of NEWKEYS, the last unencrypted packet (RFC 4253)
+SSH_MSG_NEWKEYS = 21
+# Largest packet an SSH implementation must accept (RFC 4253 6.1)
+SSH_MAX_PACKET = 35000
+
+
+class KexWatcher:
+    """Follows the server-to-client stream of an SSH connection up to the server's NEWKEYS.
+
+    Up to NEWKEYS the transport is plaintext: an identification line (maybe
+    after other lines), then binary packets of uint32 length, padding length
+    and payload, whose first byte is the message number.
+    """
+
+    def __init__(self):
+        self.done = False
+        # Bytes of the stream up to and including NEWKEYS; None until seen (or if not SSH)
+        self.kex_end = None
+        self._seen = 0
+        self._buffer = b''
+        self._identified = False
+
+    def feed(self, data: bytes) -> None:
+        """Take the next bytes the server sent."""
+        if self.done:
+            return
+        self._buffer += data
+        while not self._identified:
+            newline = self._buffer.find(b'\n')
+            if newline < 0:
+                self._give_up_if(len(self._buffer) > SSH_MAX_PACKET)
+                return
+            line, self._buffer = self._buffer[:newline], self._buffer[newline + 1:]
+            self._seen += newline + 1
+            self._identified = line.startswith(b'SSH-')
+        while len(self._buffer) >= 6:
+            length = int.from_bytes(self._buffer[:4], 'big')
+            if not 2 <= length <= SSH_MAX_PACKET:
+                self._give_up_if(True)
+                return
+            if len(self._buffer) < 4 + length:
+                return
+            message = self._buffer[5]
+            self._seen += 4 + length
+            self._buffer = self._buffer[4 + length:]
+            if message == SSH_MSG_NEWKEYS:
+                self.kex_end = self._seen
+                self.done = True
+                self._buffer = b''
+                return
+
+    def _give_up_if(self, condition: bool) -> None:
+        if condition:
+            self.done = True
+            self._buffer = b''
+
+
+def relay_supported() -> bool:
+    """Check if this platform can select on pipes (not on Windows)."""
+    return os.name != 'nt'
+
+
+class _Pump:
+    """Moves data from one non-blocking file descriptor to another."""
+
+    def __init__(self, src: int, dst: int, use_splice: bool, watcher: KexWatcher = None):
+        self.src = src
+        self.dst = dst
+        self.splice = use_splice and hasattr(os, 'splice')
+        self.watcher = watcher
+        self.pending = b''
+        self.bytes = 0
+        self.stall = 0.0
+        self.stalled_since = None
+        self.eof = False
+        # File descriptor the pump is registered with in the selector
+        self.registered = None
+
+    @property
+    def waiting(self) -> bool:
+        """True while a full destination holds this direction up."""
+        return self.stalled_since is not None
+
+    def read(self) -> None:
+        """Move what the source has to the destination; may set waiting or eof."""
+        if self.splice and (self.watcher is None or self.watcher.done):
+            try:
+                moved = os.splice(self.src, self.dst, CHUNK, flags=SPLICE_FLAGS)
+            except BlockingIOError:
+                # The source was readable, so the destination is full
+                self.stalled_since = time.monotonic()
+                return
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                    raise
+                self.splice = False  # Neither end is a pipe, or the file system cannot splice
+            else:
+                self.bytes += moved
+                self.eof = moved == 0
+                return
+
+        try:
+            data = os.read(self.src, CHUNK)
+        except BlockingIOError:
+            return
+        self.bytes += len(data)
+        self.eof = not data
+        if self.watcher is not None:
+            self.watcher.feed(data)
+        self.pending = data
+        self.write()
+
+    def write(self) -> None:
+        """Write pending data to the destination; sets waiting if it fills up, clears it otherwise."""
+        if self.waiting:
+            self.stall += time.monotonic() - self.stalled_since
+            self.stalled_since = None
+        while self.pending:
+            try:
+                written = os.write(self.dst, self.pending)
+            except BlockingIOError:
+                self.stalled_since = time.monotonic()
+                return
+            self.pending = self.pending[written:]
+
+
+def _read_available(fd: int) -> bytes:
+    """Read from a non-blocking file descriptor until it is empty or at EOF."""
+    data = b''
+    while True:
+        try:
+            chunk = os.read(fd, CHUNK)
+        except BlockingIOError:
+            return data
+        if not chunk:
+            return data
+        data += chunk
+
+
+def relay_process(process: subprocess.Popen, in_fd: int, out_fd: int,
+                  on_stderr: Callable[[str], None], use_splice: bool = True) -> dict:
+    """Relay in_fd to the child's stdin and its stdout to out_fd until the child is done.
+
+    EOF on in_fd closes the child's stdin. The relay ends when the child's
+    stdout and stderr reach EOF, or when the child has exited and what it
+    left in them is drained (a grandchild such as the session-manager-plugin
+    may hold them open). If out_fd is closed (ssh went away) the child is
+    terminated.
+
+    Args:
+        process: Child started with stdin, stdout and stderr pipes
+        in_fd: File descriptor to read (e.g. stdin)
+        out_fd: File descriptor to write (e.g. stdout)
+        on_stderr: Called with every line the child writes to stderr, without line end
+        use_splice: Move data with os.splice() where possible
+
+    Returns:
+        dict: bytes_in (in_fd to the child), bytes_out (child to out_fd),
+        kex_end (bytes_out up to the end of the SSH key exchange, None if
+        it did not finish), stall_in and stall_out (seconds a full
+        destination held each direction up) and splice (whether os.splice()
+        was used)
+    """
+    child_in, child_out, child_err = process.stdin.fileno(), process.stdout.fileno(), process.stderr.fileno()
+    inbound = _Pump(in_fd, child_in, use_splice)
+    outbound = _Pump(child_out, out_fd, use_splice, KexWatcher())
+    restore = {fd: os.get_blocking(fd) for fd in (in_fd, out_fd)}
+    for fd in (in_fd, out_fd, child_in, child_out, child_err):
+        os.set_blocking(fd, False)
+
+    # poll() also takes regular files (e.g. stdin redirected from a file), which epoll refuses
+    selector = selectors.PollSelector() if hasattr(selectors, 'PollSelector') else selectors.SelectSelector()
+    exit_fd = None
+    if hasattr(os, 'pidfd_open'):
+        try:
+            exit_fd = os.pidfd_open(process.pid)
+            selector.register(exit_fd, selectors.EVENT_READ, 'exit')
+        except OSError:
+            exit_fd = None
+    stderr = bytearray()
+    stderr_open = True
+    selector.register(child_err, selectors.EVENT_READ, 'stderr')
+
+    def forward_stderr(final: bool) -> None:
+        *lines, rest = bytes(stderr).split(b'\n')
+        if final and rest:
+            lines.append(rest)
+            rest = b''
+        stderr[:] = rest
+        for line in lines:
+            on_stderr(line.decode(errors='replace').rstrip('\r'))
+
+    def watch(pump: _Pump) -> None:
+        """(Re-)register a pump for what it waits on: a readable source or a writable destination."""
+        if pump.registered is not None:
+            selector.unregister(pump.registered)
+            pump.registered = None
+        if not pump.eof:
+            pump.registered = pump.dst if pump.waiting else pump.src
+            selector.register(pump.registered, selectors.EVENT_WRITE if pump.waiting else selectors.EVENT_READ, pump)
+
+    def stop(pump: _Pump) -> None:
+        """Stop moving data in one direction."""
+        pump.eof = True
+        watch(pump)
+        if pump is inbound:
+            process.stdin.close()
+
+    watch(inbound)
+    watch(outbound)
+    try:
+        while stderr_open or not outbound.eof:
+            events = selector.select(None if exit_fd is not None else EXIT_POLL)
+            exited = exit_fd is None and process.poll() is not None
+            for key, _ in events:
+                if key.data == 'exit':
+                    exited = True
+                elif key.data == 'stderr':
+                    try:
+                        chunk = os.read(child_err, CHUNK)
+                    except BlockingIOError:
+                        continue
+                    stderr.extend(chunk)
+                    forward_stderr(final=not chunk)
+                    if not chunk:
+                        selector.unregister(child_err)
+                        stderr_open = False
+                elif not key.data.eof:
+                    pump = key.data
+                    was_waiting = pump.waiting
+                    try:
+                        pump.write() if was_waiting else pump.read()
+                    except BrokenPipeError:
+                        # The child stopped reading its stdin, or ssh its stdout
+                        stop(pump)
+                        if pump is outbound:
+                            process.terminate()
+                        continue
+                    if pump.eof:
+                        stop(pump)
+                    elif pump.waiting != was_waiting:
+                        watch(pump)
+
+            if exited:
+                # Nobody reads stdin any more; pass on what the child left behind
+                if not inbound.eof:
+                    stop(inbound)
+                if not outbound.eof:
+                    outbound.eof = True
+                    watch(outbound)
+                    os.set_blocking(out_fd, True)
+                    rest = _read_available(child_out)
+                    outbound.bytes += len(rest)
+                    outbound.watcher.feed(rest)
+                    outbound.pending += rest
+                    try:
+                        outbound.write()
+                    except BrokenPipeError:
+                        pass
+                if stderr_open:
+                    stderr.extend(_read_available(child_err))
+                    forward_stderr(final=True)
+                    selector.unregister(child_err)
+                    stderr_open = False
+    finally:
+        selector.close()
+        if exit_fd is not None:
+            os.close(exit_fd)
+        for fd, blocking in restore.items():
+            try:
+                os.set_blocking(fd, blocking)
+            except OSError:
+                pass
+        if not process.stdin.closed:
+            process.stdin.close()
+
+    process.wait()
+    return {
+        'bytes_in': inbound.bytes,
+        'bytes_out': outbound.bytes,
+        'kex_end': outbound.watcher.kex_end,
+        'stall_in': round(inbound.stall, 6),
+        'stall_out': round(outbound.stall, 6),
+        'splice': inbound.splice or outbound.splice,
+    }
@@ -0,0 +1,122 @@
+"""AWS sessions and clients shared per (profile, aws-env, region, client settings).
+
+CloudXProxy, CloudXSetup, fleet.fetch_status and the agent get their
+sessions from context(). Within a process, the AWS config and credentials
+files are read and the region resolved once per key. Clients are built on
+first use and then reused, so a connect to an instance that is already
+Online never creates an EC2 client. Clients get the timeouts, retries and
+endpoints of the context's ClientSettings (see clientconfig.py), or
+botocore's defaults without them.
+"""
+
+import os
+import threading
+from typing import Dict, Iterable, Tuple
+
+_contexts: Dict[Tuple[str, str, str, object], 'AWSContext'] = {}
+_contexts_lock = threading.Lock()
+
+
+def aws_session(profile: str, aws_env: str = None, region: str = None) -> 'boto3.Session':
+    """Build a boto3 session bound to a profile, aws-envs directory and region.
+
+    Unlike core.configure_aws_env() this leaves os.environ untouched, so
+    sessions for different aws-envs can be used side by side.
+
+    Args:
+        profile: AWS profile to use
+        aws_env: Name of the directory in ~/.aws/aws-envs/ (None uses ~/.aws)
+        region: AWS region (default: from profile, or eu-west-1 if not set)
+
+    Returns:
+        boto3.Session: Session whose region_name is always set
+    """
+    import boto3
+    import botocore.session
+
+    core = botocore.session.get_session()
+    if aws_env:
+        aws_env_dir = os.path.expanduser(f"~/.aws/aws-envs/{aws_env}")
+        core.set_config_variable('config_file', os.path.join(aws_env_dir, "config"))
+        core.set_config_variable('credentials_file', os.path.join(aws_env_dir, "credentials"))
+
+    session = boto3.Session(botocore_session=core, profile_name=profile)
+    core.set_config_variable('region', region or session.region_name or 'eu-west-1')
+    return session
+
+
+class AWSContext:
+    """Session of one (profile, aws-env, region) and the clients built from it."""
+
+    def __init__(self, profile: str, aws_env: str = None, region: str = None,
+                 client_config: 'ClientSettings' = None):
+        """Build the session and resolve its region (clients are built on first use).
+
+        Args:
+            profile: AWS profile to use
+            aws_env: Name of the directory in ~/.aws/aws-envs/ (None uses ~/.aws)
+            region: AWS region (default: from profile, or eu-west-1 if not set)
+            client_config: Settings of the clients (default: botocore's defaults)
+        """
+        self.session = aws_session(profile, aws_env, region)
+        self.region = self.session.region_name
+        self.client_config = client_config
+        self._clients = {}
+        # boto3 sessions are not thread-safe; clients are
+        self._lock = threading.Lock()
+
+    @property
+    def clients(self) -> dict:
+        """Clients built so far, keyed by service name."""
+        return dict(self._clients)
+
+    def client(self, service: str):
+        """Return the client for a service, building it on first use."""
+        client = self._clients.get(service)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(service)
+                if client is None:
+                    kwargs = self.client_config.client_kwargs(service) if self.client_config else {}
+                    client = self._clients[service] = self.session.client(service, **kwargs)
+        return client
+
+    def warm(self, services: Iterable[str]) -> 'AWSContext':
+        """Resolve credentials and build the clients of services now.
+
+        Refreshable credentials renew themselves afterwards.
+
+        Returns:
+            AWSContext: self
+        """
+        with self._lock:
+            self.session.get_credentials()
+        for service in services:
+            self.client(service)
+        return self
+
+
+def context(profile: str, aws_env: str = None, region: str = None,
+            client_config: 'ClientSettings' = None) -> AWSContext:
+    """Return the shared context of a profile, aws-env, region and client settings, building it on first use.
+
+    A context whose session cannot be built (e.g. a missing profile) is not
+    kept, so the next call tries again.
+    """
+    key = (profile, aws_env, region, client_config)
+    with _contexts_lock:
+        if key not in _contexts:
+            _contexts[key] = AWSContext(profile, aws_env, region, client_config)
+        return _contexts[key]
+
+
+def session(profile: str, aws_env: str = None, region: str = None,
+            client_config: 'ClientSettings' = None) -> 'boto3.Session':
+    """Return the session of the shared context (see context())."""
+    return context(profile, aws_env, region, client_config).session
+
+
+def clear() -> None:
+    """Forget all contexts, e.g. after the AWS config files were changed."""
+    with _contexts_lock:
+        _contexts.clear()
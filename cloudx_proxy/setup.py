@@ -4,12 +4,19 @@ import time
 import subprocess
 import platform
 from pathlib import Path
-from typing import Optional, Tuple
-import boto3
-from botocore.exceptions import ClientError
-from ._1password import check_1password_cli, list_ssh_keys, create_ssh_key, get_vaults, save_public_key
+from typing import Callable, List, Optional, Tuple
+from . import configfile, launcher
+from .tunnel import tunnel_host_config, tunneled_instance
+from .sshconfig import Line, SSHConfig, apply_edits, block_at, block_before, find_host, find_hosts, next_header
 from .colors import header, warning, info, prompt as color_prompt, status_symbol, format_path, format_command
 
+# Environment files of the sharded layout written concurrently by cleanup
+SHARD_WORKERS = 8
+
+# Launcher of a config not looked at yet (None means uvx)
+_UNKNOWN = object()
+
+
 class CloudXSetup:
     # Define SSH key prefix as a constant
     SSH_KEY_PREFIX = "cloudX SSH Key - "
@@ -35,6 +42,49 @@ class CloudXSetup:
         pattern = r'^i-[0-9a-f]{8}$|^i-[0-9a-f]{17}$'
         return bool(re.match(pattern, instance_id, re.IGNORECASE))
 
+    @staticmethod
+    def parse_instance_tags(tags: dict) -> Tuple[Optional[str], Optional[str]]:
+        """Extract environment and hostname from instance tags.
+
+        The hostname comes from the 'Name' tag (format: cloudX-{env}-{hostname} | {username}).
+        The environment is taken by priority from {env} in the Name tag, the
+        cloudX:environment (or cloudx:environment) tag, then the Environment tag.
+
+        Args:
+            tags: Instance tags as a dict of key -> value
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: (environment, hostname), None where not found
+        """
+        hostname = None
+        env_from_name = None
+        name_tag = tags.get('Name', '')
+        if name_tag:
+            ssh_hostname = name_tag.split(' | ')[0].strip()
+            match = re.match(r'^cloud[xX]-([^-]+)-(.+)$', ssh_hostname)
+            if match:
+                env_from_name = match.group(1)
+                hostname = match.group(2)
+
+        environment = (
+            env_from_name
+            or tags.get('cloudX:environment')
+            or tags.get('cloudx:environment')
+            or tags.get('Environment')
+        )
+        return environment, hostname
+
+    def _aws_context(self):
+        """Return the shared session context for the configured profile, AWS environment and client settings."""
+        from . import clientconfig, sessions
+        if self.client_config is None:
+            self.client_config = clientconfig.resolve(defaults=clientconfig.SETUP_DEFAULTS)
+        return sessions.context(self.profile, self.aws_env, client_config=self.client_config)
+
+    def _ec2_client(self):
+        """Return the EC2 client of the shared session for the configured profile and AWS environment."""
+        return self._aws_context().client('ec2')
+
     def get_instance_tags(self, instance_id: str) -> Tuple[Optional[str], Optional[str]]:
         """Fetch instance tags and extract environment and hostname.
 
@@ -48,15 +98,10 @@ class CloudXSetup:
         Returns:
             Tuple[Optional[str], Optional[str]]: (environment, hostname) or (None, None) on failure
         """
-        try:
-            # Configure AWS environment if specified
-            if self.aws_env:
-                aws_env_dir = os.path.expanduser(f"~/.aws/aws-envs/{self.aws_env}")
-                os.environ["AWS_CONFIG_FILE"] = os.path.join(aws_env_dir, "config")
-                os.environ["AWS_SHARED_CREDENTIALS_FILE"] = os.path.join(aws_env_dir, "credentials")
+        from botocore.exceptions import ClientError
 
-            session = boto3.Session(profile_name=self.profile)
-            ec2 = session.client('ec2')
+        try:
+            ec2 = self._ec2_client()
 
             response = ec2.describe_instances(InstanceIds=[instance_id])
 
@@ -66,32 +111,13 @@ class CloudXSetup:
 
             instance = response['Reservations'][0]['Instances'][0]
             tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+            environment, hostname = self.parse_instance_tags(tags)
 
-            # Extract hostname and env from Name tag
-            # Format: cloudX-{env}-{hostname} | {username}
-            hostname = None
-            env_from_name = None
             name_tag = tags.get('Name', '')
-            if name_tag:
-                ssh_hostname = name_tag.split(' | ')[0].strip()
-                match = re.match(r'^cloud[xX]-([^-]+)-(.+)$', ssh_hostname)
-                if match:
-                    env_from_name = match.group(1)
-                    hostname = match.group(2)
-                    self.print_status(f"Found hostname from Name tag: {hostname}", True, 2)
-                else:
-                    self.print_status(f"Name tag '{name_tag}' does not match cloudX-{{env}}-{{hostname}} format", None, 2)
-
-            # Determine environment by priority:
-            # 1. {env} from Name tag
-            # 2. cloudX:environment or cloudx:environment tag
-            # 3. Environment tag
-            environment = (
-                env_from_name
-                or tags.get('cloudX:environment')
-                or tags.get('cloudx:environment')
-                or tags.get('Environment')
-            )
+            if hostname:
+                self.print_status(f"Found hostname from Name tag: {hostname}", True, 2)
+            elif name_tag:
+                self.print_status(f"Name tag '{name_tag}' does not match cloudX-{{env}}-{{hostname}} format", None, 2)
             if environment:
                 self.print_status(f"Found environment: {environment}", True, 2)
 
@@ -104,9 +130,58 @@ class CloudXSetup:
             self.print_status(f"Error fetching instance tags: {str(e)}", False, 2)
             return None, None
     
+    def discover_instances(self, environment: str = None) -> Optional[List[Tuple[str, str, str]]]:
+        """Find all cloudX instances from their Name tags.
+
+        Pages through DescribeInstances filtered on Name tags starting with
+        cloudX- or cloudx- (terminated instances excluded) and parses each
+        tag with parse_instance_tags(). Instances whose Name tag does not
+        match cloudX-{env}-{hostname} are skipped.
+
+        Args:
+            environment: Only return instances of this environment (case-insensitive, optional)
+
+        Returns:
+            Optional[List[Tuple[str, str, str]]]: (environment, hostname, instance_id) sorted by
+                environment and hostname, or None if EC2 could not be queried
+        """
+        from botocore.exceptions import ClientError
+
+        filters = [
+            {'Name': 'tag:Name', 'Values': ['cloudX-*', 'cloudx-*']},
+            {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']},
+        ]
+        try:
+            paginator = self._ec2_client().get_paginator('describe_instances')
+            found = {}
+            for page in paginator.paginate(Filters=filters):
+                for reservation in page.get('Reservations', []):
+                    for instance in reservation.get('Instances', []):
+                        tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                        env, hostname = self.parse_instance_tags(tags)
+                        if not env or not hostname:
+                            continue
+                        if environment and env.lower() != environment.lower():
+                            continue
+                        key = (env, hostname)
+                        if key in found:
+                            self.print_status(f"Skipping {instance['InstanceId']}: {self.ssh_host_prefix}-{env}-{hostname} "
+                                              f"is already used by {found[key]}", None, 2)
+                            continue
+                        found[key] = instance['InstanceId']
+            return [(env, hostname, instance_id) for (env, hostname), instance_id in sorted(found.items())]
+
+        except ClientError as e:
+            self.print_status(f"Error discovering instances: {e.response['Error']['Message']}", False, 2)
+            return None
+        except Exception as e:
+            self.print_status(f"Error discovering instances: {str(e)}", False, 2)
+            return None
+
     def __init__(self, profile: str = "cloudX", ssh_key: str = "cloudX", ssh_config: str = None,
                  ssh_dir: str = None, aws_env: str = None, use_1password: str = None, instance_id: str = None,
-                 ssh_host_prefix: str = "cloudx", non_interactive: bool = False, dry_run: bool = False):
+                 ssh_host_prefix: str = "cloudx", non_interactive: bool = False, dry_run: bool = False,
+                 layout: str = None, proxy_command: str = None, client_config=None):
         """Initialize cloudx-proxy setup.
         
         Args:
@@ -120,6 +195,12 @@ class CloudXSetup:
             ssh_host_prefix: Prefix for SSH hosts (default: "cloudx")
             non_interactive: Non-interactive mode, use defaults for all prompts (default: False)
             dry_run: Preview mode, show what would be done without executing (default: False)
+            layout: SSH config layout, 'single' or 'sharded' (one file per environment);
+                used for a new config and by cleanup, which converts (default: None, keep the current one)
+            proxy_command: ProxyCommand form, 'uvx' or 'launcher' (the installed launcher by absolute path);
+                used by cleanup, which converts (default: None, keep the one the config uses)
+            client_config: clientconfig.ClientSettings of the AWS clients
+                (default: None, clientconfig.resolve() with SETUP_DEFAULTS on first use)
         """
         self.profile = profile
         self.ssh_key = ssh_key
@@ -139,6 +220,10 @@ class CloudXSetup:
         self.instance_id = instance_id
         self.non_interactive = non_interactive
         self.dry_run = dry_run
+        self.layout = layout
+        self.proxy_command = proxy_command
+        self.client_config = client_config
+        self._config_launcher = _UNKNOWN
         self.home_dir = str(Path.home())
         self.onepassword_agent_sock = Path(self.home_dir) / ".1password" / "agent.sock"
         self.onepassword_agent_sock_macos = Path(self.home_dir) / "Library" / "Group Containers" / "2BUA8C4S2C.com.1password" / "t" / "agent.sock"
@@ -285,7 +370,9 @@ class CloudXSetup:
             return True
             
         self.print_status("Checking AWS profile configuration...")
-        
+        # boto3 is only loaded by the commands that talk to AWS
+        from botocore.exceptions import ClientError
+
         try:
             # Configure AWS environment if specified
             if self.aws_env:
@@ -293,9 +380,9 @@ class CloudXSetup:
                 os.environ["AWS_CONFIG_FILE"] = os.path.join(aws_env_dir, "config")
                 os.environ["AWS_SHARED_CREDENTIALS_FILE"] = os.path.join(aws_env_dir, "credentials")
 
-            # Try to create session with profile
+            # Try to create session with profile (shared with the EC2 calls that follow)
             try:
-                session = boto3.Session(profile_name=self.profile)
+                context = self._aws_context()
             except Exception:
                 # Profile doesn't exist, create it
                 self.print_status(f"AWS profile '{self.profile}' not found", False, 2)
@@ -309,11 +396,11 @@ class CloudXSetup:
                 ], check=True)
                 
                 # Create new session with configured profile
-                session = boto3.Session(profile_name=self.profile)
+                context = self._aws_context()
 
             # Verify the profile works
             try:
-                identity = session.client('sts').get_caller_identity()
+                identity = context.client('sts').get_caller_identity()
                 identity_arn = identity['Arn']
 
                 # Determine if the identity refers to an IAM user or an assumed role/SSO session
@@ -380,6 +467,7 @@ class CloudXSetup:
         self.print_status("Checking 1Password availability...")
         
         # Use our helper function to check 1Password CLI
+        from ._1password import check_1password_cli
         installed, authenticated, version = check_1password_cli()
         
         if not installed:
@@ -431,6 +519,8 @@ class CloudXSetup:
         Returns:
             bool: True if successful
         """
+        from ._1password import create_ssh_key, get_vaults, list_ssh_keys, save_public_key
+
         try:
             # Create possible title variations for the 1Password item
             ssh_key_title_with_prefix = f"{self.SSH_KEY_PREFIX}{self.ssh_key}"
@@ -667,12 +757,17 @@ class CloudXSetup:
         # Use the same case as ssh_host_prefix for the proxy command
         # If prefix is "cloudX", use "cloudX-proxy"; if "cloudx", use "cloudx-proxy"
         prefix_base = self.ssh_host_prefix.split('-')[0] if '-' in self.ssh_host_prefix else self.ssh_host_prefix
-        proxy_command = f"uvx {prefix_base}-proxy connect %h %p"
+        proxy_command = f"{launcher.program(f'{prefix_base}-proxy', self._launcher_dir())} connect %h %p"
 
         # Always include aws-env if specified (environment-specific, cannot be auto-detected)
         if self.aws_env:
             proxy_command += f" --aws-env {self.aws_env}"
 
+        # The default Windows ssh has no ControlMaster (see _build_generic_config),
+        # so connections share a session through the cloudx-proxy mux instead
+        if platform.system() == 'Windows':
+            proxy_command += " --mux"
+
         # Determine what the auto-detected defaults would be for this environment
         # Default profile and ssh-key based on directory: cloudX > vscode > cloudX
         cloudx_dir = Path(self.home_dir) / ".ssh" / "cloudX"
@@ -703,6 +798,93 @@ class CloudXSetup:
 
         return proxy_command
         
+    def _launcher_dir(self) -> Optional[Path]:
+        """Return the directory of the launcher ProxyCommands run, or None for uvx.
+
+        Follows self.proxy_command; without it, the form the ProxyCommands of
+        the config already use is kept.
+        """
+        if self.proxy_command == 'launcher':
+            return launcher.bin_dir()
+        if self.proxy_command == 'uvx':
+            return None
+        if self._config_launcher is _UNKNOWN:
+            self._config_launcher = None
+            content = configfile.read_with_includes(self.ssh_config_file)[0]
+            for line in SSHConfig.parse(content).lines():
+                if line.kind == 'directive' and line.key == 'proxycommand':
+                    program = launcher.proxy_program(line.value)
+                    if program:
+                        self._config_launcher = program[1]
+                        break
+        return self._config_launcher
+
+    def _convert_proxy_commands(self, content: str) -> Tuple[str, int]:
+        """Switch the cloudx-proxy ProxyCommands of a config to the form of _launcher_dir().
+
+        Only the program part changes; options and everything else keep their bytes.
+
+        Args:
+            content: SSH config content
+
+        Returns:
+            Tuple[str, int]: New content and the number of ProxyCommands changed
+        """
+        target = self._launcher_dir()
+        config = SSHConfig.parse(content)
+        changed = 0
+        for line in config.lines():
+            if line.kind == 'directive' and line.key == 'proxycommand':
+                program = launcher.proxy_program(line.value)
+                if program and program[1] != target:
+                    name, _, rest = program
+                    line.set_value(launcher.program(name, target) + rest)
+                    changed += 1
+        return str(config), changed
+
+    def convert_proxy_commands(self) -> bool:
+        """Rewrite the ProxyCommands of the config to self.proxy_command in place.
+
+        Unlike cleanup, nothing but the program of each cloudx-proxy
+        ProxyCommand changes ('uvx cloudx-proxy' or the launcher's path). In
+        the sharded layout the environment files are converted too.
+
+        Returns:
+            bool: True if the config was converted (or already used the form)
+        """
+        try:
+            if not self.ssh_config_file.exists():
+                self.print_status(f"SSH config file not found: {self.ssh_config_file}", False, 2)
+                return False
+            if self.proxy_command == 'launcher' and not launcher.installed():
+                self.print_status("The launcher is not installed; run install-launcher first", False, 2)
+                return False
+
+            changed = 0
+            # The root config's lock guards the layout: environment files only change while it is held
+            with configfile.lock(self.ssh_config_file):
+                root_config = configfile.read(self.ssh_config_file)
+                new_root, count = self._convert_proxy_commands(root_config)
+                changed += count
+                if count and not self.dry_run:
+                    configfile.write_atomic(self.ssh_config_file, new_root)
+                if self._is_sharded(root_config):
+                    for shard in configfile.included_files([str(self._shard_dir() / "*.conf")]):
+                        if self.dry_run:
+                            old = configfile.read(shard)
+                        else:
+                            old, _ = configfile.update(shard, lambda content: self._convert_proxy_commands(content)[0])
+                        changed += self._convert_proxy_commands(old)[1]
+
+            form = "the launcher" if self._launcher_dir() else "uvx"
+            prefix = "[DRY RUN] Would change" if self.dry_run else "Changed"
+            self.print_status(f"{prefix} {changed} ProxyCommands to {form}", True, 2)
+            return True
+
+        except Exception as e:
+            self.print_status(f"Error converting ProxyCommands: {str(e)}", False, 2)
+            return False
+
     def _build_auth_config(self) -> str:
         """Build the authentication configuration block.
 
@@ -740,6 +922,10 @@ class CloudXSetup:
         - 'global': Global Host cloudX-* section
         - 'environments': Dict with environment name -> {pattern, lines}
 
+        Standalone comments are dropped and inline comments are removed from
+        directives (but kept on Host lines). Use sshconfig.SSHConfig for a
+        lossless view of the file.
+
         Args:
             config_content: SSH config file content
 
@@ -751,85 +937,55 @@ class CloudXSetup:
             'global': None,
             'environments': {}
         }
+        config = SSHConfig.parse(config_content)
 
-        lines = config_content.split('\n')
-        i = 0
-
-        # Extract version header
-        while i < len(lines) and lines[i].strip().startswith('#'):
-            if 'Managed by cloudX-proxy' in lines[i] or 'SSH Configuration' in lines[i]:
-                result['version'] = lines[i].strip()
-                i += 1
+        # Extract version header from the leading comment lines
+        for line in config.preamble.lines:
+            if line.kind != 'comment':
+                break
+            if 'Managed by cloudX-proxy' in line.text or 'SSH Configuration' in line.text:
+                result['version'] = line.text.strip()
                 break
-            i += 1
 
-        # First pass: extract all Host entries and their properties
+        # First pass: collect the lines of every Host block by its pattern
         host_entries = {}  # hostname -> config_lines
         env_patterns = {}  # env_pattern -> config_lines
-        current_host = None
-        current_config = []
         global_config = None
+        target = None  # Lines of the Host block being collected
 
-        for line in lines[i:]:
-            # Skip standalone comment lines and banners (but keep inline comments on Host lines)
-            if line.strip().startswith('#') and not line.startswith('Host '):
-                continue
-
-            # Skip empty lines unless we're collecting config
-            if not line.strip():
-                if current_host and current_config:
-                    current_config.append(line)
-                continue
-
-            # Host line
-            if line.startswith('Host '):
-                # Save previous host if exists
-                if current_host:
-                    if current_host.endswith('*'):
-                        env_patterns[current_host] = current_config
-                    else:
-                        host_entries[current_host] = current_config
-                    current_config = []
-
-                # Preserve the full Host line (including inline comments after #)
-                current_host = line.replace('Host ', '', 1).strip()
-
-                # For pattern matching, extract just the hostname/pattern without comments
-                hostname_only = current_host.split('#')[0].strip()
-
-                # Global section
+        for block in config.blocks:
+            if block.keyword == 'host':
+                # Preserve the full Host line (including inline comments after #);
+                # match on the pattern without comments
+                hostname_only = block.name
                 if hostname_only == f"{self.ssh_host_prefix}-*":
-                    global_config = [line]
-                    current_host = None
+                    global_config = target = [block.header.raw]
                 else:
-                    current_host = hostname_only  # Store without inline comment for dedup/matching
-                    current_config = [line]  # Store full line with comment
-            # Config content
+                    target = [block.header.raw]
+                    entries = env_patterns if hostname_only.endswith('*') else host_entries
+                    entries[hostname_only] = target
+                body = block.body
             else:
-                if current_host:
-                    # Strip inline comments from config directives (not Host lines)
-                    if '#' in line and not line.strip().startswith('#'):
-                        line = line.split('#')[0].rstrip()
-                    current_config.append(line)
-                elif global_config is not None:
-                    # Strip inline comments from global config too
-                    if '#' in line and not line.strip().startswith('#'):
-                        line = line.split('#')[0].rstrip()
-                    global_config.append(line)
-
-        # Save last entry
-        if current_host:
-            if current_host.endswith('*'):
-                env_patterns[current_host] = current_config
-            else:
-                host_entries[current_host] = current_config
+                # Preamble, or a Match block that stays with the Host block before it
+                body = block.lines
+
+            for line in body:
+                if target is None or line.kind == 'comment':
+                    continue
+                if line.kind == 'blank':
+                    # Keep empty lines inside host blocks, not in the global section
+                    if target is not global_config:
+                        target.append(line.raw)
+                    continue
+                target.append(line.code)
 
         # Second pass: organize environment patterns and host entries
-        seen_hosts = set()  # Track seen hosts to avoid duplicates
+        env_pattern_re = re.compile(rf'{re.escape(self.ssh_host_prefix)}-(\w+)-\*', re.IGNORECASE)
+        host_re = re.compile(rf'{re.escape(self.ssh_host_prefix)}-(\w+)-', re.IGNORECASE)
 
         # First, add all environment patterns
         for env_pattern, config_lines in env_patterns.items():
-            env_match = re.match(rf'{re.escape(self.ssh_host_prefix)}-(\w+)-\*', env_pattern, re.IGNORECASE)
+            env_match = env_pattern_re.match(env_pattern)
             if env_match:
                 env_name_original = env_match.group(1)  # Preserve original case
                 env_name_key = env_name_original.lower()  # Lowercase for dict key (case-insensitive matching)
@@ -842,16 +998,11 @@ class CloudXSetup:
         # Then, add host entries to their environments
         for host_key, config_lines in host_entries.items():
             # Extract environment from hostname
-            env_match = re.match(rf'{re.escape(self.ssh_host_prefix)}-(\w+)-', host_key, re.IGNORECASE)
+            env_match = host_re.match(host_key)
             if env_match:
                 env_name_original = env_match.group(1)  # Preserve original case
                 env_name_key = env_name_original.lower()  # Lowercase for dict key
 
-                # Skip duplicates
-                if host_key in seen_hosts:
-                    continue
-                seen_hosts.add(host_key)
-
                 # Create environment if not exists (shouldn't happen, but handle it)
                 if env_name_key not in result['environments']:
                     result['environments'][env_name_key] = {
@@ -884,10 +1035,7 @@ class CloudXSetup:
 
         # Add global section with banner
         if global_config:
-            lines.append("# ==============================================================================")
-            lines.append("#  GLOBAL")
-            lines.append("# ==============================================================================")
-            lines.append("")
+            lines.extend(self._section_banner("GLOBAL"))
             lines.extend(global_config.split('\n'))
             lines.append("")
 
@@ -896,34 +1044,35 @@ class CloudXSetup:
             env_data = environments[env_key]
             # Use original case name for banner if available
             display_name = env_data.get('name', env_key)
-            lines.append("# ==============================================================================")
-            lines.append(f"#  {display_name}")
-            lines.append("# ==============================================================================")
-            lines.append("")
+            lines.extend(self._section_banner(display_name))
 
-            # Extract environment pattern and its config from lines
+            # Split the environment into its pattern block and host blocks
             env_pattern_line = None
             env_config_lines = []  # Config lines that belong to the pattern
-            host_lines = []
-            in_hosts = False
-            seen_pattern = False
-
-            for line in env_data['lines']:
-                if line.startswith('Host ') and '*' in line:
-                    # This is the environment pattern line
-                    env_pattern_line = line
-                    seen_pattern = True
-                elif line.startswith('Host ') and '*' not in line:
-                    # This is a host entry - stop collecting pattern config
-                    in_hosts = True
-                    host_lines.append(line)
-                elif in_hosts:
-                    # Host entry content
-                    host_lines.append(line)
-                elif seen_pattern and not in_hosts:
-                    # Config content that belongs to the environment pattern
-                    # (indented lines after Host pattern-*)
-                    env_config_lines.append(line)
+            sorted_hosts = []
+            tunnel_hosts = []  # Hosts pointed at a tunnel go first, overriding the pattern's ProxyCommand
+            for block in SSHConfig.parse('\n'.join(env_data['lines']) + '\n').blocks:
+                block_lines = [line.raw for line in block.lines]
+                if block.keyword != 'host':
+                    # Match blocks stay with the host entry they follow
+                    if sorted_hosts:
+                        sorted_hosts[-1].extend(block_lines)
+                    elif env_pattern_line:
+                        env_config_lines.extend(block_lines)
+                elif '*' in block.header.text:
+                    # The environment pattern and its config (auth, ProxyCommand, ...)
+                    env_pattern_line = block.header.raw
+                    env_config_lines.extend(block_lines[1:])
+                elif tunneled_instance(block):
+                    tunnel_hosts.append(block_lines)
+                else:
+                    sorted_hosts.append(block_lines)
+
+            for host in sorted(tunnel_hosts, key=lambda x: x[0]):
+                while not host[-1].strip():
+                    host.pop()
+                lines.append('\n'.join(host))
+                lines.append("")
 
             # Add environment pattern line
             if env_pattern_line:
@@ -936,38 +1085,65 @@ class CloudXSetup:
                 lines.append("")
 
             # Add host entries sorted by hostname
-            if host_lines:
-                sorted_hosts = []
-                current_host = []
-                for line in host_lines:
-                    if line.startswith('Host ') and current_host:
-                        sorted_hosts.append('\n'.join(current_host))
-                        current_host = [line]
-                    else:
-                        current_host.append(line)
-                if current_host:
-                    sorted_hosts.append('\n'.join(current_host))
-
+            if sorted_hosts:
                 # Sort by hostname (first line)
-                sorted_hosts.sort(key=lambda x: x.split('\n')[0])
+                sorted_hosts.sort(key=lambda x: x[0])
 
                 for host in sorted_hosts:
-                    lines.append(host)
-                lines.append("")
+                    # One empty line after every host, whatever the input had
+                    while not host[-1].strip():
+                        host.pop()
+                    lines.append('\n'.join(host))
+                    lines.append("")
 
-        # Join and clean up
-        result = '\n'.join(lines)
-        # Remove duplicate empty lines
-        while '\n\n\n' in result:
-            result = result.replace('\n\n\n', '\n\n')
+        # Join and clean up, collapsing runs of empty lines
+        result = re.sub(r'\n{3,}', '\n\n', '\n'.join(lines))
 
         return result.rstrip() + '\n'
 
+    @staticmethod
+    def _section_banner(title: str) -> List[str]:
+        """Banner lines (and the empty line after them) that start a section of the organized config."""
+        rule = "# =============================================================================="
+        return [rule, f"#  {title}", rule, ""]
+
+    def _shard_dir(self) -> Path:
+        """Directory holding the environment files of the sharded layout (<config>.d)."""
+        return self.ssh_config_file.with_name(f"{self.ssh_config_file.name}.d")
+
+    def _shard_file(self, cloudx_env: str) -> Path:
+        """Config file of one environment in the sharded layout."""
+        return self._shard_dir() / f"{cloudx_env.lower()}.conf"
+
+    def _shard_include(self) -> str:
+        """Include line of a sharded root config."""
+        return f"Include {self._shard_dir()}/*.conf"
+
+    def _is_sharded(self, root_config: str) -> bool:
+        """Whether a root config uses the sharded layout, i.e. includes our shard directory."""
+        include = self._shard_include()
+        return include in root_config and re.search(
+            rf'^[ \t]*{re.escape(include)}[ \t]*$', root_config, re.MULTILINE) is not None
+
+    def _sharded_root(self, global_config: str) -> str:
+        """Root config of the sharded layout: the global section and the Include of the environment files.
+
+        The Include stays inside the Host <prefix>-* block, so ssh reads the
+        environment files for our hosts only and after the global settings,
+        the same precedence as in the single-file layout.
+        """
+        include = self._shard_include()
+        global_lines = [line for line in global_config.strip().split('\n') if line.strip() != include]
+        global_lines += ["", "# Environments, one file each (read as part of the block above)", include]
+        return self._organize_ssh_config('\n'.join(global_lines), {})
+
     def _normalize_prefix(self, content: str) -> str:
         """Normalize all cloudX/cloudx references to match self.ssh_host_prefix.
 
         This allows users to convert between 'cloudX' and 'cloudx' naming conventions
         by running cleanup with the desired command name (cloudX-proxy or cloudx-proxy).
+        Only Host patterns and ProxyCommand values change; everything else is kept
+        byte for byte.
 
         Args:
             content: SSH config content or single line
@@ -977,22 +1153,21 @@ class CloudXSetup:
         """
         # Determine the "other" prefix to replace
         other_prefix = 'cloudx' if self.ssh_host_prefix == 'cloudX' else 'cloudX'
+        host_pattern = re.compile(rf'(?<!\S){other_prefix}-')
+        proxy_command = re.compile(rf'(\buvx |[/\\]){other_prefix}-proxy\b')
 
-        # Replace in Host patterns: Host cloudX-* or Host cloudx-*
-        content = re.sub(
-            rf'\bHost {other_prefix}-',
-            f'Host {self.ssh_host_prefix}-',
-            content
-        )
-
-        # Replace in ProxyCommand: uvx cloudX-proxy or uvx cloudx-proxy
-        content = re.sub(
-            rf'\buvx {other_prefix}-proxy\b',
-            f'uvx {self.ssh_host_prefix}-proxy',
-            content
-        )
+        config = SSHConfig.parse(content)
+        for line in config.lines():
+            if line.kind != 'directive':
+                continue
+            if line.key == 'host' and other_prefix in line.value:
+                # Host patterns: Host cloudX-* or Host cloudx-*
+                line.set_value(host_pattern.sub(f'{self.ssh_host_prefix}-', line.value))
+            elif line.key == 'proxycommand' and other_prefix in line.value:
+                # ProxyCommand: uvx cloudX-proxy or uvx cloudx-proxy, or the launcher's .../cloudx-proxy
+                line.set_value(proxy_command.sub(rf'\g<1>{self.ssh_host_prefix}-proxy', line.value))
 
-        return content
+        return str(config)
 
     def _build_generic_config(self) -> str:
         """Build a generic configuration block with common settings for all environments.
@@ -1010,7 +1185,8 @@ class CloudXSetup:
         # Add SSH multiplexing configuration
         # On Windows, the default SSH client doesn't support Control* options,
         # so we comment them out by default. Users with alternative SSH clients
-        # (like the one from Git for Windows) can uncomment these if needed.
+        # (like the one from Git for Windows) can uncomment these if needed;
+        # the ProxyCommand runs connect --mux there instead.
         control_path = "~/.ssh/control/%r@%h:%p"
         is_windows = platform.system() == 'Windows'
         comment_prefix = "# " if is_windows else ""
@@ -1071,7 +1247,7 @@ class CloudXSetup:
         Returns:
             bool: True if pattern exists in configuration
         """
-        return f"Host {pattern}" in current_config
+        return find_host(current_config, pattern) is not None
     
     def _extract_host_config(self, pattern: str, current_config: str) -> Tuple[str, str]:
         """Extract a host configuration block from the current config.
@@ -1083,98 +1259,362 @@ class CloudXSetup:
         Returns:
             Tuple[str, str]: Extracted host configuration, remaining configuration
         """
-        lines = current_config.splitlines()
         host_config_lines = []
         remaining_lines = []
-        in_host_block = False
-        
-        for line in lines:
-            if line.strip() == f"Host {pattern}":
-                in_host_block = True
-                host_config_lines.append(line)
-            elif in_host_block and line.strip().startswith("Host "):
-                in_host_block = False
-                remaining_lines.append(line)
-            elif in_host_block:
-                host_config_lines.append(line)
-            else:
-                remaining_lines.append(line)
+        for block in SSHConfig.parse(current_config).blocks:
+            lines = host_config_lines if block.keyword == 'host' and block.name == pattern else remaining_lines
+            lines.extend(line.raw for line in block.lines)
                 
         return "\n".join(host_config_lines), "\n".join(remaining_lines)
     
-    def _add_host_entry(self, cloudx_env: str, instance_id: str, hostname: str, current_config: str) -> bool:
-        """Add/update host entry and reorganize config file.
+    def _merge_host_entries(self, parsed: dict, cloudx_env: str, hosts: List[Tuple[str, str]]) -> dict:
+        """Add or update host entries of one environment in a parsed config.
 
-        Parses the config, adds/updates the host entry, and reorganizes the file
-        with proper structure and banners.
+        Entries that already point at the same instance are left untouched
+        (keeping inline comments and extra options); entries for another
+        instance are rebuilt.
 
         Args:
+            parsed: Config structure from _parse_ssh_config(), updated in place
             cloudx_env: CloudX environment
-            instance_id: EC2 instance ID
-            hostname: Hostname for the instance
+            hosts: (hostname, instance_id) pairs
+
+        Returns:
+            dict: Number of hosts 'added', 'updated' and 'unchanged'
+        """
+        env_key = cloudx_env.lower()
+        if env_key not in parsed['environments']:
+            # Create new environment
+            env_pattern = f"{self.ssh_host_prefix}-{cloudx_env}-*"
+            parsed['environments'][env_key] = {
+                'pattern': env_pattern,
+                'name': cloudx_env,
+                'lines': [f"Host {env_pattern}"] + self._build_environment_config(cloudx_env).split('\n')[1:]
+            }
+            self.print_status(f"Created new environment section for '{cloudx_env}'", None, 2)
+
+        wanted = {f"{self.ssh_host_prefix}-{cloudx_env}-{hostname}".lower(): (hostname, instance_id)
+                  for hostname, instance_id in hosts}
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0}
+
+        lines = []
+        for block in SSHConfig.parse('\n'.join(parsed['environments'][env_key]['lines']) + '\n').blocks:
+            block_lines = [line.raw for line in block.lines]
+            name = block.name.lower()
+            if block.keyword == 'host' and name in wanted:
+                hostname, instance_id = wanted.pop(name)
+                if (tunneled_instance(block) or block.get('HostName')) == instance_id:
+                    counts['unchanged'] += 1
+                else:
+                    counts['updated'] += 1
+                    block_lines = self._build_host_config(cloudx_env, hostname, instance_id).split('\n')
+            lines.extend(block_lines)
+
+        for hostname, instance_id in wanted.values():
+            counts['added'] += 1
+            lines.extend(self._build_host_config(cloudx_env, hostname, instance_id).split('\n'))
+
+        parsed['environments'][env_key]['lines'] = lines
+        return counts
+
+    def _update_ssh_config(self, change: Callable[[str], str]) -> Tuple[str, str]:
+        """Apply change to our SSH config file under its lock.
+
+        The file is read under the lock, so concurrent setup runs do not lose
+        each other's entries, and replaced atomically with 600 permissions if
+        change returns different content (see configfile.update).
+
+        Args:
+            change: Callable mapping the current config ('' if there is none) to the new one
+
+        Returns:
+            Tuple[str, str]: Old and new config
+        """
+        return configfile.update(self.ssh_config_file, change)
+
+    def _edit_host_entries(self, current_config: str, hosts: List[Tuple[str, str, str]],
+                           shard: bool = False) -> Optional[Tuple[str, dict]]:
+        """Add or update host entries in place in an organized config.
+
+        Only the affected lines change: an existing host gets its HostName
+        value replaced, a new host is inserted at its sorted position in the
+        environment section, and a new environment gets a section at its
+        sorted position. Hosts are located with regex scans and a binary
+        search over the sorted section, so the cost per host stays flat as the
+        file grows.
+
+        Args:
             current_config: Current SSH config content
+            hosts: (environment, hostname, instance_id) tuples
+            shard: current_config is an environment file of the sharded layout
+                (which has no global section)
 
         Returns:
-            bool: True if settings were added successfully
+            Optional[Tuple[str, dict]]: Updated config and the number of hosts
+                'added', 'updated' and 'unchanged', or None if the config is not
+                in the organized layout yet and needs a full reorganization
         """
-        try:
-            host_pattern = f"{self.ssh_host_prefix}-{cloudx_env}-{hostname}"
-            new_host_entry = self._build_host_config(cloudx_env, hostname, instance_id)
+        if (not current_config.startswith("# SSH Configuration - Managed by")
+                or (not shard and find_host(current_config, f"{self.ssh_host_prefix}-*") is None)):
+            return None
+
+        counts = {'added': 0, 'updated': 0, 'unchanged': 0}
+        edits = []
+        inserts = {}  # offset -> [(sort key, text)]
+        new_sections = {}  # lowercase environment -> (environment, host blocks)
+        wanted = {f"{self.ssh_host_prefix}-{cloudx_env}-{hostname}".lower(): (cloudx_env, hostname, instance_id)
+                  for cloudx_env, hostname, instance_id in hosts}
+
+        for host_pattern, (cloudx_env, hostname, instance_id) in wanted.items():
+            block = find_host(current_config, host_pattern)
+            if block:
+                content_end = block.content_end
+                # A host pointed at a tunnel keeps its instance ID in HostKeyAlias
+                key = 'hostkeyalias' if tunneled_instance(block) else 'hostname'
+                line = next((line for line in block.directives() if line.key == key), None)
+                if line and line.value == instance_id:
+                    counts['unchanged'] += 1
+                    continue
+                if line:
+                    line.set_value(instance_id)
+                else:
+                    block.lines.insert(1, Line.directive('HostName', instance_id))
+                counts['updated'] += 1
+                text = str(block)
+                edits.append((block.start, content_end, text[:len(text) - (block.end - content_end)]))
+                continue
 
-            # Parse existing config
-            parsed = self._parse_ssh_config(current_config)
+            counts['added'] += 1
+            host_config = self._build_host_config(cloudx_env, hostname, instance_id)
+            env_block = find_host(current_config, f"{self.ssh_host_prefix}-{cloudx_env}-*")
+            if env_block is None:
+                new_sections.setdefault(cloudx_env.lower(), (cloudx_env, []))[1].append(host_config)
+            else:
+                header = host_config.split('\n', 1)[0]
+                pos = self._sorted_host_position(current_config, env_block, header)
+                inserts.setdefault(pos, []).append(((0, header), host_config))
+
+        for env_key, (cloudx_env, host_configs) in new_sections.items():
+            env_config = [line for line in self._build_environment_config(cloudx_env).split('\n') if line.strip()]
+            section = '\n'.join(self._section_banner(cloudx_env) + env_config + ['']) + '\n'
+            section += '\n'.join(sorted(host_configs))
+            pos = self._sorted_section_position(current_config, env_key)
+            inserts.setdefault(pos, []).append(((1, env_key), section))
+
+        for pos, items in inserts.items():
+            before = current_config[:pos]
+            if not before or before.endswith('\n\n'):
+                lead = ''
+            else:
+                lead = '\n' if before.endswith('\n') else '\n\n'
+            trail = '\n' if pos < len(current_config) else ''
+            edits.append((pos, pos, lead + '\n'.join(text for _, text in sorted(items)) + trail))
 
-            # Ensure environment section exists
-            if cloudx_env not in parsed['environments']:
-                # Create new environment
-                env_pattern = f"{self.ssh_host_prefix}-{cloudx_env}-*"
-                parsed['environments'][cloudx_env] = {
-                    'pattern': env_pattern,
-                    'lines': [f"Host {env_pattern}"] + self._build_environment_config(cloudx_env).split('\n')[1:]
-                }
-                self.print_status(f"Created new environment section for '{cloudx_env}'", None, 2)
+        return apply_edits(current_config, edits), counts
+
+    def _sorted_host_position(self, config: str, env_block, header: str) -> int:
+        """Offset where a new Host block goes in the (sorted) section of env_block.
+
+        Args:
+            config: SSH config content
+            env_block: The environment's Host <prefix>-<env>-* block
+            header: Host line of the new block
+
+        Returns:
+            int: Offset after the last host that sorts before header
+        """
+        env_prefix = env_block.name[:-1].lower()
+
+        def sorts_after(start):
+            # Blocks after the environment's hosts count as sorting after, too
+            block = block_at(config, start)
+            return not block.name.lower().startswith(env_prefix) or block.header.raw > header
+
+        # Binary search on offsets for the first Host line that sorts after header
+        first = env_block.start + len(env_block.header.text)
+        after, lo, hi = len(config), first, len(config)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = next_header(config, mid, hi)
+            if start >= hi:
+                hi = mid
+            elif sorts_after(start):
+                after = hi = start
             else:
-                # Check if host entry exists and update if needed
-                env_lines = parsed['environments'][cloudx_env]['lines']
-                host_exists = any(host_pattern in line for line in env_lines if line.startswith('Host '))
+                lo = start + 1
+        return block_before(config, after).content_end
 
-                if host_exists:
-                    # Remove old host entry
-                    new_lines = []
-                    skip_until_next_host = False
-                    for line in env_lines:
-                        if line.startswith('Host ') and host_pattern in line:
-                            skip_until_next_host = True
-                            continue
-                        if skip_until_next_host:
-                            if line.startswith('Host '):
-                                skip_until_next_host = False
-                            else:
-                                continue
-                        new_lines.append(line)
-                    parsed['environments'][cloudx_env]['lines'] = new_lines
+    def _sorted_section_position(self, config: str, env_key: str) -> int:
+        """Offset where the section of a new environment goes: before the banner of the next one."""
+        prefix = self.ssh_host_prefix.lower()
+        for block, pattern in find_hosts(config, rf"{re.escape(prefix)}-\w+-\*"):
+            if pattern.lower()[len(prefix) + 1:-2] > env_key:
+                return block_before(config, block.start).content_end
+        return len(config)
 
-            # Add new host entry
-            parsed['environments'][cloudx_env]['lines'].extend(new_host_entry.split('\n'))
+    def _remove_host_entries(self, current_config: str, hosts: List[Tuple[str, str]],
+                             shard: bool = False) -> Optional[Tuple[str, dict]]:
+        """Remove host entries in place from an organized config.
 
-            # Rebuild config with organization
-            organized_config = self._organize_ssh_config(
-                parsed['global'] or self._build_generic_config(),
-                parsed['environments']
-            )
+        Each host block is cut out with the blank line after it; comments
+        before it are left alone. An environment left without hosts loses its
+        whole section: banner, <prefix>-<env>-* block and all.
 
-            # Write organized config
-            self.ssh_config_file.write_text(organized_config)
+        Args:
+            current_config: Current SSH config content
+            hosts: (environment, hostname) tuples
+            shard: current_config is an environment file of the sharded layout
 
-            # Set proper permissions on the config file
-            if platform.system() != 'Windows':
-                import stat
-                self.ssh_config_file.chmod(stat.S_IRUSR | stat.S_IWUSR)  # 600 permissions
+        Returns:
+            Optional[Tuple[str, dict]]: Updated config and the number of hosts
+                'removed' and 'missing', or None if the config is not in the
+                organized layout
+        """
+        if (not current_config.startswith("# SSH Configuration - Managed by")
+                or (not shard and find_host(current_config, f"{self.ssh_host_prefix}-*") is None)):
+            return None
+
+        counts = {'removed': 0, 'missing': 0}
+        removed = {}  # lowercase environment -> (environment, [blocks])
+        for cloudx_env, hostname in hosts:
+            block = find_host(current_config, f"{self.ssh_host_prefix}-{cloudx_env}-{hostname}")
+            if block is None:
+                counts['missing'] += 1
+                continue
+            counts['removed'] += 1
+            removed.setdefault(cloudx_env.lower(), (cloudx_env, []))[1].append(block)
+
+        ranges = []
+        for env_key, (cloudx_env, blocks) in removed.items():
+            starts = {block.start for block in blocks}
+            env_prefix = re.escape(f"{self.ssh_host_prefix}-{env_key}-".lower())
+            remaining = [block for block, _ in find_hosts(current_config, rf"{env_prefix}[^\s*]+")
+                         if block.start not in starts]
+            env_block = find_host(current_config, f"{self.ssh_host_prefix}-{cloudx_env}-*")
+            if remaining or env_block is None:
+                ranges += [(block.start, block.content_end) for block in blocks]
+                continue
+            # The section is empty now: from its banner to its last block
+            first = min([env_block.start] + [block.start for block in blocks])
+            previous = block_before(current_config, first)
+            start = previous.content_end
+            if previous.header is None:
+                banner = current_config.find(self._section_banner('')[0], 0, first)
+                start = banner if banner >= 0 else first
+            ranges.append((start, max([env_block.content_end] + [block.content_end for block in blocks])))
+
+        merged = []
+        for start, end in sorted(ranges):
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        if merged and merged[-1][1] == len(current_config):
+            # Nothing follows: drop the blank line the block before had for it
+            kept = current_config[:merged[-1][0]].rstrip('\n')
+            merged[-1][0] = len(kept) + 1 if kept else 0
 
-            if self._check_config_exists(host_pattern, organized_config):
-                self.print_status(f"Updated host entry for {host_pattern}", True, 2)
+        return apply_edits(current_config, [(start, end, '') for start, end in merged]), counts
+
+    def _host_entries_change(self, hosts: List[Tuple[str, str, str]], totals: dict,
+                             shard: bool = False) -> Callable[[str], str]:
+        """Return a change adding or updating host entries in a config's content.
+
+        An organized config is edited in place; a new or hand-written one is
+        parsed, merged and reorganized.
+
+        Args:
+            hosts: (environment, hostname, instance_id) tuples
+            totals: Dict whose 'added', 'updated' and 'unchanged' counts are increased
+            shard: The content is an environment file of the sharded layout
+
+        Returns:
+            Callable[[str], str]: Function mapping the current to the new content
+        """
+        def change(current_config):
+            edited = self._edit_host_entries(current_config, hosts, shard)
+            if edited:
+                new_config, counts = edited
+            else:
+                parsed = self._parse_ssh_config(current_config)
+
+                by_env = {}
+                for cloudx_env, hostname, instance_id in hosts:
+                    by_env.setdefault(cloudx_env, []).append((hostname, instance_id))
+
+                counts = {'added': 0, 'updated': 0, 'unchanged': 0}
+                for cloudx_env, env_hosts in sorted(by_env.items()):
+                    for key, count in self._merge_host_entries(parsed, cloudx_env, env_hosts).items():
+                        counts[key] += count
+
+                new_config = self._organize_ssh_config(
+                    parsed['global'] if shard else parsed['global'] or self._build_generic_config(),
+                    parsed['environments']
+                )
+            for key, count in counts.items():
+                totals[key] = totals.get(key, 0) + count
+            return new_config
+
+        return change
+
+    def _update_host_entries(self, hosts: List[Tuple[str, str, str]]) -> dict:
+        """Add or update host entries in our SSH config with one locked write per file.
+
+        In the sharded layout only the files of the hosts' environments are
+        written. The root config's lock is held throughout: it guards the
+        layout, so cleanup never converts it under our feet.
+
+        Args:
+            hosts: (environment, hostname, instance_id) tuples
+
+        Returns:
+            dict: Number of hosts 'added', 'updated' and 'unchanged'
+        """
+        totals = {'added': 0, 'updated': 0, 'unchanged': 0}
+
+        with configfile.lock(self.ssh_config_file):
+            root_config = configfile.read(self.ssh_config_file)
+            if self.layout == 'sharded' and not root_config.strip():
+                root_config = self._sharded_root(self._build_generic_config())
+                configfile.write_atomic(self.ssh_config_file, root_config)
+            if self._is_sharded(root_config):
+                by_env = {}
+                for host in hosts:
+                    by_env.setdefault(host[0].lower(), []).append(host)
+                for env_key, env_hosts in sorted(by_env.items()):
+                    configfile.update(self._shard_file(env_key), self._host_entries_change(env_hosts, totals, shard=True))
             else:
+                new_config = self._host_entries_change(hosts, totals)(root_config)
+                if new_config != root_config:
+                    configfile.write_atomic(self.ssh_config_file, new_config)
+        return totals
+
+    def _add_host_entry(self, cloudx_env: str, instance_id: str, hostname: str) -> bool:
+        """Add/update host entry in the config file.
+
+        In an organized config only the host's lines are inserted or updated;
+        otherwise the config is parsed and reorganized with proper structure
+        and banners.
+
+        Args:
+            cloudx_env: CloudX environment
+            instance_id: EC2 instance ID
+            hostname: Hostname for the instance
+
+        Returns:
+            bool: True if settings were added successfully
+        """
+        try:
+            host_pattern = f"{self.ssh_host_prefix}-{cloudx_env}-{hostname}"
+
+            counts = self._update_host_entries([(cloudx_env, hostname, instance_id)])
+
+            if counts['added']:
                 self.print_status(f"Added new host entry for {host_pattern}", True, 2)
+            elif counts['updated']:
+                self.print_status(f"Updated host entry for {host_pattern}", True, 2)
+            else:
+                self.print_status(f"Host entry for {host_pattern} is up to date", True, 2)
 
             return True
 
@@ -1186,89 +1626,217 @@ class CloudXSetup:
                 return True
             return False
 
+    def _tunnel_change(self, host: str, port: Optional[int], found: dict) -> Callable[[str], str]:
+        """Return a change pointing a host at a tunnel on port, or back at the ProxyCommand (port None).
+
+        A tunnel host moves before its environment's <prefix>-<env>-* block,
+        as ssh uses the first ProxyCommand it finds; a restored host goes back
+        to its sorted position after it. Without an environment block the host
+        is changed in place.
+
+        Args:
+            host: Host alias, e.g. 'cloudx-dev-web'
+            port: Local port of the tunnel, or None
+            found: Dict that receives the host's 'instance_id'
+
+        Returns:
+            Callable[[str], str]: Function mapping the current to the new content
+        """
+        def change(content):
+            block = find_host(content, host)
+            if block is None:
+                return content
+            instance_id = tunneled_instance(block) or block.get('HostName')
+            found['instance_id'] = instance_id
+            parts = block.name.split('-')
+            if port:
+                text = tunnel_host_config(block.name, instance_id, port)
+            else:
+                text = self._build_host_config(parts[1], '-'.join(parts[2:]), instance_id)
+            # Keep the Host line as written (case, inline comment)
+            text = block.header.raw + '\n' + text.split('\n', 1)[1]
+            if str(block)[:block.content_end - block.start] == text + '\n':
+                return content
+
+            pattern = f"{'-'.join(parts[:2])}-*"
+            removed = apply_edits(content, [(block.start, block.content_end, '')])
+            env_block = find_host(removed, pattern)
+            if env_block is None:
+                return apply_edits(content, [(block.start, block.content_end, text + '\n')])
+            if port:
+                return apply_edits(removed, [(env_block.start, env_block.start, text + '\n')])
+            pos = self._sorted_host_position(removed, env_block, text.split('\n', 1)[0])
+            before = removed[:pos]
+            if not before or before.endswith('\n\n'):
+                lead = ''
+            else:
+                lead = '\n' if before.endswith('\n') else '\n\n'
+            trail = '\n' if pos < len(removed) else ''
+            return apply_edits(removed, [(pos, pos, lead + text + trail)])
+
+        return change
+
+    def set_tunnel(self, host: str, port: Optional[int]) -> Optional[str]:
+        """Point a host at a local tunnel (HostName localhost, Port port), or back at the ProxyCommand.
+
+        In the sharded layout the environment's file is changed.
+
+        Args:
+            host: Host alias, e.g. 'cloudx-dev-web'
+            port: Local port of `cloudx-proxy tunnel`, or None to restore the ProxyCommand host
+
+        Returns:
+            Optional[str]: The host's instance ID, or None if the host is not in the config
+        """
+        found = {}
+        parts = host.split('-')
+        if len(parts) < 3:
+            self.print_status(f"{host} is not a {self.ssh_host_prefix}-<environment>-<name> host", False, 2)
+            return None
+        change = self._tunnel_change(host, port, found)
+        try:
+            with configfile.lock(self.ssh_config_file):
+                root_config = configfile.read(self.ssh_config_file)
+                target = self._shard_file(parts[1].lower()) if self._is_sharded(root_config) else self.ssh_config_file
+                if self.dry_run:
+                    change(configfile.read(target))
+                elif target == self.ssh_config_file:
+                    new_config = change(root_config)
+                    if new_config != root_config:
+                        configfile.write_atomic(self.ssh_config_file, new_config)
+                else:
+                    configfile.update(target, change)
+        except Exception as e:
+            self.print_status(f"Error updating SSH config: {str(e)}", False, 2)
+            return None
+
+        if not found:
+            self.print_status(f"Host {host} not found in {self.ssh_config_file}", False, 2)
+            return None
+        prefix = "[DRY RUN] Would point" if self.dry_run else "Pointed"
+        target = f"the tunnel on localhost:{port}" if port else "its ProxyCommand"
+        self.print_status(f"{prefix} {host} at {target}", True, 2)
+        return found['instance_id']
+
     def cleanup_config(self) -> bool:
         """Clean up and reorganize SSH configuration file.
 
-        Reads the entire config file, removes duplicates, reorganizes with
+        Reads the entire config file (and in the sharded layout the
+        environment files it includes), removes duplicates, reorganizes with
         proper structure, and writes back completely fresh (full rewrite).
         Also rebuilds ProxyCommand to remove unnecessary default flags.
+        With self.layout set, the config is converted to that layout; the
+        environment files of the sharded layout are written in parallel.
 
         Returns:
             bool: True if cleanup was successful
         """
+        # Only cleanup needs these; connect imports this module to validate instance IDs
+        from concurrent.futures import ThreadPoolExecutor
+        from .hostindex import HostIndex
+        from .parsecache import ParseCache
+
         try:
             if not self.ssh_config_file.exists():
                 self.print_status(f"SSH config file not found: {self.ssh_config_file}", False, 2)
                 return False
-
-            # Read current config
-            current_config = self.ssh_config_file.read_text()
-
-            # Normalize prefix (cloudX/cloudx) to match the command being used
-            # This allows users to convert between naming conventions
-            current_config = self._normalize_prefix(current_config)
+            if self.proxy_command == 'launcher' and not launcher.installed():
+                self.print_status("The launcher is not installed; run install-launcher first", False, 2)
+                return False
 
             # For dry-run, show what would be cleaned up
             if self.dry_run:
+                if self.proxy_command:
+                    self.print_status(f"[DRY RUN] Would run ProxyCommands with {self.proxy_command}", None, 2)
+                if self.layout:
+                    self.print_status(f"[DRY RUN] Would write the {self.layout} layout", None, 2)
+                # Count environments and hosts from the host index (prefix matching ignores cloudX/cloudx)
+                self.print_status("Reading host index...", None, 2)
+                with HostIndex() as index:
+                    hosts = index.hosts(self.ssh_config_file, self.ssh_host_prefix, self.profile)
+                    environments = {name.lower() for name in index.environments(self.ssh_config_file, self.ssh_host_prefix)}
+                    env_pattern = re.compile(rf'{re.escape(self.ssh_host_prefix)}-(\w+)-\*$', re.IGNORECASE)
+                    for name in index.patterns(self.ssh_config_file, self.ssh_host_prefix):
+                        match = env_pattern.match(name)
+                        if match:
+                            environments.add(match.group(1).lower())
+
+                self.print_status(f"[DRY RUN] Would reorganize {len(environments)} environments", None, 2)
+                self.print_status(f"[DRY RUN] Would reorganize {len(hosts)} host entries", None, 2)
+                return True
+
+            # The root config's lock guards the layout: environment files only change while it is held
+            with configfile.lock(self.ssh_config_file):
+                root_config = configfile.read(self.ssh_config_file)
+                sharded = self._is_sharded(root_config)
+                shards = configfile.included_files([str(self._shard_dir() / "*.conf")]) if sharded else []
+                to_sharded = sharded if self.layout is None else self.layout == 'sharded'
+
+                # Parse existing config (root and environment files together, dropping duplicates),
+                # reusing the result of an earlier run if none of the files changed since.
+                # Normalize prefix (cloudX/cloudx) to match the command being used
+                # This allows users to convert between naming conventions
                 self.print_status("Parsing SSH config...", None, 2)
-                parsed = self._parse_ssh_config(current_config)
+                parsed = ParseCache(self.ssh_config_file).get(
+                    [self.ssh_config_file] + shards, f"cleanup:{self.ssh_host_prefix}",
+                    lambda content: self._parse_ssh_config(self._normalize_prefix(content)))
 
-                # Count environments and hosts
-                total_hosts = sum(
-                    len([line for line in env_data['lines'] if line.startswith('Host ') and '*' not in line])
-                    for env_data in parsed['environments'].values()
-                )
+                # Optimize ProxyCommand in environment patterns to remove redundant flags
+                for env_name in parsed['environments'].keys():
+                    # Get existing environment lines
+                    env_lines = parsed['environments'][env_name]['lines']
 
-                self.print_status(f"[DRY RUN] Would reorganize {len(parsed['environments'])} environments", None, 2)
-                self.print_status(f"[DRY RUN] Would reorganize {total_hosts} host entries", None, 2)
-                return True
+                    # Find and rebuild the ProxyCommand line to remove unnecessary default flags
+                    new_lines = []
+                    for line in env_lines:
+                        # ProxyCommand none belongs to a host pointed at a tunnel
+                        if line.strip().startswith('ProxyCommand') and line.split()[-1].lower() != 'none':
+                            # Extract aws-env from the existing ProxyCommand if present
+                            aws_env = None
+                            if '--aws-env' in line:
+                                match = re.search(r'--aws-env\s+(\S+)', line)
+                                if match:
+                                    aws_env = match.group(1)
+
+                            # Temporarily set aws_env for ProxyCommand building
+                            original_aws_env = self.aws_env
+                            self.aws_env = aws_env
+                            optimized_command = self._build_proxy_command()
+                            self.aws_env = original_aws_env
+
+                            new_lines.append(f"    ProxyCommand {optimized_command}")
+                        else:
+                            new_lines.append(line)
 
-            # Parse existing config
-            self.print_status("Parsing SSH config...", None, 2)
-            parsed = self._parse_ssh_config(current_config)
-
-            # Optimize ProxyCommand in environment patterns to remove redundant flags
-            for env_name in parsed['environments'].keys():
-                # Get existing environment lines
-                env_lines = parsed['environments'][env_name]['lines']
-
-                # Find and rebuild the ProxyCommand line to remove unnecessary default flags
-                new_lines = []
-                for line in env_lines:
-                    if line.strip().startswith('ProxyCommand'):
-                        # Extract aws-env from the existing ProxyCommand if present
-                        aws_env = None
-                        if '--aws-env' in line:
-                            match = re.search(r'--aws-env\s+(\S+)', line)
-                            if match:
-                                aws_env = match.group(1)
-
-                        # Temporarily set aws_env for ProxyCommand building
-                        original_aws_env = self.aws_env
-                        self.aws_env = aws_env
-                        optimized_command = self._build_proxy_command()
-                        self.aws_env = original_aws_env
-
-                        new_lines.append(f"    ProxyCommand {optimized_command}")
-                    else:
-                        new_lines.append(line)
+                    parsed['environments'][env_name]['lines'] = new_lines
 
-                parsed['environments'][env_name]['lines'] = new_lines
+                global_config = '\n'.join(line for line in (parsed['global'] or self._build_generic_config()).split('\n')
+                                          if line.strip() != self._shard_include())
 
-            # Reorganize with proper structure
-            self.print_status("Reorganizing configuration...", None, 2)
-            organized_config = self._organize_ssh_config(
-                parsed['global'] or self._build_generic_config(),
-                parsed['environments']
-            )
+                # Reorganize with proper structure
+                written = set()
+                if to_sharded:
+                    self.print_status(f"Reorganizing {len(parsed['environments'])} environment files...", None, 2)
 
-            # Write completely rewritten config
-            self.ssh_config_file.write_text(organized_config)
+                    def write_shard(env_key):
+                        # Each file is written (and fsynced) only if it changed; files are independent
+                        content = self._organize_ssh_config(None, {env_key: parsed['environments'][env_key]})
+                        configfile.update(self._shard_file(env_key), lambda current: content)
+                        return self._shard_file(env_key)
 
-            # Set proper permissions on the config file
-            if platform.system() != 'Windows':
-                import stat
-                self.ssh_config_file.chmod(stat.S_IRUSR | stat.S_IWUSR)  # 600 permissions
+                    with ThreadPoolExecutor(max_workers=SHARD_WORKERS) as pool:
+                        written.update(pool.map(write_shard, sorted(parsed['environments'])))
+                    organized_config = self._sharded_root(global_config)
+                else:
+                    self.print_status("Reorganizing configuration...", None, 2)
+                    organized_config = self._organize_ssh_config(global_config, parsed['environments'])
+
+                # Write the root after the environment files it includes, then drop files it no longer reads
+                if organized_config != root_config:
+                    configfile.write_atomic(self.ssh_config_file, organized_config)
+                for shard in configfile.included_files([str(self._shard_dir() / "*.conf")]):
+                    if shard not in written:
+                        shard.unlink()
 
             self.print_status(f"Cleanup completed and config reorganized", True, 2)
             return True
@@ -1343,6 +1911,73 @@ class CloudXSetup:
             self.print_status(f"Error creating control directory: {str(e)}", False, 2)
             return False
     
+    def _ensure_system_config_include(self) -> Path:
+        """Make sure the system SSH config (~/.ssh/config) includes our config file.
+
+        Returns:
+            Path: The system SSH config file
+        """
+        # Handle system SSH config integration
+        system_config_path = Path(self.home_dir) / ".ssh" / "config"
+
+        # Ensure ~/.ssh directory has proper permissions
+        ssh_parent_dir = Path(self.home_dir) / ".ssh"
+        if not ssh_parent_dir.exists():
+            ssh_parent_dir.mkdir(parents=True, exist_ok=True)
+            self.print_status(f"Created SSH directory: {ssh_parent_dir}", True, 2)
+        self._set_directory_permissions(ssh_parent_dir)
+
+        # Handle system config integration
+        same_file = False
+        if self.ssh_config_file.exists() and system_config_path.exists():
+            try:
+                same_file = self.ssh_config_file.samefile(system_config_path)
+            except Exception:
+                same_file = str(self.ssh_config_file) == str(system_config_path)
+        else:
+            same_file = str(self.ssh_config_file) == str(system_config_path)
+
+        if same_file:
+            self.print_status("Using system SSH config directly, no Include needed", True, 2)
+        else:
+            # Otherwise, make sure the system config includes our config file
+            # Insert before any Host blocks to avoid the Include becoming part of a Host block
+            include_line = f"Include {self.ssh_config_file}"
+
+            def add_include(content):
+                # Check if Include already exists
+                if include_line in content:
+                    return content
+                if not content:
+                    return include_line + "\n"
+
+                # Find the first Host or Match block
+                blocks = SSHConfig.parse(content).blocks
+                if len(blocks) > 1:
+                    # Insert before the first Host/Match block, with a blank line after for readability
+                    insert_position = blocks[1].start
+                    return f"{content[:insert_position]}{include_line}\n\n{content[insert_position:]}"
+                # No Host blocks found, append at end with proper spacing
+                return content.rstrip() + "\n\n" + include_line + "\n"
+
+            existed = system_config_path.exists()
+            old_content, new_content = configfile.update(system_config_path, add_include)
+            if not existed:
+                self.print_status("Created system SSH config with include line", True, 2)
+            elif new_content != old_content:
+                self.print_status("Added include line to system SSH config", True, 2)
+            else:
+                self.print_status("System SSH config already includes our config", True, 2)
+
+            # Set correct permissions on system config file (rewritten files already have them)
+            if platform.system() != 'Windows':
+                if new_content == old_content:
+                    import stat
+                    system_config_path.chmod(stat.S_IRUSR | stat.S_IWUSR)  # 600 permissions
+                self.print_status("Set system config file permissions to 600", True, 2)
+
+        return system_config_path
+
     def setup_ssh_config(self, cloudx_env: str, instance_id: str, hostname: str) -> bool:
         """Set up SSH config for the instance using a three-tier configuration approach.
         
@@ -1385,111 +2020,45 @@ class CloudXSetup:
             if not self._ensure_control_dir():
                 return False
             
-            # Initialize or read current configuration
-            current_config = ""
-            if self.ssh_config_file.exists():
-                current_config = self.ssh_config_file.read_text()
-            
-            # 1. Check and create generic config (highest level)
-            self.print_status("Checking generic configuration...", None, 2)
-            success, current_config = self._check_and_create_generic_config(current_config)
-            if not success:
-                return False
-            
-            # 2. Check and create environment config
-            self.print_status("Checking environment configuration...", None, 2)
-            success, current_config = self._check_and_create_environment_config(cloudx_env, current_config)
-            if not success:
-                return False
-                
+            tiers_created = []
+
+            def add_tiers(current_config):
+                # 1. Check and create generic config (highest level)
+                self.print_status("Checking generic configuration...", None, 2)
+                success, new_config = self._check_and_create_generic_config(current_config)
+                if not success:
+                    return current_config
+
+                # 2. Check and create environment config
+                self.print_status("Checking environment configuration...", None, 2)
+                success, new_config = self._check_and_create_environment_config(cloudx_env, new_config)
+                if not success:
+                    return current_config
+
+                tiers_created.append(True)
+                if self.layout == 'sharded' and not current_config.strip():
+                    # New config in the sharded layout: the root only holds the global section
+                    return self._sharded_root(self._build_generic_config())
+                if self.layout and current_config.strip() and self._is_sharded(current_config) != (self.layout == 'sharded'):
+                    self.print_status(f"Keeping the layout of the existing config; "
+                                      f"run '{self.ssh_host_prefix}-proxy cleanup --layout {self.layout}' to convert it", None, 2)
+                return new_config
+
             # Write the updated config with generic and environment tiers
-            self.ssh_config_file.parent.mkdir(parents=True, exist_ok=True)
-            self.ssh_config_file.write_text(current_config)
-            self.print_status("Generic and environment configurations created", True, 2)
-            
-            # Set proper permissions on the config file
-            if platform.system() != 'Windows':
-                import stat
-                self.ssh_config_file.chmod(stat.S_IRUSR | stat.S_IWUSR)  # 600 permissions
-                self.print_status("Set config file permissions to 600", True, 2)
-            
+            old_config, new_config = self._update_ssh_config(add_tiers)
+            if not tiers_created:
+                return False
+            if new_config != old_config:
+                self.print_status("Generic and environment configurations created", True, 2)
+                if platform.system() != 'Windows':
+                    self.print_status("Set config file permissions to 600", True, 2)
+
             # 3. Add or update host entry (lowest level)
             self.print_status(f"Adding/updating host entry for {self.ssh_host_prefix}-{cloudx_env}-{hostname}", None, 2)
-            if not self._add_host_entry(cloudx_env, instance_id, hostname, current_config):
+            if not self._add_host_entry(cloudx_env, instance_id, hostname):
                 return False
             
-            # Handle system SSH config integration
-            system_config_path = Path(self.home_dir) / ".ssh" / "config"
-            
-            # Ensure ~/.ssh directory has proper permissions
-            ssh_parent_dir = Path(self.home_dir) / ".ssh"
-            if not ssh_parent_dir.exists():
-                ssh_parent_dir.mkdir(parents=True, exist_ok=True)
-                self.print_status(f"Created SSH directory: {ssh_parent_dir}", True, 2)
-            self._set_directory_permissions(ssh_parent_dir)
-            
-            # Handle system config integration
-            same_file = False
-            if self.ssh_config_file.exists() and system_config_path.exists():
-                try:
-                    same_file = self.ssh_config_file.samefile(system_config_path)
-                except Exception:
-                    same_file = str(self.ssh_config_file) == str(system_config_path)
-            else:
-                same_file = str(self.ssh_config_file) == str(system_config_path)
-                
-            if same_file:
-                self.print_status("Using system SSH config directly, no Include needed", True, 2)
-            else:
-                # Otherwise, make sure the system config includes our config file
-                # Insert before any Host blocks to avoid the Include becoming part of a Host block
-                include_line = f"Include {self.ssh_config_file}"
-
-                if system_config_path.exists():
-                    content = system_config_path.read_text()
-
-                    # Check if Include already exists
-                    if include_line in content:
-                        self.print_status("System SSH config already includes our config", True, 2)
-                    else:
-                        # Find the first Host or Match block
-                        lines = content.splitlines()
-                        insert_position = None
-
-                        for i, line in enumerate(lines):
-                            stripped = line.strip()
-                            if stripped.startswith('Host ') or stripped.startswith('Match '):
-                                # Found first Host or Match block, insert before it
-                                insert_position = i
-                                break
-
-                        if insert_position is not None:
-                            # Insert before the first Host/Match block
-                            lines.insert(insert_position, include_line)
-                            # Add a blank line after for readability
-                            lines.insert(insert_position + 1, "")
-                            new_content = "\n".join(lines)
-                        else:
-                            # No Host blocks found, append at end with proper spacing
-                            new_content = content.rstrip() + "\n\n" + include_line + "\n"
-
-                        system_config_path.write_text(new_content)
-                        self.print_status("Added include line to system SSH config", True, 2)
-
-                    # Set correct permissions on system config file
-                    if platform.system() != 'Windows':
-                        import stat
-                        system_config_path.chmod(stat.S_IRUSR | stat.S_IWUSR)  # 600 permissions
-                        self.print_status("Set system config file permissions to 600", True, 2)
-                else:
-                    system_config_path.write_text(include_line + "\n")
-                    self.print_status("Created system SSH config with include line", True, 2)
-
-                    # Set correct permissions on newly created system config file
-                    if platform.system() != 'Windows':
-                        import stat
-                        system_config_path.chmod(stat.S_IRUSR | stat.S_IWUSR)  # 600 permissions
-                        self.print_status("Set system config file permissions to 600", True, 2)
+            system_config_path = self._ensure_system_config_include()
 
             self.print_status("SSH configuration summary:", None)
             self.print_status(f"System config: {format_path(str(system_config_path))}", None, 2)
@@ -1507,6 +2076,96 @@ class CloudXSetup:
                 return True
             return False
 
+    def sync_ssh_config(self, hosts: List[Tuple[str, str, str]]) -> bool:
+        """Add or update host entries for many instances with a single config write.
+
+        Uses the same three-tier layout as setup_ssh_config(). All hosts are
+        edited in place in one pass over the config and written once; a config
+        that is not organized yet is parsed, merged and reorganized instead.
+
+        Args:
+            hosts: (environment, hostname, instance_id) tuples, e.g. from discover_instances()
+
+        Returns:
+            bool: True if config was set up successfully
+        """
+        self.print_header("SSH Configuration")
+
+        if self.dry_run:
+            for cloudx_env, hostname, instance_id in hosts:
+                self.print_status(f"[DRY RUN] Would add or update host entry: "
+                                  f"{self.ssh_host_prefix}-{cloudx_env}-{hostname} -> {instance_id}", None, 2)
+            self.print_status(f"[DRY RUN] Would write configuration to: {self.ssh_config_file}", None, 2)
+            return True
+
+        try:
+            # Ensure control directory exists with proper permissions
+            if not self._ensure_control_dir():
+                return False
+
+            totals = self._update_host_entries(hosts)
+            self.print_status(f"{totals['added']} added, {totals['updated']} updated, "
+                              f"{totals['unchanged']} unchanged in {format_path(str(self.ssh_config_file))}", True, 2)
+
+            self._ensure_system_config_include()
+            return True
+
+        except Exception as e:
+            self.print_status(f"\033[1;91mError:\033[0m {str(e)}", False, 2)
+            return False
+
+    def _drop_host_entries(self, hosts: List[Tuple[str, str]]) -> Optional[dict]:
+        """Remove host entries from our SSH config in place, with one locked write per file.
+
+        In the sharded layout only the files of the hosts' environments are
+        written. In dry run mode the counts are worked out but nothing is written.
+
+        Args:
+            hosts: (environment, hostname) tuples
+
+        Returns:
+            Optional[dict]: Number of hosts 'removed' and 'missing', or None if
+                a config is not in the organized layout (run cleanup first)
+        """
+        totals = {'removed': 0, 'missing': 0}
+        failed = []
+
+        def change(env_hosts, shard=False):
+            def remove(current_config):
+                if not current_config:
+                    totals['missing'] += len(env_hosts)
+                    return current_config
+                edited = self._remove_host_entries(current_config, env_hosts, shard)
+                if edited is None:
+                    failed.append(current_config)
+                    return current_config
+                for key, count in edited[1].items():
+                    totals[key] += count
+                return edited[0]
+            return remove
+
+        if self.dry_run:
+            for cloudx_env, hostname in hosts:
+                self.print_status(f"[DRY RUN] Would remove host entry: {self.ssh_host_prefix}-{cloudx_env}-{hostname}",
+                                  None, 2)
+
+        with configfile.lock(self.ssh_config_file):
+            root_config = configfile.read(self.ssh_config_file)
+            if self._is_sharded(root_config):
+                by_env = {}
+                for host in hosts:
+                    by_env.setdefault(host[0].lower(), []).append(host)
+                for env_key, env_hosts in sorted(by_env.items()):
+                    if self.dry_run:
+                        change(env_hosts, shard=True)(configfile.read(self._shard_file(env_key)))
+                    else:
+                        configfile.update(self._shard_file(env_key), change(env_hosts, shard=True))
+            else:
+                new_config = change(hosts)(root_config)
+                if new_config != root_config and not self.dry_run:
+                    configfile.write_atomic(self.ssh_config_file, new_config)
+        return None if failed else totals
+
     def check_instance_setup(self, instance_id: str, hostname: str, cloudx_env: str) -> bool:
         """Check if instance is accessible via SSH.
         
@@ -1658,58 +2317,65 @@ class CloudXSetup:
             config_file = target_dir / "config"
             if config_file.exists():
                 self.print_status(f"Updating paths in {config_file}...", None, 2)
-                config_content = config_file.read_text()
-                original_content = config_content
 
-                # Extract directory names
-                old_dir_name = vscode_dir.name
-                new_dir_name = target_dir.name
+                def update_paths(config_content):
+                    # Extract directory names
+                    old_dir_name = vscode_dir.name
+                    new_dir_name = target_dir.name
+
+                    # Replace absolute paths: /Users/.../.ssh/vscode/ -> /Users/.../.ssh/cloudX/
+                    expanded_vscode_path = str(vscode_dir)
+                    expanded_target_path = str(target_dir)
+                    config_content = config_content.replace(expanded_vscode_path + "/", expanded_target_path + "/")
 
-                # Replace absolute paths: /Users/.../.ssh/vscode/ -> /Users/.../.ssh/cloudX/
-                expanded_vscode_path = str(vscode_dir)
-                expanded_target_path = str(target_dir)
-                config_content = config_content.replace(expanded_vscode_path + "/", expanded_target_path + "/")
+                    # Replace tilde paths: ~/.ssh/vscode -> ~/.ssh/cloudX
+                    config_content = config_content.replace(f"~/.ssh/{old_dir_name}", f"~/.ssh/{new_dir_name}")
 
-                # Replace tilde paths: ~/.ssh/vscode -> ~/.ssh/cloudX
-                config_content = config_content.replace(f"~/.ssh/{old_dir_name}", f"~/.ssh/{new_dir_name}")
+                    # Replace SSH key file references: ~/.ssh/vscode/vscode -> ~/.ssh/cloudX/cloudX
+                    config_content = config_content.replace(f"~/.ssh/{old_dir_name}/{old_dir_name}", f"~/.ssh/{new_dir_name}/{new_dir_name}")
 
-                # Replace SSH key file references: ~/.ssh/vscode/vscode -> ~/.ssh/cloudX/cloudX
-                config_content = config_content.replace(f"~/.ssh/{old_dir_name}/{old_dir_name}", f"~/.ssh/{new_dir_name}/{new_dir_name}")
+                    # Replace SSH key parameter in ProxyCommand: --ssh-key vscode -> --ssh-key cloudX
+                    config_content = config_content.replace(f"--ssh-key {old_dir_name}", f"--ssh-key {new_dir_name}")
 
-                # Replace SSH key parameter in ProxyCommand: --ssh-key vscode -> --ssh-key cloudX
-                config_content = config_content.replace(f"--ssh-key {old_dir_name}", f"--ssh-key {new_dir_name}")
+                    # Replace SSH dir parameter in ProxyCommand: --ssh-dir ~/.ssh/vscode -> --ssh-dir ~/.ssh/cloudX
+                    config_content = config_content.replace(f"--ssh-dir {expanded_vscode_path}", f"--ssh-dir {expanded_target_path}")
 
-                # Replace SSH dir parameter in ProxyCommand: --ssh-dir ~/.ssh/vscode -> --ssh-dir ~/.ssh/cloudX
-                config_content = config_content.replace(f"--ssh-dir {expanded_vscode_path}", f"--ssh-dir {expanded_target_path}")
+                    return config_content
 
-                # Only write if content changed
-                if config_content != original_content:
-                    config_file.write_text(config_content)
-                    config_file.chmod(0o600)
+                # Only written if content changed; environment files of the sharded layout, too
+                changed = False
+                for path in [config_file] + configfile.included_files([str(target_dir / "config.d" / "*.conf")]):
+                    original_content, config_content = configfile.update(path, update_paths)
+                    changed = changed or config_content != original_content
+                if changed:
                     self.print_status("Updated config file paths", True, 2)
 
             # Update system SSH config
             system_config_path = Path(self.home_dir) / ".ssh" / "config"
             if system_config_path.exists():
-                content = system_config_path.read_text()
-
-                # Remove old include
-                lines = content.splitlines()
-                new_lines = []
                 include_removed = False
 
-                for line in lines:
-                    if "Include" in line and "vscode/config" in line:
-                        include_removed = True
-                        continue
-                    new_lines.append(line)
+                def update_include(content):
+                    nonlocal include_removed
+
+                    # Remove old include
+                    lines = content.splitlines()
+                    new_lines = []
+
+                    for line in lines:
+                        if "Include" in line and "vscode/config" in line:
+                            include_removed = True
+                            continue
+                        new_lines.append(line)
+
+                    # Add new include
+                    new_include = f"Include {target_dir}/config"
+                    if new_include not in content:
+                        new_lines.append(new_include)
 
-                # Add new include
-                new_include = f"Include {target_dir}/config"
-                if new_include not in content:
-                    new_lines.append(new_include)
+                    return "\n".join(new_lines) + "\n"
 
-                system_config_path.write_text("\n".join(new_lines) + "\n")
+                configfile.update(system_config_path, update_include)
 
                 if include_removed:
                     self.print_status("Updated ~/.ssh/config: Removed old Include, added new Include", True, 2)
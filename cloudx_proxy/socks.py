@@ -0,0 +1,252 @@
+"""SOCKS5 front-end over SSM port-forwarding sessions.
+
+Reaching a web server or database on (or behind) an instance with ssh -L or
+-D sends every byte through ssh's encryption inside the SSM session's. The
+SOCKS server of `cloudx-proxy socks` skips the ssh layer: each CONNECT is
+relayed through an SSM port-forwarding session to its destination, started
+on demand:
+
+- A destination on the instance itself (localhost) gets an
+  AWS-StartPortForwardingSession to the port, any other destination an
+  AWS-StartPortForwardingSessionToRemoteHost, resolved by the instance
+- Sessions are pooled per destination host and port: one tunnel.Tunnel,
+  whose session-manager-plugin carries all connections to the destination
+  over one data channel
+- A destination without connections for IDLE seconds has its session
+  stopped, and at most MAX_SESSIONS sessions run at once
+
+Only the CONNECT command without authentication is supported; the listener
+binds to 127.0.0.1 by default.
+"""
+
+import ipaddress
+import socket
+import struct
+import threading
+from typing import Callable, Optional, Tuple
+
+from .tunnel import BIND, LOCAL_HOSTS, Tunnel
+
+PORT = 1080
+
+# Seconds a destination's session stays up without connections
+IDLE = 300
+# Sessions running at once; a new destination stops the longest idle one
+MAX_SESSIONS = 16
+
+# Seconds between checks for idle sessions
+REAP_INTERVAL = 1.0
+# Seconds a client gets for its greeting and request
+HANDSHAKE_TIMEOUT = 10
+
+SOCKS_VERSION = 5
+NO_AUTHENTICATION = 0x00
+NO_ACCEPTABLE_METHODS = 0xFF
+CMD_CONNECT = 0x01
+ATYP_IPV4 = 0x01
+ATYP_DOMAIN = 0x03
+ATYP_IPV6 = 0x04
+
+# Reply codes
+SUCCEEDED = 0x00
+GENERAL_FAILURE = 0x01
+HOST_UNREACHABLE = 0x04
+COMMAND_NOT_SUPPORTED = 0x07
+ADDRESS_TYPE_NOT_SUPPORTED = 0x08
+
+
+class SocksError(Exception):
+    """Raised for a request the server cannot serve; carries the SOCKS reply code."""
+
+    def __init__(self, message: str, reply: int = GENERAL_FAILURE):
+        super().__init__(message)
+        self.reply = reply
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Client closed the connection during the SOCKS handshake")
+        data += chunk
+    return data
+
+
+def reply(code: int) -> bytes:
+    """Return a SOCKS5 reply with the given code and an unspecified bound address."""
+    return struct.pack('>BBBB4sH', SOCKS_VERSION, code, 0, ATYP_IPV4, b'\0' * 4, 0)
+
+
+def read_request(sock: socket.socket) -> Tuple[str, int]:
+    """Negotiate the method and read a CONNECT request.
+
+    Returns:
+        Tuple[str, int]: Destination host and port
+
+    Raises:
+        SocksError: If the request cannot be served (a reply has not been sent yet)
+        ConnectionError: If the client is not speaking SOCKS5 or went away
+    """
+    version, count = _recv_exact(sock, 2)
+    if version != SOCKS_VERSION:
+        raise ConnectionError(f"Not a SOCKS5 client (version {version})")
+    if NO_AUTHENTICATION not in _recv_exact(sock, count):
+        sock.sendall(bytes([SOCKS_VERSION, NO_ACCEPTABLE_METHODS]))
+        raise ConnectionError("Client does not offer SOCKS5 without authentication")
+    sock.sendall(bytes([SOCKS_VERSION, NO_AUTHENTICATION]))
+
+    version, command, _, address_type = _recv_exact(sock, 4)
+    if address_type == ATYP_IPV4:
+        host = str(ipaddress.IPv4Address(_recv_exact(sock, 4)))
+    elif address_type == ATYP_IPV6:
+        host = str(ipaddress.IPv6Address(_recv_exact(sock, 16)))
+    elif address_type == ATYP_DOMAIN:
+        host = _recv_exact(sock, _recv_exact(sock, 1)[0]).decode('idna')
+    else:
+        raise SocksError(f"Unsupported address type {address_type}", ADDRESS_TYPE_NOT_SUPPORTED)
+    port = struct.unpack('>H', _recv_exact(sock, 2))[0]
+    if command != CMD_CONNECT:
+        raise SocksError(f"Unsupported SOCKS command {command}", COMMAND_NOT_SUPPORTED)
+    return host, port
+
+
+class SocksServer:
+    """SOCKS5 listener with a pool of port-forwarding sessions per destination."""
+
+    def __init__(self, proxy, local_port: int = PORT, bind: str = BIND, idle: float = IDLE,
+                 max_sessions: int = MAX_SESSIONS, log: Callable[[str], None] = None, **tunnel_options):
+        """Initialize the server.
+
+        Args:
+            proxy: core.CloudXProxy of the instance the sessions go through
+            local_port: Port to listen on (default: 1080)
+            bind: Address to listen on (default: 127.0.0.1)
+            idle: Seconds a destination's session stays up without connections
+            max_sessions: Sessions running at once
+            log: Callable used for logging (default: proxy.log)
+            **tunnel_options: Passed on to tunnel.Tunnel (e.g. backoff_initial)
+        """
+        self.proxy = proxy
+        self.local_port = local_port
+        self.bind = bind
+        self.idle = idle
+        self.max_sessions = max_sessions
+        self.log = log or proxy.log
+        self.tunnel_options = tunnel_options
+        self._tunnels = {}       # (host, port) -> Tunnel
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._listener = None
+
+    @property
+    def destinations(self) -> list:
+        """The (host, port) destinations that have a session."""
+        with self._lock:
+            return sorted(self._tunnels)
+
+    def start(self) -> None:
+        """Listen for SOCKS clients in the background."""
+        self._listener = socket.create_server((self.bind, self.local_port))
+        self.local_port = self._listener.getsockname()[1]
+        self._listener.settimeout(0.5)
+        threading.Thread(target=self._accept, name="socks-accept", daemon=True).start()
+        threading.Thread(target=self._reap, name="socks-reap", daemon=True).start()
+        self.log(f"SOCKS5 proxy listening on {self.bind}:{self.local_port} through {self.proxy.instance_id}")
+
+    def serve(self) -> None:
+        """Start the server and run it until stop() (or KeyboardInterrupt)."""
+        self.start()
+        try:
+            while not self._stopped.wait(1):
+                pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop listening and end every session."""
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.close()
+        with self._lock:
+            tunnels, self._tunnels = list(self._tunnels.values()), {}
+        for tunnel in tunnels:
+            tunnel.stop()
+
+    def tunnel_for(self, host: str, port: int) -> Optional[Tunnel]:
+        """Return the running session of a destination, starting one if needed.
+
+        Returns:
+            Optional[Tunnel]: None if MAX_SESSIONS sessions are busy
+        """
+        local = host.lower() in LOCAL_HOSTS
+        key = ('localhost' if local else host.lower(), port)
+        retired = None
+        with self._lock:
+            tunnel = self._tunnels.get(key)
+            if tunnel is not None:
+                # Keep the reaper away until the connection is relayed
+                tunnel.touch()
+            else:
+                if len(self._tunnels) >= self.max_sessions:
+                    idle = [(candidate.idle_for, name) for name, candidate in self._tunnels.items()
+                            if candidate.idle_for > 0]
+                    if not idle:
+                        return None
+                    retired = self._tunnels.pop(max(idle)[1])
+                # Not ssh, so there is no key to push, for the session or its connections
+                tunnel = Tunnel(self.proxy, 0, port, log=self.log, remote_host=None if local else host,
+                                push_key=False, **self.tunnel_options)
+                self._tunnels[key] = tunnel
+                tunnel.start(listen=False)
+                self.log(f"Starting session to {key[0]}:{port}")
+        if retired is not None:
+            self.log(f"Stopping session to {retired.remote_host or 'localhost'}:{retired.remote_port} "
+                     f"for {key[0]}:{port}")
+            retired.stop()
+        return tunnel
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _reap(self) -> None:
+        """Stop the sessions of destinations that had no connections for self.idle seconds."""
+        while not self._stopped.wait(min(REAP_INTERVAL, self.idle or REAP_INTERVAL)):
+            with self._lock:
+                idle = [key for key, tunnel in self._tunnels.items() if tunnel.idle_for >= self.idle]
+                retired = [self._tunnels.pop(key) for key in idle]
+            for key, tunnel in zip(idle, retired):
+                self.log(f"Session to {key[0]}:{key[1]} idle for {self.idle:.0f}s, stopping it")
+                tunnel.stop()
+
+    def _handle(self, client: socket.socket) -> None:
+        """Serve one SOCKS client."""
+        try:
+            client.settimeout(HANDSHAKE_TIMEOUT)
+            host, port = read_request(client)
+            client.settimeout(None)
+            tunnel = self.tunnel_for(host, port)
+            if tunnel is None:
+                raise SocksError(f"All {self.max_sessions} sessions are busy, refusing {host}:{port}")
+        except SocksError as e:
+            self.log(str(e))
+            try:
+                client.sendall(reply(e.reply))
+            except OSError:
+                pass
+            client.close()
+            return
+        except (OSError, ValueError) as e:
+            self.log(f"SOCKS handshake failed: {e}")
+            client.close()
+            return
+
+        tunnel.relay(client, ready=lambda: client.sendall(reply(SUCCEEDED)),
+                     failed=lambda reason: client.sendall(reply(HOST_UNREACHABLE)))
@@ -0,0 +1,428 @@
+"""Lossless model of an OpenSSH client config file.
+
+SSHConfig.parse() splits a config into blocks: the preamble before the
+first Host/Match line, then one block per Host or Match line up to the
+next one. A block's lines (blank, comment, directive) are tokenized on
+first access, and so is the pattern index. Every line keeps its exact text, so
+str(SSHConfig.parse(text)) == text for any input, and editing a directive
+value only rewrites that line. Host patterns are indexed for dictionary
+lookups.
+
+Offsets are string indices into the parsed text, which equal byte offsets
+for ASCII configs.
+"""
+
+import functools
+import re
+from typing import Iterator, List, Optional, Tuple
+
+# A directive line: indentation, keyword, separator ('=' and/or blanks), value
+# up to an inline comment, the comment, newline. Matches any line whose first
+# non-blank character can start a keyword.
+_DIRECTIVE = re.compile(r"([ \t\r]*)([^\s=#]+)([ \t]*=[ \t]*|[ \t]+|)([^#\n]*)(#[^\n]*)?(\n?)")
+
+# Start of a Host or Match line; anchored on the newline so one scan over the
+# text only stops at line starts (the first line is checked separately)
+_HEADER = re.compile(r"\n[ \t\r]*(?:host|match)(?=[\s=#]|\Z)", re.IGNORECASE)
+_FIRST_HEADER = re.compile(r"[ \t\r]*(?:host|match)(?=[\s=#]|\Z)", re.IGNORECASE)
+# A Host line; group 1 is the patterns
+_HOST_LINE = re.compile(r"[ \t\r]*host(?:[ \t]*=[ \t]*|[ \t]+)([^#\n]*)", re.IGNORECASE)
+
+
+def _classify(text: str) -> str:
+    stripped = text.lstrip(' \t\r')
+    if not stripped or stripped == '\n':
+        return 'blank'
+    first = stripped[0]
+    if first == '#':
+        return 'comment'
+    if first == '=' or first.isspace():
+        return 'other'
+    return 'directive'
+
+
+def _split_lines(text: str, offset: int) -> List['Line']:
+    lines = []
+    pieces = text.split('\n')
+    last = len(pieces) - 1
+    for i, piece in enumerate(pieces):
+        if i < last:
+            piece += '\n'
+        elif not piece:
+            break
+        lines.append(Line(piece, offset))
+        offset += len(piece)
+    return lines
+
+
+class Line:
+    """One line of the config with its exact text.
+
+    kind is 'blank', 'comment', 'directive' or 'other' (text ssh would reject).
+    Directives are split on first use into indent, keyword, sep, value and
+    trailing (the whitespace and inline comment after the value), so that
+    indent + keyword + sep + value + trailing + eol == text.
+    """
+
+    __slots__ = ('kind', 'text', 'offset', '_fields')
+
+    def __init__(self, text: str, offset: int = 0, kind: str = None, fields: tuple = None):
+        self.text = text
+        self.offset = offset
+        self.kind = kind or _classify(text)
+        self._fields = fields
+
+    @classmethod
+    def directive(cls, keyword: str, value: str, indent: str = '    ', comment: str = None) -> 'Line':
+        """Build a new directive line, e.g. Line.directive('HostName', 'i-0123...')."""
+        trailing = f" # {comment}" if comment else ''
+        return cls(f"{indent}{keyword} {value}{trailing}\n", kind='directive',
+                   fields=(indent, keyword, ' ', value, trailing, '\n'))
+
+    def _split(self) -> tuple:
+        if self._fields is None:
+            if self.kind == 'directive':
+                indent, keyword, sep, value, comment, eol = _DIRECTIVE.match(self.text).groups()
+                stripped = value.rstrip(' \t\r')
+                trailing = value[len(stripped):] + (comment or '')
+                self._fields = (indent, keyword, sep, stripped, trailing, eol)
+            else:
+                eol = '\n' if self.text.endswith('\n') else ''
+                self._fields = ('', '', '', '', '', eol)
+        return self._fields
+
+    @property
+    def indent(self) -> str:
+        return self._split()[0]
+
+    @property
+    def keyword(self) -> str:
+        """Directive keyword as written, e.g. 'HostName' ('' for other lines)."""
+        return self._split()[1]
+
+    @property
+    def key(self) -> str:
+        """Lowercase keyword, for case-insensitive comparison."""
+        return self._split()[1].lower()
+
+    @property
+    def sep(self) -> str:
+        return self._split()[2]
+
+    @property
+    def value(self) -> str:
+        """Directive value without trailing blanks and inline comment."""
+        return self._split()[3]
+
+    @property
+    def trailing(self) -> str:
+        return self._split()[4]
+
+    @property
+    def eol(self) -> str:
+        return self._split()[5]
+
+    @property
+    def raw(self) -> str:
+        """Text without the newline."""
+        return self.text[:-1] if self.text.endswith('\n') else self.text
+
+    @property
+    def code(self) -> str:
+        """Text without the newline and without an inline comment."""
+        indent, keyword, sep, value, trailing, eol = self._split()
+        if self.kind == 'directive' and '#' in trailing:
+            return indent + keyword + sep + value
+        return self.raw
+
+    @property
+    def comment(self) -> Optional[str]:
+        """Inline comment of a directive (without '#'), or None."""
+        trailing = self.trailing
+        if '#' in trailing:
+            return trailing.split('#', 1)[1].strip()
+        return None
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(self.text)
+
+    def set_value(self, value: str) -> None:
+        """Replace the value of a directive, keeping indentation and inline comment."""
+        indent, keyword, sep, _, trailing, eol = self._split()
+        self._fields = (indent, keyword, sep, value, trailing, eol)
+        self.text = indent + keyword + sep + value + trailing + eol
+
+    def __repr__(self) -> str:
+        return f"Line({self.kind!r}, {self.text!r})"
+
+
+class Block:
+    """A Host or Match line with the lines up to the next one (header None for the preamble)."""
+
+    __slots__ = ('header', 'offset', '_lines', '_text')
+
+    def __init__(self, header: Optional[Line], lines: List[Line] = None, offset: int = 0):
+        """Initialize a block.
+
+        Args:
+            header: Host or Match line (None for the preamble)
+            lines: All lines of the block, starting with header (default: just the header)
+            offset: Position of the block in the parsed text
+        """
+        self.header = header
+        self.offset = offset
+        self._lines = lines if lines is not None else ([header] if header else [])
+        self._text = None
+
+    @classmethod
+    def _from_text(cls, header: Optional[Line], text: str, offset: int) -> 'Block':
+        block = cls(header, offset=offset)
+        block._lines = None
+        block._text = text
+        return block
+
+    @property
+    def lines(self) -> List[Line]:
+        """All lines of the block, header included (tokenized on first access)."""
+        if self._lines is None:
+            if self.header:
+                rest = self._text[len(self.header.text):]
+                self._lines = [self.header] + _split_lines(rest, self.offset + len(self.header.text))
+            else:
+                self._lines = _split_lines(self._text, self.offset)
+            self._text = None
+        return self._lines
+
+    @property
+    def keyword(self) -> Optional[str]:
+        """'host', 'match' or None for the preamble."""
+        return self.header.key if self.header else None
+
+    @property
+    def patterns(self) -> List[str]:
+        """Patterns of a Host line (or criteria of a Match line)."""
+        return self.header.value.split() if self.header else []
+
+    @property
+    def name(self) -> str:
+        """The Host line value without inline comment, e.g. 'cloudx-dev-*'."""
+        return self.header.value if self.header else ''
+
+    @property
+    def comment(self) -> Optional[str]:
+        """Inline comment of the Host line, or None."""
+        return self.header.comment if self.header else None
+
+    @property
+    def body(self) -> List[Line]:
+        """Lines after the header."""
+        return self.lines[1:] if self.header else self.lines
+
+    @property
+    def start(self) -> int:
+        return self.offset
+
+    @property
+    def end(self) -> int:
+        return self.offset + len(str(self))
+
+    @property
+    def content_end(self) -> int:
+        """End of the last directive and the blank lines after it.
+
+        Comment lines after that are left to whatever follows, e.g. the
+        banner of the next section.
+        """
+        end = self.offset
+        blanks = True
+        for line in self.lines:
+            if line.kind == 'comment':
+                blanks = False
+            elif line.kind != 'blank':
+                end, blanks = line.end, True
+            elif blanks:
+                end = line.end
+        return end
+
+    def get(self, key: str, default: str = None) -> Optional[str]:
+        """Value of the first directive named key (case-insensitive) in the body."""
+        key = key.lower()
+        for line in self.body:
+            if line.kind == 'directive' and line.key == key:
+                return line.value
+        return default
+
+    def directives(self) -> Iterator[Line]:
+        """Directive lines of the body."""
+        return (line for line in self.body if line.kind == 'directive')
+
+    def __str__(self) -> str:
+        if self._text is not None:
+            return self._text
+        return ''.join(line.text for line in self._lines)
+
+    def __repr__(self) -> str:
+        return f"Block({self.name!r})"
+
+
+class SSHConfig:
+    """Parsed SSH config: blocks in file order and an index of Host patterns."""
+
+    def __init__(self, blocks: List[Block]):
+        self.blocks = blocks
+        self._index = None
+
+    @classmethod
+    def parse(cls, text: str) -> 'SSHConfig':
+        """Parse config text.
+
+        Host and Match lines are found in one regex scan over the text; the
+        lines in between are tokenized when a block is first inspected.
+
+        Args:
+            text: SSH config content
+
+        Returns:
+            SSHConfig: Model whose str() is exactly text
+        """
+        starts = [m.start() + 1 for m in _HEADER.finditer(text)]
+        if _FIRST_HEADER.match(text):
+            starts.insert(0, 0)
+        blocks = [Block._from_text(None, text[:starts[0]] if starts else text, 0)]
+        starts.append(len(text))
+        for start, end in zip(starts, starts[1:]):
+            newline = text.find('\n', start, end)
+            header_end = newline + 1 if newline >= 0 else end
+            header = Line(text[start:header_end], start, 'directive')
+            blocks.append(Block._from_text(header, text[start:end], start))
+        return cls(blocks)
+
+    @property
+    def index(self) -> dict:
+        """Host pattern -> first Host block with that pattern (as ssh matches), built on first use."""
+        if self._index is None:
+            index = {}
+            for block in self.blocks:
+                if block.header and block.header.key == 'host':
+                    for pattern in block.patterns:
+                        if pattern not in index:
+                            index[pattern] = block
+            self._index = index
+        return self._index
+
+    def reindex(self) -> None:
+        """Drop the pattern index after blocks were added, removed or renamed."""
+        self._index = None
+
+    @property
+    def preamble(self) -> Block:
+        """Lines before the first Host or Match line."""
+        return self.blocks[0]
+
+    def hosts(self) -> Iterator[Block]:
+        """Host blocks in file order."""
+        return (block for block in self.blocks if block.keyword == 'host')
+
+    def lines(self) -> Iterator[Line]:
+        """All lines in file order."""
+        for block in self.blocks:
+            yield from block.lines
+
+    def get(self, pattern: str) -> Optional[Block]:
+        """Host block for a pattern (exact match), or None."""
+        return self.index.get(pattern)
+
+    def __contains__(self, pattern: str) -> bool:
+        return pattern in self.index
+
+    def __str__(self) -> str:
+        return ''.join(str(block) for block in self.blocks)
+
+
+# In-place edits. These work on the config text directly and only look at the
+# lines around the edit, so their cost does not grow with the number of hosts
+# (beyond a regex scan); SSHConfig.parse() is for reading the whole file.
+
+def next_header(text: str, pos: int, end: int = None) -> int:
+    """Offset of the first Host or Match line starting at or after pos (end if none)."""
+    end = len(text) if end is None else end
+    if pos == 0 and _FIRST_HEADER.match(text):
+        return 0
+    match = _HEADER.search(text, max(pos - 1, 0))
+    return min(match.start() + 1, end) if match else end
+
+
+def block_at(text: str, start: int) -> Block:
+    """The block whose Host or Match line starts at offset start."""
+    newline = text.find('\n', start)
+    header_end = newline + 1 if newline >= 0 else len(text)
+    header = Line(text[start:header_end], start, 'directive')
+    return Block._from_text(header, text[start:next_header(text, header_end)], start)
+
+
+def block_before(text: str, pos: int) -> Block:
+    """The block containing offset pos - 1 (the preamble if pos is before the first Host/Match line)."""
+    line_start = text.rfind('\n', 0, max(pos - 1, 0)) + 1
+    while not _FIRST_HEADER.match(text, line_start):
+        if line_start == 0:
+            return Block._from_text(None, text[:next_header(text, 0)], 0)
+        line_start = text.rfind('\n', 0, line_start - 1) + 1
+    return block_at(text, line_start)
+
+
+@functools.lru_cache(maxsize=4)
+def _lowered(text: str) -> str:
+    # Several lookups in a row on the same text lowercase it once
+    return text.lower()
+
+
+def find_hosts(text: str, regex: str) -> Iterator[Tuple[Block, str]]:
+    """Host blocks with a pattern matching regex, in file order.
+
+    Patterns are compared case-insensitively, as ssh does: regex is matched
+    against the lowercased text, so its literal characters must be
+    lowercase. The text is scanned for regex itself, which is fast when it
+    starts with literal text, and only lines where it occurs are checked for
+    being Host lines.
+
+    Args:
+        text: SSH config content
+        regex: Regular expression for a whole pattern, e.g. 'cloudx-(\\w+)-\\*'
+
+    Returns:
+        Iterator[Tuple[Block, str]]: (block, pattern as written) pairs
+    """
+    lowered = _lowered(text)
+    if len(lowered) == len(text):
+        candidates = re.compile(rf"(?:{regex})(?=[\s#]|\Z)").finditer(lowered)
+    else:
+        # lower() changed the length of some character, so offsets would not line up
+        candidates = re.compile(rf"(?:{regex})(?=[\s#]|\Z)", re.IGNORECASE).finditer(text)
+    for match in candidates:
+        start, end = match.span()
+        line_start = text.rfind('\n', 0, start) + 1
+        header = _HOST_LINE.match(text, line_start)
+        if header and header.start(1) <= start and end <= header.end(1) and (
+                start == header.start(1) or text[start - 1] in ' \t'):
+            yield block_at(text, line_start), text[start:end]
+
+
+def find_host(text: str, pattern: str) -> Optional[Block]:
+    """First Host block listing pattern (compared case-insensitively, as ssh does), or None."""
+    for block, _ in find_hosts(text, re.escape(pattern.lower())):
+        return block
+    return None
+
+
+def apply_edits(text: str, edits: List[Tuple[int, int, str]]) -> str:
+    """Replace non-overlapping (start, end, replacement) ranges of text in one pass."""
+    pieces = []
+    pos = 0
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[:2]):
+        if start < pos:
+            raise ValueError(f"Overlapping edit at offset {start}")
+        pieces += [text[pos:start], replacement]
+        pos = end
+    pieces.append(text[pos:])
+    return ''.join(pieces)
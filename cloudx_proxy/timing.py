@@ -0,0 +1,266 @@
+"""Opt-in timing spans for the connect workflow.
+
+When enabled (``connect --timing`` or $CLOUDX_PROXY_TIMING), every connect
+phase and every AWS API call is recorded as one JSON object per line, either
+appended to a file or logged to stderr. ``cloudx-proxy stats`` summarises such
+a file into p50/p95/p99 per phase and per host.
+
+Record fields:
+- ts: Unix timestamp at the end of the span
+- run: Random id shared by all records of one connect
+- host: Instance ID being connected to
+- kind: 'phase' for workflow steps, 'api' for AWS calls, 'event' for counters
+- name: Phase name (e.g. 'wait_for_instance') or API call ('ssm.DescribeInstanceInformation')
+- duration_ms: Span duration in milliseconds
+- ok: False if the span raised or the API call failed
+- attempts: Number of HTTP attempts for API calls (1 + retries)
+"""
+
+import json
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+TIMING_ENV = "CLOUDX_PROXY_TIMING"
+
+# Destination value that sends records to stderr instead of a file
+STDERR = "stderr"
+
+_active = threading.local()
+
+
+def default_timing_file() -> Path:
+    """Return the default timing file (~/.ssh/control/cloudx-proxy-timing.jsonl)."""
+    return Path.home() / ".ssh" / "control" / "cloudx-proxy-timing.jsonl"
+
+
+class Timing:
+    """Collects timing spans for one connect and writes them as JSON lines."""
+
+    def __init__(self, destination: str = None, log: Callable[[str], None] = None, host: str = None):
+        """Initialize timing.
+
+        Args:
+            destination: File path, 'stderr', or None to disable timing
+            log: Callable used for stderr output (default: print to stderr)
+            host: Instance ID recorded with every span
+        """
+        self.destination = destination
+        self.enabled = bool(destination)
+        self.log = log or (lambda message: print(message, file=sys.stderr))
+        self.host = host
+        self.run = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_option(cls, option: str = None, log: Callable[[str], None] = None, host: str = None) -> 'Timing':
+        """Build timing from a --timing value, falling back to $CLOUDX_PROXY_TIMING.
+
+        The values '1', 'true' and 'file' select the default timing file.
+        """
+        destination = option or os.environ.get(TIMING_ENV)
+        if destination and destination.lower() in ('1', 'true', 'yes', 'file'):
+            destination = str(default_timing_file())
+        elif destination and destination != STDERR:
+            destination = os.path.expanduser(destination)
+        return cls(destination, log, host)
+
+    def _write(self, record: dict) -> None:
+        line = json.dumps(record, separators=(',', ':'))
+        if self.destination == STDERR:
+            self.log(f"[timing] {line}")
+            return
+        try:
+            path = Path(self.destination)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # One append per record keeps lines from concurrent connects intact
+            with self._lock, open(path, 'a') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            self.log(f"Error writing timing record: {e}")
+            self.enabled = False
+
+    def record(self, kind: str, name: str, duration: float = None, ok: bool = True, **attrs) -> None:
+        """Write a single record.
+
+        Args:
+            kind: 'phase', 'api' or 'event'
+            name: Phase, API call or event name
+            duration: Duration in seconds (omitted for plain events)
+            ok: Whether the span succeeded
+            **attrs: Extra fields to include
+        """
+        if not self.enabled:
+            return
+        record = {'ts': round(time.time(), 3), 'run': self.run, 'host': self.host, 'kind': kind, 'name': name}
+        if duration is not None:
+            record['duration_ms'] = round(duration * 1000, 3)
+        record['ok'] = ok
+        record.update(attrs)
+        self._write(record)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time a connect phase.
+
+        Yields a dict the caller may add fields to; they are written with the
+        span. Setting 'ok' to False marks the span as failed without raising.
+        """
+        extra = dict(attrs)
+        start = time.perf_counter()
+        ok = True
+        try:
+            yield extra
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            if extra.get('ok') is False:
+                ok = False
+            fields = {key: value for key, value in extra.items() if key != 'ok'}
+            self.record('phase', name, time.perf_counter() - start, ok, **fields)
+
+    def mark(self, name: str, **attrs) -> None:
+        """Record the time elapsed since this Timing was created."""
+        self.record('phase', name, time.perf_counter() - self.started, **attrs)
+
+    def event(self, name: str, **attrs) -> None:
+        """Record a counter-style event without a duration."""
+        self.record('event', name, **attrs)
+
+    @contextmanager
+    def activate(self):
+        """Make this the timing that instrumented AWS clients report to on this thread."""
+        previous = getattr(_active, 'timing', None)
+        _active.timing = self
+        try:
+            yield self
+        finally:
+            _active.timing = previous
+
+
+def current() -> Optional[Timing]:
+    """Return the timing active on this thread, if any."""
+    return getattr(_active, 'timing', None)
+
+
+def _api_before_call(model=None, context=None, **kwargs) -> None:
+    if context is not None and current() is not None:
+        context['cloudx_timing'] = (f"{model.service_model.endpoint_prefix}.{model.name}", time.perf_counter())
+
+
+def _api_after_call(http_response=None, parsed=None, context=None, **kwargs) -> None:
+    timing = current()
+    started = (context or {}).pop('cloudx_timing', None)
+    if timing is None or started is None:
+        return
+    name, start = started
+    metadata = (parsed or {}).get('ResponseMetadata', {})
+    status = metadata.get('HTTPStatusCode') or getattr(http_response, 'status_code', None)
+    attrs = {'attempts': metadata.get('RetryAttempts', 0) + 1}
+    if status:
+        attrs['status'] = status
+    error = (parsed or {}).get('Error', {}).get('Code')
+    if error:
+        attrs['error'] = error
+    timing.record('api', name, time.perf_counter() - start, ok=not error and (status or 200) < 300, **attrs)
+
+
+def _api_after_call_error(exception=None, context=None, **kwargs) -> None:
+    timing = current()
+    started = (context or {}).pop('cloudx_timing', None)
+    if timing is None or started is None:
+        return
+    name, start = started
+    timing.record('api', name, time.perf_counter() - start, ok=False, error=type(exception).__name__)
+
+
+def instrument_client(client) -> None:
+    """Report every API call (including retries) of a boto3 client to the active timing.
+
+    Safe to call more than once; clients shared between threads (such as the
+    agent's warm clients) report to whichever timing is active on the calling
+    thread.
+    """
+    meta = getattr(client, 'meta', None)
+    if meta is None or getattr(meta, 'cloudx_timing', False):
+        return
+    # First, so stubbed or cached responses returned by other before-call handlers are still timed
+    meta.events.register_first('before-call.*.*', _api_before_call)
+    meta.events.register('after-call', _api_after_call)
+    meta.events.register('after-call-error', _api_after_call_error)
+    meta.cloudx_timing = True
+
+
+def load_records(path: Path) -> Iterable[dict]:
+    """Yield records from a timing file, skipping malformed lines."""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(records: Iterable[dict], by_host: bool = False) -> Dict[tuple, dict]:
+    """Summarise span durations.
+
+    Args:
+        records: Timing records
+        by_host: Group by (host, kind, name) instead of (kind, name)
+
+    Returns:
+        Dict[tuple, dict]: group key -> {count, failed, p50, p95, p99, max} in milliseconds
+    """
+    groups: Dict[tuple, List[float]] = {}
+    failures: Dict[tuple, int] = {}
+    for record in records:
+        if 'duration_ms' not in record:
+            continue
+        key = (record['kind'], record['name'])
+        if by_host:
+            key = (record.get('host') or '-',) + key
+        groups.setdefault(key, []).append(record['duration_ms'])
+        if record.get('ok') is False:
+            failures[key] = failures.get(key, 0) + 1
+
+    summary = {}
+    for key, values in groups.items():
+        values.sort()
+        summary[key] = {
+            'count': len(values),
+            'failed': failures.get(key, 0),
+            'p50': percentile(values, 50),
+            'p95': percentile(values, 95),
+            'p99': percentile(values, 99),
+            'max': values[-1],
+        }
+    return summary
+
+
+def count_events(records: Iterable[dict]) -> Dict[tuple, int]:
+    """Count event records by (name, result), e.g. cache hits and misses."""
+    counts: Dict[tuple, int] = {}
+    for record in records:
+        if record.get('kind') == 'event':
+            key = (record['name'], record.get('result', '-'))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
@@ -0,0 +1,393 @@
+"""Local port-forward tunnel that shares one SSM session across connections.
+
+Every ssh connection without a live ControlMaster (which the default
+Windows client lacks) runs its own ProxyCommand and pays for a full
+AWS-StartSSHSession. `cloudx-proxy tunnel` keeps one
+AWS-StartPortForwardingSession instead, whose session-manager-plugin
+forwards a loopback port to the instance, and listens on the local port ssh
+connects to (HostName localhost, Port N; see tunnel_host_config()).
+
+The tunnel owns the listening socket rather than handing it to the plugin:
+EC2 Instance Connect keys only stay valid for 60 seconds, so each accepted
+connection pushes the key (reusing recent pushes) before it is relayed to
+the plugin's port. The session is started when the tunnel starts and again
+on demand; when it ends while connections are waiting it is restarted with
+exponential backoff. An instance that stopped itself is not started again
+until a connection arrives.
+"""
+
+import os
+import platform
+import socket
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+
+BIND = '127.0.0.1'
+CHUNK = 64 * 1024
+
+# Seconds the session-manager-plugin gets to open its port
+READY_TIMEOUT = 60
+# Seconds a connection waits for the session (which may have to wake the instance)
+CONNECTION_WAIT = 600
+
+# Reconnect backoff: doubles from BACKOFF_INITIAL up to BACKOFF_MAX seconds;
+# a session that lasted STABLE seconds resets it
+BACKOFF_INITIAL = 1.0
+BACKOFF_MAX = 60.0
+STABLE = 60
+
+# Seconds between attempts to reach a session that is going away
+RETRY_INTERVAL = 0.1
+
+# Printed by the session-manager-plugin once its port accepts connections
+READY_LINE = "Waiting for connections"
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def port_forward_command(instance_id: str, remote_port: int, local_port: int, profile: str, region: str,
+                         remote_host: str = None) -> List[str]:
+    """Return the `aws ssm start-session` command forwarding local_port to remote_port.
+
+    Without remote_host the port is on the instance itself; with it the
+    instance forwards to remote_host (AWS-StartPortForwardingSessionToRemoteHost).
+    """
+    aws_cmd = 'aws.exe' if platform.system() == 'Windows' else 'aws'
+    if remote_host:
+        document = 'AWS-StartPortForwardingSessionToRemoteHost'
+        parameters = f'host={remote_host},portNumber={remote_port},localPortNumber={local_port}'
+    else:
+        document = 'AWS-StartPortForwardingSession'
+        parameters = f'portNumber={remote_port},localPortNumber={local_port}'
+    return [
+        aws_cmd, 'ssm', 'start-session',
+        '--target', instance_id,
+        '--document-name', document,
+        '--parameters', parameters,
+        '--profile', profile,
+        '--region', region
+    ]
+
+
+def free_port(bind: str = BIND) -> int:
+    """Return a loopback port that is free right now."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind((bind, 0))
+        return probe.getsockname()[1]
+
+
+def tunnel_host_config(host: str, instance_id: str, port: int) -> str:
+    """Build the Host block that points ssh at a tunnel instead of the ProxyCommand.
+
+    HostKeyAlias keeps the instance's known_hosts entry (and tells
+    tunneled_instance() which instance the host is), and ProxyCommand none
+    overrides the environment's ProxyCommand; the block must come before the
+    <prefix>-<env>-* block, as ssh uses the first value it finds.
+    """
+    return f"""Host {host}
+    HostName localhost
+    Port {port}
+    HostKeyAlias {instance_id}
+    ProxyCommand none
+"""
+
+
+def tunneled_instance(block) -> Optional[str]:
+    """Return the instance ID of a Host block pointed at a tunnel, or None for a ProxyCommand host.
+
+    Args:
+        block: sshconfig.Block of the host
+    """
+    if (block.get('ProxyCommand', '').lower() == 'none'
+            and block.get('HostName', '').lower() in LOCAL_HOSTS):
+        return block.get('HostKeyAlias')
+    return None
+
+
+def _pump(src: socket.socket, dst: socket.socket) -> None:
+    """Copy src to dst until EOF, then half-close dst."""
+    try:
+        while True:
+            data = src.recv(CHUNK)
+            if not data:
+                break
+            dst.sendall(data)
+    except OSError:
+        pass
+    finally:
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+
+class Tunnel:
+    """One port-forwarding session shared by all connections to a local port."""
+
+    def __init__(self, proxy, local_port: int, remote_port: int = 22, bind: str = BIND,
+                 log: Callable[[str], None] = None, backoff_initial: float = BACKOFF_INITIAL,
+                 backoff_max: float = BACKOFF_MAX, connection_wait: float = CONNECTION_WAIT,
+                 remote_host: str = None, push_key: bool = True):
+        """Initialize the tunnel.
+
+        Args:
+            proxy: core.CloudXProxy of the instance; wakes it and pushes the key
+            local_port: Port ssh connects to
+            remote_port: Port on the instance (default: 22)
+            bind: Address to listen on (default: 127.0.0.1)
+            log: Callable used for logging (default: proxy.log)
+            backoff_initial: Seconds before the first reconnect attempt
+            backoff_max: Longest wait between reconnect attempts
+            connection_wait: Seconds a connection waits for the session
+            remote_host: Host the instance forwards to instead of itself (e.g. a database)
+            push_key: Push the SSH key when a session starts and for each connection;
+                without it sessions only wake the instance (for other protocols than ssh)
+        """
+        self.proxy = proxy
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.remote_host = remote_host
+        self.push_key = push_key
+        self.bind = bind
+        self.log = log or proxy.log
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.connection_wait = connection_wait
+        self.sessions = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._demand = threading.Event()
+        self._ready = threading.Event()
+        self._session_port = None
+        self._process = None
+        self._connections = 0
+        self._last_activity = time.monotonic()
+        self._listener = None
+
+    @property
+    def session_port(self) -> Optional[int]:
+        """Loopback port of the running session, None while there is none."""
+        return self._session_port if self._ready.is_set() else None
+
+    @property
+    def idle_for(self) -> float:
+        """Seconds since the last connection ended, 0 while there are connections."""
+        with self._lock:
+            return 0.0 if self._connections else time.monotonic() - self._last_activity
+
+    def touch(self) -> None:
+        """Count as active now, e.g. while a connection is about to be relayed."""
+        with self._lock:
+            self._last_activity = time.monotonic()
+
+    def backoff(self, failures: int) -> float:
+        """Seconds to wait before reconnecting after failures sessions in a row failed."""
+        return min(self.backoff_max, self.backoff_initial * 2 ** (failures - 1)) if failures else 0.0
+
+    def start(self, listen: bool = True) -> None:
+        """Listen on the local port and start the session in the background.
+
+        Args:
+            listen: Accept connections on local_port; without it connections
+                are handed to relay() by the caller (see mux.MuxServer)
+        """
+        self._demand.set()
+        threading.Thread(target=self._supervise, daemon=True).start()
+        if not listen:
+            return
+        self._listener = socket.create_server((self.bind, self.local_port))
+        self.local_port = self._listener.getsockname()[1]
+        self._listener.settimeout(0.5)
+        threading.Thread(target=self._accept, daemon=True).start()
+        self.log(f"Tunnel listening on {self.bind}:{self.local_port} for {self.proxy.instance_id}:{self.remote_port}")
+
+    def serve(self) -> None:
+        """Start the tunnel and run it until stop() (or KeyboardInterrupt)."""
+        self.start()
+        try:
+            while not self._stopped.wait(1):
+                pass
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """Stop listening and end the session."""
+        self._stopped.set()
+        self._demand.set()
+        if self._listener is not None:
+            self._listener.close()
+        with self._lock:
+            process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def _accept(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            client.settimeout(None)
+            threading.Thread(target=self._handle, args=(client,), daemon=True).start()
+
+    def _supervise(self) -> None:
+        """Keep the session up while it is wanted, backing off after failures."""
+        failures = 0
+        while True:
+            self._demand.wait()
+            if self._stopped.is_set():
+                return
+            started = time.monotonic()
+            ready = self._run_session()
+            if self._stopped.is_set():
+                return
+            if ready and time.monotonic() - started >= STABLE:
+                failures = 0
+            else:
+                failures += 1
+            with self._lock:
+                if not self._connections:
+                    # No connections: start again for the next one, without backoff
+                    self._demand.clear()
+                    failures = 0
+                    self.log("Session closed; the next connection starts a new one")
+                    continue
+            delay = self.backoff(failures)
+            self.log(f"Session ended; reconnecting in {delay:.1f}s")
+            self._stopped.wait(delay)
+
+    def _run_session(self) -> bool:
+        """Prepare (or, without push_key, wake) the instance and run one port-forwarding session until it ends.
+
+        Returns:
+            bool: True if the session became ready
+        """
+        if not (self.proxy.prepare() if self.push_key else self.proxy.wake()):
+            return False
+        port = free_port(BIND)
+        cmd = port_forward_command(self.proxy.instance_id, self.remote_port, port, self.proxy.profile,
+                                   self.proxy.session.region_name, self.remote_host)
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   env=os.environ.copy(), shell=platform.system() == 'Windows')
+        with self._lock:
+            self._process = process
+            self.sessions += 1
+        if self._stopped.is_set():
+            process.terminate()
+
+        became_ready = threading.Event()
+
+        def watch_stdout():
+            for line in process.stdout:
+                line = line.decode(errors='replace').strip()
+                if READY_LINE in line and not became_ready.is_set():
+                    self._session_port = port
+                    became_ready.set()
+                    self._ready.set()
+
+        def log_stderr():
+            for line in process.stderr:
+                self.log(line.decode(errors='replace').strip())
+
+        readers = [threading.Thread(target=watch_stdout, daemon=True), threading.Thread(target=log_stderr, daemon=True)]
+        for reader in readers:
+            reader.start()
+        if not became_ready.wait(READY_TIMEOUT) and process.poll() is None:
+            self.log(f"Session did not open its port within {READY_TIMEOUT}s")
+            process.terminate()
+        elif became_ready.is_set():
+            self.log(f"Session ready on {BIND}:{port}")
+        process.wait()
+        self._ready.clear()
+        self._session_port = None
+        for reader in readers:
+            reader.join(timeout=1)
+        with self._lock:
+            self._process = None
+        return became_ready.is_set()
+
+    def _wait_ready(self, deadline: float) -> Optional[int]:
+        """Wait for the session; return its port, or None if it did not come up by deadline."""
+        while not self._stopped.is_set():
+            port = self.session_port
+            if port:
+                return port
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self._ready.wait(min(remaining, 0.5))
+        return None
+
+    def _handle(self, client: socket.socket) -> None:
+        self.relay(client)
+
+    def relay(self, client: socket.socket, log: Callable[[str], None] = None,
+              ready: Callable[[], None] = None, pending: bytes = b'',
+              failed: Callable[[str], None] = None) -> bool:
+        """Relay one ssh connection through the session.
+
+        Args:
+            client: Accepted connection; closed when the relay ends
+            log: Callable used for this connection's messages (default: self.log)
+            ready: Called once the connection reached the remote port, before
+                any byte is relayed
+            pending: Bytes already read from client
+            failed: Called with the reason instead of ready when the
+                connection cannot be relayed, before client is closed
+
+        Returns:
+            bool: False if the connection could not be relayed
+        """
+        log = log or self.log
+
+        def fail(reason: str) -> bool:
+            log(f"Closing connection: {reason}")
+            if failed:
+                failed(reason)
+            return False
+
+        with self._lock:
+            self._connections += 1
+            self._demand.set()
+        upstream = None
+        deadline = time.monotonic() + self.connection_wait
+        pushed = False
+        try:
+            while upstream is None:
+                port = self._wait_ready(deadline)
+                if port is None:
+                    return fail("the session is not available")
+                # The key must be on the instance when sshd checks it
+                if self.push_key and not pushed and not self.proxy.push_ssh_key(log=log):
+                    return fail("the SSH key could not be pushed")
+                pushed = True
+                try:
+                    upstream = socket.create_connection((BIND, port), timeout=10)
+                except OSError as e:
+                    if time.monotonic() >= deadline:
+                        return fail(str(e))
+                    # The session is ending; wait for the next one
+                    self._stopped.wait(RETRY_INTERVAL)
+            upstream.settimeout(None)
+            if ready:
+                ready()
+            if pending:
+                upstream.sendall(pending)
+            outbound = threading.Thread(target=_pump, args=(client, upstream), daemon=True)
+            outbound.start()
+            _pump(upstream, client)
+            outbound.join()
+            return True
+        except OSError:
+            return False
+        finally:
+            with self._lock:
+                self._connections -= 1
+                self._last_activity = time.monotonic()
+            for sock in (client, upstream):
+                if sock is not None:
+                    sock.close()
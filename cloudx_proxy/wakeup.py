@@ -0,0 +1,238 @@
+"""Adaptive instance wake-up for cloudx-proxy.
+
+Waking an instance used to mean calling StartInstances and polling SSM every
+3 seconds. The InstanceWaker instead follows the EC2 state and the SSM
+PingStatus together:
+
+    stopping --> stopped --StartInstances--> pending --> running --> Online
+     (wait)                                   (boot)    (register)
+
+Each phase is polled at an interval derived from how long that phase took on
+earlier wake-ups: slowly while the expected end is far away, sub-second once
+it is near. Observed phase durations are kept in a small history file under
+the control directory so later wake-ups tune their polling.
+
+Without ec2:DescribeInstances permission the waker falls back to starting the
+instance and polling SSM only.
+"""
+
+import json
+import os
+import statistics
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from botocore.exceptions import ClientError
+
+# Expected phase durations (seconds) until the history knows better
+DEFAULT_EXPECTED = {
+    'stop': 30.0,      # stopping -> stopped
+    'boot': 15.0,      # pending -> running
+    'register': 20.0,  # running -> SSM Online
+    'total': 35.0,     # StartInstances -> SSM Online
+}
+
+FAST_POLL = 0.5
+SLOW_POLL = 3.0
+
+# Phase samples kept per instance
+HISTORY_SIZE = 10
+
+# Seconds to wait for an instance to come online, including waiting out a stop
+WAKE_TIMEOUT = 240
+
+
+def default_history_file() -> Path:
+    """Return the wake-up history file (~/.ssh/control/cloudx-proxy-wakeup.json)."""
+    return Path.home() / ".ssh" / "control" / "cloudx-proxy-wakeup.json"
+
+
+def poll_interval(elapsed: float, expected: float) -> float:
+    """Return how long to sleep before the next status check in a phase.
+
+    Halves the remaining gap to the expected end of the phase (bounded by
+    FAST_POLL and SLOW_POLL), polls fast around the expected end, and backs off
+    again once the phase takes much longer than expected.
+
+    Args:
+        elapsed: Seconds spent in the phase so far
+        expected: Expected phase duration in seconds
+
+    Returns:
+        float: Seconds to sleep
+    """
+    remaining = expected - elapsed
+    if remaining > FAST_POLL:
+        return min(SLOW_POLL, max(FAST_POLL, remaining / 2))
+    if elapsed < expected * 2 + 5:
+        return FAST_POLL
+    return SLOW_POLL
+
+
+class WakeupHistory:
+    """Observed wake-up phase durations per instance, stored as JSON."""
+
+    def __init__(self, path: Path = None):
+        """Initialize the history.
+
+        Args:
+            path: History file (default: default_history_file())
+        """
+        self.path = Path(path) if path else default_history_file()
+
+    def load(self) -> Dict[str, Dict[str, list]]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def expected(self, instance_id: str, phase: str) -> float:
+        """Return the expected duration of a phase.
+
+        Uses the median of this instance's samples, then the median over all
+        instances, then DEFAULT_EXPECTED.
+        """
+        data = self.load()
+        samples = data.get(instance_id, {}).get(phase)
+        if not samples:
+            samples = [value for phases in data.values() for value in phases.get(phase, [])]
+        if samples:
+            return statistics.median(samples)
+        return DEFAULT_EXPECTED[phase]
+
+    def record(self, instance_id: str, durations: Dict[str, float]) -> None:
+        """Add observed phase durations for an instance (best effort)."""
+        if not durations:
+            return
+        data = self.load()
+        phases = data.setdefault(instance_id, {})
+        for phase, duration in durations.items():
+            phases[phase] = (phases.get(phase, []) + [round(duration, 2)])[-HISTORY_SIZE:]
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+class InstanceWaker:
+    """Brings an instance to SSM Online by following EC2 state and SSM PingStatus."""
+
+    # EC2 state -> wake-up phase it belongs to
+    PHASES = {'stopping': 'stop', 'pending': 'boot', 'running': 'register'}
+
+    def __init__(self, proxy, history: WakeupHistory = None,
+                 sleep: Callable[[float], None] = time.sleep, clock: Callable[[], float] = time.monotonic):
+        """Initialize the waker.
+
+        Args:
+            proxy: CloudXProxy providing the instance, clients, logging and timing
+            history: Wake-up history (default: WakeupHistory())
+            sleep: Sleep function (injectable for tests)
+            clock: Monotonic clock (injectable for tests)
+        """
+        self.proxy = proxy
+        self.instance_id = proxy.instance_id
+        self.history = history or WakeupHistory()
+        self.sleep = sleep
+        self.clock = clock
+        self.ec2_visible = True
+
+    def ec2_state(self) -> Optional[str]:
+        """Return the EC2 state name, or None if it cannot be read."""
+        if not self.ec2_visible:
+            return None
+        try:
+            response = self.proxy.ec2.describe_instances(InstanceIds=[self.instance_id])
+            return response['Reservations'][0]['Instances'][0]['State']['Name']
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code', 'error')
+            self.proxy.log(f"Cannot read EC2 state ({code}), following SSM status only")
+            self.ec2_visible = False
+        except (IndexError, KeyError):
+            self.ec2_visible = False
+        return None
+
+    def wake(self, status: str = None, timeout: float = WAKE_TIMEOUT) -> bool:
+        """Start the instance if needed and wait until SSM reports it Online.
+
+        Args:
+            status: PingStatus already observed by the caller (saves one call)
+            timeout: Seconds to wait in total
+
+        Returns:
+            bool: True if the instance came online
+        """
+        timing = self.proxy.timing
+        now = started = self.clock()
+        deadline = started + timeout
+        start_requested = None
+        state = previous = None
+        phase_start = None
+        durations = {}
+
+        while True:
+            state = self.ec2_state()
+            if state is not None and state != previous:
+                if previous is not None:
+                    # A phase we saw begin has ended; remember how long it took
+                    phase = self.PHASES.get(previous)
+                    if phase and phase_start is not None:
+                        durations[phase] = now - phase_start
+                        timing.record('phase', f"wake_{phase}", durations[phase])
+                    # The boot phase is timed from our StartInstances call
+                    if not (previous == 'stopped' and state == 'pending' and start_requested is not None):
+                        phase_start = now
+                self._log_state(state)
+                previous = state
+
+            if state in ('shutting-down', 'terminated'):
+                self.proxy.log(f"Instance {self.instance_id} is {state} and cannot be started")
+                return False
+
+            if state in ('running', None):
+                if status is None:
+                    status = self.proxy.get_instance_status()
+                if status == 'Online':
+                    if state == 'running' and phase_start is not None:
+                        durations['register'] = now - phase_start
+                        timing.record('phase', 'wake_register', durations['register'])
+                    if start_requested is not None:
+                        durations['total'] = now - start_requested
+                    self.history.record(self.instance_id, durations)
+                    return True
+            # The caller's status only describes the first iteration
+            status = None
+
+            if start_requested is None and state in ('stopped', None):
+                with timing.span('start_instance') as span:
+                    span['ok'] = self.proxy.start_instance()
+                if not span['ok']:
+                    return False
+                now = phase_start = start_requested = self.clock()
+
+            if now >= deadline:
+                return False
+
+            self.sleep(min(self._interval(state, now - (phase_start or started)), max(0.0, deadline - now)))
+            now = self.clock()
+
+    def _interval(self, state: Optional[str], elapsed: float) -> float:
+        if state is None:
+            # SSM only: boot and registration are indistinguishable
+            return poll_interval(elapsed, self.history.expected(self.instance_id, 'total'))
+        phase = self.PHASES.get(state, 'boot')
+        return poll_interval(elapsed, self.history.expected(self.instance_id, phase))
+
+    def _log_state(self, state: Optional[str]) -> None:
+        messages = {
+            'stopping': "is stopping, waiting for it to stop before starting it...",
+            'pending': "is booting...",
+            'running': "is running, waiting for the SSM agent to come online...",
+        }
+        if state in messages:
+            self.proxy.log(f"Instance {self.instance_id} {messages[state]}")
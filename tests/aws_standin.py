@@ -0,0 +1,153 @@
+"""Local stand-in for the SSM, EC2 and EC2 Instance Connect APIs.
+
+One HTTP server on 127.0.0.1 answers the calls CloudXProxy makes, for all
+three services (pass its url as --endpoint-url for each of them). SSM and
+EC2 Instance Connect speak the JSON protocol (X-Amz-Target), EC2 the query
+protocol with XML responses. Instances move through the EC2 states on a
+short clock: StartInstances makes a stopped instance pending, it is running
+`boot` seconds later and Online in SSM `register` seconds after that.
+
+StartSession returns the session of a StandInSSM data channel endpoint, so
+native connects relay through a local echo as well.
+"""
+
+import collections
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from .ssm_standin import StandInSSM
+
+EC2_NAMESPACE = "http://ec2.amazonaws.com/doc/2016-11-15/"
+
+STATE_CODES = {'pending': 0, 'running': 16, 'stopping': 64, 'stopped': 80}
+
+
+class StandInAWS:
+    """SSM, EC2 and EC2 Instance Connect API endpoint with simulated instances."""
+
+    def __init__(self, boot: float = 0.2, register: float = 0.2):
+        """Start serving.
+
+        Args:
+            boot: Seconds an instance stays pending after StartInstances
+            register: Seconds a running instance takes to come Online in SSM
+        """
+        self.boot = boot
+        self.register = register
+        self.calls = collections.Counter()
+        self._instances = {}
+        self._lock = threading.Lock()
+        self.data_channel = StandInSSM()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.standin = self
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self.data_channel.close()
+
+    def add_instance(self, instance_id: str, state: str = 'running') -> None:
+        """Add an instance; a running one is Online right away."""
+        with self._lock:
+            self._instances[instance_id] = {'state': state, 'since': time.monotonic() - self.boot - self.register}
+
+    def state(self, instance_id: str) -> tuple:
+        """Return the (EC2 state, SSM PingStatus) of an instance now."""
+        with self._lock:
+            instance = self._instances[instance_id]
+            elapsed = time.monotonic() - instance['since']
+            if instance['state'] != 'pending':
+                online = instance['state'] == 'running' and elapsed >= self.boot + self.register
+                return instance['state'], 'Online' if online else 'ConnectionLost'
+            if elapsed < self.boot:
+                return 'pending', 'ConnectionLost'
+            return 'running', 'Online' if elapsed >= self.boot + self.register else 'ConnectionLost'
+
+    def start(self, instance_id: str) -> tuple:
+        """StartInstances: return (previous, current) EC2 state."""
+        previous, _ = self.state(instance_id)
+        if previous == 'stopped':
+            with self._lock:
+                self._instances[instance_id] = {'state': 'pending', 'since': time.monotonic()}
+            return previous, 'pending'
+        return previous, previous
+
+    def count(self, operation: str) -> None:
+        with self._lock:
+            self.calls[operation] += 1
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self.calls.clear()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        standin = self.server.standin
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        target = self.headers.get('X-Amz-Target')
+        if target:
+            operation = target.split('.', 1)[1]
+            standin.count(operation)
+            self._json(standin, operation, json.loads(body or b'{}'))
+        else:
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            standin.count(form['Action'])
+            self._query(standin, form)
+
+    def _reply(self, status: int, content_type: str, payload: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _json(self, standin: StandInAWS, operation: str, request: dict) -> None:
+        if operation == 'DescribeInstanceInformation':
+            instance_id = request['Filters'][0]['Values'][0]
+            _, ping = standin.state(instance_id)
+            response = {'InstanceInformationList': [{'InstanceId': instance_id, 'PingStatus': ping}]}
+        elif operation == 'SendSSHPublicKey':
+            response = {'RequestId': 'stand-in', 'Success': True}
+        elif operation == 'StartSession':
+            response = standin.data_channel.session
+        elif operation == 'TerminateSession':
+            response = {'SessionId': request['SessionId']}
+        else:
+            error = {'__type': 'InvalidAction', 'message': f"{operation} is not supported by the stand-in"}
+            self._reply(400, 'application/x-amz-json-1.1', json.dumps(error).encode())
+            return
+        self._reply(200, 'application/x-amz-json-1.1', json.dumps(response).encode())
+
+    def _query(self, standin: StandInAWS, form: dict) -> None:
+        action = form['Action']
+        instance_id = form['InstanceId.1']
+        if action == 'DescribeInstances':
+            state, _ = standin.state(instance_id)
+            items = (f"<reservationSet><item><reservationId>r-standin</reservationId><instancesSet><item>"
+                     f"<instanceId>{instance_id}</instanceId>{_state('instanceState', state)}"
+                     f"</item></instancesSet></item></reservationSet>")
+        elif action == 'StartInstances':
+            previous, current = standin.start(instance_id)
+            items = (f"<instancesSet><item><instanceId>{instance_id}</instanceId>"
+                     f"{_state('currentState', current)}{_state('previousState', previous)}</item></instancesSet>")
+        else:
+            self._reply(400, 'text/xml', "<Response><Errors><Error><Code>InvalidAction</Code></Error></Errors></Response>".encode())
+            return
+        payload = f'<{action}Response xmlns="{EC2_NAMESPACE}"><requestId>stand-in</requestId>{items}</{action}Response>'
+        self._reply(200, 'text/xml', payload.encode())
+
+
+def _state(tag: str, name: str) -> str:
+    return f"<{tag}><code>{STATE_CODES[name]}</code><name>{name}</name></{tag}>"
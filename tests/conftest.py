@@ -0,0 +1,52 @@
+"""Fixtures shared by the tunnel, mux and SOCKS tests."""
+
+import os
+import sys
+
+import pytest
+
+from . import plugin_standin
+
+
+class FakeProxy:
+    """The CloudXProxy calls the tunnel makes, counted."""
+
+    instance_id = 'i-0123456789abcdef0'
+    profile = 'cloudX'
+
+    class session:
+        region_name = 'eu-west-1'
+
+    def __init__(self, prepare_results=()):
+        self.prepare_results = list(prepare_results)
+        self.prepares = 0
+        self.wakes = 0
+        self.pushes = 0
+        self.lines = []
+
+    def log(self, message):
+        self.lines.append(message)
+
+    def prepare(self):
+        self.prepares += 1
+        return self.prepare_results.pop(0) if self.prepare_results else True
+
+    def wake(self):
+        self.wakes += 1
+        return True
+
+    def push_ssh_key(self, log=None):
+        self.pushes += 1
+        return True
+
+
+@pytest.fixture
+def fake_aws(tmp_path, monkeypatch):
+    """Put the stand-in AWS CLI and session-manager-plugin on PATH; returns the log of its calls."""
+    if sys.platform == 'win32':
+        pytest.skip("uses a shell script as the AWS CLI")
+    plugin_standin.install(tmp_path)
+    log = tmp_path / "aws.log"
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv('FAKE_AWS_LOG', str(log))
+    return log
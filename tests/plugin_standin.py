@@ -0,0 +1,77 @@
+"""Local stand-in for the AWS CLI and the session-manager-plugin.
+
+install() writes an `aws` executable that plays `aws ssm start-session`:
+
+- AWS-StartSSHSession relays stdin to stdout (exec cat), like a session to
+  an sshd that echoes
+- AWS-StartPortForwardingSession listens on localPortNumber, prints the
+  plugin's "Waiting for connections..." and echoes every connection; a
+  connection sending "quit" ends the session
+- AWS-StartPortForwardingSessionToRemoteHost listens the same way but
+  connects every connection to host:portNumber, as the instance would
+
+Each port-forwarding start is appended to $FAKE_AWS_LOG when it is set.
+"""
+
+import sys
+from pathlib import Path
+
+PORT_FORWARD = """
+import os, socket, sys, threading
+parameters = dict(item.split('=', 1) for item in sys.argv[sys.argv.index('--parameters') + 1].split(','))
+port = int(parameters['localPortNumber'])
+if os.environ.get('FAKE_AWS_LOG'):
+    with open(os.environ['FAKE_AWS_LOG'], 'a') as log:
+        log.write(' '.join(sys.argv[1:]) + '\\n')
+server = socket.create_server(('127.0.0.1', port))
+print(f"Port {port} opened for sessionId stand-in.", flush=True)
+print("Waiting for connections...", flush=True)
+
+def echo(conn):
+    while data := conn.recv(65536):
+        if data == b'quit':
+            os._exit(0)
+        conn.sendall(data)
+    conn.close()
+
+def pump(src, dst):
+    while data := src.recv(65536):
+        dst.sendall(data)
+    dst.shutdown(socket.SHUT_WR)
+
+def forward(conn):
+    try:
+        remote = socket.create_connection((parameters['host'], int(parameters['portNumber'])))
+    except OSError:
+        conn.close()
+        return
+    threading.Thread(target=pump, args=(conn, remote), daemon=True).start()
+    pump(remote, conn)
+
+while True:
+    conn, _ = server.accept()
+    threading.Thread(target=forward if 'host' in parameters else echo, args=(conn,), daemon=True).start()
+"""
+
+# The SSH session path stays a shell script so it costs no interpreter start
+AWS = """#!/bin/sh
+case "$*" in
+    *AWS-StartPortForwardingSession*) exec "{python}" "{port_forward}" "$@" ;;
+esac
+exec cat
+"""
+
+
+def install(directory: Path) -> Path:
+    """Write the stand-in `aws` (and its port forwarder) into directory, which goes on PATH.
+
+    Returns:
+        Path: The `aws` executable
+    """
+    directory = Path(directory)
+    port_forward = directory / "port_forward.py"
+    port_forward.write_text(PORT_FORWARD)
+    aws = directory / "aws"
+    aws.write_text(AWS.format(python=sys.executable, port_forward=port_forward))
+    aws.chmod(0o755)
+    return aws
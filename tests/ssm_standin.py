@@ -0,0 +1,160 @@
+"""Local stand-in for the SSM Session Manager data channel endpoint.
+
+Speaks the server side of the protocol implemented by
+cloudx_proxy.datachannel: accepts the websocket, checks the token, runs the
+session handshake and then echoes every byte of stream data back to the
+client, acknowledging and sequencing messages like the real agent does.
+"""
+
+import json
+import socket
+import struct
+import threading
+
+from cloudx_proxy._websocket import WebSocket, WebSocketError
+from cloudx_proxy import datachannel as dc
+
+TOKEN = "stand-in-token"
+
+
+class StandInSSM:
+    """Echoing SSM data channel endpoint on 127.0.0.1."""
+
+    def __init__(self, require_kms: bool = False, drop_first_data: bool = False):
+        """Start listening.
+
+        Args:
+            require_kms: Request KMS encryption in the handshake (the native client refuses it)
+            drop_first_data: Ignore the first data message once to force a client resend
+        """
+        self.require_kms = require_kms
+        self.drop_first_data = drop_first_data
+        self.received = bytearray()
+        self.sessions = 0
+        self.resends_seen = 0
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(16)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    @property
+    def session(self) -> dict:
+        """A StartSession-style response pointing at this stand-in."""
+        return {
+            'SessionId': 'stand-in-session',
+            'TokenValue': TOKEN,
+            'StreamUrl': f"ws://127.0.0.1:{self.port}/v1/data-channel/stand-in-session?role=publish_subscribe",
+        }
+
+    def close(self) -> None:
+        self._listener.close()
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn: socket.socket) -> None:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        ws = WebSocket.accept(conn)
+        try:
+            _, opening = ws.recv()
+            if json.loads(opening).get('TokenValue') != TOKEN:
+                ws.close()
+                return
+            self.sessions += 1
+            _Session(self, ws).run()
+        except (OSError, WebSocketError):
+            pass
+        finally:
+            ws.close()
+
+
+class _Session:
+    def __init__(self, server: StandInSSM, ws: WebSocket):
+        self.server = server
+        self.ws = ws
+        self.send_sequence = 0
+        self.expected = 0
+        self.pending = {}
+        self.dropped = False
+
+    def send_output(self, payload: bytes, payload_type: int) -> None:
+        message = dc.ClientMessage(dc.OUTPUT_STREAM_DATA, self.send_sequence, payload, payload_type)
+        self.send_sequence += 1
+        self.ws.send(message.encode())
+
+    def ack(self, message: dc.ClientMessage) -> None:
+        payload = json.dumps({
+            "AcknowledgedMessageType": message.message_type,
+            "AcknowledgedMessageId": str(message.message_id),
+            "AcknowledgedMessageSequenceNumber": message.sequence_number,
+            "IsSequentialMessage": True,
+        }).encode()
+        self.ws.send(dc.ClientMessage(dc.ACKNOWLEDGE, 0, payload, flags=3).encode())
+
+    def close_channel(self, output: str = "") -> None:
+        payload = json.dumps({"MessageType": dc.CHANNEL_CLOSED, "SessionId": "stand-in-session",
+                              "Output": output}).encode()
+        self.ws.send(dc.ClientMessage(dc.CHANNEL_CLOSED, 0, payload).encode())
+
+    def run(self) -> None:
+        actions = [{"ActionType": "SessionType",
+                    "ActionParameters": {"SessionType": "Port", "Properties": {"portNumber": "22"}}}]
+        if self.server.require_kms:
+            actions.append({"ActionType": "KMSEncryption", "ActionParameters": {"KMSKeyId": "alias/test"}})
+        self.send_output(json.dumps({"AgentVersion": "3.3.0.0", "RequestedClientActions": actions}).encode(),
+                         dc.PAYLOAD_HANDSHAKE_REQUEST)
+
+        while True:
+            _, data = self.ws.recv()
+            message = dc.ClientMessage.decode(data)
+            if message.message_type != dc.INPUT_STREAM_DATA:
+                continue
+
+            if message.sequence_number < self.expected or message.sequence_number in self.pending:
+                self.server.resends_seen += 1
+                self.ack(message)
+                continue
+
+            if (self.server.drop_first_data and not self.dropped
+                    and message.payload_type == dc.PAYLOAD_OUTPUT):
+                self.dropped = True
+                continue
+
+            self.ack(message)
+            self.pending[message.sequence_number] = message
+            while self.expected in self.pending:
+                if not self.handle(self.pending.pop(self.expected)):
+                    self.drain()
+                    return
+                self.expected += 1
+
+    def drain(self) -> None:
+        """Keep reading until the client closes, so our close never resets unread data."""
+        try:
+            while True:
+                self.ws.recv()
+        except (OSError, WebSocketError):
+            pass
+
+    def handle(self, message: dc.ClientMessage) -> bool:
+        if message.payload_type == dc.PAYLOAD_HANDSHAKE_RESPONSE:
+            response = json.loads(message.payload)
+            if response.get("Errors"):
+                self.close_channel("; ".join(response["Errors"]))
+                return False
+            self.send_output(b'{}', dc.PAYLOAD_HANDSHAKE_COMPLETE)
+        elif message.payload_type == dc.PAYLOAD_OUTPUT:
+            self.server.received += message.payload
+            self.send_output(message.payload, dc.PAYLOAD_OUTPUT)
+        elif message.payload_type == dc.PAYLOAD_FLAG:
+            if struct.unpack('>I', message.payload)[0] == dc.FLAG_TERMINATE_SESSION:
+                self.close_channel("Exiting session with sessionId: stand-in-session.")
+                return False
+        return True
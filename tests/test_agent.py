@@ -0,0 +1,154 @@
+"""Tests for cloudx_proxy.agent.
+
+The agent is exercised over a real Unix socket with the AWS side replaced by
+in-memory fakes, so no credentials or network access are needed.
+"""
+
+import socket
+import threading
+
+import pytest
+
+from cloudx_proxy import agent, sessions
+
+pytestmark = pytest.mark.skipif(not agent.agent_supported(), reason="requires Unix domain sockets")
+
+
+class FakeSSM:
+    def __init__(self):
+        self.calls = 0
+
+    def describe_instance_information(self, **kwargs):
+        self.calls += 1
+        return {'InstanceInformationList': [{'PingStatus': 'Online'}]}
+
+
+class FakeInstanceConnect:
+    def __init__(self):
+        self.pushed = []
+
+    def send_ssh_public_key(self, **kwargs):
+        self.pushed.append(kwargs)
+        return {'Success': True}
+
+
+class FakeSession:
+    region_name = 'eu-central-1'
+
+
+class FakeContext:
+    built = 0
+    warmed = []
+
+    def __init__(self, profile, aws_env=None, region=None, client_config=None):
+        FakeContext.built += 1
+        self.session = FakeSession()
+        self.region = region or FakeSession.region_name
+        self.clients = {'ssm': FakeSSM(), 'ec2': object(), 'ec2-instance-connect': FakeInstanceConnect()}
+
+    def client(self, service):
+        return self.clients[service]
+
+    def warm(self, services):
+        FakeContext.warmed.append(tuple(services))
+        return self
+
+
+@pytest.fixture
+def running_agent(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(sessions, "AWSContext", FakeContext)
+    monkeypatch.setattr(sessions, "_contexts", {})
+    FakeContext.built = 0
+    FakeContext.warmed = []
+
+    path = tmp_path / "agent.sock"
+    server = agent.AgentServer(path)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _prepare_request(tmp_path, **overrides):
+    ssh_dir = tmp_path / "ssh"
+    ssh_dir.mkdir(exist_ok=True)
+    (ssh_dir / "testkey.pub").write_text("ssh-ed25519 AAAA test\n")
+    message = {
+        'op': 'prepare',
+        'instance_id': 'i-0123456789abcdef0',
+        'port': 22,
+        'profile': 'cloudX',
+        'region': None,
+        'ssh_key': 'testkey',
+        'ssh_config': None,
+        'ssh_dir': str(ssh_dir),
+        'aws_env': None,
+    }
+    message.update(overrides)
+    return message
+
+
+def test_no_agent_returns_none(tmp_path):
+    assert agent.request({'op': 'ping'}, tmp_path / "missing.sock") is None
+
+
+def test_ping(running_agent):
+    reply = agent.ping(running_agent.socket_path)
+    assert reply['ok'] is True
+    assert reply['contexts'] == 0
+
+
+def test_socket_is_private(running_agent):
+    assert running_agent.socket_path.stat().st_mode & 0o777 == 0o600
+
+
+def test_prepare_streams_logs_and_reuses_context(running_agent, tmp_path):
+    logs = []
+    message = _prepare_request(tmp_path)
+
+    first = agent.request(message, running_agent.socket_path, log=logs.append)
+    second = agent.request(message, running_agent.socket_path, log=logs.append)
+
+    assert (first['ok'], first['region']) == (True, 'eu-central-1')
+    assert first['key_push'].startswith('i-0123456789abcdef0|ec2-user|SHA256:')
+    assert second == dict(first, status_cached=True), "the second connect trusts the cached Online status"
+    assert any("testkey.pub" in line for line in logs)
+    assert FakeContext.built == 1, "the warm context must be shared across requests"
+    assert FakeContext.warmed == [agent.WARM_SERVICES]
+
+
+def test_prepare_failure_is_reported(running_agent, tmp_path):
+    message = _prepare_request(tmp_path, ssh_key='missing')
+
+    reply = agent.request(message, running_agent.socket_path)
+
+    assert reply['ok'] is False
+
+
+def test_prepare_records_timing_under_client_run(running_agent, tmp_path):
+    from cloudx_proxy.timing import load_records
+
+    path = tmp_path / "timing.jsonl"
+    message = _prepare_request(tmp_path, timing=str(path), run='client-run')
+
+    agent.request(message, running_agent.socket_path)
+    agent.request(message, running_agent.socket_path)
+
+    records = list(load_records(path))
+    assert {r['run'] for r in records} == {'client-run'}
+    assert [r['warm'] for r in records if r['name'] == 'agent_context'] == [False, True]
+    assert 'push_ssh_key' in {r['name'] for r in records}
+
+
+def test_serve_replaces_stale_socket(tmp_path, monkeypatch):
+    path = tmp_path / "stale.sock"
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(path))
+    stale.close()  # socket file remains but nobody listens
+
+    monkeypatch.setattr(agent.AgentServer, "serve_forever", lambda self, poll_interval: None)
+    agent.serve(path)
+
+    assert not path.exists(), "socket is cleaned up on exit"
@@ -0,0 +1,304 @@
+"""Tests for cloudx_proxy.cache and the key push and status caches in CloudXProxy."""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from cloudx_proxy import cache, relay
+from cloudx_proxy.core import CloudXProxy, SessionStartError, run_session
+from cloudx_proxy.timing import Timing, count_events, load_records
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+PUBLIC_KEY = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIJ1xWmGKOiwEZ1NdbQvD9kjbEuvgzTPrHKkcADxwNYbR test\n"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeInstanceConnect:
+    def __init__(self):
+        self.pushed = 0
+
+    def send_ssh_public_key(self, **kwargs):
+        self.pushed += 1
+        return {'Success': True}
+
+
+class FakeSession:
+    region_name = 'eu-west-1'
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return tmp_path
+
+
+# Bytes sshd sends after NEWKEYS when it rejects the key: SERVICE_ACCEPT,
+# EXT_INFO and a USERAUTH_FAILURE for "none" and each of two keys. A login adds
+# PK_OK, USERAUTH_SUCCESS, the hostkeys-00@openssh.com notice and the channel.
+REJECTED_AFTER_KEX = 52 + 260 + 3 * 84
+LOGIN_AFTER_KEX = REJECTED_AFTER_KEX + 100 + 36 + 690 + 6 * 52 + 2000
+
+
+def _packet(message: int, size: int) -> bytes:
+    """An unencrypted SSH binary packet whose payload is message and size - 1 more bytes."""
+    payload = bytes([message]) + os.urandom(size - 1)
+    padding = 8 - (5 + len(payload)) % 8 + 8
+    return (1 + len(payload) + padding).to_bytes(4, 'big') + bytes([padding]) + payload + bytes(padding)
+
+
+def _sshd_stream(after_kex: int) -> bytes:
+    """What sshd sends: identification, KEXINIT, the ECDH reply and NEWKEYS in the clear, then encrypted data."""
+    return (b"SSH-2.0-OpenSSH_9.6\r\n" + _packet(20, 1080) + _packet(31, 1200) + _packet(21, 1)
+            + os.urandom(after_kex))
+
+
+def _run_ssh_session(proxy, tmp_path, monkeypatch, stream: bytes) -> dict:
+    """Run proxy.start_session() with an AWS CLI on PATH that plays sshd sending stream; return the relay stats."""
+    if not relay.relay_supported():
+        pytest.skip("relay mode needs selectable pipes")
+    (tmp_path / "sshd").write_bytes(stream)
+    fake_aws = tmp_path / "aws"
+    fake_aws.write_text(f"#!/bin/sh\ncat > /dev/null\ncat '{tmp_path / 'sshd'}'\n")
+    fake_aws.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    spans = []
+    monkeypatch.setattr(proxy.timing, 'span', _recording_span(proxy.timing.span, spans))
+    (tmp_path / "client").write_bytes(b"SSH-2.0-OpenSSH_9.6\r\n" + os.urandom(3000))
+    with open(tmp_path / "client") as stdin, open(os.devnull, 'w') as stdout:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        monkeypatch.setattr(sys, 'stdout', stdout)
+        proxy.start_session()
+    return next(span for name, span in spans if name == 'session')
+
+
+def _recording_span(span, spans):
+    from contextlib import contextmanager
+
+    @contextmanager
+    def recording(name, **fields):
+        with span(name, **fields) as record:
+            yield record
+        spans.append((name, record))
+    return recording
+
+
+def _proxy(home, eic):
+    ssh_dir = home / "ssh"
+    ssh_dir.mkdir(exist_ok=True)
+    (ssh_dir / "testkey.pub").write_text(PUBLIC_KEY)
+    proxy = CloudXProxy(INSTANCE_ID, ssh_key='testkey', ssh_dir=str(ssh_dir), session=FakeSession(),
+                        clients={'ssm': object(), 'ec2': object(), 'ec2-instance-connect': eic},
+                        timing=Timing(str(home / "timing.jsonl")))
+    proxy.log = lambda message: None
+    return proxy
+
+
+class TestFileCache:
+    def test_entries_expire_and_are_evicted(self, tmp_path):
+        clock = Clock()
+        store = cache.FileCache(tmp_path / "cache.json", ttl=10, clock=clock)
+
+        store.put('a', 1)
+        clock.now += 5
+        store.put('b', 2)
+        assert store.get('a')['value'] == 1
+
+        clock.now += 6
+        assert store.get('a') is None
+        store.put('c', 3)
+        assert set(store._load()) == {'b', 'c'}
+
+    def test_file_is_private(self, tmp_path):
+        store = cache.FileCache(tmp_path / "cache.json", ttl=10)
+        store.put('a')
+
+        assert (tmp_path / "cache.json").stat().st_mode & 0o777 == 0o600
+
+    @pytest.mark.skipif(not shutil.which('ssh-keygen'), reason="requires ssh-keygen")
+    def test_fingerprint_matches_ssh_keygen(self, tmp_path):
+        path = tmp_path / "key.pub"
+        path.write_text(PUBLIC_KEY)
+        output = subprocess.run(['ssh-keygen', '-lf', str(path)], capture_output=True, text=True).stdout
+
+        assert output.split()[1] == cache.key_fingerprint(PUBLIC_KEY)
+
+
+class TestKeyPushCache:
+    def test_recent_push_is_reused_across_processes(self, home):
+        eic = FakeInstanceConnect()
+
+        assert _proxy(home, eic).push_ssh_key()
+        # A new CloudXProxy stands in for the next ssh process
+        assert _proxy(home, eic).push_ssh_key()
+
+        assert eic.pushed == 1
+        assert count_events(load_records(home / "timing.jsonl")) == {
+            ('key_push_cache', 'miss'): 1, ('key_push_cache', 'hit'): 1}
+
+    def test_stale_push_is_repeated(self, home):
+        eic = FakeInstanceConnect()
+        _proxy(home, eic).push_ssh_key()
+
+        path = cache.key_push_cache().path
+        data = json.loads(path.read_text())
+        for entry in data.values():
+            entry['ts'] -= cache.KEY_PUSH_REUSE
+        path.write_text(json.dumps(data))
+        _proxy(home, eic).push_ssh_key()
+
+        assert eic.pushed == 2
+
+    def test_rejected_login_forgets_push(self, home, monkeypatch, tmp_path):
+        eic = FakeInstanceConnect()
+        proxy = _proxy(home, eic)
+        proxy.push_ssh_key()
+
+        # ssh: "Permission denied (publickey)"; it closes stdin and the AWS CLI exits 0
+        stats = _run_ssh_session(proxy, tmp_path, monkeypatch, _sshd_stream(REJECTED_AFTER_KEX))
+        proxy.push_ssh_key()
+
+        assert stats['kex_end'] and stats['bytes_out'] - stats['kex_end'] == REJECTED_AFTER_KEX
+        assert eic.pushed == 2
+
+    def test_short_successful_session_keeps_push(self, home, monkeypatch, tmp_path):
+        eic = FakeInstanceConnect()
+        proxy = _proxy(home, eic)
+        proxy.push_ssh_key()
+
+        # e.g. git fetch: done in a second, exit status 0
+        _run_ssh_session(proxy, tmp_path, monkeypatch, _sshd_stream(LOGIN_AFTER_KEX))
+        proxy.push_ssh_key()
+
+        assert eic.pushed == 1
+
+    def test_session_without_key_exchange_forgets_push(self, home):
+        proxy = _proxy(home, FakeInstanceConnect())
+        proxy.push_ssh_key()
+        entry = proxy.key_push_entry()
+
+        with cache.watch_session(entry) as stats:
+            stats.update(bytes_in=21, bytes_out=0, kex_end=None)  # sshd never answered
+
+        assert cache.key_push_cache().get(entry) is None
+
+    def test_failed_session_forgets_push(self, home):
+        proxy = _proxy(home, FakeInstanceConnect())
+        proxy.push_ssh_key()
+        entry = proxy.key_push_entry()
+
+        with pytest.raises(RuntimeError):
+            with cache.watch_session(entry):
+                raise RuntimeError("session failed")
+
+        assert cache.key_push_cache().get(entry) is None
+
+    def test_long_session_keeps_push(self, home, monkeypatch):
+        proxy = _proxy(home, FakeInstanceConnect())
+        proxy.push_ssh_key()
+        entry = proxy.key_push_entry()
+        monkeypatch.setattr(cache, 'AUTH_FAILURE_WINDOW', 0)
+
+        with cache.watch_session(entry):
+            pass
+
+        assert cache.key_push_cache().get(entry) is not None
+
+
+class FakeSSM:
+    def __init__(self, status='Online'):
+        self.status = status
+        self.calls = 0
+
+    def describe_instance_information(self, **kwargs):
+        self.calls += 1
+        return {'InstanceInformationList': [{'PingStatus': self.status}]}
+
+
+def _status_proxy(home, ssm, **kwargs):
+    proxy = CloudXProxy(INSTANCE_ID, session=FakeSession(), ssh_dir=str(home / "ssh"),
+                        clients={'ssm': ssm, 'ec2': object(), 'ec2-instance-connect': object()}, **kwargs)
+    proxy.log = lambda message: None
+    return proxy
+
+
+class TestStatusCache:
+    def test_fresh_online_status_skips_ssm(self, home):
+        ssm = FakeSSM()
+
+        assert _status_proxy(home, ssm).cached_instance_status() == 'Online'
+        second = _status_proxy(home, ssm)
+        assert second.cached_instance_status() == 'Online'
+
+        assert ssm.calls == 1
+        assert second.status_cached
+
+    def test_ttl_zero_always_asks_ssm(self, home):
+        ssm = FakeSSM()
+
+        _status_proxy(home, ssm).cached_instance_status()
+        _status_proxy(home, ssm, status_ttl=0).cached_instance_status()
+
+        assert ssm.calls == 2
+
+    def test_ttl_from_environment(self, monkeypatch):
+        monkeypatch.setenv(cache.STATUS_TTL_ENV, '42')
+        assert cache.resolve_status_ttl() == 42
+        assert cache.resolve_status_ttl(5) == 5
+
+        monkeypatch.setenv(cache.STATUS_TTL_ENV, 'soon')
+        assert cache.resolve_status_ttl() == cache.STATUS_TTL
+
+    def test_offline_status_drops_entry(self, home):
+        _status_proxy(home, FakeSSM('Online')).cached_instance_status()
+        _status_proxy(home, FakeSSM('ConnectionLost'), status_ttl=0).cached_instance_status()
+
+        assert cache.status_cache().get(INSTANCE_ID) is None
+
+    def test_stale_status_falls_back_to_full_path(self, home, monkeypatch):
+        ssm = FakeSSM()
+        _status_proxy(home, ssm).cached_instance_status()
+        proxy = _status_proxy(home, ssm)
+        attempts = []
+
+        def start_session():
+            attempts.append(proxy.status_cached)
+            if len(attempts) == 1:
+                raise SessionStartError(254, ['aws'])
+
+        monkeypatch.setattr(proxy, 'push_ssh_key', lambda: True)
+        monkeypatch.setattr(proxy, 'start_session', start_session)
+
+        assert proxy.connect()
+        assert attempts == [True, False]
+        assert ssm.calls == 2
+
+
+@pytest.mark.skipif(os.name == 'nt', reason="fake aws executable is a shell script")
+def test_run_session_detects_start_failure(tmp_path, monkeypatch):
+    fake_aws = tmp_path / "aws"
+    fake_aws.write_text("#!/bin/sh\n"
+                        "echo 'An error occurred (TargetNotConnected) when calling the StartSession operation: "
+                        "i-0123456789abcdef0 is not connected.' >&2\n"
+                        "exit 254\n")
+    fake_aws.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    lines = []
+
+    with open(os.devnull) as stdin, open(os.devnull, 'w') as stdout:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        monkeypatch.setattr(sys, 'stdout', stdout)
+        with pytest.raises(SessionStartError):
+            run_session(INSTANCE_ID, 22, 'cloudX', 'eu-west-1', log=lines.append)
+
+    assert 'TargetNotConnected' in lines[0]
@@ -0,0 +1,147 @@
+"""Tests for cloudx_proxy.clientconfig and the client options of connect and setup."""
+
+import pytest
+from click.testing import CliRunner
+
+from cloudx_proxy import agent, clientconfig, sessions
+from cloudx_proxy.cli import cli
+
+CONFIG = """\
+[client]
+connect_timeout = 7
+read_timeout = 20
+retry_mode = adaptive
+tcp_keepalive = no
+
+[endpoints]
+ssm = https://vpce-0example.ssm.eu-west-1.vpce.amazonaws.com
+ec2 = https://vpce-0example.ec2.eu-west-1.vpce.amazonaws.com
+"""
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    for name in ('CLOUDX_PROXY_CONFIG', 'AWS_RETRY_MODE', 'AWS_MAX_ATTEMPTS', 'AWS_ENDPOINT_URL',
+                 'AWS_ENDPOINT_URL_SSM', *(v for names in clientconfig.ENVIRONMENT.values() for v in names)):
+        monkeypatch.delenv(name, raising=False)
+    return tmp_path
+
+
+@pytest.fixture
+def config_file(home):
+    path = clientconfig.default_config_file()
+    path.parent.mkdir(parents=True)
+    path.write_text(CONFIG)
+    return path
+
+
+def test_defaults_without_config(home):
+    assert clientconfig.resolve().to_dict() == dict(clientconfig.PROXY_DEFAULTS, endpoints={})
+    setup = clientconfig.resolve(defaults=clientconfig.SETUP_DEFAULTS)
+    assert (setup.connect_timeout, setup.read_timeout, setup.max_attempts) == (10.0, 30.0, 5)
+
+
+def test_options_override_environment_override_file(config_file, monkeypatch):
+    monkeypatch.setenv('CLOUDX_PROXY_READ_TIMEOUT', '5')
+    monkeypatch.setenv('AWS_MAX_ATTEMPTS', '4')
+
+    settings = clientconfig.resolve({'connect_timeout': 1.5, 'retry_mode': None})
+
+    assert settings.connect_timeout == 1.5
+    assert settings.read_timeout == 5.0
+    assert settings.max_attempts == 4
+    assert settings.retry_mode == 'adaptive'
+    assert settings.tcp_keepalive is False
+    assert settings.max_pool_connections == clientconfig.PROXY_DEFAULTS['max_pool_connections']
+
+
+def test_invalid_values_fall_through(config_file, monkeypatch):
+    monkeypatch.setenv('CLOUDX_PROXY_CONNECT_TIMEOUT', 'soon')
+    monkeypatch.setenv('CLOUDX_PROXY_RETRY_MODE', 'eager')
+    monkeypatch.setenv('CLOUDX_PROXY_MAX_ATTEMPTS', '0')
+
+    settings = clientconfig.resolve()
+
+    assert settings.connect_timeout == 7.0
+    assert settings.retry_mode == 'adaptive'
+    assert settings.max_attempts == clientconfig.PROXY_DEFAULTS['max_attempts']
+
+
+def test_broken_config_file_is_ignored(home):
+    path = clientconfig.default_config_file()
+    path.parent.mkdir(parents=True)
+    path.write_text("connect_timeout = 1\n[client\n")
+
+    assert clientconfig.resolve() == clientconfig.resolve(config_file=home / "missing.ini")
+
+
+def test_endpoints(config_file, monkeypatch):
+    settings = clientconfig.resolve(endpoints={'ec2': 'https://ec2.example.com'})
+    assert settings.endpoints == {'ssm': 'https://vpce-0example.ssm.eu-west-1.vpce.amazonaws.com',
+                                  'ec2': 'https://ec2.example.com'}
+
+    # botocore's own variable wins over the file
+    monkeypatch.setenv('AWS_ENDPOINT_URL_SSM', 'https://ssm.example.com')
+    assert 'ssm' not in clientconfig.resolve().endpoints
+
+    with pytest.raises(ValueError):
+        clientconfig.parse_endpoints(['https://ssm.example.com'])
+
+
+def test_settings_round_trip_and_share_contexts(config_file):
+    settings = clientconfig.resolve()
+    copy = clientconfig.ClientSettings.from_dict(settings.to_dict())
+
+    assert copy == settings and hash(copy) == hash(settings)
+    assert copy != clientconfig.resolve({'read_timeout': 1})
+    with pytest.raises(TypeError):
+        clientconfig.ClientSettings(timeout=1)
+
+
+def test_clients_get_the_settings(config_file, monkeypatch):
+    aws = config_file.parent.parent.parent / ".aws"
+    aws.mkdir()
+    (aws / "config").write_text("[profile vscode]\nregion = eu-west-1\n")
+    monkeypatch.setattr(sessions, '_contexts', {})
+    settings = clientconfig.resolve({'max_attempts': 2})
+
+    ssm = sessions.context('vscode', client_config=settings).client('ssm')
+    ec2_connect = sessions.context('vscode', client_config=settings).client('ec2-instance-connect')
+
+    assert ssm.meta.endpoint_url == settings.endpoints['ssm']
+    assert ssm.meta.config.connect_timeout == 7.0 and ssm.meta.config.read_timeout == 20.0
+    assert ssm.meta.config.retries == {'mode': 'adaptive', 'total_max_attempts': 2}
+    assert ssm.meta.config.tcp_keepalive is False
+    assert ec2_connect.meta.endpoint_url == "https://ec2-instance-connect.eu-west-1.amazonaws.com"
+
+
+def test_connect_sends_settings_to_agent(home, monkeypatch):
+    targets = []
+    monkeypatch.setattr(agent, 'connect', lambda target, log, timing=None: targets.append(target) or True)
+
+    result = CliRunner().invoke(cli, ['connect', 'i-0123456789abcdef0', '--read-timeout', '4',
+                                      '--no-tcp-keepalive', '--endpoint-url', 'ssm=https://ssm.example.com'])
+
+    assert result.exit_code == 0, result.output
+    settings = clientconfig.ClientSettings.from_dict(targets[0]['client_config'])
+    assert settings == clientconfig.resolve({'read_timeout': 4.0, 'tcp_keepalive': False},
+                                            {'ssm': 'https://ssm.example.com'})
+
+
+def test_invalid_endpoint_option(home):
+    result = CliRunner().invoke(cli, ['connect', 'i-0123456789abcdef0', '--endpoint-url', 'ssm'])
+
+    assert result.exit_code == 2
+    assert "Expected SERVICE=URL" in result.output
+
+
+def test_settings_survive_the_command_line(home, monkeypatch):
+    targets = []
+    monkeypatch.setattr(agent, 'connect', lambda target, log, timing=None: targets.append(target) or True)
+    settings = clientconfig.resolve({'max_attempts': 5, 'tcp_keepalive': False}, {'ssm': 'https://ssm.example.com'})
+
+    result = CliRunner().invoke(cli, ['connect', 'i-0123456789abcdef0', *settings.to_args()])
+
+    assert result.exit_code == 0, result.output
+    assert clientconfig.ClientSettings.from_dict(targets[0]['client_config']) == settings
@@ -0,0 +1,110 @@
+"""Tests for cloudx_proxy.configfile, including many concurrent setup runs."""
+
+import multiprocessing
+import os
+import stat
+import time
+
+import pytest
+
+from cloudx_proxy import configfile
+from cloudx_proxy.setup import CloudXSetup
+
+WRITERS = 24
+HOSTS_PER_WRITER = 5
+
+
+def _writer(ssh_dir, start_at, writer, results):
+    """One `setup` run adding its own hosts to the shared config."""
+    setup = CloudXSetup(ssh_key="cloudX", ssh_dir=ssh_dir, ssh_host_prefix="cloudx", non_interactive=True)
+    setup.print_status = lambda *args, **kwargs: None
+    time.sleep(max(0.0, start_at - time.time()))
+
+    ok = all(setup._add_host_entry(f"env{writer % 3}", f"i-{writer:08x}{n:09x}", f"w{writer}n{n}")
+             for n in range(HOSTS_PER_WRITER))
+    results.put(ok)
+
+
+def test_parallel_writers_lose_no_updates(tmp_path):
+    ssh_dir = tmp_path / "cloudX"
+    config = ssh_dir / "config"
+    results = multiprocessing.Queue()
+    start_at = time.time() + 0.5
+    processes = [multiprocessing.Process(target=_writer, args=(str(ssh_dir), start_at, writer, results))
+                 for writer in range(WRITERS)]
+    for process in processes:
+        process.start()
+
+    # Readers (ssh) must never see a missing, truncated or half-written file once it exists
+    snapshots = 0
+    while any(process.is_alive() for process in processes):
+        content = configfile.read(config)
+        if content:
+            assert content.startswith("# SSH Configuration - Managed by") and content.endswith("\n")
+            snapshots += 1
+
+    outcomes = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(10)
+
+    assert outcomes == [True] * WRITERS
+    assert snapshots
+    content = config.read_text()
+    for writer in range(WRITERS):
+        for n in range(HOSTS_PER_WRITER):
+            assert f"Host cloudx-env{writer % 3}-w{writer}n{n}\n    HostName i-{writer:08x}{n:09x}\n" in content
+    assert content.count("\nHost cloudx-env") == WRITERS * HOSTS_PER_WRITER + 3
+    assert stat.S_IMODE(config.stat().st_mode) == 0o600
+    assert not list(ssh_dir.glob("*.tmp"))
+
+
+def test_compare_and_swap(tmp_path):
+    path = tmp_path / "config"
+    configfile.write(path, "Host a\n")
+    expected = configfile.digest(configfile.read(path))
+
+    configfile.write(path, "Host b\n")
+    with pytest.raises(configfile.ConfigChanged):
+        configfile.write(path, "Host c\n", expected=expected)
+
+    assert path.read_text() == "Host b\n"
+    configfile.write(path, "Host c\n", expected=configfile.digest("Host b\n"))
+    assert path.read_text() == "Host c\n"
+
+
+def test_failed_write_keeps_old_file(tmp_path, monkeypatch):
+    path = tmp_path / "config"
+    configfile.write(path, "Host a\n")
+
+    def fail(src, dst):
+        raise OSError("disk full")
+    monkeypatch.setattr(os, 'replace', fail)
+
+    with pytest.raises(OSError):
+        configfile.update(path, lambda content: content + "Host b\n")
+
+    assert path.read_text() == "Host a\n"
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")] == []
+
+
+def test_update_writes_only_changes(tmp_path, monkeypatch):
+    path = tmp_path / "new" / "config"
+
+    assert configfile.update(path, lambda content: content + "Host a\n") == ("", "Host a\n")
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+
+    monkeypatch.setattr(configfile, 'write_atomic', lambda path, content: pytest.fail("rewritten"))
+    assert configfile.update(path, lambda content: content) == ("Host a\n", "Host a\n")
+
+
+def test_symlinked_config_stays_a_link(tmp_path):
+    target = tmp_path / "dotfiles" / "ssh_config"
+    target.parent.mkdir()
+    target.write_text("Host a\n")
+    link = tmp_path / "config"
+    link.symlink_to(target)
+
+    configfile.update(link, lambda content: content + "Host b\n")
+
+    assert link.is_symlink()
+    assert target.read_text() == "Host a\nHost b\n"
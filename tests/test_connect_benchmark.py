@@ -0,0 +1,267 @@
+"""End-to-end connect benchmarks against local stand-ins for AWS.
+
+Each run starts `cloudx-proxy connect` the way ssh runs a ProxyCommand: as a
+subprocess whose stdin/stdout carry the SSH stream. The AWS APIs are served by
+StandInAWS (pointed at with --endpoint-url) and `aws ssm start-session` is a
+fake AWS CLI on PATH that echoes the stream back (plugin_standin); native
+connects relay through the StandInSSM data channel echo. Per scenario the suite reports:
+
+- cold start: process start until its first log line (interpreter and imports)
+- first byte: process start until a byte written to stdin comes back
+- throughput: MB/s relayed through the session once it is up
+
+Timings are printed (pytest -s) and, when $CLOUDX_PROXY_BENCHMARK_OUTPUT is
+set, written there as JSON. The AWS calls of every scenario are asserted,
+so an extra round trip on the ProxyCommand hot path fails the suite.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from . import plugin_standin
+from .aws_standin import StandInAWS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+PUBLIC_KEY = "ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAIJ1xWmGKOiwEZ1NdbQvD9kjbEuvgzTPrHKkcADxwNYbR bench\n"
+
+OUTPUT_ENV = "CLOUDX_PROXY_BENCHMARK_OUTPUT"
+
+RUNS = 3
+PARALLEL = 8
+PAYLOAD = os.urandom(2 * 1024 * 1024)
+
+
+@pytest.fixture(scope='module')
+def bench(tmp_path_factory):
+    """Stand-in AWS, a prepared HOME and the environment connect runs in."""
+    if sys.platform == 'win32':
+        pytest.skip("uses a shell script as the AWS CLI")
+    home = tmp_path_factory.mktemp('home')
+    (home / ".aws").mkdir()
+    (home / ".aws" / "config").write_text("[profile cloudX]\nregion = eu-west-1\n")
+    (home / ".aws" / "credentials").write_text("[cloudX]\naws_access_key_id = AKIDSTANDIN\n"
+                                               "aws_secret_access_key = stand-in\n")
+    (home / ".ssh" / "cloudX").mkdir(parents=True)
+    (home / ".ssh" / "cloudX" / "cloudX.pub").write_text(PUBLIC_KEY)
+    bin_dir = home / "bin"
+    bin_dir.mkdir()
+    plugin_standin.install(bin_dir)
+
+    env = {name: value for name, value in os.environ.items()
+           if not name.startswith(('AWS_', 'CLOUDX_PROXY_', 'COVERAGE_'))}
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env.update(HOME=str(home), PATH=f"{bin_dir}{os.pathsep}{env.get('PATH', '')}", PYTHONPATH=ROOT)
+    # Compile once so that cold start measures imports, not compilation
+    subprocess.run([sys.executable, '-m', 'compileall', '-q', os.path.join(ROOT, 'cloudx_proxy')], check=True)
+
+    standin = StandInAWS()
+    results = {}
+    yield {'standin': standin, 'home': home, 'env': env, 'results': results}
+    standin.close()
+
+    print()
+    print(f"    {'scenario':10} {'cold start':>12} {'first byte':>12} {'throughput':>12}")
+    for name, result in results.items():
+        print(f"    {name:10} {result['cold_start'] * 1000:9.1f} ms {result['first_byte'] * 1000:9.1f} ms"
+              f" {result['throughput']:7.1f} MB/s")
+    if os.environ.get(OUTPUT_ENV):
+        with open(os.environ[OUTPUT_ENV], 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def _forget_caches(home):
+    """Drop the status and key push caches so the next connect asks AWS again."""
+    for name in ("cloudx-proxy-status.json", "cloudx-proxy-keypush.json"):
+        try:
+            (home / ".ssh" / "control" / name).unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _connect(bench, *options, payload=PAYLOAD) -> dict:
+    """Run one connect as a ProxyCommand and time it."""
+    url = bench['standin'].url
+    command = [sys.executable, '-m', 'cloudx_proxy', 'connect', INSTANCE_ID, '22', '--no-agent',
+               '--endpoint-url', f"ssm={url}", '--endpoint-url', f"ec2={url}",
+               '--endpoint-url', f"ec2-instance-connect={url}", *options]
+    started = time.perf_counter()
+    process = subprocess.Popen(command, env=bench['env'], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    log, first_log = [], []
+
+    def read_log():
+        for line in process.stderr:
+            if not first_log:
+                first_log.append(time.perf_counter())
+            log.append(line.decode(errors='replace'))
+
+    reader = threading.Thread(target=read_log, daemon=True)
+    reader.start()
+
+    process.stdin.write(b'\0')
+    process.stdin.flush()
+    echoed = process.stdout.read(1)
+    first_byte = time.perf_counter()
+
+    def send():
+        process.stdin.write(payload)
+        process.stdin.close()
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    received = process.stdout.read(len(payload))
+    relayed = time.perf_counter()
+    process.wait(timeout=30)
+    sender.join()
+    reader.join()
+
+    assert echoed == b'\0' and received == payload, ''.join(log)
+    assert process.returncode == 0, ''.join(log)
+    return {
+        'cold_start': first_log[0] - started,
+        'first_byte': first_byte - started,
+        'throughput': len(payload) / (relayed - first_byte) / 1e6,
+    }
+
+
+def _best(runs: list) -> dict:
+    return {
+        'cold_start': min(run['cold_start'] for run in runs),
+        'first_byte': min(run['first_byte'] for run in runs),
+        'throughput': max(run['throughput'] for run in runs),
+    }
+
+
+def _record(bench, name, runs):
+    bench['results'][name] = _best(runs)
+
+
+def test_warm_instance(bench):
+    standin = bench['standin']
+    standin.add_instance(INSTANCE_ID, 'running')
+    runs = []
+    for _ in range(RUNS):
+        _forget_caches(bench['home'])
+        standin.reset_calls()
+        runs.append(_connect(bench))
+        assert standin.calls == {'DescribeInstanceInformation': 1, 'SendSSHPublicKey': 1}
+    _record(bench, 'warm', runs)
+
+
+def test_cached_instance(bench):
+    standin = bench['standin']
+    standin.add_instance(INSTANCE_ID, 'running')
+    _forget_caches(bench['home'])
+    _connect(bench)
+
+    runs = []
+    for _ in range(RUNS):
+        standin.reset_calls()
+        runs.append(_connect(bench))
+        # The cached Online status skips SSM. The key is pushed again: the
+        # stand-in's echo has no SSH key exchange, so it looks like a rejected login.
+        assert standin.calls == {'SendSSHPublicKey': 1}
+    _record(bench, 'cached', runs)
+
+
+def test_stopped_instance(bench):
+    standin = bench['standin']
+    # Let the adaptive wake-up expect the stand-in's short boot
+    history = bench['home'] / ".ssh" / "control" / "cloudx-proxy-wakeup.json"
+    history.parent.mkdir(parents=True, exist_ok=True)
+    history.write_text(json.dumps({INSTANCE_ID: {'boot': [standin.boot], 'register': [standin.register],
+                                                 'total': [standin.boot + standin.register]}}))
+    standin.add_instance(INSTANCE_ID, 'stopped')
+    _forget_caches(bench['home'])
+    standin.reset_calls()
+
+    result = _connect(bench)
+
+    assert standin.calls['StartInstances'] == 1
+    assert standin.calls['SendSSHPublicKey'] == 1
+    assert standin.state(INSTANCE_ID) == ('running', 'Online')
+    assert result['first_byte'] > standin.boot + standin.register
+    _record(bench, 'stopped', [result])
+
+
+def test_parallel_connections(bench):
+    """The concurrent ssh processes VS Code starts share one preparation."""
+    standin = bench['standin']
+    standin.add_instance(INSTANCE_ID, 'running')
+    _forget_caches(bench['home'])
+    standin.reset_calls()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=PARALLEL) as pool:
+        runs = list(pool.map(lambda _: _connect(bench, payload=PAYLOAD[:256 * 1024]), range(PARALLEL)))
+    elapsed = time.perf_counter() - started
+
+    assert standin.calls['SendSSHPublicKey'] == 1
+    assert standin.calls['DescribeInstanceInformation'] <= PARALLEL
+    # The slowest connect is what the user waits for
+    bench['results']['parallel'] = {
+        'cold_start': max(run['cold_start'] for run in runs),
+        'first_byte': max(run['first_byte'] for run in runs),
+        'throughput': sum(run['throughput'] for run in runs),
+        'elapsed': elapsed,
+    }
+
+
+def test_native_session(bench):
+    standin = bench['standin']
+    standin.add_instance(INSTANCE_ID, 'running')
+    runs = []
+    for _ in range(RUNS):
+        _forget_caches(bench['home'])
+        standin.reset_calls()
+        runs.append(_connect(bench, '--native'))
+        assert standin.calls == {'DescribeInstanceInformation': 1, 'SendSSHPublicKey': 1, 'StartSession': 1,
+                                 'TerminateSession': 1}
+    _record(bench, 'native', runs)
+
+
+def test_relayed_session(bench):
+    standin = bench['standin']
+    standin.add_instance(INSTANCE_ID, 'running')
+    runs = []
+    for _ in range(RUNS):
+        _forget_caches(bench['home'])
+        standin.reset_calls()
+        runs.append(_connect(bench, '--relay'))
+        assert standin.calls == {'DescribeInstanceInformation': 1, 'SendSSHPublicKey': 1}
+    _record(bench, 'relay', runs)
+
+
+def test_multiplexed_session(bench):
+    """connect --mux: the first connect starts the mux, the others reuse its session."""
+    standin = bench['standin']
+    standin.add_instance(INSTANCE_ID, 'running')
+    _forget_caches(bench['home'])
+    standin.reset_calls()
+    runs = []
+    try:
+        for _ in range(RUNS):
+            runs.append(_connect(bench, '--mux'))
+    finally:
+        subprocess.run([sys.executable, '-m', 'cloudx_proxy', 'mux', '--stop'], env=bench['env'],
+                       capture_output=True, timeout=30)
+    # One instance check for the shared session; the key push is reused
+    assert standin.calls == {'DescribeInstanceInformation': 1, 'SendSSHPublicKey': 1}
+    bench['results']['mux'] = _best(runs[1:])
+    bench['results']['mux_start'] = runs[0]
+
+
+def test_cached_beats_stopped(bench):
+    results = bench['results']
+    if not {'cached', 'stopped'} <= set(results):
+        pytest.skip("needs the cached and stopped scenarios")
+    assert results['cached']['first_byte'] < results['stopped']['first_byte']
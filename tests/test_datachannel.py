@@ -0,0 +1,161 @@
+"""Tests for cloudx_proxy.datachannel against a local stand-in SSM endpoint."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import pytest
+
+from cloudx_proxy import datachannel as dc
+from .ssm_standin import StandInSSM
+
+
+@pytest.fixture
+def standin():
+    server = StandInSSM()
+    yield server
+    server.close()
+
+
+def _relay_through(session: dict, payload: bytes) -> tuple:
+    """Relay payload through a native data channel; return (echo, first byte latency, total time)."""
+    in_read, in_write = os.pipe()
+    out_read, out_write = os.pipe()
+    received = bytearray()
+    first_byte = []
+    start = time.perf_counter()
+
+    def feed():
+        os.write(in_write, payload[:1])
+        while not received:
+            time.sleep(0.0005)
+        for offset in range(1, len(payload), 65536):
+            os.write(in_write, payload[offset:offset + 65536])
+        os.close(in_write)
+
+    def drain():
+        while len(received) < len(payload):
+            chunk = os.read(out_read, 65536)
+            if not chunk:
+                break
+            if not received:
+                first_byte.append(time.perf_counter() - start)
+            received.extend(chunk)
+
+    threads = [threading.Thread(target=feed), threading.Thread(target=drain)]
+    for thread in threads:
+        thread.start()
+    status = dc.relay_session(session, log=lambda message: None, in_fd=in_read, out_fd=out_write)
+    for thread in threads:
+        thread.join(10)
+    elapsed = time.perf_counter() - start
+    for fd in (in_read, out_read, out_write):
+        os.close(fd)
+    assert status == 0
+    return bytes(received), first_byte[0], elapsed
+
+
+class TestClientMessage:
+    def test_round_trip(self):
+        message = dc.ClientMessage(dc.INPUT_STREAM_DATA, 42, b"hello", dc.PAYLOAD_OUTPUT, flags=1)
+        decoded = dc.ClientMessage.decode(message.encode())
+
+        assert decoded.message_type == dc.INPUT_STREAM_DATA
+        assert decoded.sequence_number == 42
+        assert decoded.payload == b"hello"
+        assert decoded.payload_type == dc.PAYLOAD_OUTPUT
+        assert decoded.flags == 1
+        assert decoded.message_id == message.message_id
+
+    def test_header_layout_matches_plugin(self):
+        message_id = uuid.UUID("00112233-4455-6677-8899-aabbccddeeff")
+        encoded = dc.ClientMessage(dc.ACKNOWLEDGE, 0, b"{}", message_id=message_id).encode()
+
+        assert int.from_bytes(encoded[0:4], 'big') == 116
+        assert encoded[4:36] == b"acknowledge".ljust(32)
+        # The plugin stores the least significant half of the UUID first
+        assert encoded[64:80] == bytes.fromhex("8899aabbccddeeff0011223344556677")
+        assert int.from_bytes(encoded[116:120], 'big') == 2
+        assert len(encoded) == 122
+
+    def test_truncated_message_rejected(self):
+        with pytest.raises(dc.DataChannelError):
+            dc.ClientMessage.decode(b"\x00" * 50)
+
+
+class TestRelay:
+    def test_echo(self, standin):
+        payload = os.urandom(100_000)
+
+        echoed, _, _ = _relay_through(standin.session, payload)
+
+        assert echoed == payload
+        assert bytes(standin.received) == payload
+
+    def test_unacknowledged_message_is_resent(self, monkeypatch):
+        monkeypatch.setattr(dc, "RESEND_TIMEOUT", 0.05)
+        server = StandInSSM(drop_first_data=True)
+        try:
+            echoed, _, _ = _relay_through(server.session, b"resend me")
+        finally:
+            server.close()
+
+        assert echoed == b"resend me"
+
+    def test_kms_session_is_refused_before_reading_stdin(self):
+        server = StandInSSM(require_kms=True)
+        try:
+            in_read, in_write = os.pipe()
+            os.write(in_write, b"untouched")
+            status = dc.relay_session(server.session, log=lambda message: None, in_fd=in_read, out_fd=1)
+            leftover = os.read(in_read, 100)
+            os.close(in_read)
+            os.close(in_write)
+        finally:
+            server.close()
+
+        assert status is None, "caller must be told to fall back"
+        assert leftover == b"untouched"
+
+    def test_bad_url_falls_back(self):
+        session = {'SessionId': 's', 'TokenValue': 't', 'StreamUrl': 'ws://127.0.0.1:1/nothing'}
+
+        assert dc.relay_session(session, log=lambda message: None) is None
+
+
+def test_native_vs_subprocess_relay(standin, capsys):
+    """Compare the in-process relay with the same relay behind an extra process hop.
+
+    The subprocess variant mirrors today's CLI path, where bytes pass
+    through a separate interpreter before reaching the websocket.
+    """
+    payload = os.urandom(512 * 1024)
+
+    native_echo, native_latency, native_time = _relay_through(standin.session, payload)
+
+    script = (
+        "import sys; from cloudx_proxy.datachannel import relay_session; "
+        f"sys.exit(relay_session({standin.session!r}, log=lambda m: None) or 0)"
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               cwd=os.path.dirname(os.path.dirname(__file__)))
+    process.stdin.write(payload[:1])
+    process.stdin.flush()
+    first = process.stdout.read(1)
+    sub_latency = time.perf_counter() - start
+    rest, _ = process.communicate(payload[1:], timeout=60)
+    sub_time = time.perf_counter() - start
+
+    assert native_echo == payload
+    assert first + rest == payload
+
+    with capsys.disabled():
+        size_mb = len(payload) / 1e6
+        print(f"\n  native relay:     first byte {native_latency * 1000:7.1f} ms, "
+              f"{size_mb / native_time:6.1f} MB/s")
+        print(f"  subprocess relay: first byte {sub_latency * 1000:7.1f} ms, "
+              f"{size_mb / sub_time:6.1f} MB/s")
@@ -0,0 +1,174 @@
+"""Tests for cloudx_proxy.fleet and the status command."""
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from click.testing import CliRunner
+
+from cloudx_proxy import fleet
+from cloudx_proxy.cli import cli
+from cloudx_proxy.sshconfig import SSHConfig
+
+CONFIG = """\
+# Managed by cloudX-proxy
+Host cloudx-*
+    User ec2-user
+
+Host cloudx-dev-*
+    IdentityFile ~/.ssh/cloudX/cloudX
+    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env dev
+
+Host cloudx-dev-web # frontend
+    HostName i-0000000000000000a
+
+Host cloudx-dev-db
+    HostName i-0000000000000000b
+
+Host cloudx-prod-*
+    ProxyCommand uvx cloudx-proxy connect %h %p --profile prod --region us-east-1
+
+Host cloudx-prod-api
+    HostName i-0000000000000000c
+"""
+
+
+def _instance_id(n):
+    return f"i-{n:017x}"
+
+
+def _hosts(count, **options):
+    return [dict({'profile': 'cloudX', 'aws_env': None, 'region': None}, instance_id=_instance_id(n), **options)
+            for n in range(count)]
+
+
+class StubbedSessions:
+    """context_factory handing out stubbed ec2 and ssm clients, one pair per (profile, aws-env, region)."""
+
+    def __init__(self):
+        self.groups = {}
+
+    def __call__(self, profile, aws_env, region):
+        session = boto3.Session(aws_access_key_id='testing', aws_secret_access_key='testing',
+                                region_name=region or 'eu-west-1')
+        clients = {name: session.client(name) for name in ('ec2', 'ssm')}
+        stubbers = {name: Stubber(client) for name, client in clients.items()}
+        for stubber in stubbers.values():
+            stubber.activate()
+        self.groups[(profile, aws_env, region)] = stubbers
+        self.configure(stubbers)
+
+        class Context:
+            def client(self, name):
+                return clients[name]
+        return Context()
+
+    def configure(self, stubbers):
+        pass
+
+
+def _reservations(instance_ids, state='running'):
+    return {'Reservations': [{'Instances': [{'InstanceId': i, 'State': {'Name': state}} for i in instance_ids]}]}
+
+
+def _information(instance_ids, ping='Online'):
+    return {'InstanceInformationList': [{'InstanceId': i, 'PingStatus': ping} for i in instance_ids]}
+
+
+def test_connect_options():
+    assert fleet.connect_options("uvx cloudx-proxy connect %h %p --aws-env dev --profile=ops") == {
+        'aws_env': 'dev', 'profile': 'ops'}
+    assert fleet.connect_options("uvx cloudx-proxy connect %h %p") == {}
+
+
+def test_configured_hosts_take_options_from_environment():
+    config = SSHConfig.parse(CONFIG)
+    hosts = {h['name']: h for h in fleet.configured_hosts(config, 'cloudx', 'cloudX')}
+
+    assert hosts['web']['instance_id'] == 'i-0000000000000000a'
+    assert hosts['web']['comment'] == 'frontend'
+    assert (hosts['db']['profile'], hosts['db']['aws_env'], hosts['db']['region']) == ('cloudX', 'dev', None)
+    assert (hosts['api']['profile'], hosts['api']['region']) == ('prod', 'us-east-1')
+    assert [h['name'] for h in fleet.configured_hosts(config, 'cloudx', 'cloudX', environment='PROD')] == ['api']
+
+
+def test_many_hosts_take_few_calls():
+    instance_ids = [_instance_id(n) for n in range(500)]
+    sessions = StubbedSessions()
+
+    def configure(stubbers):
+        for start in range(0, 500, fleet.EC2_CHUNK):
+            stubbers['ec2'].add_response('describe_instances', _reservations(instance_ids[start:start + fleet.EC2_CHUNK]))
+        for start in range(0, 500, fleet.SSM_CHUNK):
+            # The last instance of every chunk is not registered with SSM
+            stubbers['ssm'].add_response('describe_instance_information',
+                                         _information(instance_ids[start:start + fleet.SSM_CHUNK - 1]))
+    sessions.configure = configure
+
+    results = fleet.fetch_status(_hosts(500), context_factory=sessions, max_workers=1)
+
+    stubbers = sessions.groups[('cloudX', None, None)]
+    for stubber in stubbers.values():
+        stubber.assert_no_pending_responses()
+    assert len(results) == 500
+    assert results[instance_ids[0]] == {'state': 'running', 'ping': 'Online', 'error': None}
+    assert results[instance_ids[49]]['ping'] is None
+
+
+def test_groups_and_errors_are_separate():
+    sessions = StubbedSessions()
+
+    def configure(stubbers):
+        if len(sessions.groups) == 1:
+            stubbers['ec2'].add_response('describe_instances', _reservations([_instance_id(0)], 'stopped'))
+            stubbers['ssm'].add_response('describe_instance_information', _information([]))
+        else:
+            stubbers['ec2'].add_client_error('describe_instances', 'AuthFailure')
+            stubbers['ssm'].add_client_error('describe_instance_information', 'AccessDeniedException')
+    sessions.configure = configure
+
+    hosts = _hosts(2) + [dict(h, aws_env='prod', instance_id=_instance_id(10)) for h in _hosts(1)]
+    results = fleet.fetch_status(hosts, context_factory=sessions, max_workers=1)
+
+    assert len(sessions.groups) == 2
+    assert results[_instance_id(0)] == {'state': 'stopped', 'ping': None, 'error': None}
+    assert results[_instance_id(1)]['state'] == 'not found'
+    assert results[_instance_id(10)]['state'] is None
+    assert 'AccessDeniedException' in results[_instance_id(10)]['error']
+
+
+def test_status_command(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+    monkeypatch.setattr(fleet, 'fetch_status', lambda hosts, client_config: {
+        'i-0000000000000000a': {'state': 'running', 'ping': 'Online', 'error': None},
+        'i-0000000000000000b': {'state': 'stopped', 'ping': None, 'error': None},
+        'i-0000000000000000c': {'state': None, 'ping': None, 'error': 'ExpiredToken'},
+    })
+
+    result = CliRunner().invoke(cli, ['status', '--ssh-config', str(config)])
+    assert result.exit_code == 0, result.output
+    assert 'i-0000000000000000a' in result.output and 'Online' in result.output
+    assert 'ExpiredToken' in result.output
+    assert '3 instances: 1 running, 1 Online' in result.output
+
+    result = CliRunner().invoke(cli, ['list', '--status', '--ssh-config', str(config)])
+    assert result.exit_code == 0, result.output
+    assert 'running, Online' in result.output
+
+
+def test_clients_use_the_client_settings(monkeypatch):
+    from cloudx_proxy import sessions
+    from cloudx_proxy.clientconfig import resolve
+
+    settings = resolve({'read_timeout': 2.0})
+    contexts = []
+
+    def context(profile, aws_env, region, client_config=None):
+        contexts.append((profile, aws_env, region, client_config))
+        return StubbedSessions()(profile, aws_env, region)
+    monkeypatch.setattr(sessions, 'context', context)
+
+    fleet.fetch_status(_hosts(1, region='us-east-1'), settings, max_workers=1)
+
+    assert contexts == [('cloudX', None, 'us-east-1', settings)]
@@ -0,0 +1,181 @@
+"""Tests for cloudx_proxy.hostindex and the commands reading hosts from it."""
+
+import os
+import sqlite3
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from cloudx_proxy import fleet, hostindex
+from cloudx_proxy.cli import cli
+from cloudx_proxy.setup import CloudXSetup
+from cloudx_proxy.sshconfig import SSHConfig
+
+CONFIG = """\
+# Managed by cloudX-proxy
+Host cloudx-*
+    User ec2-user
+
+Host cloudx-dev-*
+    IdentityFile ~/.ssh/cloudX/cloudX
+    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env dev
+
+Host cloudx-dev-web # frontend
+    HostName i-0000000000000000a
+
+Host cloudx-dev-db
+    HostName i-0000000000000000b
+
+Host cloudx-prod-*
+    ProxyCommand uvx cloudx-proxy connect %h %p --profile prod --region us-east-1
+
+Host cloudx-prod-api
+    HostName i-0000000000000000c
+"""
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config"
+    path.write_text(CONFIG)
+    return path
+
+
+@pytest.fixture
+def index(tmp_path):
+    with hostindex.HostIndex(tmp_path / "control" / hostindex.INDEX_FILE) as index:
+        yield index
+
+
+def _no_parsing(monkeypatch):
+    monkeypatch.setattr(hostindex, '_scan', lambda *args: pytest.fail("config parsed again"))
+
+
+def _generated(count):
+    lines = ["Host cloudx-dev-*", "    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env dev", ""]
+    for n in range(count):
+        lines += [f"Host cloudx-dev-host{n}", f"    HostName i-{n:017x}", ""]
+    return "\n".join(lines)
+
+
+def test_hosts_match_configured_hosts(config, index):
+    expected = fleet.configured_hosts(SSHConfig.parse(CONFIG), 'cloudx', 'cloudX')
+    key = lambda host: (host['environment'], host['name'])
+
+    assert index.hosts(config, 'cloudx', 'cloudX') == sorted(expected, key=key)
+    assert [h['host'] for h in index.hosts(config, 'cloudX', 'cloudX', environment='DEV')] == [
+        'cloudx-dev-db', 'cloudx-dev-web']
+    assert index.patterns(config, 'cloudx') == ['cloudx-*', 'cloudx-dev-*', 'cloudx-prod-*']
+    assert index.environments(config, 'cloudx') == ['dev', 'prod']
+    assert os.stat(index.path).st_mode & 0o777 == 0o600
+
+
+def test_lookups(config, index):
+    [host] = index.find(config, 'cloudx', 'cloudX', instance_id='i-0000000000000000c')
+    assert (host['host'], host['profile'], host['region']) == ('cloudx-prod-api', 'prod', 'us-east-1')
+    assert index.find(config, 'cloudx', 'cloudX', host='cloudx-dev-web')[0]['comment'] == 'frontend'
+    assert index.find(config, 'cloudx', 'cloudX', instance_id='i-ffffffffffffffff0') == []
+
+
+def test_unchanged_config_is_not_parsed_again(config, index, monkeypatch):
+    index.hosts(config, 'cloudx', 'cloudX')
+    _no_parsing(monkeypatch)
+
+    assert len(index.hosts(config, 'cloudx', 'cloudX')) == 3
+    # Same content under a new mtime (and a new inode, as configfile writes it) is only hashed
+    os.replace(config, config.with_name("moved"))
+    config.with_name("moved").rename(config)
+    os.utime(config, ns=(time.time_ns(), time.time_ns() + 10**9))
+    assert len(index.hosts(config, 'cloudx', 'cloudX')) == 3
+
+
+def test_changes_are_applied_incrementally(config, index):
+    index.hosts(config, 'cloudx', 'cloudX')
+    db = index._connect()
+    config.write_text(CONFIG.replace("i-0000000000000000b", "i-0000000000000000d").replace(
+        "Host cloudx-prod-api\n    HostName i-0000000000000000c\n", ""))
+    before = db.total_changes
+
+    hosts = index.hosts(config, 'cloudx', 'cloudX')
+
+    assert [h['instance_id'] for h in hosts] == ['i-0000000000000000d', 'i-0000000000000000a']
+    assert index.patterns(config, 'cloudx') == ['cloudx-*', 'cloudx-dev-*', 'cloudx-prod-*']
+    # configs row, one changed host, one removed host, and the three patterns (deleted and inserted)
+    assert db.total_changes - before == 1 + 2 + 3 + 3
+
+
+def test_other_format_version_is_rebuilt(config, index):
+    index.hosts(config, 'cloudx', 'cloudX')
+    index.close()
+    with sqlite3.connect(index.path) as db:
+        db.execute("PRAGMA user_version = 0")
+        db.execute("DELETE FROM hosts")
+
+    assert len(index.hosts(config, 'cloudx', 'cloudX')) == 3
+
+
+def test_unusable_index_falls_back_to_parsing(config, tmp_path):
+    path = tmp_path / "broken.sqlite"
+    path.write_text("not a database" * 100)
+
+    with hostindex.HostIndex(path) as index:
+        assert len(index.hosts(config, 'cloudx', 'cloudX', environment='prod')) == 1
+        assert index.patterns(config, 'cloudx')[0] == 'cloudx-*'
+    with pytest.raises(FileNotFoundError):
+        hostindex.HostIndex(path).hosts(tmp_path / "missing", 'cloudx', 'cloudX')
+
+
+def test_lookup_cost_does_not_grow_with_config(tmp_path, index):
+    timings = {}
+    for count in (10, 10000):
+        config = tmp_path / f"config{count}"
+        config.write_text(_generated(count))
+        index.hosts(config, 'cloudx', 'cloudX')
+
+        best = float('inf')
+        for _ in range(5):
+            start = time.perf_counter()
+            [host] = index.find(config, 'cloudx', 'cloudX', instance_id=f"i-{count - 1:017x}")
+            index.hosts(config, 'cloudx', 'cloudX', environment='prod')
+            best = min(best, time.perf_counter() - start)
+        timings[count] = best
+        assert host['host'] == f"cloudx-dev-host{count - 1}"
+
+    assert timings[10000] < timings[10] * 5 + 0.001
+
+
+def test_commands_use_the_index(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+    runner = CliRunner()
+    assert runner.invoke(cli, ['list', '--ssh-config', str(config)]).exit_code == 0
+    _no_parsing(monkeypatch)
+
+    result = runner.invoke(cli, ['list', '--detailed', '--ssh-config', str(config)])
+    assert result.exit_code == 0, result.output
+    assert 'cloudx-dev-*' in result.output and 'i-0000000000000000b' in result.output
+
+    setup = CloudXSetup(ssh_config=str(config), ssh_host_prefix='cloudx', dry_run=True)
+    messages = []
+    setup.print_status = lambda message, *args: messages.append(message)
+    assert setup.cleanup_config()
+    assert "[DRY RUN] Would reorganize 2 environments" in messages
+    assert "[DRY RUN] Would reorganize 3 host entries" in messages
+
+
+def test_shell_completion(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+
+    def complete(words):
+        monkeypatch.setenv('COMP_WORDS', f"cloudx-proxy {words}")
+        monkeypatch.setenv('COMP_CWORD', str(len(words.split(' '))))
+        result = CliRunner().invoke(cli, [], prog_name='cloudx-proxy', env={'_CLOUDX_PROXY_COMPLETE': 'bash_complete'})
+        return [line.split(',', 1)[1] for line in result.output.splitlines()]
+
+    assert complete(f"status --ssh-config {config} --environment p") == ['prod']
+    assert sorted(complete(f"connect --ssh-config {config} i-0000000000000000")) == [
+        'i-0000000000000000a', 'i-0000000000000000b', 'i-0000000000000000c']
@@ -0,0 +1,197 @@
+"""Tests for cloudx_proxy.launcher and the launcher form of ProxyCommand."""
+
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from cloudx_proxy import fleet, launcher
+from cloudx_proxy.cli import cli
+from cloudx_proxy.setup import CloudXSetup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """\
+Host cloudx-*
+    User ec2-user
+
+# production, ask ops before changing
+Host cloudx-prod-*
+    IdentityFile ~/.ssh/cloudX/cloudX
+    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env prod # pinned region below
+    ProxyCommand uvx cloudx-proxy connect %h %p --profile prod --region us-east-1
+
+Host cloudx-prod-api
+    HostName i-0000000000000000c
+
+Host bastion
+    ProxyCommand ssh -W %h:%p jump
+"""
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return tmp_path
+
+
+def _fake_install(venv=None):
+    """Create the console scripts install() would leave behind."""
+    directory = launcher.bin_dir(venv)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name in launcher.SCRIPTS + ('python',):
+        (directory / name).write_text("#!/bin/sh\n")
+    return directory
+
+
+def _setup(config, **kwargs):
+    setup = CloudXSetup(ssh_config=str(config), ssh_host_prefix='cloudx', **kwargs)
+    setup.print_status = lambda *args, **kw: None
+    return setup
+
+
+@pytest.mark.parametrize('uv', [None, '/usr/bin/uv'])
+def test_install_commands(home, monkeypatch, uv):
+    monkeypatch.setattr(launcher.shutil, 'which', lambda name: uv)
+    commands = []
+
+    def run(command, check):
+        commands.append(command)
+        if command[0] != str(launcher.bin_dir() / 'python'):
+            _fake_install()
+    venv = str(launcher.default_venv())
+    python = str(launcher.bin_dir() / 'python')
+
+    assert launcher.install(run=run) == launcher.bin_dir()
+    if uv:
+        assert commands == [[uv, 'venv', '--quiet', venv],
+                            [uv, 'pip', 'install', '--quiet', '--python', python, launcher.default_package()]]
+    else:
+        assert commands[0][1:] == ['-m', 'venv', venv]
+        assert commands[1][:4] == [python, '-m', 'pip', 'install'] and commands[1][-1] == launcher.default_package()
+
+    # An existing environment is reused
+    commands.clear()
+    launcher.install('cloudx-proxy==0.16.3', run=run)
+    assert len(commands) == 1 and commands[0][-1] == 'cloudx-proxy==0.16.3'
+
+
+def test_install_without_scripts_fails(home, monkeypatch):
+    monkeypatch.setattr(launcher.shutil, 'which', lambda name: None)
+    with pytest.raises(FileNotFoundError):
+        launcher.install(run=lambda command, check: None)
+
+
+@pytest.mark.parametrize('directory', [None, '/opt/cloudx proxy/bin', '/home/100%/bin'])
+def test_program_round_trip(directory):
+    directory = directory and launcher.Path(directory)
+    command = launcher.program('cloudX-proxy', directory) + " connect %h %p --aws-env dev"
+
+    assert launcher.proxy_program(command) == ('cloudX-proxy', directory, " connect %h %p --aws-env dev")
+    assert fleet.connect_options(command) == {'aws_env': 'dev'}
+
+
+def test_other_commands_are_not_launchers():
+    assert launcher.proxy_program("ssh -W %h:%p jump") is None
+    assert launcher.proxy_program("uvx other-tool connect %h") is None
+    assert launcher.proxy_program("/usr/bin/nc connect %h %p") is None
+
+
+def test_convert_in_place_and_back(home, tmp_path):
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+    directory = _fake_install()
+
+    assert _setup(config, proxy_command='launcher').convert_proxy_commands()
+    converted = config.read_text()
+    script = directory / 'cloudx-proxy'
+    assert converted == CONFIG.replace("uvx cloudx-proxy", str(script))
+
+    assert _setup(config, proxy_command='uvx').convert_proxy_commands()
+    assert config.read_text() == CONFIG
+
+
+def test_launcher_must_be_installed(home, tmp_path):
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+
+    assert not _setup(config, proxy_command='launcher').convert_proxy_commands()
+    assert not _setup(config, proxy_command='launcher').cleanup_config()
+    assert config.read_text() == CONFIG
+
+
+def test_cleanup_and_setup_keep_the_form(home, tmp_path):
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+    script = str(_fake_install() / 'cloudx-proxy')
+
+    assert _setup(config, proxy_command='launcher').cleanup_config()
+    assert f"ProxyCommand {script} connect %h %p" in config.read_text()
+
+    # Without --proxy-command, cleanup and new environments follow the config
+    assert _setup(config).cleanup_config()
+    assert _setup(config)._add_host_entry('dev', 'i-0000000000000000d', 'web')
+    content = config.read_text()
+    assert "uvx" not in content
+    assert f"ProxyCommand {script} connect %h %p" in content.split("Host cloudx-dev-*")[1]
+
+    assert _setup(config, proxy_command='uvx').cleanup_config()
+    assert script not in config.read_text()
+    assert "ProxyCommand uvx cloudx-proxy connect %h %p" in config.read_text()
+
+
+def test_install_launcher_command(home, tmp_path, monkeypatch):
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+    installs = []
+    monkeypatch.setattr(launcher, 'install', lambda package: installs.append(package) or _fake_install())
+    runner = CliRunner()
+
+    result = runner.invoke(cli, ['install-launcher', '--ssh-config', str(config), '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert installs == [] and config.read_text() == CONFIG
+
+    result = runner.invoke(cli, ['install-launcher', '--ssh-config', str(config)])
+    assert result.exit_code == 0, result.output
+    assert installs == [launcher.default_package()]
+    assert "Changed 2 ProxyCommands to the launcher" in result.output
+    assert config.read_text().count(str(launcher.bin_dir() / 'cloudx-proxy')) == 2
+
+    result = runner.invoke(cli, ['cleanup', '--ssh-config', str(config), '--proxy-command', 'uvx'])
+    assert result.exit_code == 0, result.output
+    assert "uvx cloudx-proxy connect" in config.read_text()
+
+
+def _time_to_first_byte(command, env, runs=5):
+    """Best time from starting a ProxyCommand until it writes its first byte."""
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        process.stderr.read(1)
+        best = min(best, time.perf_counter() - start)
+        process.kill()
+        process.wait()
+        process.stderr.close()
+    return best
+
+
+@pytest.mark.skipif(not shutil.which('uvx'), reason="needs uv")
+def test_time_to_first_byte(tmp_path):
+    env = dict(os.environ, HOME=str(tmp_path))
+    directory = launcher.install(ROOT, venv=tmp_path / "venv")
+    connect = ['connect', 'i-0123456789abcdef0', '22', '--dry-run']
+
+    timings = {
+        'uvx': _time_to_first_byte(['uvx', '--from', ROOT, 'cloudx-proxy'] + connect, env),
+        'launcher': _time_to_first_byte([str(directory / 'cloudx-proxy')] + connect, env),
+    }
+    print()
+    for name, seconds in timings.items():
+        print(f"    {name:9} {seconds * 1000:7.1f} ms to first byte")
+
+    assert timings['launcher'] < timings['uvx']
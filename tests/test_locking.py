@@ -0,0 +1,154 @@
+"""Tests for cloudx_proxy.locking, including a multi-process connection storm."""
+
+import multiprocessing
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from cloudx_proxy import locking, wakeup
+from cloudx_proxy.core import CloudXProxy
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+
+
+def _storm_worker(directory, counter, start_at, token, results):
+    """One 'ssh process': prepare the instance through single_flight."""
+    time.sleep(max(0.0, start_at - time.time()))
+
+    def work():
+        with open(counter, 'a') as f:
+            f.write(f"{os.getpid()}\n")
+        time.sleep(0.3)
+        return True
+
+    results.put(locking.single_flight(INSTANCE_ID, work, token=token, directory=Path(directory)))
+
+
+def _storm(tmp_path, tokens):
+    counter = tmp_path / "work.log"
+    results = multiprocessing.Queue()
+    start_at = time.time() + 0.5
+    processes = [multiprocessing.Process(target=_storm_worker, args=(str(tmp_path), str(counter), start_at, token,
+                                                                     results))
+                 for token in tokens]
+    for process in processes:
+        process.start()
+    outcomes = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join(10)
+    runs = counter.read_text().split() if counter.exists() else []
+    return outcomes, runs
+
+
+def test_storm_runs_work_once(tmp_path):
+    outcomes, runs = _storm(tmp_path, ['key'] * 8)
+
+    assert outcomes == [True] * 8
+    assert len(runs) == 1
+
+
+def test_different_tokens_do_not_share_results(tmp_path):
+    _, runs = _storm(tmp_path, ['key-a', 'key-b'])
+
+    assert len(runs) == 2
+
+
+def test_lock_times_out(tmp_path):
+    path = tmp_path / "held.lock"
+    with locking.FileLock(path):
+        with pytest.raises(locking.LockTimeout):
+            locking.FileLock(path, timeout=0.1).acquire()
+    with locking.FileLock(path, timeout=0.1):
+        pass
+
+
+def test_result_is_not_reused_by_later_connects(tmp_path):
+    calls = []
+
+    def failing():
+        calls.append(1)
+        return False
+
+    assert locking.single_flight(INSTANCE_ID, failing, directory=tmp_path) is False
+    # A connect that starts after the leader finished tries again
+    assert locking.single_flight(INSTANCE_ID, failing, directory=tmp_path) is False
+    assert len(calls) == 2
+
+
+class FakeSSM:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def describe_instance_information(self, **kwargs):
+        time.sleep(0.05)
+        status = 'Online' if self.fleet.started else 'ConnectionLost'
+        return {'InstanceInformationList': [{'PingStatus': status}]}
+
+
+class FakeEC2:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def describe_instances(self, **kwargs):
+        state = 'running' if self.fleet.started else 'stopped'
+        return {'Reservations': [{'Instances': [{'State': {'Name': state}}]}]}
+
+    def start_instances(self, **kwargs):
+        with self.fleet.lock:
+            self.fleet.start_calls += 1
+        time.sleep(0.1)
+        self.fleet.started = True
+
+
+class FakeInstanceConnect:
+    def __init__(self, fleet):
+        self.fleet = fleet
+
+    def send_ssh_public_key(self, **kwargs):
+        with self.fleet.lock:
+            self.fleet.push_calls += 1
+        return {'Success': True}
+
+
+class FakeSession:
+    region_name = 'eu-west-1'
+
+
+class Fleet:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = False
+        self.start_calls = 0
+        self.push_calls = 0
+
+    def clients(self):
+        return {'ssm': FakeSSM(self), 'ec2': FakeEC2(self), 'ec2-instance-connect': FakeInstanceConnect(self)}
+
+
+def test_parallel_connects_share_one_preparation(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(wakeup, 'SLOW_POLL', 0.05)
+    ssh_dir = tmp_path / "ssh"
+    ssh_dir.mkdir()
+    (ssh_dir / "testkey.pub").write_text("ssh-ed25519 AAAA test\n")
+    fleet = Fleet()
+    results = []
+
+    def connect():
+        proxy = CloudXProxy(INSTANCE_ID, ssh_key='testkey', ssh_dir=str(ssh_dir),
+                            session=FakeSession(), clients=fleet.clients())
+        proxy.log = lambda message: None
+        results.append(proxy.prepare())
+
+    threads = [threading.Thread(target=connect) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert results == [True] * 6
+    assert fleet.start_calls == 1
+    assert fleet.push_calls == 1
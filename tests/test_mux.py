@@ -0,0 +1,185 @@
+"""Tests for cloudx_proxy.mux against the stand-in session-manager-plugin."""
+
+import json
+import os
+import platform
+import socket
+import sys
+import threading
+
+import pytest
+
+from cloudx_proxy import mux
+from cloudx_proxy.clientconfig import resolve
+from cloudx_proxy.setup import CloudXSetup
+from .conftest import FakeProxy
+
+TARGET = {'instance_id': FakeProxy.instance_id, 'port': 22, 'profile': 'cloudX'}
+
+
+@pytest.fixture
+def serving(fake_aws, tmp_path):
+    """Run a MuxServer in a thread; yields a function starting one."""
+    servers = []
+
+    def start(proxy, persist=60):
+        server = mux.MuxServer(proxy, mux.state_path(TARGET, tmp_path), persist=persist,
+                               log=lambda message: None, backoff_initial=0.05)
+        thread = threading.Thread(target=server.serve, daemon=True)
+        thread.start()
+        while not server.state_file.exists() and thread.is_alive():
+            thread.join(0.01)
+        servers.append(server)
+        return server, thread
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _connect(directory, payload: bytes, lines: list = None) -> tuple:
+    """Relay payload through mux.connect() the way ssh runs the ProxyCommand; return (ok, echo)."""
+    in_read, in_write = os.pipe()
+    out_read, out_write = os.pipe()
+    received = bytearray()
+
+    def feed():
+        for offset in range(0, len(payload), 65536):
+            os.write(in_write, payload[offset:offset + 65536])
+        os.close(in_write)
+
+    def drain():
+        while chunk := os.read(out_read, 65536):
+            received.extend(chunk)
+
+    threads = [threading.Thread(target=feed), threading.Thread(target=drain)]
+    for thread in threads:
+        thread.start()
+    log = lines.append if lines is not None else (lambda message: None)
+    ok = mux.connect(TARGET, log, directory=directory, in_fd=in_read, out_fd=out_write)
+    os.close(out_write)
+    for thread in threads:
+        thread.join(10)
+    os.close(in_read)
+    os.close(out_read)
+    return ok, bytes(received)
+
+
+def test_connects_share_one_session(serving, fake_aws, tmp_path):
+    proxy = FakeProxy()
+    serving(proxy)
+    payloads = [os.urandom(256 * 1024) for _ in range(4)]
+    results = [None] * len(payloads)
+
+    def run(index):
+        results[index] = _connect(tmp_path, payloads[index])
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(len(payloads))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+
+    assert results == [(True, payload) for payload in payloads]
+    assert len(fake_aws.read_text().splitlines()) == 1
+    assert proxy.prepares == 1
+    # Keys expire after 60 seconds, so every connection pushes (the cache dedupes)
+    assert proxy.pushes == len(payloads)
+
+
+def test_waiting_connect_sees_the_session_log(serving, tmp_path):
+    serving(FakeProxy())
+    lines = []
+
+    assert _connect(tmp_path, b'hello', lines) == (True, b'hello')
+    assert any(line.startswith("Session ready on") for line in lines)
+    assert any(line.startswith("Connected through cloudx-proxy mux") for line in lines)
+
+
+def test_mux_exits_after_the_last_connection_without_persist(serving, tmp_path):
+    server, thread = serving(FakeProxy(), persist=0)
+
+    assert _connect(tmp_path, b'hello') == (True, b'hello')
+    thread.join(10)
+    assert not thread.is_alive()
+    assert not server.state_file.exists()
+    # Nothing is listening any more, and a stale state file is not trusted
+    assert mux.request(server.state_file, {'op': 'ping'}) is None
+
+
+def test_requests_need_the_token(serving, tmp_path):
+    server, thread = serving(FakeProxy())
+
+    with socket.create_connection(('127.0.0.1', server.port), timeout=10) as conn:
+        conn.sendall(json.dumps({'op': 'shutdown', 'token': 'guessed'}).encode() + b'\n')
+        assert conn.recv(100) == b''
+    assert thread.is_alive()
+
+    reply = mux.request(server.state_file, {'op': 'ping'})
+    assert reply['ok'] and reply['instance_id'] == FakeProxy.instance_id and reply['connections'] == 0
+    assert [found['state_file'] for found in mux.running(tmp_path)] == [str(server.state_file)]
+
+    assert mux.stop(server.state_file)
+    thread.join(10)
+    assert not thread.is_alive()
+    assert mux.running(tmp_path) == []
+
+
+def test_connects_with_other_settings_get_their_own_mux(serving, tmp_path):
+    serving(FakeProxy())
+
+    assert mux.state_path(dict(TARGET, region=None), tmp_path) == mux.state_path(TARGET, tmp_path)
+    for other in ({'profile': 'other'}, {'ssh_key': 'other'}, {'aws_env': 'prod'}, {'region': 'us-east-1'}):
+        path = mux.state_path(dict(TARGET, **other), tmp_path)
+        assert path != mux.state_path(TARGET, tmp_path)
+        assert mux.request(path, {'op': 'ping'}) is None
+
+
+def test_started_mux_serves_the_connect_target(tmp_path, monkeypatch):
+    from click.testing import CliRunner
+    from cloudx_proxy import core
+    from cloudx_proxy.cli import cli
+
+    monkeypatch.setenv('HOME', str(tmp_path))
+    settings = resolve({'read_timeout': 4.0}, {'ssm': 'https://ssm.example.com'})
+    target = dict(TARGET, ssh_key='cloudX', aws_env='prod', region='eu-west-1', client_config=settings.to_dict())
+    served = []
+    monkeypatch.setattr(core, 'CloudXProxy', lambda **kwargs: FakeProxy())
+    monkeypatch.setattr(mux, 'serve', lambda proxy, served_target, persist: served.append(served_target))
+
+    result = CliRunner().invoke(cli, mux.spawn_command(target, 600)[3:])
+
+    assert result.exit_code == 0, result.output
+    assert mux.state_path(served[0]) == mux.state_path(target)
+
+
+def test_spawn_command_passes_the_connect_options(monkeypatch):
+    settings = resolve({'read_timeout': 4.0, 'tcp_keepalive': False}, {'ssm': 'https://ssm.example.com'})
+    target = dict(TARGET, aws_env='prod', region=None, client_config=settings.to_dict())
+
+    command = mux.spawn_command(target, 600)
+
+    assert command[:7] == [sys.executable, '-m', 'cloudx_proxy', 'mux', FakeProxy.instance_id, '22', '--persist']
+    assert command[command.index('--aws-env') + 1] == 'prod'
+    assert '--region' not in command
+    assert command[-2:] == ['--endpoint-url', 'ssm=https://ssm.example.com']
+    assert '--no-tcp-keepalive' in command and command[command.index('--read-timeout') + 1] == '4.0'
+
+
+def test_persist_resolution(monkeypatch):
+    monkeypatch.delenv(mux.PERSIST_ENV, raising=False)
+    assert mux.resolve_persist() == mux.PERSIST
+    monkeypatch.setenv(mux.PERSIST_ENV, '600')
+    assert mux.resolve_persist() == 600
+    assert mux.resolve_persist(0) == 0
+
+
+def test_windows_proxy_command_uses_the_mux(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    setup = CloudXSetup(profile="cloudX", ssh_key="cloudX", ssh_dir=str(tmp_path / ".ssh" / "cloudX"),
+                        ssh_host_prefix="cloudx", non_interactive=True)
+
+    assert '--mux' not in setup._build_proxy_command()
+    monkeypatch.setattr(platform, 'system', lambda: 'Windows')
+    assert setup._build_proxy_command().endswith(' --mux')
+    assert '# ControlMaster auto' in setup._build_generic_config()
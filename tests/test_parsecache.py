@@ -0,0 +1,129 @@
+"""Tests for cloudx_proxy.parsecache and its use by cleanup."""
+
+import json
+import os
+import stat
+import time
+
+import pytest
+
+from cloudx_proxy import parsecache
+from cloudx_proxy.parsecache import ParseCache
+from cloudx_proxy.setup import CloudXSetup
+
+CONFIG = """\
+Host cloudx-*
+    User ec2-user
+
+Host cloudx-dev-*
+    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env dev
+
+Host cloudx-dev-web
+    HostName i-0000000000000000a
+"""
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, content):
+        self.calls += 1
+        return {'lines': content.splitlines()}
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "config"
+    path.write_text(CONFIG)
+    return path
+
+
+def test_unchanged_files_are_not_parsed_again(config, tmp_path):
+    extra = tmp_path / "dev.conf"
+    extra.write_text("Host cloudx-dev-db")
+    parse = Counter()
+    cache = ParseCache(config)
+
+    first = cache.get([config, extra], 'lines', parse)
+    first['lines'].append("changed by the caller")
+    assert cache.get([config, extra], 'lines', parse) == {'lines': CONFIG.splitlines() + ["Host cloudx-dev-db"]}
+    assert parse.calls == 1
+    assert cache.path == tmp_path / ".config.parsed.json"
+    assert stat.S_IMODE(cache.path.stat().st_mode) == 0o600
+
+    # Rewritten with the same content: a new inode and mtime, but the hash matches
+    config.rename(tmp_path / "moved")
+    (tmp_path / "moved").rename(config)
+    os.utime(config, ns=(time.time_ns(), time.time_ns() + 10**9))
+    cache.get([config, extra], 'lines', parse)
+    assert parse.calls == 1
+
+    extra.write_text("Host cloudx-dev-api\n")
+    assert cache.get([config, extra], 'lines', parse)['lines'][-1] == "Host cloudx-dev-api"
+    assert parse.calls == 2
+
+
+def test_keys_are_cached_separately(config):
+    parse = Counter()
+    cache = ParseCache(config)
+
+    cache.get([config], 'a', parse)
+    cache.get([config], 'b', parse)
+    cache.get([config], 'a', parse)
+    assert parse.calls == 2
+
+
+@pytest.mark.parametrize('content', [
+    "not json",
+    json.dumps({'version': parsecache.FORMAT_VERSION + 1, 'entries': {}}),
+    json.dumps([1, 2]),
+])
+def test_unusable_cache_is_a_miss(config, content):
+    parse = Counter()
+    cache = ParseCache(config)
+    cache.get([config], 'lines', parse)
+    cache.path.write_text(content)
+
+    assert cache.get([config], 'lines', parse)['lines'][0] == "Host cloudx-*"
+    assert parse.calls == 2
+    assert json.loads(cache.path.read_text())['version'] == parsecache.FORMAT_VERSION
+
+
+def test_unwritable_cache_still_parses(config, monkeypatch):
+    def fail(path, content, mode=0o600):
+        raise OSError("read-only file system")
+    monkeypatch.setattr(parsecache.configfile, 'write_atomic', fail)
+    parse = Counter()
+
+    assert ParseCache(config).get([config], 'lines', parse)['lines'][0] == "Host cloudx-*"
+    assert ParseCache(config).get([config], 'lines', parse)['lines'][0] == "Host cloudx-*"
+    assert parse.calls == 2
+
+
+def test_repeated_cleanup_skips_parsing(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+    setup = CloudXSetup(ssh_config=str(config), ssh_host_prefix='cloudx')
+    setup.print_status = lambda *args, **kwargs: None
+    parse = setup._parse_ssh_config
+    calls = []
+    setup._parse_ssh_config = lambda content: calls.append(content) or parse(content)
+
+    assert setup.cleanup_config()
+    cleaned = config.read_text()
+    assert setup.cleanup_config()
+    assert len(calls) == 2  # the first run rewrote the config
+
+    assert setup.cleanup_config()
+    assert setup.cleanup_config()
+    assert len(calls) == 2
+    assert config.read_text() == cleaned
+    assert "Host cloudx-dev-web\n    HostName i-0000000000000000a\n" in cleaned
+
+    # A cleanup with the other prefix is a different parse
+    other = CloudXSetup(ssh_config=str(config), ssh_host_prefix='cloudX')
+    other.print_status = setup.print_status
+    assert other.cleanup_config()
+    assert "Host cloudX-dev-web\n" in config.read_text()
@@ -0,0 +1,120 @@
+"""Tests for the optimistic concurrent pre-flight in CloudXProxy.prepare."""
+
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from cloudx_proxy import cache, wakeup
+from cloudx_proxy.core import CloudXProxy
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+LATENCY = 0.2
+
+
+class Instance:
+    """Fake ssm, ec2 and ec2-instance-connect clients for one instance, each call taking LATENCY."""
+
+    def __init__(self, online=True):
+        self.online = online
+        self.lock = threading.Lock()
+        self.calls = []
+        self.terminated = []
+
+    def _call(self, name):
+        with self.lock:
+            self.calls.append(name)
+        time.sleep(LATENCY)
+
+    def describe_instance_information(self, **kwargs):
+        self._call('status')
+        return {'InstanceInformationList': [{'PingStatus': 'Online' if self.online else 'ConnectionLost'}]}
+
+    def send_ssh_public_key(self, **kwargs):
+        self._call('push')
+        if not self.online:
+            raise ClientError({'Error': {'Code': 'EC2InstanceStateInvalidException'}}, 'SendSSHPublicKey')
+        return {'Success': True}
+
+    def start_session(self, **kwargs):
+        self._call('start_session')
+        return {'SessionId': 's-1', 'TokenValue': 't', 'StreamUrl': 'wss://example'}
+
+    def terminate_session(self, SessionId):
+        self.terminated.append(SessionId)
+
+    def describe_instances(self, **kwargs):
+        state = 'running' if self.online else 'stopped'
+        return {'Reservations': [{'Instances': [{'State': {'Name': state}}]}]}
+
+    def start_instances(self, **kwargs):
+        self._call('start')
+        self.online = True
+
+
+class FakeSession:
+    region_name = 'eu-west-1'
+
+
+@pytest.fixture
+def proxy_for(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(wakeup, 'SLOW_POLL', 0.01)
+    ssh_dir = tmp_path / "ssh"
+    ssh_dir.mkdir()
+    (ssh_dir / "testkey.pub").write_text("ssh-ed25519 AAAA test\n")
+    logs = []
+
+    def build(instance, **kwargs):
+        proxy = CloudXProxy(INSTANCE_ID, ssh_key='testkey', ssh_dir=str(ssh_dir), session=FakeSession(),
+                            clients={'ssm': instance, 'ec2': instance, 'ec2-instance-connect': instance},
+                            status_ttl=0, **kwargs)
+        proxy.log = logs.append
+        return proxy
+
+    build.logs = logs
+    return build
+
+
+def _timed_prepare(proxy):
+    start = time.perf_counter()
+    ok = proxy.prepare()
+    return ok, time.perf_counter() - start
+
+
+def test_warm_instance_takes_one_round_trip(proxy_for):
+    ok, sequential = _timed_prepare(proxy_for(Instance(), native=True))
+    assert ok
+    cache.key_push_cache().path.unlink()
+
+    instance = Instance()
+    proxy = proxy_for(instance, native=True, optimistic=True)
+    ok, optimistic = _timed_prepare(proxy)
+
+    assert ok
+    assert sorted(instance.calls) == ['push', 'start_session', 'status']
+    assert proxy.preopened_session['SessionId'] == 's-1'
+    assert optimistic < 2 * LATENCY <= sequential
+
+
+def test_not_online_redoes_work_after_wakeup(proxy_for):
+    instance = Instance(online=False)
+    proxy = proxy_for(instance, native=True, optimistic=True)
+
+    assert proxy.prepare()
+
+    assert instance.calls.count('status') == 2, "one optimistic check, one by the wake-up loop"
+    assert instance.calls.count('push') == 2, "the speculative push failed and is repeated"
+    assert instance.terminated == ['s-1'], "the speculative session is not kept"
+    assert proxy.preopened_session is None
+    assert not any("Error pushing SSH key" in line for line in proxy_for.logs)
+
+
+def test_wake_needs_no_key(proxy_for, tmp_path):
+    (tmp_path / "ssh" / "testkey.pub").unlink()
+    instance = Instance(online=False)
+
+    assert proxy_for(instance).wake()
+
+    assert 'start' in instance.calls and 'push' not in instance.calls
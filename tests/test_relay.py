@@ -0,0 +1,203 @@
+"""Tests for cloudx_proxy.relay and the relay mode of run_session."""
+
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from cloudx_proxy import relay
+from cloudx_proxy.core import SessionStartError, run_session
+
+pytestmark = pytest.mark.skipif(not relay.relay_supported(), reason="relay mode needs selectable pipes")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _child(script: str) -> subprocess.Popen:
+    return subprocess.Popen(['sh', '-c', script], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+
+
+def _relay(process, payload: bytes = b'', close_stdin: bool = True, use_splice: bool = True):
+    """Relay payload through process from and to pipes; return (output, stderr lines, stats)."""
+    in_read, in_write = os.pipe()
+    out_read, out_write = os.pipe()
+    output, lines = bytearray(), []
+
+    def feed():
+        os.write(in_write, payload)
+        if close_stdin:
+            os.close(in_write)
+
+    def collect():
+        while chunk := os.read(out_read, 65536):
+            output.extend(chunk)
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=collect, daemon=True)]
+    for thread in threads:
+        thread.start()
+    stats = relay.relay_process(process, in_read, out_write, lines.append, use_splice=use_splice)
+    os.close(out_write)
+    for thread in threads:
+        thread.join(timeout=10)
+    os.close(in_read)
+    os.close(out_read)
+    if not close_stdin:
+        os.close(in_write)
+    return bytes(output), lines, stats
+
+
+@pytest.mark.parametrize('use_splice', [True, False])
+def test_echo(use_splice):
+    payload = os.urandom(3 * relay.CHUNK + 123)
+
+    output, lines, stats = _relay(_child('exec cat'), payload, use_splice=use_splice)
+
+    assert output == payload and lines == []
+    assert stats['bytes_in'] == stats['bytes_out'] == len(payload)
+    assert stats['splice'] == (use_splice and hasattr(os, 'splice'))
+
+
+@pytest.mark.parametrize('use_splice', [True, False])
+def test_server_key_exchange_is_followed(use_splice):
+    kexinit = (1085).to_bytes(4, 'big') + bytes([10, 20]) + os.urandom(1073) + bytes(10)
+    newkeys = (12).to_bytes(4, 'big') + bytes([10, 21]) + bytes(10)
+    handshake = b"banner\r\nSSH-2.0-OpenSSH_9.6\r\n" + kexinit + newkeys
+    payload = handshake + os.urandom(2 * relay.CHUNK)
+
+    output, _, stats = _relay(_child('exec cat'), payload, use_splice=use_splice)
+
+    assert output == payload
+    assert stats['kex_end'] == len(handshake)
+    assert _relay(_child('exec cat'), os.urandom(4096))[2]['kex_end'] is None
+
+
+def test_stderr_lines_are_forwarded():
+    process = _child("echo 'first' >&2; printf 'second\\r\\nlast' >&2; printf out")
+
+    output, lines, stats = _relay(process)
+
+    assert output == b'out'
+    assert lines == ['first', 'second', 'last']
+    assert process.returncode == 0
+
+
+@pytest.mark.parametrize('pidfd', [True, False])
+def test_child_exit_ends_relay_with_stdin_open(pidfd, monkeypatch):
+    """The relay must not wait for stdin, nor for a grandchild holding the pipes open."""
+    if not pidfd:
+        monkeypatch.delattr(os, 'pidfd_open', raising=False)
+    process = _child("sleep 30 & printf done")
+    started = time.monotonic()
+
+    output, _, _ = _relay(process, close_stdin=False)
+
+    assert output == b'done'
+    assert time.monotonic() - started < 5
+
+
+def test_closed_stdout_terminates_child():
+    process = _child('exec yes')
+    out_read, out_write = os.pipe()
+    in_read, in_write = os.pipe()
+    os.close(out_read)
+
+    relay.relay_process(process, in_read, out_write, lambda line: None)
+
+    assert process.returncode is not None
+    for fd in (out_write, in_read, in_write):
+        os.close(fd)
+
+
+def test_stdin_eof_closes_child_stdin():
+    process = _child('cat >/dev/null; echo finished')
+
+    output, _, stats = _relay(process, b'x' * 1000)
+
+    assert output == b'finished\n'
+    assert stats['bytes_in'] == 1000
+
+
+@pytest.fixture
+def fake_aws(tmp_path, monkeypatch):
+    def install(script: str):
+        path = tmp_path / "aws"
+        path.write_text("#!/bin/sh\n" + script)
+        path.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    return install
+
+
+def test_run_session_relay_detects_start_failure(fake_aws, monkeypatch):
+    fake_aws("echo 'An error occurred (TargetNotConnected) when calling the StartSession operation: "
+             "i-0123456789abcdef0 is not connected.' >&2\nexit 254\n")
+    lines = []
+
+    with open(os.devnull) as stdin, open(os.devnull, 'w') as stdout:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        monkeypatch.setattr(sys, 'stdout', stdout)
+        with pytest.raises(SessionStartError):
+            run_session('i-0123456789abcdef0', 22, 'cloudX', 'eu-west-1', log=lines.append, relay=True)
+
+    assert 'TargetNotConnected' in lines[0]
+
+
+def test_run_session_relay_returns_stats(fake_aws, tmp_path, monkeypatch):
+    fake_aws("exec cat\n")
+    (tmp_path / "in").write_bytes(b"ssh bytes")
+
+    with open(tmp_path / "in") as stdin, open(tmp_path / "out", 'w') as stdout:
+        monkeypatch.setattr(sys, 'stdin', stdin)
+        monkeypatch.setattr(sys, 'stdout', stdout)
+        stats = run_session('i-0123456789abcdef0', 22, 'cloudX', 'eu-west-1', log=lambda line: None, relay=True)
+
+    assert (tmp_path / "out").read_bytes() == b"ssh bytes"
+    assert stats['bytes_in'] == stats['bytes_out'] == 9
+
+
+# Echo "plugin" behind the relay variants, run in a fresh interpreter with pipes as stdin/stdout
+BENCH_SCRIPT = """
+import subprocess, sys
+if sys.argv[1] == 'passthrough':
+    sys.exit(subprocess.run(['cat']).returncode)
+from cloudx_proxy.relay import relay_process
+process = subprocess.Popen(['cat'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+relay_process(process, 0, 1, print, use_splice=sys.argv[1] == 'splice')
+"""
+
+
+def _throughput(mode: str, payload: bytes) -> tuple:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    process = subprocess.Popen([sys.executable, '-c', BENCH_SCRIPT, mode], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, env=env)
+    start = time.perf_counter()
+    process.stdin.write(payload[:1])
+    process.stdin.flush()
+    first = process.stdout.read(1)
+    first_byte = time.perf_counter() - start
+
+    start = time.perf_counter()
+    writer = threading.Thread(target=lambda: (process.stdin.write(payload[1:]), process.stdin.close()))
+    writer.start()
+    rest = process.stdout.read()
+    elapsed = time.perf_counter() - start
+    writer.join()
+    process.wait(timeout=30)
+
+    assert first + rest == payload
+    return first_byte, len(payload) / elapsed / 1e6
+
+
+def test_relay_throughput(capsys):
+    payload = os.urandom(32 * 1024 * 1024)
+    modes = ['passthrough', 'splice', 'read/write'] if hasattr(os, 'splice') else ['passthrough', 'read/write']
+
+    results = {mode: _throughput(mode, payload) for mode in modes}
+
+    with capsys.disabled():
+        print()
+        for mode, (first_byte, throughput) in results.items():
+            print(f"    {mode:12} first byte {first_byte * 1000:6.1f} ms, {throughput:8.1f} MB/s")
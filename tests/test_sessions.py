@@ -0,0 +1,94 @@
+"""Tests for cloudx_proxy.sessions and its use by CloudXProxy."""
+
+import pytest
+from botocore.exceptions import ProfileNotFound
+
+from cloudx_proxy import clientconfig, sessions
+from cloudx_proxy.core import CloudXProxy
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+
+AWS_CONFIG = """\
+[profile vscode]
+region = us-west-2
+"""
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    for name in ('AWS_CONFIG_FILE', 'AWS_SHARED_CREDENTIALS_FILE', 'AWS_PROFILE', 'AWS_DEFAULT_REGION', 'AWS_REGION'):
+        # CloudXProxy sets some of these; setenv first so they are removed again afterwards
+        monkeypatch.setenv(name, '')
+        monkeypatch.delenv(name)
+    monkeypatch.setattr(sessions, '_contexts', {})
+    return tmp_path
+
+
+def _aws_env(home, name):
+    directory = home / ".aws" / "aws-envs" / name
+    directory.mkdir(parents=True)
+    (directory / "config").write_text(AWS_CONFIG)
+    return directory
+
+
+def _count_clients(context):
+    built = []
+    create = context.session.client
+    context.session.client = lambda service, **kwargs: built.append(service) or create(service, **kwargs)
+    return built
+
+
+def test_contexts_are_shared_per_key(home):
+    _aws_env(home, 'dev')
+
+    context = sessions.context('vscode', 'dev')
+    assert sessions.context('vscode', 'dev') is context
+    assert sessions.session('vscode', 'dev') is context.session
+    assert context.region == 'us-west-2'
+
+    other = sessions.context('vscode', 'dev', 'eu-central-1')
+    assert other is not context and other.region == 'eu-central-1'
+
+    sessions.clear()
+    assert sessions.context('vscode', 'dev') is not context
+
+
+def test_failed_context_is_not_kept(home):
+    with pytest.raises(ProfileNotFound):
+        sessions.context('vscode', 'dev')
+
+    _aws_env(home, 'dev')
+    assert sessions.context('vscode', 'dev').region == 'us-west-2'
+
+
+def test_clients_are_built_once_on_first_use(home):
+    _aws_env(home, 'dev')
+    context = sessions.context('vscode', 'dev')
+    built = _count_clients(context)
+
+    assert context.clients == {}
+    ssm = context.client('ssm')
+    assert context.client('ssm') is ssm
+    assert built == ['ssm']
+    assert context.clients == {'ssm': ssm}
+
+
+def test_proxy_builds_only_the_clients_it_uses(home):
+    _aws_env(home, 'dev')
+    context = sessions.context('vscode', 'dev', client_config=clientconfig.resolve())
+    built = _count_clients(context)
+    first = CloudXProxy(INSTANCE_ID, aws_env='dev', ssh_dir=str(home / "ssh"))
+    second = CloudXProxy(INSTANCE_ID, aws_env='dev', ssh_dir=str(home / "ssh"))
+
+    assert first.session is second.session is context.session
+    assert first.region == 'us-west-2'
+    assert built == []
+
+    # A fresh Online status in the status cache needs no client at all
+    first.remember_status('Online')
+    assert second.cached_instance_status() == 'Online'
+    assert built == []
+
+    assert second.ssm is first.ssm
+    assert built == ['ssm']
@@ -11,8 +11,13 @@ These focus on the behaviour touched by the CodeQL quality cleanup:
 - ``validate_instance_id`` regression coverage.
 """
 
+import shutil
+import subprocess
+import time
+
 import pytest
 
+from cloudx_proxy import configfile
 from cloudx_proxy.setup import CloudXSetup
 
 
@@ -55,17 +60,18 @@ class TestCreate1PasswordKey:
 
     def _install_stubs(self, monkeypatch, setup, *, create_success=True,
                         save_success=True):
-        import cloudx_proxy.setup as setup_mod
+        # setup imports the 1Password helpers when it uses them
+        import cloudx_proxy._1password as op_mod
 
         calls = {"saved": [], "reminded": False}
 
-        monkeypatch.setattr(setup_mod, "list_ssh_keys", lambda: [])
+        monkeypatch.setattr(op_mod, "list_ssh_keys", lambda: [])
         monkeypatch.setattr(
-            setup_mod, "get_vaults",
+            op_mod, "get_vaults",
             lambda: [{"id": "vault-1", "name": "Private"}],
         )
         monkeypatch.setattr(
-            setup_mod, "create_ssh_key",
+            op_mod, "create_ssh_key",
             lambda title, vault: (create_success, "ssh-ed25519 AAAA...", "item-1"),
         )
 
@@ -73,7 +79,7 @@ class TestCreate1PasswordKey:
             calls["saved"].append((public_key, path))
             return save_success
 
-        monkeypatch.setattr(setup_mod, "save_public_key", fake_save)
+        monkeypatch.setattr(op_mod, "save_public_key", fake_save)
 
         # Detect the reminder line (previously dead code after the returns).
         orig_print_status = setup.print_status
@@ -119,12 +125,13 @@ class TestSetupAwsProfileExceptionHandling:
     """The bare except was narrowed to Exception (issue #2 in CodeQL)."""
 
     def test_missing_profile_is_handled(self, monkeypatch, setup):
+        import boto3
         import cloudx_proxy.setup as setup_mod
 
         def boom(*args, **kwargs):
             raise Exception("profile not found")
 
-        monkeypatch.setattr(setup_mod.boto3, "Session", boom)
+        monkeypatch.setattr(boto3, "Session", boom)
         # The recovery path shells out to `aws configure`; stub it so nothing
         # real runs. Session then raises again and the outer handler returns.
         monkeypatch.setattr(setup_mod.subprocess, "run", lambda *a, **k: None)
@@ -134,13 +141,290 @@ class TestSetupAwsProfileExceptionHandling:
         assert isinstance(result, bool)
 
     def test_keyboard_interrupt_propagates(self, monkeypatch, setup):
-        import cloudx_proxy.setup as setup_mod
+        import boto3
 
         def interrupt(*args, **kwargs):
             raise KeyboardInterrupt()
 
-        monkeypatch.setattr(setup_mod.boto3, "Session", interrupt)
+        monkeypatch.setattr(boto3, "Session", interrupt)
 
         # Previously a bare `except:` would have swallowed this.
         with pytest.raises(KeyboardInterrupt):
             setup.setup_aws_profile()
+
+
+def _instance(instance_id, name, state='running'):
+    return {'InstanceId': instance_id, 'State': {'Name': state}, 'Tags': [{'Key': 'Name', 'Value': name}]}
+
+
+class TestDiscover:
+    """Bulk discovery from Name tags and the single-write sync."""
+
+    @pytest.fixture
+    def ec2(self, monkeypatch, setup):
+        import boto3
+        from botocore.stub import Stubber
+
+        client = boto3.Session(aws_access_key_id='testing', aws_secret_access_key='testing',
+                               region_name='eu-west-1').client('ec2')
+        monkeypatch.setattr(setup, '_ec2_client', lambda: client)
+        with Stubber(client) as stubber:
+            yield stubber
+            stubber.assert_no_pending_responses()
+
+    def test_pages_are_parsed_with_name_rules(self, ec2, setup):
+        filters = {'Filters': [{'Name': 'tag:Name', 'Values': ['cloudX-*', 'cloudx-*']},
+                               {'Name': 'instance-state-name',
+                                'Values': ['pending', 'running', 'stopping', 'stopped']}]}
+        ec2.add_response('describe_instances', {'NextToken': 'page2', 'Reservations': [{'Instances': [
+            _instance('i-0000000000000000a', 'cloudX-dev-web | alice'),
+            _instance('i-0000000000000000b', 'cloudX-bad'),
+        ]}]}, filters)
+        ec2.add_response('describe_instances', {'Reservations': [{'Instances': [
+            _instance('i-0000000000000000c', 'cloudx-prod-api'),
+            _instance('i-0000000000000000d', 'cloudX-dev-web'),
+        ]}]}, dict(filters, NextToken='page2'))
+
+        assert setup.discover_instances() == [
+            ('dev', 'web', 'i-0000000000000000a'),
+            ('prod', 'api', 'i-0000000000000000c'),
+        ]
+
+    def test_environment_filter(self, ec2, setup):
+        ec2.add_response('describe_instances', {'Reservations': [{'Instances': [
+            _instance('i-0000000000000000a', 'cloudX-Dev-web'),
+            _instance('i-0000000000000000c', 'cloudX-prod-api'),
+        ]}]})
+
+        assert setup.discover_instances(environment='dev') == [('Dev', 'web', 'i-0000000000000000a')]
+
+    def test_api_error_returns_none(self, ec2, setup):
+        ec2.add_client_error('describe_instances', 'UnauthorizedOperation')
+
+        assert setup.discover_instances() is None
+
+
+class TestSyncSshConfig:
+    @pytest.fixture
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        return CloudXSetup(profile="cloudX", ssh_key="cloudX", ssh_dir=str(tmp_path / ".ssh" / "cloudX"),
+                           ssh_host_prefix="cloudx", non_interactive=True)
+
+    def test_single_write_keeps_unchanged_entries(self, setup, monkeypatch):
+        setup._add_host_entry('dev', 'i-0000000000000000a', 'web')
+        config = setup.ssh_config_file.read_text().replace(
+            "Host cloudx-dev-web", "Host cloudx-dev-web # frontend")
+        config = config.replace("HostName i-0000000000000000a", "HostName i-0000000000000000a\n    LocalForward 8080 localhost:80")
+        setup.ssh_config_file.write_text(config)
+        setup._add_host_entry('dev', 'i-0000000000000000b', 'db')
+        writes = []
+        original = configfile.write_atomic
+        monkeypatch.setattr(configfile, 'write_atomic', lambda path, content: (
+            path == setup.ssh_config_file and writes.append(content), original(path, content)))
+
+        assert setup.sync_ssh_config([
+            ('dev', 'web', 'i-0000000000000000a'),
+            ('dev', 'db', 'i-0000000000000000e'),
+            ('Dev', 'cache', 'i-0000000000000000f'),
+            ('prod', 'api', 'i-0000000000000000c'),
+        ])
+
+        assert len(writes) == 1
+        parsed = setup._parse_ssh_config(writes[0])
+        assert set(parsed['environments']) == {'dev', 'prod'}
+        assert "Host cloudx-dev-web # frontend" in writes[0]
+        assert "LocalForward 8080 localhost:80" in writes[0]
+        assert "HostName i-0000000000000000b" not in writes[0]
+        assert "HostName i-0000000000000000e" in writes[0]
+        assert "Host cloudx-Dev-cache" in writes[0]
+        assert (setup.ssh_config_file.parent.parent / "config").read_text().startswith("Include ")
+
+    def test_unchanged_config_is_not_rewritten(self, setup, monkeypatch):
+        hosts = [('dev', 'web', 'i-0000000000000000a')]
+        setup.sync_ssh_config(hosts)
+        monkeypatch.setattr(configfile, 'write_atomic', lambda path, content: pytest.fail(f"{path} rewritten"))
+
+        assert setup.sync_ssh_config(hosts)
+
+
+class TestIncrementalEdits:
+    @pytest.fixture
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        setup = CloudXSetup(profile="cloudX", ssh_key="cloudX", ssh_dir=str(tmp_path / ".ssh" / "cloudX"),
+                            ssh_host_prefix="cloudx", non_interactive=True)
+        setup.print_status = lambda *args, **kwargs: None
+        return setup
+
+    def _organized(self, setup, hosts):
+        parsed = setup._parse_ssh_config("")
+        by_env = {}
+        for cloudx_env, hostname, instance_id in hosts:
+            by_env.setdefault(cloudx_env, []).append((hostname, instance_id))
+        for cloudx_env, env_hosts in by_env.items():
+            setup._merge_host_entries(parsed, cloudx_env, env_hosts)
+        return setup._organize_ssh_config(setup._build_generic_config(), parsed['environments'])
+
+    def test_matches_full_reorganization(self, setup):
+        config = self._organized(setup, [('dev', 'db', 'i-1'), ('dev', 'w10', 'i-2'), ('qa', 'web', 'i-3')])
+        hosts = [('dev', 'w1', 'i-4'), ('dev', 'zz', 'i-5'), ('qa', 'web', 'i-6'), ('beta', 'x', 'i-7'),
+                 ('prod', 'y', 'i-8'), ('dev', 'db', 'i-1')]
+
+        edited, counts = setup._edit_host_entries(config, hosts)
+
+        assert edited == self._organized(setup, [('dev', 'db', 'i-1'), ('dev', 'w10', 'i-2'), ('qa', 'web', 'i-3')] + hosts)
+        assert counts == {'added': 4, 'updated': 1, 'unchanged': 1}
+
+    def test_removal_matches_full_reorganization(self, setup):
+        hosts = [('dev', 'db', 'i-1'), ('dev', 'w10', 'i-2'), ('dev', 'zz', 'i-3'), ('qa', 'web', 'i-4'),
+                 ('prod', 'y', 'i-5')]
+        config = self._organized(setup, hosts)
+
+        # A host in the middle and at the end of a section, a whole section, the last host of the file
+        for removed in ([('dev', 'w10')], [('dev', 'db'), ('dev', 'zz')], [('qa', 'web')], [('qa', 'web'), ('prod', 'y')]):
+            edited, counts = setup._remove_host_entries(config, removed + [('dev', 'gone')])
+
+            assert edited == self._organized(setup, [host for host in hosts if host[:2] not in removed])
+            assert counts == {'removed': len(removed), 'missing': 1}
+
+        edited, _ = setup._remove_host_entries(config, [(env, name) for env, name, _ in hosts])
+        assert edited == setup._organize_ssh_config(setup._build_generic_config(), {})
+
+    def test_drop_host_entries_in_sharded_layout(self, setup):
+        setup.layout = 'sharded'
+        setup.sync_ssh_config([('dev', 'web', 'i-1'), ('dev', 'db', 'i-2'), ('prod', 'api', 'i-3')])
+        prod = setup._shard_file('prod').read_text()
+
+        setup.dry_run = True
+        assert setup._drop_host_entries([('dev', 'web'), ('qa', 'x')]) == {'removed': 1, 'missing': 1}
+        assert "Host cloudx-dev-web" in setup._shard_file('dev').read_text()
+
+        setup.dry_run = False
+        assert setup._drop_host_entries([('dev', 'web'), ('qa', 'x')]) == {'removed': 1, 'missing': 1}
+        assert "cloudx-dev-web" not in setup._shard_file('dev').read_text()
+        assert "Host cloudx-dev-db" in setup._shard_file('dev').read_text()
+        assert setup._shard_file('prod').read_text() == prod
+
+    def test_only_the_host_lines_change(self, setup):
+        config = self._organized(setup, [('dev', 'db', 'i-1'), ('dev', 'web', 'i-2')])
+        config = config.replace("Host cloudx-dev-web\n", "# the frontend\nHost cloudx-dev-web # web\n    User admin\n")
+
+        edited, _ = setup._edit_host_entries(config, [('dev', 'web', 'i-9'), ('dev', 'cache', 'i-3')])
+
+        assert edited == config.replace("HostName i-2", "HostName i-9").replace(
+            "Host cloudx-dev-db\n", "Host cloudx-dev-cache\n    HostName i-3\n\nHost cloudx-dev-db\n")
+
+    def test_unorganized_config_is_reorganized(self, setup):
+        setup.ssh_config_file.parent.mkdir(parents=True)
+        setup.ssh_config_file.write_text("Host cloudx-*\n    User ec2-user\n")
+        setup._add_host_entry('dev', 'i-0000000000000000a', 'web')
+
+        assert setup.ssh_config_file.read_text().startswith("# SSH Configuration - Managed by")
+        assert setup._edit_host_entries("Host other\n", [('dev', 'web', 'i-1')]) is None
+
+    def test_update_cost_stays_flat(self, setup, capsys):
+        """Benchmark adding one host at 10, 1k and 10k hosts against a full reorganization."""
+        def best(fn):
+            times = []
+            for _ in range(3):
+                configfile.write_atomic(setup.ssh_config_file, config)
+                start = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - start)
+            return min(times) * 1000
+
+        results = {}
+        for count in (10, 1000, 10000):
+            config = self._organized(setup, [('dev', f"host{n}", f"i-{n:017x}") for n in range(count)])
+
+            def reorganize():
+                parsed = setup._parse_ssh_config(config)
+                setup._merge_host_entries(parsed, 'dev', [('new', 'i-0123456789abcdef0')])
+                configfile.write_atomic(setup.ssh_config_file,
+                                        setup._organize_ssh_config(parsed['global'], parsed['environments']))
+
+            results[count] = (best(lambda: setup._add_host_entry('dev', 'i-0123456789abcdef0', 'new')),
+                              best(reorganize))
+
+        with capsys.disabled():
+            print()
+            for count, (incremental, full) in results.items():
+                print(f"  {count:6} hosts: in place {incremental:7.2f} ms, reorganize {full:8.2f} ms")
+
+        assert results[10000][0] < results[10000][1] / 10
+        assert results[10000][0] < 50
+
+
+class TestShardedLayout:
+    HOSTS = [('dev', 'web', 'i-0000000000000000a'), ('dev', 'db', 'i-0000000000000000b'),
+             ('prod', 'api', 'i-0000000000000000c')]
+
+    @pytest.fixture
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        setup = CloudXSetup(profile="cloudX", ssh_key="cloudX", ssh_dir=str(tmp_path / ".ssh" / "cloudX"),
+                            ssh_host_prefix="cloudx", non_interactive=True, layout='sharded')
+        setup.print_status = lambda *args, **kwargs: None
+        return setup
+
+    def test_new_config_is_sharded(self, setup, monkeypatch):
+        assert setup.sync_ssh_config(self.HOSTS)
+
+        root = setup.ssh_config_file.read_text()
+        assert setup._is_sharded(root) and "Host cloudx-dev" not in root
+        shards = sorted(path.name for path in setup._shard_dir().iterdir() if not path.name.startswith('.'))
+        assert shards == ['dev.conf', 'prod.conf']
+        assert "Host cloudx-dev-web\n    HostName i-0000000000000000a\n" in setup._shard_file('dev').read_text()
+
+        writes = []
+        original = configfile.write_atomic
+        monkeypatch.setattr(configfile, 'write_atomic', lambda path, content: (
+            writes.append(path), original(path, content)))
+        setup.sync_ssh_config([('Dev', 'cache', 'i-0000000000000000d')])
+        assert writes == [setup._shard_file('dev')]
+
+    def test_cleanup_converts_both_ways(self, setup):
+        single = CloudXSetup(ssh_config=str(setup.ssh_config_file), ssh_host_prefix="cloudx", non_interactive=True)
+        single.print_status = setup.print_status
+        single.sync_ssh_config(self.HOSTS)
+        original = setup.ssh_config_file.read_text()
+
+        assert setup.cleanup_config()
+        assert setup._is_sharded(setup.ssh_config_file.read_text())
+        assert "Host cloudx-prod-api" in setup._shard_file('prod').read_text()
+
+        single.layout = 'single'
+        assert single.cleanup_config()
+        assert setup.ssh_config_file.read_text() == original
+        assert not list(setup._shard_dir().glob("*.conf"))
+
+    def test_index_reads_environment_files(self, setup, tmp_path):
+        from cloudx_proxy.hostindex import HostIndex
+        setup.sync_ssh_config(self.HOSTS)
+
+        with HostIndex(tmp_path / "index.sqlite") as index:
+            assert [h['host'] for h in index.hosts(setup.ssh_config_file, 'cloudx', 'cloudX')] == [
+                'cloudx-dev-db', 'cloudx-dev-web', 'cloudx-prod-api']
+            setup.sync_ssh_config([('prod', 'api', 'i-0000000000000000e'), ('qa', 'x', 'i-0000000000000000f')])
+            assert index.find(setup.ssh_config_file, 'cloudx', 'cloudX', host='cloudx-prod-api')[0]['instance_id'] == \
+                'i-0000000000000000e'
+            assert index.environments(setup.ssh_config_file, 'cloudx') == ['dev', 'prod', 'qa']
+
+    @pytest.mark.skipif(not shutil.which('ssh'), reason="needs the OpenSSH client")
+    def test_ssh_reads_the_same_settings(self, setup, tmp_path):
+        single = CloudXSetup(profile="cloudX", ssh_key="cloudX", ssh_dir=str(setup.ssh_dir),
+                             ssh_host_prefix="cloudx", non_interactive=True)
+        single.ssh_config_file = tmp_path / "single"
+        single.sync_ssh_config(self.HOSTS)
+        single = single.ssh_config_file
+        setup.sync_ssh_config(self.HOSTS)
+
+        def effective(config, host):
+            result = subprocess.run(['ssh', '-G', '-F', str(config), host], capture_output=True, text=True, check=True)
+            # The single-file config is not in the default place, so its ProxyCommand names it
+            return result.stdout.replace(f" --ssh-config {config}", '')
+
+        for host in ('cloudx-dev-web', 'cloudx-prod-api', 'example.com'):
+            assert effective(setup.ssh_config_file, host) == effective(single, host)
+        assert 'hostname i-0000000000000000a' in effective(setup.ssh_config_file, 'cloudx-dev-web')
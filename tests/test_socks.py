@@ -0,0 +1,191 @@
+"""Tests for cloudx_proxy.socks against the stand-in session-manager-plugin."""
+
+import ipaddress
+import os
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from cloudx_proxy import socks, tunnel
+from .conftest import FakeProxy
+
+
+@pytest.fixture
+def remote():
+    """A server behind the instance: answers every connection with b'remote:' and its data."""
+    try:
+        server = socket.create_server(('127.0.0.2', 0))
+    except OSError:
+        pytest.skip("needs 127.0.0.2 on the loopback interface")
+
+    def answer(conn):
+        with conn:
+            received = b''
+            while data := conn.recv(65536):
+                received += data
+            conn.sendall(b'remote:' + received)
+
+    def accept():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=answer, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield server.getsockname()
+    server.close()
+
+
+@pytest.fixture
+def server(fake_aws):
+    servers = []
+
+    def start(proxy=None, **kwargs):
+        kwargs.setdefault('backoff_initial', 0.05)
+        instance = socks.SocksServer(proxy or FakeProxy(), 0, log=lambda message: None, **kwargs)
+        instance.start()
+        servers.append(instance)
+        return instance
+
+    yield start
+    for instance in servers:
+        instance.stop()
+
+
+def _open(port: int, host: str, destination_port: int, methods: bytes = b'\x00') -> tuple:
+    """Connect to the SOCKS server and request host:destination_port; return (socket, reply code)."""
+    conn = socket.create_connection(('127.0.0.1', port), timeout=10)
+    conn.sendall(bytes([5, len(methods)]) + methods)
+    method = conn.recv(2)
+    if method != b'\x05\x00':
+        return conn, method[1]
+    try:
+        address = bytes([socks.ATYP_IPV4]) + ipaddress.IPv4Address(host).packed
+    except ValueError:
+        address = bytes([socks.ATYP_DOMAIN, len(host)]) + host.encode()
+    conn.sendall(b'\x05\x01\x00' + address + struct.pack('>H', destination_port))
+    response = b''
+    while len(response) < 10:
+        data = conn.recv(10 - len(response))
+        if not data:
+            break
+        response += data
+    return conn, response[1] if len(response) > 1 else None
+
+
+def _exchange(port: int, host: str, destination_port: int, payload: bytes) -> bytes:
+    conn, code = _open(port, host, destination_port)
+    with conn:
+        assert code == socks.SUCCEEDED
+        conn.sendall(payload)
+        conn.shutdown(socket.SHUT_WR)
+        received = b''
+        while data := conn.recv(65536):
+            received += data
+    return received
+
+
+def _starts(log) -> list:
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def test_connections_share_a_session_per_destination(server, fake_aws, remote):
+    proxy = FakeProxy()
+    instance = server(proxy)
+    host, port = remote
+    payload = os.urandom(128 * 1024)
+
+    assert [_exchange(instance.local_port, host, port, payload) for _ in range(3)] == [b'remote:' + payload] * 3
+    # localhost is the instance itself (the stand-in echoes there)
+    assert [_exchange(instance.local_port, 'localhost', 8080, b'local') for _ in range(2)] == [b'local'] * 2
+
+    starts = _starts(fake_aws)
+    assert len(starts) == 2
+    assert 'AWS-StartPortForwardingSessionToRemoteHost' in starts[0] and f'host={host},portNumber={port},' in starts[0]
+    assert 'AWS-StartPortForwardingSession ' in starts[1] and 'portNumber=8080,' in starts[1]
+    assert instance.destinations == [(host, port), ('localhost', 8080)]
+    # Not ssh: each session only wakes the instance
+    assert (proxy.wakes, proxy.prepares, proxy.pushes) == (2, 0, 0)
+
+
+class KeylessProxy(FakeProxy):
+    """A CloudXProxy without a readable SSH key: pushing it fails, and so does prepare()."""
+
+    def prepare(self):
+        super().prepare()
+        return self.push_ssh_key()
+
+    def push_ssh_key(self, log=None):
+        super().push_ssh_key(log)
+        return False
+
+
+def test_sessions_need_no_ssh_key(server):
+    proxy = KeylessProxy()
+    instance = server(proxy)
+
+    assert _exchange(instance.local_port, 'localhost', 8080, b'hello') == b'hello'
+    assert proxy.pushes == 0
+
+
+def test_idle_sessions_are_stopped(server, fake_aws, monkeypatch):
+    monkeypatch.setattr(socks, 'REAP_INTERVAL', 0.05)
+    instance = server(idle=0.2)
+
+    assert _exchange(instance.local_port, '127.0.0.1', 22, b'hello') == b'hello'
+    deadline = time.monotonic() + 10
+    while instance.destinations and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert instance.destinations == []
+
+    assert _exchange(instance.local_port, '127.0.0.1', 22, b'again') == b'again'
+    assert len(_starts(fake_aws)) == 2
+
+
+def test_new_destination_replaces_the_longest_idle_session(server, fake_aws):
+    instance = server(max_sessions=1)
+
+    assert _exchange(instance.local_port, 'localhost', 22, b'one') == b'one'
+    first = instance._tunnels[('localhost', 22)]
+    deadline = time.monotonic() + 10
+    while not first.idle_for and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _exchange(instance.local_port, 'localhost', 2222, b'two') == b'two'
+    assert instance.destinations == [('localhost', 2222)]
+
+    # A destination with a connection open cannot be replaced
+    conn, code = _open(instance.local_port, 'localhost', 2222)
+    with conn:
+        assert code == socks.SUCCEEDED
+        other, refused = _open(instance.local_port, 'localhost', 22)
+        other.close()
+    assert refused == socks.GENERAL_FAILURE
+
+
+def test_unsupported_requests_are_refused(server):
+    instance = server()
+
+    conn, method = _open(instance.local_port, 'localhost', 22, methods=b'\x02')
+    conn.close()
+    assert method == socks.NO_ACCEPTABLE_METHODS
+
+    with socket.create_connection(('127.0.0.1', instance.local_port), timeout=10) as conn:
+        conn.sendall(b'\x05\x01\x00')
+        assert conn.recv(2) == b'\x05\x00'
+        # BIND
+        conn.sendall(b'\x05\x02\x00\x01\x7f\x00\x00\x01\x00\x16')
+        assert conn.recv(10)[1] == socks.COMMAND_NOT_SUPPORTED
+    assert instance.destinations == []
+
+
+def test_port_forward_command_to_a_remote_host():
+    command = tunnel.port_forward_command('i-0123456789abcdef0', 5432, 40000, 'cloudX', 'eu-west-1',
+                                          remote_host='db.internal')
+
+    assert command[command.index('--document-name') + 1] == 'AWS-StartPortForwardingSessionToRemoteHost'
+    assert command[command.index('--parameters') + 1] == 'host=db.internal,portNumber=5432,localPortNumber=40000'
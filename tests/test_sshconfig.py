@@ -0,0 +1,157 @@
+"""Tests for cloudx_proxy.sshconfig and the CloudXSetup helpers built on it."""
+
+import time
+
+import pytest
+
+from cloudx_proxy.setup import CloudXSetup
+from cloudx_proxy.sshconfig import Line, SSHConfig, apply_edits, block_at, block_before, find_host, next_header
+
+CONFIG = """\
+# SSH Configuration - Managed by cloudx-proxy v1
+Include ~/.ssh/other
+
+Host cloudx-*
+    User ec2-user
+    # keep me
+    TCPKeepAlive yes  # inline
+
+Host cloudx-dev-*
+\tProxyCommand=uvx cloudx-proxy connect %h %p --aws-env dev
+
+host cloudx-dev-web cloudx-dev-www # frontend
+    HostName i-0123456789abcdef0
+Match exec "true"
+    User root
+"""
+
+
+def _generated(count):
+    lines = ["# SSH Configuration - Managed by cloudx-proxy v1", "",
+             "Host cloudx-dev-*", "    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env dev", ""]
+    for n in range(count):
+        lines += [f"Host cloudx-dev-host{n} # box {n}", f"    HostName i-{n:017x}", ""]
+    return "\n".join(lines)
+
+
+class TestRoundTrip:
+    @pytest.mark.parametrize("text", [
+        "",
+        "\n",
+        CONFIG,
+        CONFIG.rstrip("\n"),
+        CONFIG.replace("\n", "\r\n"),
+        "Host a\n\n\n  # only comments\n",
+        "HostName not-a-header\nHostkeyAlias x\n",
+        "Host\nHost=b\n\tMatch all\n",
+        "= odd line\n  \t \nHost x # c # d\n",
+    ])
+    def test_str_is_input(self, text):
+        assert str(SSHConfig.parse(text)) == text
+
+    def test_directive_fields_add_up(self):
+        for line in SSHConfig.parse(CONFIG).lines():
+            if line.kind == 'directive':
+                assert line.indent + line.keyword + line.sep + line.value + line.trailing + line.eol == line.text
+
+
+class TestModel:
+    def test_blocks_and_lines(self):
+        config = SSHConfig.parse(CONFIG)
+
+        assert [block.keyword for block in config.blocks] == [None, 'host', 'host', 'host', 'match']
+        assert [line.kind for line in config.preamble.lines] == ['comment', 'directive', 'blank']
+        web = config.get('cloudx-dev-www')
+        assert web.patterns == ['cloudx-dev-web', 'cloudx-dev-www']
+        assert web.comment == 'frontend'
+        assert web.get('hostname') == 'i-0123456789abcdef0'
+        assert config.get('cloudx-dev-*').get('ProxyCommand').startswith('uvx cloudx-proxy')
+        assert [line.kind for line in config.get('cloudx-*').body] == ['directive', 'comment', 'directive', 'blank']
+        assert 'cloudx-prod-*' not in config
+
+    def test_offsets_point_into_text(self):
+        config = SSHConfig.parse(CONFIG)
+
+        for line in config.lines():
+            assert CONFIG[line.offset:line.end] == line.text
+        for block in config.blocks:
+            assert CONFIG[block.start:block.end] == str(block)
+
+    def test_set_value_keeps_layout(self):
+        config = SSHConfig.parse(CONFIG)
+        line = next(config.get('cloudx-*').directives())
+        line.set_value('admin')
+        config.get('cloudx-dev-*').body[0].set_value('uvx cloudx-proxy connect %h %p')
+
+        text = str(config)
+        assert "    User admin\n    # keep me\n    TCPKeepAlive yes  # inline\n" in text
+        assert "\tProxyCommand=uvx cloudx-proxy connect %h %p\n" in text
+        assert text.replace('admin', 'ec2-user').replace(' %h %p\n\nhost', ' %h %p --aws-env dev\n\nhost') == CONFIG
+
+    def test_new_directive_line(self):
+        line = Line.directive('HostName', 'i-0123456789abcdef0', comment='web')
+
+        assert line.text == "    HostName i-0123456789abcdef0 # web\n"
+        assert (line.key, line.value, line.comment) == ('hostname', 'i-0123456789abcdef0', 'web')
+
+    def test_parse_and_serialize_10k_hosts(self):
+        text = _generated(10000)
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            config = SSHConfig.parse(text)
+            assert str(config) == text
+            best = min(best, time.perf_counter() - start)
+
+        assert len(config.index) == 10001
+        assert best < 0.1
+
+
+class TestSetupHelpers:
+    def test_normalize_prefix_only_touches_hosts_and_proxy_commands(self):
+        setup = CloudXSetup(ssh_host_prefix='cloudX')
+
+        text = setup._normalize_prefix(CONFIG)
+
+        assert "Host cloudX-*\n" in text
+        assert "host cloudX-dev-web cloudX-dev-www # frontend\n" in text
+        assert "ProxyCommand=uvx cloudX-proxy connect" in text
+        assert "# SSH Configuration - Managed by cloudx-proxy v1\n" in text
+        assert text.replace('cloudX', 'cloudx') == CONFIG
+
+    def test_extract_host_config(self):
+        setup = CloudXSetup()
+
+        block, rest = setup._extract_host_config('cloudx-dev-*', CONFIG)
+
+        assert block.splitlines()[0] == 'Host cloudx-dev-*'
+        assert 'ProxyCommand' in block and 'ProxyCommand' not in rest
+        assert setup._check_config_exists('cloudx-dev-web', CONFIG)
+        assert not setup._check_config_exists('cloudx-dev', CONFIG)
+
+
+class TestEdits:
+    def test_find_host_ignores_case_and_comments(self):
+        assert find_host(CONFIG, 'CLOUDX-DEV-WWW').name == 'cloudx-dev-web cloudx-dev-www'
+        assert find_host(CONFIG, 'cloudx-*').start == CONFIG.index('Host cloudx-*')
+        assert find_host(CONFIG, 'frontend') is None
+        assert find_host(CONFIG, 'cloudx-dev-we') is None
+        assert find_host("Host=first\n", 'first').start == 0
+
+    def test_block_neighbours(self):
+        web = find_host(CONFIG, 'cloudx-dev-web')
+
+        assert block_before(CONFIG, web.start).name == 'cloudx-dev-*'
+        assert block_before(CONFIG, 5).header is None
+        assert next_header(CONFIG, web.start + 1) == CONFIG.index('Match')
+        assert block_at(CONFIG, web.start).get('HostName') == 'i-0123456789abcdef0'
+
+    def test_content_end_leaves_following_comments(self):
+        text = "Host a\n    HostName x\n\n# ===\n#  next\n\nHost b\n"
+
+        assert text[:find_host(text, 'a').content_end] == "Host a\n    HostName x\n\n"
+
+    def test_apply_edits(self):
+        assert apply_edits("abcdef", [(4, 5, "E"), (0, 0, ">"), (1, 3, "")]) == ">adEf"
+        with pytest.raises(ValueError):
+            apply_edits("abcdef", [(0, 3, ""), (2, 4, "")])
@@ -0,0 +1,101 @@
+"""Startup cost of the CLI: commands that do not talk to AWS must not load boto3."""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = """\
+Host cloudx-*
+    User ec2-user
+
+Host cloudx-dev-*
+    ProxyCommand uvx cloudx-proxy connect %h %p --aws-env dev
+
+Host cloudx-dev-web
+    HostName i-0000000000000000a
+"""
+
+HEAVY = ('boto3', 'botocore', 'cloudx_proxy._1password', 'cloudx_proxy.core')
+
+# Runs the commands in one fresh interpreter and reports which heavy modules they loaded
+SCRIPT = """
+import json, sys
+from click.testing import CliRunner
+from cloudx_proxy.cli import cli
+config = sys.argv[1]
+runner = CliRunner()
+outputs = [runner.invoke(cli, args, prog_name='cloudx-proxy').output for args in (
+    ['--help'],
+    ['list', '--detailed', '--ssh-config', config],
+    ['cleanup', '--dry-run', '--ssh-config', config],
+    ['cleanup', '--ssh-config', config],
+)]
+# What connect loads before handing the connection to a running agent
+from cloudx_proxy import agent, clientconfig, setup, timing
+clientconfig.resolve()
+print(json.dumps({'outputs': outputs, 'loaded': [m for m in sys.argv[2:] if m in sys.modules]}))
+"""
+
+
+def _env(tmp_path):
+    env = dict(os.environ, HOME=str(tmp_path), PYTHONPATH=ROOT)
+    env.pop('COVERAGE_PROCESS_START', None)
+    return env
+
+
+def _best_of(args, env, runs=5):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, env=env, check=True, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def test_local_commands_do_not_load_aws_modules(tmp_path):
+    config = tmp_path / "config"
+    config.write_text(CONFIG)
+
+    result = subprocess.run([sys.executable, '-c', SCRIPT, str(config), *HEAVY], env=_env(tmp_path),
+                            capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout)
+
+    assert 'cloudx-dev-web' in report['outputs'][1]
+    assert 'Cleanup completed' in report['outputs'][3]
+    assert report['loaded'] == []
+
+
+def test_version_does_not_load_the_cli(tmp_path):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'cloudx_proxy', '--version'],
+                            env=_env(tmp_path), capture_output=True, text=True, check=True)
+
+    from cloudx_proxy import __version__
+    assert result.stdout == f"python -m cloudx_proxy, version {__version__}\n"
+    modules = [line.rsplit('|', 1)[1].strip() for line in result.stderr.splitlines() if '|' in line]
+    assert 'cloudx_proxy._version' in modules
+    assert 'click' not in modules and 'cloudx_proxy.cli' not in modules
+
+
+def test_import_time_budget(tmp_path):
+    env = _env(tmp_path)
+    # Compile once so that neither measurement includes it
+    subprocess.run([sys.executable, '-m', 'compileall', '-q', os.path.join(ROOT, 'cloudx_proxy')], check=True)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    timings = {
+        'python': _best_of([sys.executable, '-c', 'pass'], env),
+        'version': _best_of([sys.executable, '-m', 'cloudx_proxy', '--version'], env),
+        'cli': _best_of([sys.executable, '-c', 'import cloudx_proxy.cli'], env),
+        'cli + boto3': _best_of([sys.executable, '-c', 'import cloudx_proxy.cli, boto3'], env),
+    }
+    print()
+    for name, seconds in timings.items():
+        print(f"    {name:12} {seconds * 1000:7.1f} ms")
+
+    # boto3 alone costs several times what the CLI does without it
+    assert timings['cli'] - timings['python'] < (timings['cli + boto3'] - timings['cli']) / 2
+    assert timings['version'] < timings['cli']
@@ -0,0 +1,146 @@
+"""Tests for cloudx_proxy.timing and the connect phases it records."""
+
+import json
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+from click.testing import CliRunner
+
+from cloudx_proxy import timing, wakeup
+from cloudx_proxy.cli import cli
+from cloudx_proxy.core import CloudXProxy
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+
+
+def _ec2_state(name):
+    return {'Reservations': [{'Instances': [{'InstanceId': INSTANCE_ID, 'State': {'Name': name}}]}]}
+
+
+def _records(path):
+    return list(timing.load_records(path))
+
+
+@pytest.fixture
+def session():
+    return boto3.Session(aws_access_key_id='testing', aws_secret_access_key='testing', region_name='eu-west-1')
+
+
+@pytest.fixture
+def proxy(tmp_path, session, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(wakeup, 'FAST_POLL', 0.001)
+    monkeypatch.setattr(wakeup, 'SLOW_POLL', 0.001)
+    ssh_dir = tmp_path / "ssh"
+    ssh_dir.mkdir()
+    (ssh_dir / "testkey.pub").write_text("ssh-ed25519 " + "A" * 68 + " test\n")
+    spans = timing.Timing(str(tmp_path / "timing.jsonl"), host=INSTANCE_ID)
+    return CloudXProxy(INSTANCE_ID, ssh_key='testkey', ssh_dir=str(ssh_dir), session=session, timing=spans)
+
+
+class TestTiming:
+    def test_disabled_by_default(self, tmp_path, monkeypatch):
+        monkeypatch.delenv(timing.TIMING_ENV, raising=False)
+        spans = timing.Timing.from_option()
+
+        with spans.span('phase'):
+            pass
+
+        assert not spans.enabled
+
+    def test_env_selects_default_file(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        monkeypatch.setenv(timing.TIMING_ENV, '1')
+
+        assert timing.Timing.from_option().destination == str(timing.default_timing_file())
+
+    def test_span_records_failure(self, tmp_path):
+        path = tmp_path / "timing.jsonl"
+        spans = timing.Timing(str(path), host=INSTANCE_ID)
+
+        with spans.span('good', attempt=1):
+            pass
+        with spans.span('soft') as span:
+            span['ok'] = False
+        with pytest.raises(RuntimeError):
+            with spans.span('raised'):
+                raise RuntimeError("boom")
+
+        records = _records(path)
+        assert [(r['name'], r['ok']) for r in records] == [('good', True), ('soft', False), ('raised', False)]
+        assert records[0]['attempt'] == 1
+        assert all(r['host'] == INSTANCE_ID and r['run'] == spans.run for r in records)
+
+    def test_stderr_goes_through_log(self):
+        lines = []
+        spans = timing.Timing(timing.STDERR, log=lines.append)
+
+        spans.event('cache_hit')
+
+        assert lines[0].startswith('[timing] ')
+        assert json.loads(lines[0][len('[timing] '):])['name'] == 'cache_hit'
+
+    def test_percentiles(self):
+        records = [{'kind': 'phase', 'name': 'p', 'host': h, 'duration_ms': float(v)}
+                   for v, h in zip(range(1, 101), ['a', 'b'] * 50)]
+
+        summary = timing.summarize(records)[('phase', 'p')]
+        per_host = timing.summarize(records, by_host=True)
+
+        assert (summary['count'], summary['p50'], summary['p95'], summary['p99']) == (100, 50, 95, 99)
+        assert per_host[('a', 'phase', 'p')]['count'] == 50
+
+
+class TestConnectPhases:
+    def test_prepare_records_phases_and_api_calls(self, proxy, tmp_path):
+        with Stubber(proxy.ssm) as ssm, Stubber(proxy.ec2) as ec2, Stubber(proxy.ec2_connect) as eic:
+            ssm.add_response('describe_instance_information', {'InstanceInformationList': []})
+            ec2.add_response('describe_instances', _ec2_state('stopped'))
+            ec2.add_response('start_instances', {'StartingInstances': []})
+            ec2.add_response('describe_instances', _ec2_state('running'))
+            ssm.add_response('describe_instance_information', {
+                'InstanceInformationList': [{'PingStatus': 'Online'}],
+                'ResponseMetadata': {'RetryAttempts': 2, 'HTTPStatusCode': 200}})
+            eic.add_response('send_ssh_public_key', {'Success': True})
+
+            proxy.log = lambda message: None
+            assert proxy.prepare()
+
+        records = _records(tmp_path / "timing.jsonl")
+        phases = [r['name'] for r in records if r['kind'] == 'phase']
+        api = [(r['name'], r['attempts']) for r in records if r['kind'] == 'api']
+
+        assert phases == ['single_flight', 'get_instance_status', 'start_instance', 'wake_register',
+                          'wait_for_instance', 'push_ssh_key']
+        assert api == [('ssm.DescribeInstanceInformation', 1), ('ec2.DescribeInstances', 1),
+                       ('ec2.StartInstances', 1), ('ec2.DescribeInstances', 1),
+                       ('ssm.DescribeInstanceInformation', 3), ('ec2-instance-connect.SendSSHPublicKey', 1)]
+
+    def test_failed_api_call_marks_span(self, proxy, tmp_path):
+        with Stubber(proxy.ssm) as ssm, Stubber(proxy.ec2) as ec2:
+            ssm.add_response('describe_instance_information', {'InstanceInformationList': []})
+            ec2.add_response('describe_instances', _ec2_state('stopped'))
+            ec2.add_client_error('start_instances', 'UnauthorizedOperation', http_status_code=403)
+
+            proxy.log = lambda message: None
+            assert not proxy.prepare()
+
+        records = {r['name']: r for r in _records(tmp_path / "timing.jsonl")}
+        assert records['start_instance']['ok'] is False
+        assert records['ec2.StartInstances']['error'] == 'UnauthorizedOperation'
+        assert records['ec2.StartInstances']['status'] == 403
+
+
+def test_stats_command(tmp_path):
+    path = tmp_path / "timing.jsonl"
+    spans = timing.Timing(str(path), host=INSTANCE_ID)
+    for _ in range(3):
+        with spans.span('push_ssh_key'):
+            pass
+
+    result = CliRunner().invoke(cli, ['stats', str(path), '--by-host'])
+
+    assert result.exit_code == 0, result.output
+    assert 'push_ssh_key' in result.output
+    assert f"Host {INSTANCE_ID}" in result.output
@@ -0,0 +1,162 @@
+"""Tests for cloudx_proxy.tunnel and pointing hosts at a tunnel in the SSH config."""
+
+import os
+import shutil
+import socket
+import subprocess
+import time
+
+import pytest
+
+from cloudx_proxy import tunnel
+from cloudx_proxy.fleet import configured_hosts
+from cloudx_proxy.setup import CloudXSetup
+from cloudx_proxy.sshconfig import SSHConfig
+from .conftest import FakeProxy
+
+
+@pytest.fixture
+def running(fake_aws):
+    tunnels = []
+
+    def start(proxy, **kwargs):
+        kwargs.setdefault('backoff_initial', 0.05)
+        kwargs.setdefault('connection_wait', 10)
+        instance = tunnel.Tunnel(proxy, 0, **kwargs)
+        instance.start()
+        tunnels.append(instance)
+        return instance
+
+    yield start
+    for instance in tunnels:
+        instance.stop()
+
+
+def _echo(port: int, payload: bytes) -> bytes:
+    with socket.create_connection(('127.0.0.1', port), timeout=10) as conn:
+        conn.sendall(payload)
+        conn.shutdown(socket.SHUT_WR)
+        received = b''
+        while data := conn.recv(65536):
+            received += data
+    return received
+
+
+def _starts(log) -> list:
+    return log.read_text().splitlines() if log.exists() else []
+
+
+def test_connections_share_one_session(running, fake_aws):
+    proxy = FakeProxy()
+    instance = running(proxy)
+    payload = os.urandom(256 * 1024)
+
+    assert [_echo(instance.local_port, payload) for _ in range(3)] == [payload] * 3
+
+    assert len(_starts(fake_aws)) == 1
+    assert 'AWS-StartPortForwardingSession' in _starts(fake_aws)[0]
+    assert 'portNumber=22,localPortNumber=' in _starts(fake_aws)[0]
+    assert proxy.prepares == 1
+    # Keys expire after 60 seconds, so every connection pushes (the cache dedupes)
+    assert proxy.pushes == 3
+
+
+def test_sessions_without_push_key_only_wake_the_instance(running, fake_aws):
+    proxy = FakeProxy()
+    instance = running(proxy, push_key=False)
+
+    assert _echo(instance.local_port, b'hello') == b'hello'
+    assert (proxy.wakes, proxy.prepares, proxy.pushes) == (1, 0, 0)
+
+
+def test_closed_session_restarts_for_the_next_connection(running, fake_aws):
+    instance = running(FakeProxy())
+    _echo(instance.local_port, b'hello')
+    with socket.create_connection(('127.0.0.1', instance.local_port), timeout=10) as conn:
+        conn.sendall(b'quit')
+        assert conn.recv(10) == b''
+    deadline = time.monotonic() + 10
+    while instance.session_port and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert _echo(instance.local_port, b'again') == b'again'
+    assert len(_starts(fake_aws)) == 2
+
+
+def test_failed_start_is_retried_with_backoff(running, fake_aws):
+    proxy = FakeProxy(prepare_results=[False, False])
+    instance = running(proxy)
+
+    assert _echo(instance.local_port, b'hello') == b'hello'
+    assert proxy.prepares == 3
+    assert any("reconnecting in" in line for line in proxy.lines)
+
+
+def test_backoff_doubles_up_to_the_maximum():
+    instance = tunnel.Tunnel(FakeProxy(), 0, backoff_initial=1, backoff_max=5)
+
+    assert [instance.backoff(failures) for failures in range(5)] == [0, 1, 2, 4, 5]
+
+
+class TestConfigure:
+    HOSTS = [('dev', 'db', 'i-0000000000000000a'), ('dev', 'web', 'i-0000000000000000b'),
+             ('prod', 'api', 'i-0000000000000000c')]
+
+    @pytest.fixture(params=['single', 'sharded'])
+    def setup(self, request, tmp_path, monkeypatch):
+        monkeypatch.setenv('HOME', str(tmp_path))
+        setup = CloudXSetup(profile="cloudX", ssh_key="cloudX", ssh_dir=str(tmp_path / ".ssh" / "cloudX"),
+                            ssh_host_prefix="cloudx", non_interactive=True, layout=request.param)
+        setup.print_status = lambda *args, **kwargs: None
+        setup.sync_ssh_config(self.HOSTS)
+        return setup
+
+    def _dev_config(self, setup):
+        if setup._is_sharded(setup.ssh_config_file.read_text()):
+            return setup._shard_file('dev').read_text()
+        return setup.ssh_config_file.read_text()
+
+    def test_host_moves_before_the_environment_and_back(self, setup):
+        original = self._dev_config(setup)
+
+        assert setup.set_tunnel('cloudx-dev-web', 2222) == 'i-0000000000000000b'
+        config = self._dev_config(setup)
+        assert tunnel.tunnel_host_config('cloudx-dev-web', 'i-0000000000000000b', 2222) + "\nHost cloudx-dev-*" in config
+        hosts = {host['host']: host['instance_id'] for host in configured_hosts(SSHConfig.parse(config), 'cloudx', 'cloudX')}
+        assert hosts['cloudx-dev-web'] == 'i-0000000000000000b'
+
+        assert setup.set_tunnel('cloudx-dev-web', 2222) == 'i-0000000000000000b'
+        assert self._dev_config(setup) == config
+
+        assert setup.set_tunnel('cloudx-dev-web', None) == 'i-0000000000000000b'
+        assert self._dev_config(setup) == original
+
+    def test_unknown_host(self, setup):
+        assert setup.set_tunnel('cloudx-dev-nothere', 2222) is None
+        assert setup.set_tunnel('web', 2222) is None
+
+    def test_setup_and_cleanup_keep_the_tunnel(self, setup):
+        setup.set_tunnel('cloudx-dev-web', 2222)
+        config = self._dev_config(setup)
+
+        setup.sync_ssh_config(self.HOSTS)
+        assert self._dev_config(setup) == config
+
+        assert setup.cleanup_config()
+        assert tunnel.tunnel_host_config('cloudx-dev-web', 'i-0000000000000000b', 2222) + "\nHost cloudx-dev-*" in \
+            self._dev_config(setup)
+
+    @pytest.mark.skipif(not shutil.which('ssh'), reason="needs the OpenSSH client")
+    def test_ssh_connects_to_the_tunnel(self, setup):
+        setup.set_tunnel('cloudx-dev-web', 2222)
+
+        def effective(host):
+            result = subprocess.run(['ssh', '-G', '-F', str(setup.ssh_config_file), host],
+                                    capture_output=True, text=True, check=True)
+            return result.stdout.splitlines()
+
+        web = effective('cloudx-dev-web')
+        assert 'hostname localhost' in web and 'port 2222' in web
+        assert 'hostkeyalias i-0000000000000000b' in web
+        assert not any(line.startswith('proxycommand') for line in web)
+        assert any(line.startswith('proxycommand') for line in effective('cloudx-dev-db'))
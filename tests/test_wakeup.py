@@ -0,0 +1,163 @@
+"""Tests for cloudx_proxy.wakeup against a simulated instance on a fake clock."""
+
+import pytest
+from botocore.exceptions import ClientError
+
+from cloudx_proxy import wakeup
+from cloudx_proxy.timing import Timing
+
+INSTANCE_ID = 'i-0123456789abcdef0'
+
+
+class SimulatedInstance:
+    """EC2 + SSM view of one instance whose state advances with a fake clock."""
+
+    def __init__(self, state='stopped', stop_after=0.0, boot=12.0, register=8.0, describable=True):
+        self.now = 0.0
+        self.state = state
+        self.stopped_at = stop_after if state == 'stopping' else None
+        self.started_at = 0.0 if state in ('pending', 'running') else None
+        self.boot = boot
+        self.register = register
+        self.describable = describable
+        self.start_calls = []
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append((self.current_state(), seconds))
+        self.now += seconds
+
+    def current_state(self):
+        if self.state == 'stopping' and self.now >= self.stopped_at:
+            self.state = 'stopped'
+        if self.started_at is not None and self.state in ('pending', 'running'):
+            self.state = 'running' if self.now >= self.started_at + self.boot else 'pending'
+        return self.state
+
+    # ec2 client
+    def describe_instances(self, InstanceIds):
+        if not self.describable:
+            raise ClientError({'Error': {'Code': 'UnauthorizedOperation'}}, 'DescribeInstances')
+        return {'Reservations': [{'Instances': [{'State': {'Name': self.current_state()}}]}]}
+
+    def start_instances(self, InstanceIds):
+        state = self.current_state()
+        self.start_calls.append((self.now, state))
+        if state in ('stopping', 'shutting-down', 'terminated'):
+            raise ClientError({'Error': {'Code': 'IncorrectInstanceState'}}, 'StartInstances')
+        if state == 'stopped':
+            self.state = 'pending'
+            self.started_at = self.now
+
+    @property
+    def online_at(self):
+        return self.started_at + self.boot + self.register
+
+    def ping_status(self):
+        if self.current_state() == 'running' and self.now >= self.online_at:
+            return 'Online'
+        return 'ConnectionLost'
+
+
+class FakeProxy:
+    def __init__(self, instance):
+        self.instance_id = INSTANCE_ID
+        self.ec2 = instance
+        self.instance = instance
+        self.timing = Timing()
+        self.logs = []
+
+    def log(self, message):
+        self.logs.append(message)
+
+    def get_instance_status(self):
+        return self.instance.ping_status()
+
+    def start_instance(self):
+        try:
+            self.instance.start_instances(InstanceIds=[INSTANCE_ID])
+            return True
+        except ClientError:
+            return False
+
+
+def _wake(instance, history, **kwargs):
+    proxy = FakeProxy(instance)
+    waker = wakeup.InstanceWaker(proxy, history, sleep=instance.sleep, clock=instance.clock)
+    return waker.wake(**kwargs), proxy
+
+
+@pytest.fixture
+def history(tmp_path):
+    return wakeup.WakeupHistory(tmp_path / "wakeup.json")
+
+
+def test_poll_interval_speeds_up_near_expected_end():
+    assert wakeup.poll_interval(0, 30) == wakeup.SLOW_POLL
+    assert wakeup.poll_interval(28, 30) == 1.0
+    assert wakeup.poll_interval(30, 30) == wakeup.FAST_POLL
+    assert wakeup.poll_interval(120, 30) == wakeup.SLOW_POLL
+
+
+def test_stopping_instance_is_started_once_stopped(history):
+    instance = SimulatedInstance(state='stopping', stop_after=10)
+
+    ok, _ = _wake(instance, history)
+
+    assert ok
+    assert len(instance.start_calls) == 1
+    started, state = instance.start_calls[0]
+    assert state == 'stopped' and started >= 10
+
+
+def test_learned_wakeup_detects_online_promptly(history):
+    _wake(SimulatedInstance(boot=12, register=8), history)
+    instance = SimulatedInstance(boot=12, register=8)
+
+    ok, _ = _wake(instance, history, status='Offline')
+
+    assert ok
+    # Fixed 3 second polling overshoots by up to 3 seconds
+    assert instance.now - instance.online_at <= wakeup.FAST_POLL
+    boot_polls = [seconds for state, seconds in instance.sleeps if state == 'pending']
+    assert max(boot_polls) > 1, "polls slowly early in the boot phase"
+
+
+def test_history_tunes_later_wakeups(history):
+    instance = SimulatedInstance(boot=40, register=5)
+    _wake(instance, history)
+
+    assert history.expected(INSTANCE_ID, 'boot') == pytest.approx(40, abs=wakeup.SLOW_POLL)
+    assert history.expected(INSTANCE_ID, 'register') == pytest.approx(5, abs=wakeup.SLOW_POLL)
+    assert history.expected('i-other', 'boot') == history.expected(INSTANCE_ID, 'boot')
+
+
+def test_falls_back_to_ssm_only_without_describe_permission(history):
+    instance = SimulatedInstance(describable=False)
+
+    ok, proxy = _wake(instance, history)
+
+    assert ok
+    assert len(instance.start_calls) == 1
+    assert any("following SSM status only" in line for line in proxy.logs)
+
+
+def test_terminated_instance_fails_without_start(history):
+    instance = SimulatedInstance(state='terminated')
+
+    ok, _ = _wake(instance, history)
+
+    assert not ok
+    assert instance.start_calls == []
+
+
+def test_times_out(history):
+    instance = SimulatedInstance(boot=500)
+
+    ok, _ = _wake(instance, history, timeout=60)
+
+    assert not ok
+    assert instance.now == pytest.approx(60)